@@ -0,0 +1,28 @@
+"""
+API Server - 无界面 HTTP 服务入口
+与 web_app.py（Streamlit）并行部署，支持多 worker 进程
+
+用法:
+    python api_server.py
+"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import uvicorn
+
+from config.settings import settings
+
+
+def main():
+    uvicorn.run(
+        "src.api.app:app",
+        host=settings.API_HOST,
+        port=settings.API_PORT,
+        workers=settings.API_WORKERS,
+    )
+
+
+if __name__ == "__main__":
+    main()
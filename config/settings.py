@@ -57,9 +57,34 @@ class Settings:
     
     # 重叠大小：防止切片时把一句话切断了，保留一点上下文
     CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
+
+    # 切分模式（可在知识库级配置中覆盖，修改后需重新入库）
+    # standard: 按 CHUNK_SIZE 切分 | parent_child: 小的子片段做向量检索，命中后返回去重后的父片段
+    CHUNK_MODE = os.getenv("CHUNK_MODE", "standard")
+    PARENT_CHUNK_SIZE = int(os.getenv("PARENT_CHUNK_SIZE", "2000"))
+    CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", "400"))
+    CHILD_CHUNK_OVERLAP = int(os.getenv("CHILD_CHUNK_OVERLAP", "50"))
+    # 父子模式下多取 top_k × factor 个子片段，保证去重后仍有 top_k 个父片段
+    PARENT_FETCH_FACTOR = int(os.getenv("PARENT_FETCH_FACTOR", "3"))
     
     # 检索参数
     RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+    # 上下文打包：合并相邻 / 重叠片段、去掉近重复，按相关度填入 token 预算（0 = 不限制）
+    CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "true").lower() == "true"
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+    # 段落的字符 n-gram 有该比例包含在更相关的段落中时视为近重复
+    CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.9"))
+    # 抽取式上下文压缩：生成前按与问题的相关度抽取句子（本地计算，不调用 LLM）
+    CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "false").lower() == "true"
+    COMPRESSION_TOKEN_BUDGET = int(os.getenv("COMPRESSION_TOKEN_BUDGET", "1500"))
+    COMPRESSION_TARGET_RATIO = float(os.getenv("COMPRESSION_TARGET_RATIO", "0.5"))  # 最多保留原文的比例
+    COMPRESSION_MIN_TOKENS = int(os.getenv("COMPRESSION_MIN_TOKENS", "200"))       # 原文更短时不压缩
+    # 句子打分中语义相似度的权重（其余为查询关键词覆盖率），0 = 只按关键词、不做句子 Embedding
+    COMPRESSION_SEMANTIC_WEIGHT = float(os.getenv("COMPRESSION_SEMANTIC_WEIGHT", "0.7"))
+    # 按文件名搜索工具最多返回的片段数
+    FILENAME_SEARCH_LIMIT = int(os.getenv("FILENAME_SEARCH_LIMIT", "50"))
+    # Token 计数使用的 tiktoken 编码（不可用时按字符估算）
+    TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
     
     # ==================== 模型切换功能开关 ====================
     # 是否启用动态模型切换（Web界面）
@@ -69,25 +94,134 @@ class Settings:
     # 混合检索模式：vector（纯向量）| hybrid（向量+BM25+RRF）
     RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
     BM25_TOP_K = int(os.getenv("BM25_TOP_K", "10"))
+    # 关键词检索路：fulltext（数据库全文索引，随入库同步）| bm25（每次在内存中构建）
+    KEYWORD_BACKEND = os.getenv("KEYWORD_BACKEND", "fulltext")
+    # 内存 BM25 的分词器：auto（有 jieba 用词典分词，否则相邻二字）| jieba | bigram | char；
+    # jieba 用户词典路径；查询分词缓存条数
+    BM25_TOKENIZER = os.getenv("BM25_TOKENIZER", "auto")
+    TOKENIZER_USER_DICT = os.getenv("TOKENIZER_USER_DICT", "")
+    QUERY_TOKEN_CACHE_SIZE = int(os.getenv("QUERY_TOKEN_CACHE_SIZE", "4096"))
     RRF_K = int(os.getenv("RRF_K", "60"))
+    # 混合检索各路并发执行：每路时限（秒，0 不限制；超时的路不参与融合）、检索路线程数
+    RETRIEVAL_LEG_TIMEOUT = float(os.getenv("RETRIEVAL_LEG_TIMEOUT", "2.0"))
+    RETRIEVAL_LEG_WORKERS = int(os.getenv("RETRIEVAL_LEG_WORKERS", "8"))
+    # 批量混合检索（每个查询一路向量检索）整批的总时限（秒，0 不限制），不使用单路时限
+    RETRIEVAL_BATCH_TIMEOUT = float(os.getenv("RETRIEVAL_BATCH_TIMEOUT", "0"))
+    # 联邦检索：最多检索的知识库数、与最佳知识库质心相似度的最大差距、最低质心相似度、
+    # 单库检索时限（秒，0 不限制）、并行线程数
+    FEDERATED_MAX_PROJECTS = int(os.getenv("FEDERATED_MAX_PROJECTS", "5"))
+    FEDERATED_ROUTING_MARGIN = float(os.getenv("FEDERATED_ROUTING_MARGIN", "0.15"))
+    FEDERATED_MIN_SIMILARITY = float(os.getenv("FEDERATED_MIN_SIMILARITY", "0.0"))
+    FEDERATED_TIMEOUT = float(os.getenv("FEDERATED_TIMEOUT", "5.0"))
+    FEDERATED_WORKERS = int(os.getenv("FEDERATED_WORKERS", "8"))
 
     # Reranker 重排序
     ENABLE_RERANKER = os.getenv("ENABLE_RERANKER", "false").lower() == "true"
-    RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "cohere")  # "cohere" | "bge"
+    RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "cohere")  # "cohere" | "bge" | "bge-onnx"
     COHERE_API_KEY = os.getenv("COHERE_API_KEY", "")
+    # 重排序：本地模型每批候选数、打分超时（秒，0 不限制）、分数缓存条数、打分线程数
+    RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+    RERANK_TIMEOUT = float(os.getenv("RERANK_TIMEOUT", "2.0"))
+    RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+    RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+    # 本地重排序后端的跨请求动态批处理：每批最多 (查询, 候选) 对数、最早请求最多等待的毫秒数
+    RERANK_BATCHING = os.getenv("RERANK_BATCHING", "true").lower() == "true"
+    RERANK_BATCH_MAX_SIZE = int(os.getenv("RERANK_BATCH_MAX_SIZE", "64"))
+    RERANK_BATCH_MAX_WAIT_MS = float(os.getenv("RERANK_BATCH_MAX_WAIT_MS", "5"))
+    # 启动时预热重排序模型
+    RERANK_WARMUP = os.getenv("RERANK_WARMUP", "true").lower() == "true"
+    # bge-onnx 后端：模型仓库（本地目录为 LOCAL_EMBEDDING_DIR/<仓库名最后一段>）、线程数（0 自动）、
+    # 查询+候选最大 token 数、只有 float32 模型时是否量化为 int8
+    RERANK_ONNX_MODEL = os.getenv("RERANK_ONNX_MODEL", "Xenova/bge-reranker-base")
+    RERANK_ONNX_THREADS = int(os.getenv("RERANK_ONNX_THREADS", "0"))
+    RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+    RERANK_ONNX_QUANTIZE = os.getenv("RERANK_ONNX_QUANTIZE", "true").lower() == "true"
 
     # 查询改写
     ENABLE_QUERY_REWRITE = os.getenv("ENABLE_QUERY_REWRITE", "true").lower() == "true"
     QUERY_REWRITE_STRATEGY = os.getenv("QUERY_REWRITE_STRATEGY", "hyde")  # "hyde"|"multi"|"auto"
 
     # ==================== Sprint 2: 基础设施配置 ====================
-    # 向量存储后端：chroma（默认本地）| qdrant（分布式）
+    # 向量存储后端：chroma（默认本地）| qdrant（分布式）| numpy（进程内内存映射，单机）
     VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")
 
+    # ChromaDB 集合布局：per_project（每个知识库一个集合，独立 HNSW 索引）| shared（所有知识库共用一个集合）
+    # 已有共享集合数据时需先迁移（scripts/migrate_chroma_collections.py），迁移前继续按共享布局读写
+    CHROMA_COLLECTION_MODE = os.getenv("CHROMA_COLLECTION_MODE", "per_project")
+    # 初始化时自动迁移共享集合（多进程部署时建议保持关闭，用脚本迁移）
+    CHROMA_AUTO_MIGRATE = os.getenv("CHROMA_AUTO_MIGRATE", "false").lower() == "true"
+
+    # NumPy 存储配置
+    NUMPY_STORE_DIR = BASE_DIR / "data" / "numpy_store"
+    # 向量存储精度：float32 | float16（内存减半，分数误差约 1e-3）
+    NUMPY_STORE_DTYPE = os.getenv("NUMPY_STORE_DTYPE", "float32")
+    # 删除行占比超过该值时自动整理
+    NUMPY_STORE_COMPACT_RATIO = float(os.getenv("NUMPY_STORE_COMPACT_RATIO", "0.2"))
+
+    # ANN 近似索引（NumPy 后端，可在知识库级配置中覆盖）
+    # auto: 行数超过 ANN_MIN_ROWS 时启用 IVF | ivf: 总是启用 | exact: 精确检索
+    ANN_INDEX = os.getenv("ANN_INDEX", "auto")
+    ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "50000"))
+    IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))             # 0 = 约 4·√n
+    IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+    IVF_TRAIN_SAMPLE = int(os.getenv("IVF_TRAIN_SAMPLE", "100000"))
+    # 行数增长到上次训练时的该倍数后重新训练（IVF 簇中心与量化参数共用）
+    IVF_RETRAIN_FACTOR = float(os.getenv("IVF_RETRAIN_FACTOR", "2.0"))
+
+    # 向量量化（NumPy 后端，可在知识库级配置中覆盖）：none | sq8 | pq
+    # 量化编码常驻内存，float 向量只在重打分时从内存映射文件读取少量行
+    VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+    PQ_SUBSPACES = int(os.getenv("PQ_SUBSPACES", "0"))       # 0 = 每段约 8 维
+    QUANT_RESCORE_FACTOR = int(os.getenv("QUANT_RESCORE_FACTOR", "10"))
+    QUANT_TRAIN_SAMPLE = int(os.getenv("QUANT_TRAIN_SAMPLE", "65536"))
+    QUANT_MIN_ROWS = int(os.getenv("QUANT_MIN_ROWS", "1000"))  # 行数过少时训练 PQ 码本没有意义
+
+    # Embedding 截断输出维度（text-embedding-3 系列支持），0 = 模型全维度；可在知识库级配置中覆盖
+    # 修改已有数据的知识库的维度后需要重新入库
+    EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+
+    # 两阶段检索：先按文档级向量选出最相关的 TWO_STAGE_TOP_DOCS 个文件，再在其片段中检索
+    # 0 = 关闭（全库检索）；片段数少于 TWO_STAGE_MIN_CHUNKS 的知识库不启用。可在知识库级配置中覆盖
+    TWO_STAGE_TOP_DOCS = int(os.getenv("TWO_STAGE_TOP_DOCS", "0"))
+    TWO_STAGE_MIN_CHUNKS = int(os.getenv("TWO_STAGE_MIN_CHUNKS", "5000"))
+    # MMR 去冗余：取 top_k × MMR_FETCH_FACTOR 个候选，按 λ × 相关度 - (1 - λ) × 与已选片段的相似度贪心选出 top_k
+    # MMR_FETCH_FACTOR 不大于 1 时关闭；MMR_LAMBDA 越小结果越分散。可在知识库级配置中覆盖
+    MMR_FETCH_FACTOR = int(os.getenv("MMR_FETCH_FACTOR", "0"))
+    MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+    # 知识库预热：进入聊天时在后台预加载向量索引、关键词索引、重排序模型并建立模型接口连接
+    # WARMUP_PROJECTS 为服务启动时预热的常用知识库 ID（逗号分隔）；预热线程数
+    WARMUP_ON_OPEN = os.getenv("WARMUP_ON_OPEN", "true").lower() == "true"
+    WARMUP_PROJECTS = [pid.strip() for pid in os.getenv("WARMUP_PROJECTS", "").split(",") if pid.strip()]
+    WARMUP_WORKERS = int(os.getenv("WARMUP_WORKERS", "2"))
+
+    # 本地 CPU Embedding（EMBEDDING_MODEL 选择 provider=local 的模型时生效）
+    # 模型目录：LOCAL_EMBEDDING_DIR/<模型ID>/{tokenizer.json, model.onnx}，不存在时从 Hugging Face 下载
+    LOCAL_EMBEDDING_DIR = BASE_DIR / "data" / "models"
+    # ONNX Runtime intra-op 线程数，0 = 由 ONNX Runtime 决定（通常为物理核数）
+    LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0"))
+    # 动态批处理：攒满 batch 或最早的请求等待超过 max_wait_ms 即推理
+    LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+    LOCAL_EMBEDDING_MAX_WAIT_MS = float(os.getenv("LOCAL_EMBEDDING_MAX_WAIT_MS", "5"))
+    LOCAL_EMBEDDING_MAX_LENGTH = int(os.getenv("LOCAL_EMBEDDING_MAX_LENGTH", "512"))
+    # 启动时预热本地模型
+    LOCAL_EMBEDDING_WARMUP = os.getenv("LOCAL_EMBEDDING_WARMUP", "true").lower() == "true"
+
+    # 知识库级配置的进程内缓存时间（秒）
+    PROJECT_CONFIG_TTL = float(os.getenv("PROJECT_CONFIG_TTL", "30"))
+    # 由片段目录统计得到的值（全文索引是否就绪等）的进程内缓存时间（秒），本进程的入库 / 删除立即生效
+    CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "30"))
+
     # Qdrant 配置
     QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
     QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
     QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "rag_documents")
+    # 嵌入式模式：":memory:" 或本地目录（不连接 Qdrant 服务，适合测试与单机）；为空时连接 host:port
+    QDRANT_LOCATION = os.getenv("QDRANT_LOCATION", "")
+    # 写入按批 upsert，多批并行
+    QDRANT_UPSERT_BATCH = int(os.getenv("QDRANT_UPSERT_BATCH", "256"))
+    QDRANT_UPSERT_PARALLEL = int(os.getenv("QDRANT_UPSERT_PARALLEL", "4"))
+    # 全量读取时每页条数
+    QDRANT_SCROLL_PAGE = int(os.getenv("QDRANT_SCROLL_PAGE", "1000"))
 
     # PostgreSQL 配置（不配置时 fallback 到 SQLite）
     POSTGRES_HOST = os.getenv("POSTGRES_HOST", "")
@@ -100,5 +234,29 @@ class Settings:
     REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 
+    # ==================== 批量问答配置 ====================
+    # 批量生成时同时在途的 LLM 请求上限（chat model 的 batch/abatch 并发度）
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+    # ==================== HTTP API 服务配置 ====================
+    API_HOST = os.getenv("API_HOST", "0.0.0.0")
+    API_PORT = int(os.getenv("API_PORT", "8000"))
+    # worker 进程数（每个进程各自持有 Service 单例）
+    API_WORKERS = int(os.getenv("API_WORKERS", "2"))
+    # 单个上传文件大小上限（MB）
+    API_MAX_UPLOAD_MB = int(os.getenv("API_MAX_UPLOAD_MB", "50"))
+
+    # ==================== 后台入库任务配置 ====================
+    # 上传文件暂存目录（任务中断后可从这里恢复）
+    INGEST_STAGING_DIR = BASE_DIR / "data" / "ingest_staging"
+    # 入库 worker 线程数
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+    # 每批 embed → upsert 的文档块数量，也是断点续传的粒度
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+    # 任务超过该秒数未更新视为进程已退出，可被其他进程接管
+    INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", "300"))
+    # Web 界面轮询任务进度的间隔（秒）
+    INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "2"))
+
 # 实例化对象，方便其他模块直接 import settings
 settings = Settings()
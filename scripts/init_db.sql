@@ -36,6 +36,96 @@ CREATE TABLE IF NOT EXISTS project_files (
     created_at TEXT
 );
 
+-- 后台入库任务
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id TEXT PRIMARY KEY,
+    project_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total_files INTEGER DEFAULT 0,
+    done_files INTEGER DEFAULT 0,
+    total_chunks INTEGER DEFAULT 0,
+    error TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+
+-- 入库任务中的文件（阶段与断点）
+CREATE TABLE IF NOT EXISTS ingest_job_files (
+    id SERIAL PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    staged_path TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    chunks_total INTEGER DEFAULT 0,
+    chunks_done INTEGER DEFAULT 0,
+    error TEXT,
+    updated_at TEXT,
+    FOREIGN KEY (job_id) REFERENCES ingest_jobs(id)
+);
+
+-- 知识库级配置（值为 JSON）
+CREATE TABLE IF NOT EXISTS project_configs (
+    project_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (project_id, key)
+);
+
+CREATE TABLE IF NOT EXISTS chunk_catalog (
+    chunk_id TEXT PRIMARY KEY,
+    project_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    file_type TEXT,
+    ordinal INTEGER NOT NULL,
+    content_hash TEXT,
+    token_count INTEGER,
+    created_at TEXT,
+    -- 内存 BM25 的分词器名称与词序列（空格分隔，入库时分词一次）
+    tokenizer TEXT,
+    tokens TEXT
+);
+
+-- 知识库质心向量（联邦检索路由用），chunk_count 与片段目录不一致时重新计算
+CREATE TABLE IF NOT EXISTS project_centroids (
+    project_id TEXT PRIMARY KEY,
+    embedding_key TEXT NOT NULL,
+    vector TEXT NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    updated_at TEXT
+);
+
+-- 父片段（父子切分模式）：子片段入向量库，检索命中后按 parent_id 换回父片段正文
+CREATE TABLE IF NOT EXISTS parent_chunks (
+    parent_id TEXT PRIMARY KEY,
+    project_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    token_count INTEGER,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_parent_chunks_source ON parent_chunks(project_id, source, ordinal);
+
+-- 文档级粗排索引：每个来源文件一条质心向量（两阶段检索第一阶段用）
+CREATE TABLE IF NOT EXISTS document_centroids (
+    project_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    embedding_key TEXT NOT NULL,
+    vector TEXT NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    updated_at TEXT,
+    PRIMARY KEY (project_id, source)
+);
+
+-- 全文索引：文本入库前已分词（空格分隔），用 simple 配置建 tsvector
+CREATE TABLE IF NOT EXISTS chunk_fts (
+    chunk_id TEXT PRIMARY KEY,
+    source_tsv TSVECTOR,
+    content_tsv TSVECTOR
+);
+
 -- 插入默认知识库
 INSERT INTO projects (id, name, created_at)
 VALUES ('default', '默认知识库', NOW()::text)
@@ -45,3 +135,9 @@ ON CONFLICT (id) DO NOTHING;
 CREATE INDEX IF NOT EXISTS idx_sessions_project_id ON sessions(project_id);
 CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(session_id);
 CREATE INDEX IF NOT EXISTS idx_project_files_project_id ON project_files(project_id);
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_project_id ON ingest_jobs(project_id);
+CREATE INDEX IF NOT EXISTS idx_ingest_job_files_job_id ON ingest_job_files(job_id);
+CREATE INDEX IF NOT EXISTS idx_chunk_catalog_source ON chunk_catalog(project_id, source, ordinal);
+CREATE INDEX IF NOT EXISTS idx_chunk_catalog_file_type ON chunk_catalog(project_id, file_type);
+CREATE INDEX IF NOT EXISTS idx_chunk_fts_source ON chunk_fts USING GIN(source_tsv);
+CREATE INDEX IF NOT EXISTS idx_chunk_fts_content ON chunk_fts USING GIN(content_tsv);
@@ -0,0 +1,28 @@
+# scripts/migrate_chroma_collections.py
+"""
+把 ChromaDB 共享集合迁移到按知识库分区的集合（CHROMA_COLLECTION_MODE=per_project）
+运行前停止 API / 入库进程，完成后重启；中断后重跑即可继续
+"""
+import sys
+import os
+
+# 将项目根目录加入 python path，防止找不到模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import settings
+from src.rag.stores.chroma_store import ChromaStore
+from src.utils.logger import setup_logger
+
+logger = setup_logger("Chroma_Migration")
+
+
+def main():
+    if settings.CHROMA_COLLECTION_MODE != "per_project":
+        logger.error("❌ 请先设置 CHROMA_COLLECTION_MODE=per_project")
+        return
+    moved = ChromaStore().migrate_shared_collection()
+    logger.info(f"✅ 迁移结束，共迁移 {moved} 条")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@
 """
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig
+from typing import Optional
 
 from config.settings import settings
 from src.agent.state import AgentState
@@ -72,7 +74,7 @@ def researcher_node(state: AgentState) -> AgentState:
 
 
 # --- 角色 2: 作家 (Writer) ---
-def writer_node(state: AgentState):
+def writer_node(state: AgentState, config: Optional[RunnableConfig] = None):
     """
     作家节点：基于研究员提供的信息，撰写最终回答
     
@@ -82,13 +84,22 @@ def writer_node(state: AgentState):
     3. 标注信息来源（如适用）
     
     使用统一的提示词管理模块获取写作模板
+    启用上下文压缩时，工具返回结果先按与用户问题的相关度抽取句子
     """
     logger.info("✍️ [作家] 正在撰写回答...")
     
     messages = state["messages"]
-    
+
+    compressor, query = None, None
+    if settings.CONTEXT_COMPRESSION:
+        query = state.get("original_query") or _last_user_query(messages)
+        if query:
+            from src.rag.compressor import get_compressor
+            project_id = ((config or {}).get("configurable") or {}).get("project_id", "default")
+            compressor = get_compressor(project_id)
+
     # 将历史消息转换为字符串，让作家能够"看见"研究员查到的内容
-    conversation_str = _format_conversation_history(messages)
+    conversation_str = _format_conversation_history(messages, compressor=compressor, query=query)
     
     # 使用统一的提示词管理模块获取写作模板
     prompt = get_writer_prompt()
@@ -105,12 +116,19 @@ def writer_node(state: AgentState):
     return {"messages": [response]}
 
 
-def _format_conversation_history(messages) -> str:
+def _last_user_query(messages) -> Optional[str]:
+    for msg in reversed(messages):
+        if getattr(msg, 'type', None) == 'human':
+            return msg.content if isinstance(msg.content, str) else None
+    return None
+
+
+def _format_conversation_history(messages, compressor=None, query: Optional[str] = None) -> str:
     """
     格式化对话历史，提取关键信息
     
     将消息列表转换为易读的字符串格式，
-    特别标注工具调用和返回结果
+    特别标注工具调用和返回结果；给出 compressor 时工具结果先按 query 压缩
     """
     formatted_lines = []
     
@@ -136,6 +154,8 @@ def _format_conversation_history(messages) -> str:
         elif msg_type == 'tool':
             # 工具返回结果，通常内容较长，截取关键部分
             tool_name = getattr(msg, 'name', 'unknown')
+            if compressor is not None and isinstance(content, str):
+                content = compressor.compress_text(query, content)
             content_preview = content[:2000] + "..." if len(content) > 2000 else content
             formatted_lines.append(f"🔧 [工具-{tool_name}]: {content_preview}")
         else:
@@ -23,6 +23,12 @@ def get_general_llm():
     return model_manager.get_chat_model(temperature=0.7)
 
 
+def get_vector_db():
+    """获取向量库管理器（向量存储 + 片段目录）"""
+    from src.rag.vectorstore import VectorDBManager
+    return VectorDBManager()
+
+
 def get_chroma_db():
     """获取向量数据库连接（通过抽象层）"""
     from src.rag.stores import get_vector_store
@@ -5,7 +5,24 @@ from langchain_core.tools import tool, BaseTool
 from langgraph.config import RunnableConfig
 from typing import List
 
-from ._common import logger, get_rag_engine, get_chroma_db
+from config.settings import settings
+from src.rag.keyword_index import search_sources
+from src.utils.db import list_catalog_files, search_chunk_records
+from ._common import logger, get_rag_engine, get_vector_db
+
+# 文件类型关键词 -> 扩展名（不带点）
+_TYPE_HINTS = {
+    "pdf": ["pdf"],
+    "py": ["py"],
+    "txt": ["txt"],
+    "word": ["doc", "docx"],
+    "md": ["md"],
+}
+
+
+def _catalog_scope(project_id: str):
+    """默认知识库查看全部知识库的文件（与原有行为一致）"""
+    return None if project_id == "default" else project_id
 
 
 @tool
@@ -54,27 +71,18 @@ def list_knowledge_base_files(config: RunnableConfig) -> str:
     project_id = cfg.get("project_id", "default")
 
     try:
-        db = get_chroma_db()
-        results = db.get(include=["metadatas"])
-
-        if not results or not results.get("metadatas"):
-            return "知识库中暂时没有任何文件。"
-
-        files = {}
-        for meta in results["metadatas"]:
-            if meta.get("project_id") == project_id or project_id == "default":
-                source = meta.get("source", "未知来源")
-                file_type = source.split(".")[-1].upper() if "." in source else "未知"
-                if source not in files:
-                    files[source] = {"type": file_type, "count": 0}
-                files[source]["count"] += 1
+        get_vector_db().ensure_catalog(_catalog_scope(project_id))
+        files = list_catalog_files(_catalog_scope(project_id))
 
         if not files:
+            if project_id == "default":
+                return "知识库中暂时没有任何文件。"
             return f"项目 {project_id} 下没有找到任何文件。"
 
         output_lines = [f"知识库中共有 {len(files)} 个文件：\n"]
-        for source, info in files.items():
-            output_lines.append(f"  - {source} ({info['type']} 文件, {info['count']} 个片段)")
+        for source, file_type, count, _ in files:
+            type_label = file_type.upper() if file_type else "未知"
+            output_lines.append(f"  - {source} ({type_label} 文件, {count} 个片段)")
 
         return "\n".join(output_lines)
 
@@ -101,51 +109,48 @@ def search_by_filename(filename: str, config: RunnableConfig) -> str:
     """
     cfg = config.get("configurable", {}) or {}
     project_id = cfg.get("project_id", "default")
+    scope = _catalog_scope(project_id)
+    limit = settings.FILENAME_SEARCH_LIMIT
 
     try:
-        db = get_chroma_db()
-        results = db.get(include=["metadatas", "documents"])
+        vector_db = get_vector_db()
+        vector_db.ensure_catalog(scope)
 
-        if not results or not results.get("metadatas"):
-            return "知识库中没有找到任何内容。"
+        filename_lower = filename.lower().strip()
+        # 先查文件名全文索引；未命中（如只给了文件名的一部分）再按子串 / 文件类型查找
+        records = search_sources(filename_lower, scope, limit=limit + 1)
+        if not records:
+            records = search_chunk_records(scope, pattern=filename_lower, file_types=[filename_lower], limit=limit + 1)
 
-        matched_content = []
-        filename_lower = filename.lower()
-
-        for i, meta in enumerate(results["metadatas"]):
-            source = meta.get("source", "").lower()
-            if filename_lower in source or source.endswith(f".{filename_lower}"):
-                doc_content = results["documents"][i] if i < len(results["documents"]) else ""
-                if project_id == "default" or meta.get("project_id") == project_id:
-                    matched_content.append(f"【来源: {meta.get('source')}】\n{doc_content}")
-
-        if not matched_content:
-            type_hints = {
-                "pdf": [".pdf"],
-                "py": [".py"],
-                "txt": [".txt"],
-                "word": [".doc", ".docx"],
-                "md": [".md"],
-            }
-
-            for hint_type, extensions in type_hints.items():
+        if not records:
+            for hint_type, extensions in _TYPE_HINTS.items():
                 if hint_type in filename_lower:
-                    for i, meta in enumerate(results["metadatas"]):
-                        source = meta.get("source", "")
-                        for ext in extensions:
-                            if source.lower().endswith(ext):
-                                doc_content = results["documents"][i] if i < len(results["documents"]) else ""
-                                if project_id == "default" or meta.get("project_id") == project_id:
-                                    matched_content.append(f"【来源: {source}】\n{doc_content}")
+                    records = search_chunk_records(scope, file_types=extensions, limit=limit + 1)
                     break
 
+        if not records:
+            return f"没有找到与 '{filename}' 相关的文件内容。\n提示：可以使用 list_knowledge_base_files 工具查看所有可用文件。"
+
+        truncated = len(records) > limit
+        records = records[:limit]
+        # 只为实际返回的片段回向量库取正文
+        documents = vector_db.store.get_by_ids([r["chunk_id"] for r in records], project_id=scope)
+        contents = {doc.metadata.get("chunk_id"): doc.page_content for doc in documents}
+        if len(contents) < len(documents):      # 早期数据的元数据中没有 chunk_id，按顺序对应
+            contents = {r["chunk_id"]: doc.page_content for r, doc in zip(records, documents)}
+
+        matched_content = [
+            f"【来源: {r['source']}】\n{contents[r['chunk_id']]}"
+            for r in records if r["chunk_id"] in contents
+        ]
         if not matched_content:
             return f"没有找到与 '{filename}' 相关的文件内容。\n提示：可以使用 list_knowledge_base_files 工具查看所有可用文件。"
 
         total_content = "\n\n---\n\n".join(matched_content)
         logger.info(f"按文件名 '{filename}' 搜索到 {len(matched_content)} 个片段")
 
-        return f"找到 {len(matched_content)} 个与 '{filename}' 相关的内容片段：\n\n{total_content}"
+        note = f"（仅显示前 {limit} 个）" if truncated else ""
+        return f"找到 {len(matched_content)} 个与 '{filename}' 相关的内容片段{note}：\n\n{total_content}"
 
     except Exception as e:
         logger.error(f"按文件名搜索失败: {e}")
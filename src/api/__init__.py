@@ -0,0 +1,10 @@
+"""
+HTTP API 层 - 无界面的 ASGI 服务
+与 Streamlit 界面并行，直接复用 Service 层，便于负载均衡和被其他服务调用
+"""
+
+from src.api.app import create_app
+
+__all__ = [
+    "create_app",
+]
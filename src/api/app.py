@@ -0,0 +1,398 @@
+# src/api/app.py
+"""
+ASGI 应用 - 基于 FastAPI 的 HTTP 接口
+所有业务逻辑由 Service 层处理，这里只负责协议转换：
+1. 同步的 Service 调用放到线程池执行，不阻塞事件循环
+2. Agent 事件、writer token、批量问答结果通过 SSE 推送
+3. 上传文件分块落盘，不在内存中整体缓存
+"""
+import json
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List
+
+from fastapi import Depends, FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from config.settings import settings
+from src.api.schemas import (
+    BatchAnswerRequest,
+    ChatRequest,
+    ChatResponse,
+    CreateKnowledgeBaseRequest,
+    CreateSessionRequest,
+    FederatedSearchRequest,
+)
+from src.utils.logger import setup_logger
+
+logger = setup_logger("API")
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 上传分块大小：1 MB
+
+
+# ==================== Service Instances ====================
+# 每个 worker 进程各自持有一份单例；测试时通过 app.dependency_overrides 替换
+
+@lru_cache(maxsize=1)
+def get_kb_service():
+    from src.service import KnowledgeBaseService
+    return KnowledgeBaseService()
+
+
+@lru_cache(maxsize=1)
+def get_chat_service():
+    from src.service import ChatService
+    return ChatService()
+
+
+@lru_cache(maxsize=1)
+def get_doc_service():
+    from src.service import DocumentService
+    return DocumentService()
+
+
+@lru_cache(maxsize=1)
+def get_retriever():
+    from src.rag.retriever import VectorRetriever
+    return VectorRetriever()
+
+
+@lru_cache(maxsize=1)
+def get_rag_generator():
+    from src.rag.generator import RAGGenerator
+    return RAGGenerator()
+
+
+# ==================== Helpers ====================
+
+def _sse(event: str, data) -> str:
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _DiskUpload:
+    """
+    落盘后的上传文件
+    提供与 Streamlit UploadedFile 相同的 name / getvalue 接口，供 DocumentService 复用
+    """
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+
+    def getvalue(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+async def _save_upload(upload: UploadFile, max_bytes: int) -> _DiskUpload:
+    """分块写入临时文件，超过大小上限时中止"""
+    suffix = Path(upload.filename or "").suffix
+    written = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        try:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"文件过大: {upload.filename}")
+                tmp.write(chunk)
+        except HTTPException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    return _DiskUpload(upload.filename, tmp.name)
+
+
+def _job_payload(job) -> dict:
+    """入库任务状态 + 整体进度"""
+    payload = asdict(job)
+    payload["progress"] = round(job.progress, 4)
+    return payload
+
+
+def _warmup_payload(state) -> dict:
+    """知识库预热状态 + 是否就绪 / 总耗时"""
+    payload = asdict(state)
+    payload["ready"] = state.ready
+    payload["latency_ms"] = round(state.latency_ms, 1)
+    return payload
+
+
+def _resolve_session(kb_service, project_id: str, session_id) -> str:
+    return kb_service.get_or_create_session(project_id, session_id)
+
+
+# ==================== App ====================
+
+def create_app() -> FastAPI:
+    """创建 ASGI 应用"""
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # 启动时初始化数据库（KnowledgeBaseService 内部保证只执行一次）
+        if get_kb_service not in app.dependency_overrides:
+            await run_in_threadpool(get_kb_service)
+        if settings.LOCAL_EMBEDDING_WARMUP:
+            # 本地 Embedding 模型在接收请求前加载并预热（远程模型直接跳过）
+            from src.utils.model_manager import model_manager
+            await run_in_threadpool(model_manager.warmup_embedding_model)
+        if settings.RERANK_WARMUP:
+            # 启用重排序时预加载模型 / 建立客户端连接
+            from src.rag.reranker import warmup_reranker
+            await run_in_threadpool(warmup_reranker)
+        if settings.WARMUP_PROJECTS:
+            # 常用知识库在后台预热，不阻塞启动
+            from src.rag.warmup import warmup_projects
+            warmup_projects(settings.WARMUP_PROJECTS)
+        logger.info("✅ API 服务启动完成")
+        yield
+
+    app = FastAPI(title="Enterprise RAG Agent API", lifespan=lifespan)
+
+    # ---------- 健康检查 ----------
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/metrics/rerank")
+    async def rerank_metrics():
+        """重排序统计：分数缓存、超时次数、批处理队列深度与批大小直方图"""
+        from src.rag.reranker import get_reranker_stats
+        return get_reranker_stats()
+
+    # ---------- 知识库 ----------
+
+    @app.get("/kbs")
+    async def list_kbs(kb_service=Depends(get_kb_service)):
+        kbs = await run_in_threadpool(kb_service.get_all_kbs)
+        return [asdict(kb) for kb in kbs]
+
+    @app.post("/kbs", status_code=201)
+    async def create_kb(req: CreateKnowledgeBaseRequest, kb_service=Depends(get_kb_service)):
+        ok = await run_in_threadpool(kb_service.create_kb, req.id, req.name)
+        if not ok:
+            raise HTTPException(status_code=500, detail="创建知识库失败")
+        return {"id": req.id.strip(), "name": req.name.strip()}
+
+    @app.delete("/kbs/{kb_id}")
+    async def delete_kb(kb_id: str, kb_service=Depends(get_kb_service)):
+        ok, msg = await run_in_threadpool(kb_service.delete_kb, kb_id)
+        if not ok:
+            raise HTTPException(status_code=400, detail=msg)
+        return {"message": msg}
+
+    @app.get("/kbs/{kb_id}/stats")
+    async def kb_stats(kb_id: str, kb_service=Depends(get_kb_service)):
+        stats = await run_in_threadpool(kb_service.get_kb_stats, kb_id)
+        return asdict(stats)
+
+    @app.get("/kbs/{kb_id}/config")
+    async def kb_config(kb_id: str, kb_service=Depends(get_kb_service)):
+        config = await run_in_threadpool(kb_service.get_retrieval_config, kb_id)
+        return asdict(config)
+
+    @app.patch("/kbs/{kb_id}/config")
+    async def update_kb_config(kb_id: str, values: Dict[str, Any], kb_service=Depends(get_kb_service)):
+        try:
+            config = await run_in_threadpool(lambda: kb_service.update_retrieval_config(kb_id, **values))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return asdict(config)
+
+    @app.post("/kbs/{kb_id}/warmup", status_code=202)
+    async def warmup_kb(kb_id: str, force: bool = False, kb_service=Depends(get_kb_service)):
+        """提交后台预热，立即返回当前状态"""
+        state = await run_in_threadpool(lambda: kb_service.warmup_kb(kb_id, force=force))
+        return _warmup_payload(state)
+
+    @app.get("/kbs/{kb_id}/warmup")
+    async def warmup_status(kb_id: str, kb_service=Depends(get_kb_service)):
+        state = await run_in_threadpool(kb_service.get_warmup_status, kb_id)
+        return _warmup_payload(state)
+
+    @app.get("/kbs/{kb_id}/files")
+    async def kb_files(kb_id: str, limit: int = 50, kb_service=Depends(get_kb_service)):
+        files = await run_in_threadpool(kb_service.get_kb_files, kb_id, limit)
+        return [asdict(f) for f in files]
+
+    # ---------- 会话 ----------
+
+    @app.get("/kbs/{kb_id}/sessions")
+    async def list_sessions(kb_id: str, kb_service=Depends(get_kb_service)):
+        sessions = await run_in_threadpool(kb_service.get_sessions, kb_id)
+        return [{"id": sid, "name": name} for sid, name in sessions]
+
+    @app.post("/kbs/{kb_id}/sessions", status_code=201)
+    async def create_session(kb_id: str, req: CreateSessionRequest, kb_service=Depends(get_kb_service)):
+        session_id = await run_in_threadpool(kb_service.create_new_session, kb_id, req.title)
+        return {"id": session_id, "name": req.title.strip()}
+
+    @app.get("/sessions/{session_id}/messages")
+    async def session_messages(session_id: str, chat_service=Depends(get_chat_service)):
+        messages = await run_in_threadpool(chat_service.get_history, session_id)
+        return [asdict(m) for m in messages]
+
+    # ---------- 文档入库 ----------
+
+    @app.post("/kbs/{kb_id}/documents")
+    async def upload_documents(
+        kb_id: str,
+        files: List[UploadFile] = File(...),
+        background: bool = False,
+        doc_service=Depends(get_doc_service),
+    ):
+        """上传并入库；background=true 时提交后台任务并立即返回 202 与任务 ID"""
+        max_bytes = settings.API_MAX_UPLOAD_MB * 1024 * 1024
+        saved: List[_DiskUpload] = []
+        try:
+            for upload in files:
+                saved.append(await _save_upload(upload, max_bytes))
+
+            supported, unsupported = doc_service.filter_supported_files(saved)
+            if not supported:
+                raise HTTPException(status_code=415, detail=f"不支持的文件格式: {unsupported}")
+
+            if background:
+                job_id = await run_in_threadpool(doc_service.submit_ingest_job, supported, kb_id)
+                return JSONResponse(
+                    status_code=202,
+                    content={"job_id": job_id, "unsupported": unsupported},
+                )
+
+            result = await run_in_threadpool(doc_service.process_and_ingest, supported, kb_id)
+            payload = asdict(result)
+            payload["unsupported"] = unsupported
+            if not result.success:
+                raise HTTPException(status_code=422, detail=payload)
+            return payload
+        finally:
+            for item in saved:
+                if os.path.exists(item.path):
+                    os.remove(item.path)
+
+    @app.get("/kbs/{kb_id}/jobs")
+    async def list_jobs(kb_id: str, limit: int = 10, doc_service=Depends(get_doc_service)):
+        jobs = await run_in_threadpool(doc_service.list_ingest_jobs, kb_id, limit)
+        return [_job_payload(job) for job in jobs]
+
+    @app.get("/jobs/{job_id}")
+    async def get_job(job_id: str, doc_service=Depends(get_doc_service)):
+        job = await run_in_threadpool(doc_service.get_ingest_job, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        return _job_payload(job)
+
+    @app.post("/jobs/{job_id}/cancel")
+    async def cancel_job(job_id: str, doc_service=Depends(get_doc_service)):
+        ok = await run_in_threadpool(doc_service.cancel_ingest_job, job_id)
+        if not ok:
+            raise HTTPException(status_code=409, detail="任务不存在或已结束")
+        return {"job_id": job_id, "status": "cancelling"}
+
+    # ---------- 聊天 ----------
+
+    @app.post("/chat", response_model=ChatResponse)
+    async def chat(
+        req: ChatRequest,
+        kb_service=Depends(get_kb_service),
+        chat_service=Depends(get_chat_service),
+    ):
+        sid = await run_in_threadpool(_resolve_session, kb_service, req.project_id, req.session_id)
+        if req.save_history:
+            await run_in_threadpool(chat_service.save_user_message, sid, req.prompt)
+
+        success, content, events = await run_in_threadpool(chat_service.chat, req.prompt, sid, req.project_id)
+        if success and req.save_history:
+            await run_in_threadpool(chat_service.save_assistant_message, sid, content)
+
+        return ChatResponse(
+            success=success,
+            session_id=sid,
+            content=content,
+            events=[e.description for e in events],
+        )
+
+    @app.post("/chat/stream")
+    async def chat_stream(
+        req: ChatRequest,
+        kb_service=Depends(get_kb_service),
+        chat_service=Depends(get_chat_service),
+    ):
+        sid = await run_in_threadpool(_resolve_session, kb_service, req.project_id, req.session_id)
+        if req.save_history:
+            await run_in_threadpool(chat_service.save_user_message, sid, req.prompt)
+
+        def run() -> Iterator[str]:
+            yield _sse("session", {"session_id": sid})
+            for event_type, data in chat_service.stream_agent_response(
+                req.prompt, sid, req.project_id, stream_tokens=True
+            ):
+                if event_type == "event":
+                    yield _sse("agent", {"node": data.node_type.value, "description": data.description})
+                elif event_type == "token":
+                    yield _sse("token", {"text": data})
+                elif event_type == "response":
+                    if req.save_history:
+                        chat_service.save_assistant_message(sid, data)
+                    yield _sse("response", {"content": data})
+                elif event_type == "error":
+                    yield _sse("error", {"message": data})
+            yield _sse("done", {})
+
+        return StreamingResponse(iterate_in_threadpool(run()), media_type="text/event-stream")
+
+    # ---------- 联邦检索 ----------
+
+    @app.post("/search/federated")
+    async def federated_search(
+        req: FederatedSearchRequest,
+        kb_service=Depends(get_kb_service),
+        retriever=Depends(get_retriever),
+    ):
+        project_ids = req.project_ids
+        if not project_ids:
+            project_ids = [kb.id for kb in await run_in_threadpool(kb_service.get_all_kbs)]
+        result = await run_in_threadpool(
+            retriever.query_federated, req.query, project_ids, top_k=req.top_k, mode=req.mode
+        )
+        return {
+            "results": [
+                {
+                    "project_id": doc.metadata.get("project_id"),
+                    "source": doc.metadata.get("source"),
+                    "chunk_id": doc.metadata.get("chunk_id"),
+                    "content": doc.page_content,
+                    "score": score,
+                }
+                for doc, score in result.results
+            ],
+            "searched": result.searched,
+            "skipped": result.skipped,
+            "routing_scores": result.routing_scores,
+            "latency_ms": round(result.latency_ms, 1),
+        }
+
+    # ---------- 批量问答 ----------
+
+    @app.post("/answers/batch")
+    async def answers_batch(req: BatchAnswerRequest, generator=Depends(get_rag_generator)):
+        async def run() -> AsyncIterator[str]:
+            async for item in generator.aiter_answers_batch(
+                req.questions, project_id=req.project_id, max_concurrency=req.max_concurrency
+            ):
+                yield _sse("answer", asdict(item))
+            yield _sse("done", {})
+
+        return StreamingResponse(run(), media_type="text/event-stream")
+
+    return app
+
+
+# uvicorn 多 worker 模式需要可导入的模块级 app
+app = create_app()
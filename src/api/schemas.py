@@ -0,0 +1,49 @@
+# src/api/schemas.py
+"""
+API 请求/响应模型
+"""
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class CreateKnowledgeBaseRequest(BaseModel):
+    """新建知识库"""
+    id: str = Field(..., min_length=1)
+    name: str = Field(..., min_length=1)
+
+
+class CreateSessionRequest(BaseModel):
+    """新建会话"""
+    title: str = Field(..., min_length=1)
+
+
+class ChatRequest(BaseModel):
+    """聊天请求"""
+    prompt: str = Field(..., min_length=1)
+    project_id: str = "default"
+    session_id: Optional[str] = None     # 为空时使用知识库最新会话（没有则新建）
+    save_history: bool = True            # 是否把问答写入会话历史
+
+
+class ChatResponse(BaseModel):
+    """聊天响应（非流式）"""
+    success: bool
+    session_id: str
+    content: str
+    events: List[str]
+
+
+class BatchAnswerRequest(BaseModel):
+    """批量问答请求"""
+    questions: List[str] = Field(..., min_length=1)
+    project_id: str = "default"
+    max_concurrency: Optional[int] = Field(default=None, ge=1)
+
+
+class FederatedSearchRequest(BaseModel):
+    """多知识库联邦检索请求"""
+    query: str = Field(..., min_length=1)
+    project_ids: Optional[List[str]] = None     # 为空时检索全部知识库
+    top_k: int = Field(default=5, ge=1, le=100)
+    mode: Optional[str] = None                  # "vector" | "hybrid"，为空时取配置
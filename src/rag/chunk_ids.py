@@ -0,0 +1,48 @@
+# src/rag/chunk_ids.py
+"""
+片段 ID
+片段 ID 由 (知识库, 来源文件, 文件内序号, 内容哈希) 确定性生成：
+同一文件重复入库得到相同 ID（覆盖写入而非重复），各向量库、片段目录、
+检索融合、重排序缓存与删除都以它为连接键。
+
+ID 采用 UUID 格式（uuid5），Qdrant 点 ID 只接受 UUID 或整数。
+"""
+import hashlib
+import uuid
+from typing import Optional
+
+from langchain_core.documents import Document
+
+_NAMESPACE = uuid.UUID("6f1c8f3e-5d0b-4b7e-9a43-2c1e7d9b8a10")
+
+
+def content_hash(text: str) -> str:
+    """片段正文的 SHA-1"""
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+def make_chunk_id(project_id: str, source: str, ordinal: int, content: str) -> str:
+    """确定性片段 ID"""
+    return str(uuid.uuid5(_NAMESPACE, f"{project_id}|{source}|{ordinal}|{content_hash(content)}"))
+
+
+def make_parent_id(project_id: str, source: str, ordinal: int, content: str) -> str:
+    """确定性父片段 ID（父子切分模式，与子片段 ID 不在同一命名下）"""
+    return str(uuid.uuid5(_NAMESPACE, f"parent|{project_id}|{source}|{ordinal}|{content_hash(content)}"))
+
+
+def assign_chunk_id(chunk: Document, project_id: str, ordinal: Optional[int] = None) -> str:
+    """为片段写入 chunk_index / chunk_id 元数据（已有 chunk_index 时沿用）"""
+    metadata = chunk.metadata
+    if ordinal is None or "chunk_index" in metadata:
+        ordinal = metadata.get("chunk_index", ordinal or 0)
+    chunk_id = make_chunk_id(project_id, metadata.get("source", "unknown"), ordinal, chunk.page_content)
+    metadata["chunk_index"] = ordinal
+    metadata["chunk_id"] = chunk_id
+    return chunk_id
+
+
+def chunk_key(doc: Document) -> str:
+    """检索结果的去重 / 融合键：优先用 chunk_id，早期数据没有时退回内容哈希"""
+    chunk_id = (doc.metadata or {}).get("chunk_id")
+    return chunk_id or f"sha1:{content_hash(doc.page_content)}"
@@ -0,0 +1,246 @@
+# src/rag/compressor.py
+"""
+抽取式上下文压缩 - 生成前去掉与问题无关的句子（本地计算，不调用 LLM）
+1. 检索片段按句切分，跨片段重复的句子（如 CHUNK_OVERLAP 重叠部分）只保留第一次出现
+2. 句子打分 = 语义权重 × 与查询向量的余弦相似度 + (1 - 语义权重) × 查询关键词覆盖率
+   （句向量一次批量 Embedding 并缓存，相似度为一次矩阵乘法）
+3. 按分数从高到低填入 token 预算（分数不大于 0 的句子不入选），再按原文顺序拼回各片段
+   （省略处用 … 标记），没有句子入选的片段丢弃；没有任何相关信号时原样返回
+
+用于 RAGGenerator 的上下文与 Writer 节点看到的工具结果。
+"""
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config.settings import settings
+from src.rag.text_tokenizer import get_tokenizer
+from src.utils.logger import setup_logger
+from src.utils.tokens import count_tokens
+
+logger = setup_logger("Context_Compressor")
+
+# 按中英文句末标点切句（英文句号须后跟空白），换行也是句子边界
+_SENTENCE = re.compile(r".+?(?:[。！？!?；;]+|\.(?=\s)|$)", re.M)
+
+_compressors: Dict[str, "ExtractiveCompressor"] = {}
+_compressors_lock = threading.Lock()
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE.findall(text or "") if s.strip()]
+
+
+@dataclass
+class CompressionResult:
+    """压缩结果"""
+    results: List[Tuple[Document, float]]
+    original_tokens: int
+    compressed_tokens: int
+    sentences_total: int = 0
+    sentences_kept: int = 0
+    latency_ms: float = 0.0
+
+    @property
+    def ratio(self) -> float:
+        """压缩后 / 压缩前 token 数"""
+        return self.compressed_tokens / self.original_tokens if self.original_tokens else 1.0
+
+
+class ExtractiveCompressor:
+    """按查询相关度抽取句子的压缩器"""
+
+    def __init__(
+        self,
+        embeddings=None,
+        token_budget: Optional[int] = None,
+        target_ratio: Optional[float] = None,
+        min_tokens: Optional[int] = None,
+        semantic_weight: Optional[float] = None,
+    ):
+        """
+        Args:
+            embeddings: 句子与查询的 Embedding 模型，None 时只按关键词打分
+            token_budget: 压缩后 token 上限
+            target_ratio: 压缩后最多保留原 token 数的比例
+            min_tokens: 原文不超过该 token 数时不压缩
+            semantic_weight: 语义相似度在打分中的权重
+        """
+        self.embeddings = embeddings
+        self.token_budget = settings.COMPRESSION_TOKEN_BUDGET if token_budget is None else token_budget
+        self.target_ratio = settings.COMPRESSION_TARGET_RATIO if target_ratio is None else target_ratio
+        self.min_tokens = settings.COMPRESSION_MIN_TOKENS if min_tokens is None else min_tokens
+        self.semantic_weight = settings.COMPRESSION_SEMANTIC_WEIGHT if semantic_weight is None else semantic_weight
+        self.tokenizer = get_tokenizer()
+
+    def _semantic_scores(self, query: str, sentences: List[str],
+                         query_embedding: Optional[List[float]]) -> Optional[np.ndarray]:
+        if self.embeddings is None or self.semantic_weight <= 0:
+            return None
+        try:
+            if query_embedding is None:
+                query_embedding = self.embeddings.embed_query(query)
+            # 句子按文档嵌入（bge 等模型只给查询加检索指令）
+            vectors = self.embeddings.embed_documents(sentences)
+            matrix = np.asarray(vectors, dtype=np.float32)
+            query_vec = np.asarray(query_embedding, dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"句子 Embedding 失败: {e}，只按关键词打分")
+            return None
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vec) or 1.0)
+        return (matrix @ query_vec) / np.where(norms == 0, 1.0, norms)
+
+    def _keyword_scores(self, query: str, sentences: List[str]) -> np.ndarray:
+        terms = set(self.tokenizer.tokenize_query(query))
+        if not terms:
+            return np.zeros(len(sentences), dtype=np.float32)
+        return np.array(
+            [len(terms.intersection(self.tokenizer.tokenize(s))) / len(terms) for s in sentences],
+            dtype=np.float32,
+        )
+
+    def score(self, query: str, sentences: List[str],
+              query_embedding: Optional[List[float]] = None) -> np.ndarray:
+        """句子与查询的相关度（越大越相关）"""
+        keyword = self._keyword_scores(query, sentences)
+        semantic = self._semantic_scores(query, sentences, query_embedding)
+        if semantic is None:
+            return keyword
+        return self.semantic_weight * semantic + (1 - self.semantic_weight) * keyword
+
+    def _select(self, query: str, texts: List[str],
+                query_embedding=None) -> Optional[Tuple[List[List[Optional[str]]], int, int]]:
+        """
+        各文本中按预算保留的句子（原文顺序，省略处为 None）
+
+        Returns:
+            (各文本的句子列表, 句子总数, 保留数)；没有任何相关信号时返回 None（不压缩）
+        """
+        units: List[Tuple[int, int, str]] = []     # (文本下标, 句子下标, 句子)
+        per_text: List[List[str]] = []
+        seen = set()
+        for t, text in enumerate(texts):
+            sentences = split_sentences(text)
+            per_text.append(sentences)
+            for s, sentence in enumerate(sentences):
+                key = "".join(sentence.split())
+                if key not in seen:
+                    seen.add(key)
+                    units.append((t, s, sentence))
+        if not units:
+            return None
+
+        original = sum(count_tokens(text) for text in texts)
+        budget = min(self.token_budget, max(self.min_tokens, int(original * self.target_ratio)))
+        scores = self.score(query, [u[2] for u in units], query_embedding)
+        if scores.max() <= 0:
+            # 如只按关键词打分而查询词都未出现
+            return None
+        kept, used = set(), 0
+        for i in np.argsort(-scores, kind="stable"):
+            if scores[i] <= 0:
+                break
+            cost = count_tokens(units[i][2])
+            if kept and used + cost > budget:
+                continue
+            kept.add((units[i][0], units[i][1]))
+            used += cost
+
+        selected = []
+        for t, sentences in enumerate(per_text):
+            parts, gap = [], False
+            for s, sentence in enumerate(sentences):
+                if (t, s) in kept:
+                    if gap:
+                        parts.append(None)
+                    parts.append(sentence)
+                    gap = False
+                else:
+                    gap = True
+            if parts and gap:
+                parts.append(None)
+            selected.append(parts)
+        return selected, len(units), len(kept)
+
+    @staticmethod
+    def _join(parts: List[Optional[str]]) -> str:
+        return " ".join("…" if part is None else part for part in parts)
+
+    def compress(
+        self,
+        query: str,
+        results: List[Tuple[Document, float]],
+        query_embedding: Optional[List[float]] = None,
+    ) -> CompressionResult:
+        """
+        压缩检索结果（保持原有顺序与分数，没有句子入选的片段丢弃）
+
+        Returns:
+            CompressionResult
+        """
+        start = time.perf_counter()
+        texts = [doc.page_content for doc, _ in results]
+        original = sum(count_tokens(text) for text in texts)
+        if original <= self.min_tokens:
+            return CompressionResult(results, original, original, latency_ms=(time.perf_counter() - start) * 1000)
+
+        selection = self._select(query, texts, query_embedding)
+        if selection is None:
+            return CompressionResult(results, original, original, latency_ms=(time.perf_counter() - start) * 1000)
+        selected, total, kept = selection
+        compressed = []
+        for (doc, score), parts in zip(results, selected):
+            if not any(part is not None for part in parts):
+                continue
+            text = self._join(parts)
+            metadata = {**doc.metadata, "compressed_from_tokens": count_tokens(doc.page_content)}
+            compressed.append((Document(page_content=text, metadata=metadata), score))
+
+        result = CompressionResult(
+            results=compressed,
+            original_tokens=original,
+            compressed_tokens=sum(count_tokens(doc.page_content) for doc, _ in compressed),
+            sentences_total=total,
+            sentences_kept=kept,
+            latency_ms=(time.perf_counter() - start) * 1000,
+        )
+        logger.info(
+            f"🗜️ 上下文压缩: {len(results)} 个片段，句子 {kept}/{total}，"
+            f"{original} → {result.compressed_tokens} tokens ({result.ratio:.0%}, {result.latency_ms:.0f}ms)"
+        )
+        _record_compression(result)
+        return result
+
+    def compress_text(self, query: str, text: str) -> str:
+        """压缩一段文本（如工具返回结果）"""
+        result = self.compress(query, [(Document(page_content=text), 0.0)])
+        return result.results[0][0].page_content if result.results else text
+
+
+def get_compressor(project_id: str = "default") -> ExtractiveCompressor:
+    """知识库 Embedding 模型对应的共享压缩器（句向量缓存随实例复用）"""
+    from src.rag.project_config import get_project_embedding_key, get_project_embedding_model
+    from src.rag.retriever import CachedEmbeddings
+
+    key = get_project_embedding_key(project_id)
+    with _compressors_lock:
+        compressor = _compressors.get(key)
+        if compressor is None:
+            compressor = ExtractiveCompressor(CachedEmbeddings(get_project_embedding_model(project_id)))
+            _compressors[key] = compressor
+        return compressor
+
+
+def _record_compression(result: CompressionResult):
+    from src.metrics.collector import metrics_collector
+
+    metrics_collector.record("compression", "ratio", result.ratio, "ratio")
+    metrics_collector.record("compression", "latency", result.latency_ms, "ms")
+    metrics_collector.record(
+        "compression", "tokens_saved", result.original_tokens - result.compressed_tokens, "tokens"
+    )
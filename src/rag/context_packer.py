@@ -0,0 +1,218 @@
+# src/rag/context_packer.py
+"""
+上下文打包 - 检索结果拼进提示词之前的整理
+1. 按来源文件与文件内序号分组，相邻 / 重叠的片段合并为一段（去掉 CHUNK_OVERLAP 带来的重复文本）
+2. 内容几乎相同的段落（字符 n-gram 包含度超过阈值）只保留排名靠前的一个
+3. 按相关度顺序填入 token 预算，放不下的段落跳过（第一段超出预算时截断）
+
+输入的检索结果须已按相关度排序（向量距离升序或融合 / 重排序分数降序均可），
+合并后的段落以其中排名最高的片段定位置与分数。
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from config.settings import settings
+from src.utils.logger import setup_logger
+from src.utils.tokens import count_tokens
+
+logger = setup_logger("Context_Packer")
+
+_SHINGLE = 5            # 近重复判断的字符 n-gram 长度
+_MIN_OVERLAP = 8        # 相邻片段首尾重叠少于该字符数时不视为重叠（直接换行拼接）
+
+
+@dataclass
+class PackedSpan:
+    """合并后的一段上下文"""
+    source: str
+    text: str
+    score: float
+    rank: int                                    # 段内最靠前片段在输入中的位置
+    chunk_ids: List[str] = field(default_factory=list)
+
+
+@dataclass
+class PackedContext:
+    """打包结果"""
+    text: str
+    spans: List[PackedSpan]
+    input_chunks: int
+    raw_tokens: int             # 逐条原样拼接的 token 数
+    packed_tokens: int
+    merged_chunks: int = 0      # 并入相邻片段的片段数
+    dropped_duplicates: int = 0
+    dropped_over_budget: int = 0
+    truncated: bool = False
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.raw_tokens - self.packed_tokens)
+
+
+def format_span(index: int, source: str, score: float, text: str) -> str:
+    return f"【文档{index} 来源: {source} 相关度: {score:.2f}】\n{text}"
+
+
+def _position(doc: Document) -> Optional[Tuple[str, int]]:
+    """片段在文件内的位置：(层级, 序号)；父片段按父片段序号，没有序号时返回 None"""
+    metadata = doc.metadata or {}
+    if "child_chunk_id" in metadata and metadata.get("parent_index") is not None:
+        return "parent", int(metadata["parent_index"])
+    if metadata.get("chunk_index") is not None:
+        return "chunk", int(metadata["chunk_index"])
+    return None
+
+
+def merge_overlapping(left: str, right: str, max_overlap: Optional[int] = None) -> str:
+    """拼接相邻片段：left 的结尾与 right 的开头重叠时去掉重复部分"""
+    limit = min(len(left), len(right), max_overlap or settings.CHUNK_OVERLAP * 2)
+    for size in range(limit, _MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return f"{left}\n{right}"
+
+
+def _shingles(text: str) -> set:
+    compact = "".join(text.split())
+    if len(compact) <= _SHINGLE:
+        return {compact}
+    return {compact[i:i + _SHINGLE] for i in range(len(compact) - _SHINGLE + 1)}
+
+
+def _merge_runs(results: List[Tuple[Document, float]]) -> Tuple[List[PackedSpan], int]:
+    """同一文件内序号连续（或相同）的片段合并，返回 (段落列表（按排名）, 被合并掉的片段数)"""
+    groups: Dict[Tuple[str, str], List[Tuple[int, int, Document, float]]] = {}
+    spans: List[PackedSpan] = []
+    for rank, (doc, score) in enumerate(results):
+        source = (doc.metadata or {}).get("source", "未知来源")
+        position = _position(doc)
+        if position is None:
+            spans.append(PackedSpan(source, doc.page_content, score, rank, [doc.metadata.get("chunk_id", "")]))
+        else:
+            groups.setdefault((source, position[0]), []).append((position[1], rank, doc, score))
+
+    merged = 0
+    for (source, _), members in groups.items():
+        members.sort(key=lambda m: (m[0], m[1]))
+        current, last_ordinal = None, None
+        for ordinal, rank, doc, score in members:
+            chunk_id = doc.metadata.get("chunk_id", "")
+            if current is not None and ordinal <= last_ordinal + 1:
+                if ordinal > last_ordinal:
+                    current.text = merge_overlapping(current.text, doc.page_content)
+                if rank < current.rank:
+                    current.rank, current.score = rank, score
+                current.chunk_ids.append(chunk_id)
+                merged += 1
+            else:
+                current = PackedSpan(source, doc.page_content, score, rank, [chunk_id])
+                spans.append(current)
+            last_ordinal = ordinal
+    spans.sort(key=lambda s: s.rank)
+    return spans, merged
+
+
+def _drop_near_duplicates(spans: List[PackedSpan], threshold: float) -> Tuple[List[PackedSpan], int]:
+    """段落的 n-gram 集合有 threshold 以上包含在排名更靠前的段落中时丢弃"""
+    kept: List[Tuple[PackedSpan, set]] = []
+    dropped = 0
+    for span in spans:
+        shingles = _shingles(span.text)
+        duplicate = any(
+            len(shingles & other) >= threshold * min(len(shingles), len(other))
+            for _, other in kept
+        )
+        if duplicate:
+            dropped += 1
+        else:
+            kept.append((span, shingles))
+    return [span for span, _ in kept], dropped
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按字符二分截断到不超过 max_tokens"""
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def pack_context(
+    results: List[Tuple[Document, float]],
+    token_budget: Optional[int] = None,
+    duplicate_threshold: Optional[float] = None,
+) -> PackedContext:
+    """
+    合并相邻片段、去掉近重复、按相关度填入 token 预算
+
+    Args:
+        results: 已按相关度排序的 [(Document, score), ...]
+        token_budget: 上下文 token 上限，默认 CONTEXT_TOKEN_BUDGET（0 不限制）
+        duplicate_threshold: 近重复阈值，默认 CONTEXT_DUPLICATE_THRESHOLD
+
+    Returns:
+        PackedContext
+    """
+    budget = settings.CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    threshold = settings.CONTEXT_DUPLICATE_THRESHOLD if duplicate_threshold is None else duplicate_threshold
+
+    raw_tokens = count_tokens("\n\n".join(
+        format_span(i + 1, (doc.metadata or {}).get("source", "未知来源"), score, doc.page_content)
+        for i, (doc, score) in enumerate(results)
+    ))
+    spans, merged = _merge_runs(results)
+    spans, duplicates = _drop_near_duplicates(spans, threshold)
+
+    packed: List[PackedSpan] = []
+    blocks: List[str] = []
+    used, over_budget, truncated = 0, 0, False
+    for span in spans:
+        block = format_span(len(packed) + 1, span.source, span.score, span.text)
+        # 段落之间的空行也计入
+        cost = count_tokens(block) + (1 if blocks else 0)
+        if budget and used + cost > budget:
+            if packed:
+                over_budget += 1
+                continue
+            header_cost = count_tokens(format_span(1, span.source, span.score, ""))
+            span.text = _truncate_to_tokens(span.text, max(0, budget - header_cost))
+            block = format_span(1, span.source, span.score, span.text)
+            cost, truncated = count_tokens(block), True
+        packed.append(span)
+        blocks.append(block)
+        used += cost
+
+    text = "\n\n".join(blocks)
+    context = PackedContext(
+        text=text,
+        spans=packed,
+        input_chunks=len(results),
+        raw_tokens=raw_tokens,
+        packed_tokens=count_tokens(text),
+        merged_chunks=merged,
+        dropped_duplicates=duplicates,
+        dropped_over_budget=over_budget,
+        truncated=truncated,
+    )
+    if results:
+        logger.info(
+            f"📦 上下文打包: {len(results)} 个片段 → {len(packed)} 段，"
+            f"合并 {merged}、去重 {duplicates}、超预算 {over_budget}，"
+            f"{raw_tokens} → {context.packed_tokens} tokens（节省 {context.tokens_saved}）"
+        )
+        _record_packing(context)
+    return context
+
+
+def _record_packing(context: PackedContext):
+    from src.metrics.collector import metrics_collector
+
+    metrics_collector.record("context", "raw_tokens", context.raw_tokens, "tokens")
+    metrics_collector.record("context", "packed_tokens", context.packed_tokens, "tokens")
+    metrics_collector.record("context", "tokens_saved", context.tokens_saved, "tokens")
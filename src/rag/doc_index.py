@@ -0,0 +1,164 @@
+# src/rag/doc_index.py
+"""
+文档级粗排索引 - 两阶段检索
+大知识库上片段级检索全库扫描慢，且 top 结果常被同一文件的大量相似片段占满。
+两阶段检索先在文档级向量（每个来源文件一条：该文件片段向量的单位化均值）上选出
+最相关的 N 个文件，再只在这些文件的片段中做片段级检索。
+
+- 文档级向量在入库时按文件计算并持久化（document_centroids 表），早期数据首次检索时回填
+- 每个进程按知识库缓存一份文档向量矩阵，表内容变化（文件数 / 更新时间）后重新加载；
+  片段数与表签名按片段目录版本缓存（见 src.utils.db.catalog_cached），检索时不再逐次统计
+- 按知识库配置启用：two_stage_top_docs > 0 且片段数不少于 two_stage_min_chunks
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.rag.project_config import get_project_embedding_key, get_project_retrieval_config
+from src.utils.db import (
+    catalog_cached,
+    count_chunk_records,
+    delete_document_centroids,
+    document_index_signature,
+    get_document_centroids,
+    save_document_centroids,
+)
+from src.utils.logger import setup_logger
+
+logger = setup_logger("Doc_Index")
+
+_indexes: Dict[str, Tuple[tuple, "DocumentIndex"]] = {}
+_lock = threading.Lock()
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def document_centroids(embeddings: np.ndarray, sources: List[str]) -> Dict[str, Tuple[np.ndarray, int]]:
+    """
+    片段向量按来源文件求单位化均值
+
+    Returns:
+        {source: (单位向量, 片段数)}
+    """
+    embeddings = _unit(np.asarray(embeddings, dtype=np.float32))
+    groups: Dict[str, List[int]] = {}
+    for row, source in enumerate(sources):
+        groups.setdefault(source, []).append(row)
+    return {
+        source: (_unit(embeddings[rows].mean(axis=0)), len(rows))
+        for source, rows in groups.items()
+    }
+
+
+class DocumentIndex:
+    """一个知识库的文档级向量矩阵（行与 sources 一一对应，已单位化）"""
+
+    def __init__(self, sources: List[str], vectors: np.ndarray):
+        self.sources = sources
+        self.vectors = np.asarray(vectors, dtype=np.float32).reshape(len(sources), -1)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def top_sources(self, query: np.ndarray, n: int) -> List[Tuple[str, float]]:
+        """与查询最相似的 n 个文件 [(source, 余弦相似度), ...]，降序"""
+        if not self.sources or n <= 0:
+            return []
+        sims = self.vectors @ _unit(np.asarray(query, dtype=np.float32))
+        n = min(n, len(self.sources))
+        top = np.argpartition(-sims, n - 1)[:n]
+        top = top[np.argsort(-sims[top])]
+        return [(self.sources[i], float(sims[i])) for i in top]
+
+
+def refresh_document_index(store, project_id: str, sources: Optional[List[str]] = None) -> int:
+    """
+    从向量库重新计算文档级向量并保存（入库一个文件后调用；sources 为空时重建整个知识库）
+
+    Returns:
+        写入的文件数
+    """
+    where: Dict = {"project_id": project_id}
+    if sources is not None:
+        if not sources:
+            return 0
+        where = {"$and": [{"project_id": project_id}, {"source": {"$in": list(sources)}}]}
+    raw = store.get(where=where, include=["metadatas", "embeddings"])
+    embeddings = raw.get("embeddings")
+    found = {}
+    if embeddings is not None and len(embeddings):
+        chunk_sources = [(m or {}).get("source", "unknown") for m in raw["metadatas"]]
+        found = document_centroids(np.asarray(embeddings, dtype=np.float32), chunk_sources)
+
+    # 向量库中已没有片段的文件（被删除 / 改名）不再保留文档级向量
+    stale = [s for s in sources if s not in found] if sources is not None else None
+    if sources is None:
+        delete_document_centroids(project_id)
+    elif stale:
+        delete_document_centroids(project_id, stale)
+
+    save_document_centroids(
+        project_id, get_project_embedding_key(project_id),
+        [(source, vector.tolist(), count) for source, (vector, count) in found.items()],
+    )
+    return len(found)
+
+
+def get_document_index(store, project_id: str) -> Optional[DocumentIndex]:
+    """
+    读取（或构建）知识库的文档级索引；文档级向量不全或 Embedding 模型变化时从向量库回填
+
+    Returns:
+        DocumentIndex，知识库为空时返回 None
+    """
+    signature = catalog_cached("document_index_signature", project_id,
+                               lambda: document_index_signature(project_id))
+    with _lock:
+        cached = _indexes.get(project_id)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    embedding_key = get_project_embedding_key(project_id)
+    rows = get_document_centroids(project_id)
+    source_count, indexed, _ = signature
+    if indexed < source_count or any(key != embedding_key for _, key, _, _ in rows):
+        built = refresh_document_index(store, project_id)
+        logger.info(f"📑 文档级索引已回填: {project_id} ({built} 个文件)")
+        signature = document_index_signature(project_id)
+        rows = get_document_centroids(project_id)
+    if not rows:
+        return None
+
+    index = DocumentIndex([source for source, _, _, _ in rows], np.asarray([v for _, _, v, _ in rows]))
+    with _lock:
+        _indexes[project_id] = (signature, index)
+    return index
+
+
+def coarse_filter(store, project_id: str, query_vector) -> Optional[Dict]:
+    """
+    两阶段检索第一阶段：知识库启用且规模足够时，返回限定在最相关 N 个文件内的过滤条件
+
+    Returns:
+        片段级检索使用的过滤条件；未启用、规模不足或失败时返回 None（按全库检索）
+    """
+    config = get_project_retrieval_config(project_id)
+    if config.two_stage_top_docs <= 0:
+        return None
+    try:
+        chunks = catalog_cached("chunk_count", project_id, lambda: count_chunk_records(project_id))
+        if chunks < config.two_stage_min_chunks:
+            return None
+        index = get_document_index(store, project_id)
+        if index is None or len(index) <= config.two_stage_top_docs:
+            return None
+        top = index.top_sources(query_vector, config.two_stage_top_docs)
+    except Exception as e:
+        logger.warning(f"文档级粗排失败: {e}，按全库检索")
+        return None
+    logger.info(f"📑 两阶段检索: {len(index)} 个文件中选出 {len(top)} 个")
+    return {"$and": [{"project_id": project_id}, {"source": {"$in": [source for source, _ in top]}}]}
@@ -1,6 +1,7 @@
 # src/rag/etl.py
 import os
 import tempfile
+from collections import Counter
 from pathlib import Path
 from typing import Dict, List, Optional
 
@@ -14,6 +15,9 @@ from langchain_community.document_loaders import (
 )
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from config.settings import settings
+from src.rag.chunk_ids import assign_chunk_id, make_parent_id
+from src.rag.parent_chunks import PARENT_CONTENT_KEY
+from src.rag.project_config import get_project_retrieval_config
 from src.utils.logger import setup_logger
 
 logger = setup_logger("RAG_ETL")
@@ -170,6 +174,9 @@ class ContentProcessor:
     def __init__(self):
         self.chunk_size = settings.CHUNK_SIZE
         self.chunk_overlap = settings.CHUNK_OVERLAP
+        self.parent_chunk_size = settings.PARENT_CHUNK_SIZE
+        self.child_chunk_size = settings.CHILD_CHUNK_SIZE
+        self.child_chunk_overlap = settings.CHILD_CHUNK_OVERLAP
 
     def load_uploaded_files(self, uploaded_files: List[UploadedFile]) -> List:
         """
@@ -254,55 +261,96 @@ class ContentProcessor:
             logger.info(f"   📝 检测到非 UTF-8 编码，尝试 GBK...")
             return TextLoader(file_path, encoding="gbk", errors="ignore")
 
-    def split_documents(self, documents: List) -> List:
+    @staticmethod
+    def _separators_for(file_type: str) -> List[str]:
+        """根据文件类型选择分隔符"""
+        if file_type == ".md":
+            return MARKDOWN_SEPARATORS
+        if file_type == ".py":
+            return PYTHON_SEPARATORS
+        if file_type == ".java":
+            return JAVA_SEPARATORS
+        if file_type in [".js", ".ts"]:
+            return JS_SEPARATORS
+        if file_type in [".c", ".cpp", ".go", ".rs"]:
+            # C/C++/Go/Rust 使用类似的代码分隔符
+            return [
+                "\n\nfunc ", "\n\nfunc (", "\n\nfn ", "\n\nstruct ",
+                "\nfunc ", "\nfn ", "\nstruct ",
+                "\n\n", "\n", ";", " ", ""
+            ]
+        # txt、pdf、docx 等普通文档使用中文分隔符
+        return CHINESE_SEPARATORS
+
+    @staticmethod
+    def _splitter(separators: List[str], chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=separators,
+            length_function=len,
+            is_separator_regex=False
+        )
+
+    def split_documents(self, documents: List, project_id: Optional[str] = None,
+                        mode: Optional[str] = None) -> List:
         """
         智能切分文档：
         - 根据文档类型选择不同的分隔符策略
         - 支持中文文档、Markdown、多种代码语言
+        - 每个片段记录文件内序号 chunk_index；给出 project_id 时同时生成确定性 chunk_id
+        - parent_child 模式（按知识库配置，需给出 project_id）：先切出父片段，再把每个父片段切成
+          子片段；返回的是子片段，元数据带 parent_id / parent_index 与父片段正文（入库时写入父片段表）
         """
         if not documents:
             return []
-        
+        if mode is None:
+            mode = get_project_retrieval_config(project_id).chunk_mode if project_id else settings.CHUNK_MODE
+        if mode == "parent_child" and project_id is None:
+            logger.warning("父子切分需要知识库ID，按普通模式切分")
+            mode = "standard"
+
         all_chunks = []
-        
-        # 按文件类型分组处理
+        ordinals = Counter()
+        parent_ordinals = Counter()
+
         for doc in documents:
-            file_type = doc.metadata.get("file_type", "").lower()
-            
-            # 根据文件类型选择分隔符
-            if file_type == ".md":
-                separators = MARKDOWN_SEPARATORS
-            elif file_type == ".py":
-                separators = PYTHON_SEPARATORS
-            elif file_type == ".java":
-                separators = JAVA_SEPARATORS
-            elif file_type in [".js", ".ts"]:
-                separators = JS_SEPARATORS
-            elif file_type in [".c", ".cpp", ".go", ".rs"]:
-                # C/C++/Go/Rust 使用类似的代码分隔符
-                separators = [
-                    "\n\nfunc ", "\n\nfunc (", "\n\nfn ", "\n\nstruct ",
-                    "\nfunc ", "\nfn ", "\nstruct ",
-                    "\n\n", "\n", ";", " ", ""
-                ]
+            separators = self._separators_for(doc.metadata.get("file_type", "").lower())
+
+            if mode == "parent_child":
+                chunks = []
+                child_splitter = self._splitter(separators, self.child_chunk_size, self.child_chunk_overlap)
+                for parent in self._splitter(separators, self.parent_chunk_size, 0).split_documents([doc]):
+                    source = parent.metadata.get("source", "unknown")
+                    parent_index = parent_ordinals[source]
+                    parent_ordinals[source] += 1
+                    parent_id = make_parent_id(project_id, source, parent_index, parent.page_content)
+                    for child in child_splitter.split_documents([parent]):
+                        child.metadata.update({
+                            "parent_id": parent_id,
+                            "parent_index": parent_index,
+                            PARENT_CONTENT_KEY: parent.page_content,
+                        })
+                        chunks.append(child)
             else:
-                # txt、pdf、docx 等普通文档使用中文分隔符
-                separators = CHINESE_SEPARATORS
-            
-            # 创建切分器
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=self.chunk_size,
-                chunk_overlap=self.chunk_overlap,
-                separators=separators,
-                length_function=len,
-                is_separator_regex=False
-            )
-            
-            # 切分单个文档
-            chunks = text_splitter.split_documents([doc])
+                chunks = self._splitter(separators, self.chunk_size, self.chunk_overlap).split_documents([doc])
+
+            # 同一文件的多个页面连续编号
+            for chunk in chunks:
+                source = chunk.metadata.get("source", "unknown")
+                chunk.metadata["chunk_index"] = ordinals[source]
+                ordinals[source] += 1
+                if project_id is not None:
+                    assign_chunk_id(chunk, project_id)
             all_chunks.extend(chunks)
-        
-        logger.info(f"✅ 切分完成: {len(documents)} 个文档 → {len(all_chunks)} 个片段")
+
+        if mode == "parent_child":
+            logger.info(
+                f"✅ 父子切分完成: {len(documents)} 个文档 → {sum(parent_ordinals.values())} 个父片段 / "
+                f"{len(all_chunks)} 个子片段"
+            )
+        else:
+            logger.info(f"✅ 切分完成: {len(documents)} 个文档 → {len(all_chunks)} 个片段")
         return all_chunks
     
     def get_supported_file_types(self) -> Dict[str, str]:
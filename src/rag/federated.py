@@ -0,0 +1,278 @@
+# src/rag/federated.py
+"""
+联邦检索 - 一次查询多个知识库
+1. 路由：查询向量与各知识库的质心向量比较，明显无关的知识库不检索
+2. 扇出：选中的知识库在线程池中并行检索（单库超时不拖慢整体）
+3. 融合：各库分数先归一化到 [0, 1]（各库结果已按相关度排序，首条为 1、末条为 0），
+   乘以路由权重得到跨库可比的全局排序，再与各库自身排序一起做 RRF，取全局 top_k
+
+质心为知识库全部片段向量（单位化后）的均值，持久化在 project_centroids 表，并记录计算时的内容签名
+（文档级索引签名，入库 / 删除后变化）。计算需要读取知识库全部片段向量，只在后台进行：
+入库 / 删除后重算已有的质心；检索时发现签名过期仍先用旧质心路由，同时提交后台重算；
+尚无可用质心（从未计算 / Embedding 模型变化）的知识库不参与路由，照常检索。
+"""
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config.settings import settings
+from src.rag.hybrid_retriever import rrf_fuse
+from src.rag.project_config import get_project_embedding_key
+from src.utils.db import (
+    catalog_cached,
+    count_chunk_records,
+    document_index_signature,
+    get_project_centroids,
+    save_project_centroid,
+)
+from src.utils.logger import setup_logger
+
+logger = setup_logger("Federated_Search")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# 质心后台重算：单线程，同一知识库同时只有一个任务
+_refresh_executor: Optional[ThreadPoolExecutor] = None
+_refreshing: Dict[str, Future] = {}
+_refresh_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.FEDERATED_WORKERS, thread_name_prefix="federated"
+            )
+        return _executor
+
+
+@dataclass
+class FederatedSearchResult:
+    """联邦检索结果"""
+    results: List[Tuple[Document, float]]        # 全局 top_k（分数为 RRF 分数）
+    searched: List[str]                          # 实际检索的知识库
+    skipped: Dict[str, str] = field(default_factory=dict)   # 知识库 -> 跳过原因
+    routing_scores: Dict[str, float] = field(default_factory=dict)  # 知识库 -> 查询与质心的余弦相似度
+    latency_ms: float = 0.0
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def compute_centroid(store, project_id: str) -> Optional[np.ndarray]:
+    """知识库全部片段向量的单位化均值（知识库为空时返回 None）"""
+    raw = store.get(where={"project_id": project_id}, include=["embeddings"])
+    embeddings = raw.get("embeddings")
+    if embeddings is None or len(embeddings) == 0:
+        return None
+    return _unit(_unit(np.asarray(embeddings, dtype=np.float32)).mean(axis=0))
+
+
+def _chunk_count(project_id: str) -> int:
+    return catalog_cached("chunk_count", project_id, lambda: count_chunk_records(project_id))
+
+
+def content_signature(project_id: str) -> str:
+    """知识库内容签名（文档级索引签名，入库 / 删除后变化；按片段目录版本缓存）"""
+    signature = catalog_cached("document_index_signature", project_id,
+                               lambda: document_index_signature(project_id))
+    return json.dumps(list(signature))
+
+
+def refresh_centroid(store, project_id: str) -> Optional[np.ndarray]:
+    """从向量库重新计算并保存知识库质心（读取全部片段向量，只在后台调用）"""
+    # 先取签名：计算期间有新写入时签名随之变化，下次检索会再次重算
+    signature = content_signature(project_id)
+    centroid = compute_centroid(store, project_id)
+    if centroid is None:
+        return None
+    count = _chunk_count(project_id)
+    save_project_centroid(project_id, get_project_embedding_key(project_id), centroid.tolist(), count, signature)
+    logger.info(f"📍 知识库质心已更新: {project_id} ({count} 个片段)")
+    return centroid
+
+
+def _refresh_quietly(store, project_id: str):
+    try:
+        refresh_centroid(store, project_id)
+    except Exception as e:
+        logger.warning(f"⚠️ 知识库 {project_id} 质心重算失败: {e}")
+
+
+def schedule_centroid_refresh(store, project_id: str) -> Future:
+    """在后台重算知识库质心（已在排队 / 计算中时不重复提交）"""
+    global _refresh_executor
+    with _refresh_lock:
+        future = _refreshing.get(project_id)
+        if future is None or future.done():
+            if _refresh_executor is None:
+                _refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="centroid")
+            future = _refresh_executor.submit(_refresh_quietly, store, project_id)
+            _refreshing[project_id] = future
+        return future
+
+
+def refresh_saved_centroid(store, project_id: str) -> Optional[Future]:
+    """入库 / 删除后调用：已有质心的知识库在后台重算（未参与过联邦检索的不计算）"""
+    if project_id not in get_project_centroids([project_id]):
+        return None
+    return schedule_centroid_refresh(store, project_id)
+
+
+def load_centroids(store, project_ids: List[str],
+                   embedding_keys: Dict[str, str]) -> Dict[str, Optional[np.ndarray]]:
+    """
+    读取各知识库质心（不读取片段向量）：签名过期的仍返回已保存的质心并提交后台重算
+
+    Returns:
+        {project_id: 单位质心向量或 None（空知识库）}；尚无可用质心的知识库不在其中
+    """
+    saved = get_project_centroids(project_ids)
+    centroids = {}
+    for project_id in project_ids:
+        if not _chunk_count(project_id):
+            centroids[project_id] = None
+            continue
+        record = saved.get(project_id)
+        usable = record is not None and record["embedding_key"] == embedding_keys[project_id]
+        if usable:
+            centroids[project_id] = np.asarray(record["vector"], dtype=np.float32)
+        if not usable or record["signature"] != content_signature(project_id):
+            schedule_centroid_refresh(store, project_id)
+    return centroids
+
+
+def route_projects(
+    query_vectors: Dict[str, np.ndarray],
+    centroids: Dict[str, Optional[np.ndarray]],
+    max_projects: Optional[int] = None,
+    margin: Optional[float] = None,
+    min_similarity: Optional[float] = None,
+) -> Tuple[List[str], Dict[str, str], Dict[str, float]]:
+    """
+    按查询与质心的余弦相似度选择要检索的知识库
+
+    保留相似度不低于 min_similarity、且与最佳知识库相差不超过 margin 的知识库，最多 max_projects 个
+
+    Args:
+        query_vectors: 知识库 -> 该库 Embedding 模型下的查询向量
+
+    Returns:
+        (选中的知识库（按相似度降序）, 跳过原因, 相似度)
+    """
+    max_projects = max_projects or settings.FEDERATED_MAX_PROJECTS
+    margin = settings.FEDERATED_ROUTING_MARGIN if margin is None else margin
+    min_similarity = settings.FEDERATED_MIN_SIMILARITY if min_similarity is None else min_similarity
+
+    skipped, scores = {}, {}
+    for project_id, centroid in centroids.items():
+        query = query_vectors[project_id]
+        if centroid is None:
+            skipped[project_id] = "empty"
+        elif centroid.shape != query.shape:
+            skipped[project_id] = "dimension_mismatch"
+        else:
+            scores[project_id] = float(np.dot(_unit(query), centroid))
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    if not ranked:
+        return [], skipped, scores
+    floor = max(min_similarity, scores[ranked[0]] - margin)
+    selected = []
+    for project_id in ranked:
+        if scores[project_id] < floor:
+            skipped[project_id] = "routing"
+        elif len(selected) >= max_projects:
+            skipped[project_id] = "max_projects"
+        else:
+            selected.append(project_id)
+    return selected, skipped, scores
+
+
+def normalize_scores(results: List[Tuple[Document, float]]) -> List[float]:
+    """
+    单库结果分数归一化到 [0, 1]
+
+    结果已按相关度排序（向量距离升序或融合分数降序），按首末两条线性映射，
+    方向无关：首条为 1，末条为 0，全部相同时为 1
+    """
+    if not results:
+        return []
+    first, last = results[0][1], results[-1][1]
+    if first == last:
+        return [1.0] * len(results)
+    return [(score - last) / (first - last) for _, score in results]
+
+
+def fuse_results(
+    per_project: Dict[str, List[Tuple[Document, float]]],
+    routing_scores: Dict[str, float],
+    top_k: int,
+) -> List[Tuple[Document, float]]:
+    """各库排序 + 按（归一化分数 × 路由权重）的全局排序，RRF 融合取 top_k"""
+    best = max((routing_scores.get(p, 0.0) for p in per_project), default=0.0)
+    calibrated = []
+    for project_id, results in per_project.items():
+        weight = routing_scores.get(project_id, 0.0) / best if best > 0 else 1.0
+        for (doc, _), norm in zip(results, normalize_scores(results)):
+            calibrated.append((doc, norm * weight))
+    calibrated.sort(key=lambda x: x[1], reverse=True)
+    return rrf_fuse(list(per_project.values()) + [calibrated], top_k=top_k, k=settings.RRF_K)
+
+
+def federated_search(
+    search_fn: Callable[[str], List[Tuple[Document, float]]],
+    project_ids: List[str],
+    query_vectors: Dict[str, np.ndarray],
+    centroids: Dict[str, Optional[np.ndarray]],
+    top_k: int = 5,
+    timeout: Optional[float] = None,
+) -> FederatedSearchResult:
+    """
+    路由 → 并行检索 → 归一化 + RRF 融合
+
+    Args:
+        search_fn: 单库检索函数 project_id -> [(Document, score), ...]（已按相关度排序）
+        centroids: 知识库质心；不在其中的知识库（尚无可用质心）无法路由，一律检索
+        timeout: 单库检索时限（秒，0 不限制），超时的知识库不参与融合
+    """
+    start = time.perf_counter()
+    timeout = settings.FEDERATED_TIMEOUT if timeout is None else timeout
+    selected, skipped, scores = route_projects(
+        query_vectors, {p: centroids[p] for p in project_ids if p in centroids}
+    )
+    unrouted = [p for p in project_ids if p not in centroids]
+    selected += unrouted
+    logger.info(f"🧭 联邦检索路由: 检索 {selected}（{len(unrouted)} 个未路由），跳过 {len(skipped)} 个知识库")
+
+    executor = _get_executor()
+    futures = {project_id: executor.submit(search_fn, project_id) for project_id in selected}
+    per_project, searched = {}, []
+    for project_id, future in futures.items():
+        remaining = max(0.0, start + timeout - time.perf_counter()) if timeout else None
+        try:
+            per_project[project_id] = future.result(timeout=remaining)
+            searched.append(project_id)
+        except FutureTimeoutError:
+            skipped[project_id] = "timeout"
+            logger.warning(f"⏱️ 知识库 {project_id} 检索超时 ({timeout}s)，不参与融合")
+        except Exception as e:
+            skipped[project_id] = "error"
+            logger.warning(f"知识库 {project_id} 检索失败: {e}")
+
+    results = fuse_results(per_project, scores, top_k)
+    latency = (time.perf_counter() - start) * 1000
+    logger.info(f"✅ 联邦检索完成: {len(searched)} 个知识库，返回 {len(results)} 条 ({latency:.0f}ms)")
+    return FederatedSearchResult(
+        results=results, searched=searched, skipped=skipped, routing_scores=scores, latency_ms=latency,
+    )
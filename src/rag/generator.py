@@ -12,6 +12,8 @@ from langchain_core.prompts import ChatPromptTemplate
 # 输出解析器，将模型输出转换为字符串
 from langchain_core.output_parsers import StrOutputParser
 
+from src.rag.compressor import get_compressor
+from src.rag.context_packer import format_span, pack_context
 from src.rag.retriever import VectorRetriever
 from src.agent.prompts import (
     get_rag_generator_prompt, 
@@ -21,7 +23,9 @@ from src.agent.prompts import (
 from config.settings import settings
 from src.utils.logger import setup_logger
 from src.utils.model_manager import model_manager
-from typing import List, Tuple, Optional
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, List, Tuple, Optional
+import asyncio
 import time
 
 logger = setup_logger("RAG_Generator")
@@ -30,6 +34,21 @@ logger = setup_logger("RAG_Generator")
 RELEVANCE_THRESHOLD = 0.15  # 低于此分数认为不相关（放宽，减少误拒）
 SCORE_THRESHOLD = 2.0      # 向量距离阈值（越小越相关）
 
+@dataclass
+class BatchAnswer:
+    """批量问答中单个问题的结果"""
+    index: int                  # 在输入列表中的位置
+    question: str
+    answer: str
+    success: bool = True
+    docs_count: int = 0
+    deny_reason: str = ""       # 被拒答时的原因，正常生成为空
+    retrieval_ms: float = 0.0   # 批量检索耗时按问题数均摊
+    generation_ms: float = 0.0  # 从批量生成开始到该条完成的耗时
+    latency_ms: float = 0.0
+    error: str = ""
+
+
 class RAGGenerator:
     def __init__(self, enable_relevance_check: bool = True):
         self.retriever = VectorRetriever()
@@ -48,8 +67,8 @@ class RAGGenerator:
         self.reranker = None
         if self.enable_reranker:
             try:
-                from src.rag.reranker import Reranker
-                self.reranker = Reranker(backend=settings.RERANKER_BACKEND)
+                from src.rag.reranker import get_reranker
+                self.reranker = get_reranker(settings.RERANKER_BACKEND)
                 logger.info(f"✅ Reranker 已启用，后端: {settings.RERANKER_BACKEND}")
             except Exception as e:
                 logger.warning(f"Reranker 初始化失败: {e}，将不使用重排序")
@@ -74,12 +93,20 @@ class RAGGenerator:
             formatted.append(f"【文档{i+1} 来源: {source}】\n{doc.page_content}")
         return "\n\n".join(formatted)
     
-    def _format_docs_with_scores(self, docs: List[Tuple]) -> str:
-        """格式化带分数的文档列表"""
+    def _format_docs_with_scores(self, docs: List[Tuple], question: Optional[str] = None,
+                                 project_id: str = "default") -> str:
+        """
+        格式化带分数的文档列表
+        给出 question 且启用上下文压缩时先抽取相关句子；启用上下文打包时合并相邻片段、去掉近重复并限制 token 数
+        """
+        if question and settings.CONTEXT_COMPRESSION and docs:
+            docs = get_compressor(project_id).compress(question, docs).results
+        if settings.CONTEXT_PACKING:
+            return pack_context(docs).text
         formatted = []
         for i, (doc, score) in enumerate(docs):
             source = doc.metadata.get('source', '未知来源')
-            formatted.append(f"【文档{i+1} 来源: {source} 相关度: {score:.2f}】\n{doc.page_content}")
+            formatted.append(format_span(i + 1, source, score, doc.page_content))
         return "\n\n".join(formatted)
     
     def check_relevance(self, question: str, context: str) -> float:
@@ -198,7 +225,7 @@ class RAGGenerator:
             print(f"📄 片段 {i+1} (匹配分 {score:.2f}):\n{doc.page_content.strip()[:100]}...")
         print("="*60 + "\n")
         
-        context = self._format_docs_with_scores(docs)
+        context = self._format_docs_with_scores(docs, question=question, project_id=project_id)
         logger.info(f"检索上下文长度: {len(context)} 字符")
 
         # 3. 生成回答
@@ -214,6 +241,146 @@ class RAGGenerator:
             logger.error(f"LLM 调用出错: {e}")
             return "生成回答时出错，请稍后重试。"
     
+    # ==================== 批量问答 ====================
+
+    def _prepare_batch(
+        self,
+        questions: List[str],
+        project_id: str,
+    ) -> Tuple[List[BatchAnswer], List[Tuple[BatchAnswer, str]]]:
+        """
+        批量检索 + 重排序 + 拒答判断
+
+        Returns:
+            (已完成的结果, [(待生成的结果, context), ...])
+        """
+        start_time = time.time()
+        docs_batch = self.retriever.query_batch(questions, project_id=project_id, top_k=10)
+        retrieval_ms = (time.time() - start_time) * 1000 / max(len(questions), 1)
+
+        finished: List[BatchAnswer] = []
+        pending: List[Tuple[BatchAnswer, str]] = []
+        for index, (question, docs) in enumerate(zip(questions, docs_batch)):
+            item_start = time.time()
+            if self.enable_reranker and self.reranker and docs:
+                docs = self.reranker.rerank(question, docs, top_k=3)
+
+            item = BatchAnswer(index=index, question=question, answer="", docs_count=len(docs))
+
+            deny_reason = ""
+            if self.enable_relevance_check:
+                should_deny, reason = self.should_deny(question, docs, use_llm_check=False)
+                if should_deny:
+                    deny_reason = reason
+            elif not docs:
+                deny_reason = "no_results"
+
+            item.retrieval_ms = retrieval_ms + (time.time() - item_start) * 1000
+            if deny_reason:
+                item.deny_reason = deny_reason
+                item.answer = self._generate_denial_response(question, deny_reason)
+                item.latency_ms = item.retrieval_ms
+                finished.append(item)
+            else:
+                context = self._format_docs_with_scores(docs, question=question, project_id=project_id)
+                pending.append((item, context))
+
+        return finished, pending
+
+    @staticmethod
+    def _complete_batch_item(item: BatchAnswer, output, generation_start: float) -> BatchAnswer:
+        """写入单条生成结果及耗时"""
+        item.generation_ms = (time.time() - generation_start) * 1000
+        item.latency_ms = item.retrieval_ms + item.generation_ms
+        if isinstance(output, Exception):
+            logger.error(f"批量生成第 {item.index} 条出错: {output}")
+            item.success = False
+            item.error = str(output)
+            item.answer = "生成回答时出错，请稍后重试。"
+        else:
+            item.answer = output
+        return item
+
+    def iter_answers_batch(
+        self,
+        questions: List[str],
+        project_id: str = "default",
+        max_concurrency: Optional[int] = None,
+    ) -> Iterator[BatchAnswer]:
+        """
+        批量问答（流式）：检索阶段整体批量执行，生成阶段按完成顺序逐条产出
+
+        Args:
+            questions: 问题列表
+            project_id: 知识库ID
+            max_concurrency: 同时在途的 LLM 请求上限，None 时读取 BATCH_MAX_CONCURRENCY
+
+        Yields:
+            BatchAnswer，顺序为完成顺序，可用 index 对应回输入位置
+        """
+        if not questions:
+            return
+        max_concurrency = max_concurrency or settings.BATCH_MAX_CONCURRENCY
+        logger.info(f"🤖 批量问答: {len(questions)} 个问题 (并发 {max_concurrency})")
+
+        finished, pending = self._prepare_batch(questions, project_id)
+        yield from finished
+        if not pending:
+            return
+
+        rag_chain = self.prompt_template | self._get_llm() | StrOutputParser()
+        inputs = [{"context": context, "question": item.question} for item, context in pending]
+        generation_start = time.time()
+        for pos, output in rag_chain.batch_as_completed(
+            inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True
+        ):
+            yield self._complete_batch_item(pending[pos][0], output, generation_start)
+
+    def get_answers_batch(
+        self,
+        questions: List[str],
+        project_id: str = "default",
+        max_concurrency: Optional[int] = None,
+    ) -> List[BatchAnswer]:
+        """批量问答，按输入顺序返回全部结果"""
+        results = list(self.iter_answers_batch(questions, project_id, max_concurrency))
+        return sorted(results, key=lambda r: r.index)
+
+    async def aiter_answers_batch(
+        self,
+        questions: List[str],
+        project_id: str = "default",
+        max_concurrency: Optional[int] = None,
+    ) -> AsyncIterator[BatchAnswer]:
+        """iter_answers_batch 的异步版本，生成阶段走 chat model 的 abatch"""
+        if not questions:
+            return
+        max_concurrency = max_concurrency or settings.BATCH_MAX_CONCURRENCY
+
+        finished, pending = await asyncio.to_thread(self._prepare_batch, questions, project_id)
+        for item in finished:
+            yield item
+        if not pending:
+            return
+
+        rag_chain = self.prompt_template | self._get_llm() | StrOutputParser()
+        inputs = [{"context": context, "question": item.question} for item, context in pending]
+        generation_start = time.time()
+        async for pos, output in rag_chain.abatch_as_completed(
+            inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True
+        ):
+            yield self._complete_batch_item(pending[pos][0], output, generation_start)
+
+    async def aget_answers_batch(
+        self,
+        questions: List[str],
+        project_id: str = "default",
+        max_concurrency: Optional[int] = None,
+    ) -> List[BatchAnswer]:
+        """异步批量问答，按输入顺序返回全部结果"""
+        results = [item async for item in self.aiter_answers_batch(questions, project_id, max_concurrency)]
+        return sorted(results, key=lambda r: r.index)
+
     def _generate_denial_response(self, question: str, reason: str) -> str:
         """生成拒绝回答的响应"""
         denial_responses = {
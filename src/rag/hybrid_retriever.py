@@ -1,48 +1,156 @@
 # src/rag/hybrid_retriever.py
 """
-混合检索模块 - 向量检索 + BM25 关键词检索 + RRF 融合
+混合检索模块 - 向量检索 + 关键词检索 + RRF 融合
 通过结合语义搜索和关键词精确匹配，提升检索质量
+
+关键词检索路有两种：
+- 全文索引（默认）：查询数据库中持久化的 FTS5 / tsvector 索引，只为命中的片段回向量库取正文
+- 内存 BM25：传入 documents 时在进程内构建（rank-bm25），片段词序列优先使用入库时保存的结果
+
+各检索路（向量、关键词、多查询变体的各路）在共享线程池中并发执行，每路有独立时限（从该路开始执行时计）：
+超时的路不参与融合，不拖慢整个请求；批量检索整批共用一个总时限。各路耗时写入指标收集器。
+
+启用 MMR 时融合出 top_k × mmr_fetch_factor 个候选再去冗余选出 top_k，
+候选向量复用向量路检索时一并返回的向量，只有关键词路独有的片段才按 ID 回向量库取向量。
 """
 
-from typing import List, Tuple, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Tuple, Optional
+
+import numpy as np
 from langchain_core.documents import Document
-from rank_bm25 import BM25Okapi
 
+from src.rag import keyword_index
+from src.rag.chunk_ids import chunk_key
+from src.rag.mmr import apply_mmr, mmr_fetch_k
+from config.settings import settings
+from src.rag.text_tokenizer import Tokenizer, get_tokenizer
 from src.utils.logger import setup_logger
 
 logger = setup_logger("Hybrid_Retriever")
 
+# 检索路线程池（进程内共享；超时的路在后台跑完后结果丢弃）
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RETRIEVAL_LEG_WORKERS, thread_name_prefix="retrieval-leg"
+            )
+        return _executor
+
+
+def _record_leg(project_id: str, leg: str, latency_ms: float, status: str):
+    """各检索路耗时写入指标收集器（retrieval.<路类型>_latency，status: ok | error | timeout）"""
+    from src.metrics.collector import metrics_collector
+
+    metrics_collector.record(
+        "retrieval", f"{leg.split(':')[0]}_latency", latency_ms, "ms",
+        tags={"project_id": project_id, "leg": leg, "status": status},
+    )
+
+
+def rrf_fuse(
+    result_lists: List[List[Tuple[Document, float]]],
+    top_k: int = 5,
+    k: int = 60,
+) -> List[Tuple[Document, float]]:
+    """
+    任意多路结果的 RRF 融合（按片段 ID 合并同一片段）
+
+    Args:
+        result_lists: 各路结果（各自按相关度降序）
+        top_k: 返回的结果数量
+        k: RRF 平滑参数
+
+    Returns:
+        融合排序后的 [(Document, rrf_score), ...] 列表
+    """
+    scores = {}
+    doc_map = {}
+
+    for results in result_lists:
+        for rank, (doc, _score) in enumerate(results):
+            key = chunk_key(doc)
+            scores[key] = scores.get(key, 0) + 1.0 / (k + rank + 1)
+            if key not in doc_map:
+                doc_map[key] = doc
+
+    # 按 RRF 分数降序排列，返回 top_k 结果
+    sorted_results = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    return [(doc_map[key], rrf_score) for key, rrf_score in sorted_results[:top_k]]
+
 
 class HybridRetriever:
     """
-    混合检索器：向量 + BM25 + RRF 融合
+    混合检索器：向量 + 关键词（全文索引 / BM25）+ RRF 融合
 
-    结合语义向量检索（捕捉语义相似性）和 BM25 关键词检索（捕捉精确匹配），
+    结合语义向量检索（捕捉语义相似性）和关键词检索（捕捉精确匹配），
     使用 Reciprocal Rank Fusion (RRF) 算法融合两路结果。
     """
 
-    def __init__(self, vector_store, documents: List[Document], project_id: str):
+    def __init__(
+        self,
+        vector_store,
+        documents: Optional[List[Document]],
+        project_id: str,
+        tokenizer: Optional[Tokenizer] = None,
+        token_streams: Optional[Dict[str, List[str]]] = None,
+        leg_timeouts: Optional[Dict[str, float]] = None,
+    ):
         """
         初始化混合检索器
 
         Args:
-            vector_store: Chroma 向量数据库实例
-            documents: 用于构建 BM25 索引的文档列表
+            vector_store: 向量存储（VectorStoreBase 实现）
+            documents: 用于构建内存 BM25 索引的文档列表；为 None 时使用持久化全文索引
             project_id: 项目/知识库 ID
+            tokenizer: BM25 分词器，默认取 BM25_TOKENIZER 配置
+            token_streams: 入库时保存的词序列 {chunk_id: tokens}（须由同一分词器切分），
+                           缺失的片段在此现场分词
+            leg_timeouts: 各类检索路的时限（秒）{"vector": 1.0, "keyword": 0.5}，
+                          未指定的取 RETRIEVAL_LEG_TIMEOUT；0 表示不限制
         """
         self.vector_store = vector_store
         self.project_id = project_id
+        self.documents = documents
+        self.bm25 = None
+        self.leg_timeouts = leg_timeouts or {}
+        self.dropped_legs = 0
+
+        if documents is None:
+            logger.info(f"混合检索器初始化完成，关键词检索使用全文索引 (project_id={project_id})")
+            return
 
         # 构建 BM25 索引
-        self.documents = documents
-        self.tokenized_corpus = [self._tokenize(doc.page_content) for doc in documents]
+        from rank_bm25 import BM25Okapi
+        self.tokenizer = tokenizer or get_tokenizer()
+        token_streams = token_streams or {}
+        self.tokenized_corpus = []
+        reused = 0
+        for doc in documents:
+            tokens = token_streams.get((doc.metadata or {}).get("chunk_id"))
+            if tokens is None:
+                tokens = self.tokenizer.tokenize(doc.page_content)
+            else:
+                reused += 1
+            self.tokenized_corpus.append(tokens)
         self.bm25 = BM25Okapi(self.tokenized_corpus)
 
-        logger.info(f"混合检索器初始化完成，BM25 索引文档数: {len(documents)}")
+        logger.info(
+            f"混合检索器初始化完成，BM25 索引文档数: {len(documents)} "
+            f"(分词器: {self.tokenizer.name}, 复用入库词序列 {reused})"
+        )
 
     def _tokenize(self, text: str) -> List[str]:
         """
-        简单分词：按字符级拆分中文 + 按空格拆分英文
+        查询分词（与片段使用同一分词器，结果按查询缓存）
 
         Args:
             text: 待分词文本
@@ -50,49 +158,142 @@ class HybridRetriever:
         Returns:
             分词结果列表
         """
-        tokens = []
-        # 按空格拆分英文单词
-        for word in text.split():
-            word = word.strip()
-            if not word:
-                continue
-            # 对英文单词直接加入
-            if word.isascii():
-                tokens.append(word.lower())
-            else:
-                # 对中文字符，按字符拆分（简单策略，生产环境可用 jieba）
-                for char in word:
-                    if '\u4e00' <= char <= '\u9fff':
-                        tokens.append(char)
-                    elif char.isalnum():
-                        tokens.append(char.lower())
-        return tokens
+        return self.tokenizer.tokenize_query(text)
 
-    def retrieve(self, query: str, top_k: int = 5) -> List[Tuple[Document, float]]:
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = 5,
+        variants: Optional[List[str]] = None,
+        query_embedding: Optional[List[float]] = None,
+        vector_filter: Optional[Dict] = None,
+        mmr_fetch_factor: int = 0,
+        mmr_lambda: Optional[float] = None,
+    ) -> List[Tuple[Document, float]]:
         """
-        执行混合检索：向量检索 + BM25 检索 + RRF 融合
+        执行混合检索：向量检索与关键词检索并发执行，再 RRF 融合
 
         Args:
             query: 用户查询
             top_k: 返回结果数量
+            variants: 查询变体（多查询改写），每个变体各跑一路向量与一路关键词检索
+            query_embedding: 已计算好的查询向量（原查询的向量路直接使用）
+            vector_filter: 原查询向量路的过滤条件（两阶段检索限定的文件范围），默认整个知识库
+            mmr_fetch_factor: 大于 1 时融合出 top_k × factor 个候选做 MMR 去冗余
+            mmr_lambda: MMR 相关度权重，默认 MMR_LAMBDA
 
         Returns:
             [(Document, score), ...] 融合后的结果列表
         """
-        # 1. 向量检索
-        vector_results = self._vector_search(query, top_k=top_k * 2)
-        logger.info(f"向量检索返回 {len(vector_results)} 条结果")
+        pool_k = mmr_fetch_k(mmr_fetch_factor, top_k)
+        leg_k = max(top_k * 2, pool_k)
+        vectors: Optional[Dict[str, Any]] = {} if pool_k > top_k else None
+
+        legs: Dict[str, Callable[[], List[Tuple[Document, float]]]] = {}
+        for i, text in enumerate([query] + list(variants or [])):
+            suffix = f":{i}" if i else ""
+            if i == 0 and query_embedding is not None:
+                legs["vector"] = lambda: self._vector_search_by_vector(query_embedding, leg_k, vector_filter, vectors)
+            else:
+                legs[f"vector{suffix}"] = lambda text=text: self._vector_search(text, top_k=leg_k)
+            legs[f"keyword{suffix}"] = lambda text=text: self._keyword_search(text, top_k=leg_k)
 
-        # 2. BM25 检索
-        bm25_results = self._bm25_search(query, top_k=top_k * 2)
-        logger.info(f"BM25 检索返回 {len(bm25_results)} 条结果")
+        results = self._run_legs(legs)
+        logger.info(
+            "各检索路返回: " + ", ".join(f"{name}={len(hits)}" for name, hits in results.items())
+        )
 
-        # 3. RRF 融合
-        fused_results = self._rrf_fuse(vector_results, bm25_results, top_k=top_k)
+        fused_results = rrf_fuse(list(results.values()), top_k=pool_k)
+        if vectors is not None:
+            fused_results = self._diversify(fused_results, vectors, top_k, mmr_lambda)
         logger.info(f"RRF 融合后返回 {len(fused_results)} 条结果")
 
         return fused_results
 
+    def _diversify(
+        self,
+        results: List[Tuple[Document, float]],
+        vectors: Dict[str, Any],
+        top_k: int,
+        mmr_lambda: Optional[float],
+    ) -> List[Tuple[Document, float]]:
+        """
+        融合结果的 MMR 去冗余（相关度按融合排名）
+
+        Args:
+            results: 融合排序后的候选
+            vectors: 向量路已返回的 {chunk_key: 向量}，缺失的按 chunk_id 回向量库补取
+        """
+        missing = [
+            doc.metadata.get("chunk_id") for doc, _ in results
+            if chunk_key(doc) not in vectors and doc.metadata.get("chunk_id")
+        ]
+        if missing:
+            try:
+                vectors.update(self.vector_store.get_embeddings(missing, project_id=self.project_id))
+            except Exception as e:
+                logger.warning(f"补取候选向量失败: {e}")
+        return apply_mmr(results, [vectors.get(chunk_key(doc)) for doc, _ in results], top_k, mmr_lambda)
+
+    def _leg_timeout(self, leg: str) -> float:
+        return self.leg_timeouts.get(leg.split(":")[0], settings.RETRIEVAL_LEG_TIMEOUT)
+
+    def _run_legs(self, legs: Dict[str, Callable[[], list]],
+                  batch_timeout: Optional[float] = None) -> Dict[str, list]:
+        """
+        并发执行各检索路
+
+        batch_timeout 为 None 时每路按自己的时限等待，从该路真正开始执行时计（在线程池中排队的时间不计）；
+        排队等待另有上限：从提交时刻起超过各路时限的最大值仍未开始的路直接放弃
+        （线程池被超时未结束的路占满时，请求不会无限期等待）。
+        给出 batch_timeout 时所有路共用一个从提交时刻计的总时限（0 表示不限制），用于一次提交大量检索路的批量检索。
+        超时的路：尚未开始的直接取消，已在执行的无法中断，结果丢弃。
+
+        Returns:
+            {路名: 结果}，按 legs 的顺序；超时或失败的路不在其中
+        """
+        began = {name: threading.Event() for name in legs}
+        leg_starts: Dict[str, float] = {}
+
+        def timed(name: str, fn: Callable[[], list]) -> list:
+            leg_starts[name] = leg_start = time.perf_counter()
+            began[name].set()
+            status = "error"
+            try:
+                result = fn()
+                status = "ok"
+                return result
+            finally:
+                _record_leg(self.project_id, name, (time.perf_counter() - leg_start) * 1000, status)
+
+        executor = _get_executor()
+        start = time.perf_counter()
+        futures = {name: executor.submit(timed, name, fn) for name, fn in legs.items()}
+        queue_cap = max((self._leg_timeout(name) for name in legs), default=0)
+
+        results = {}
+        for name, future in futures.items():
+            try:
+                if batch_timeout is None:
+                    timeout = self._leg_timeout(name)
+                    if timeout and not began[name].wait(max(0.0, start + queue_cap - time.perf_counter())):
+                        raise FutureTimeoutError()
+                    remaining = max(0.0, leg_starts[name] + timeout - time.perf_counter()) if timeout else None
+                else:
+                    timeout = batch_timeout
+                    remaining = max(0.0, start + timeout - time.perf_counter()) if timeout else None
+                results[name] = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                future.cancel()
+                self.dropped_legs += 1
+                started = "" if began[name].is_set() else "，排队未开始"
+                logger.warning(f"⏱️ 检索路 {name} 超时 ({timeout}s{started})，不参与融合")
+                _record_leg(self.project_id, name, timeout * 1000, "timeout")
+            except Exception as e:
+                self.dropped_legs += 1
+                logger.warning(f"检索路 {name} 失败: {e}，不参与融合")
+        return results
+
     def _vector_search(self, query: str, top_k: int = 10) -> List[Tuple[Document, float]]:
         """
         向量语义检索
@@ -107,13 +308,168 @@ class HybridRetriever:
         try:
             filter_rule = {"project_id": self.project_id}
             results = self.vector_store.similarity_search_with_score(
-                query, k=top_k, filter=filter_rule
+                query, top_k=top_k, filter=filter_rule
             )
             return results
         except Exception as e:
             logger.warning(f"向量检索失败: {e}")
             return []
 
+    def _vector_search_by_vector(self, embedding: List[float], top_k: int = 10,
+                                 filter_rule: Optional[Dict] = None,
+                                 vectors: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """按已计算好的查询向量检索（filter_rule 默认为整个知识库）；给出 vectors 时顺带收集命中片段的向量"""
+        try:
+            filter_rule = filter_rule or {"project_id": self.project_id}
+            if vectors is None:
+                return self.vector_store.similarity_search_by_vector_with_score(
+                    embedding, top_k=top_k, filter=filter_rule
+                )
+            hits = self.vector_store.similarity_search_by_vector_with_embeddings(
+                embedding, top_k=top_k, filter=filter_rule
+            )
+            for doc, _, vector in hits:
+                if vector is not None:
+                    vectors[chunk_key(doc)] = vector
+            return [(doc, score) for doc, score, _ in hits]
+        except Exception as e:
+            logger.warning(f"向量检索失败: {e}")
+            return []
+
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        query_embeddings: List[List[float]],
+        top_k: int = 5,
+        vector_filters: Optional[List[Optional[Dict]]] = None,
+        mmr_fetch_factor: int = 0,
+        mmr_lambda: Optional[float] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        批量混合检索：内存 BM25 模式下所有查询共享同一份索引，全文索引模式下正文一次批量取回
+
+        Args:
+            queries: 查询列表
+            query_embeddings: 与 queries 一一对应的查询向量（一次批量 Embedding 得到）
+            top_k: 每个查询返回的结果数量
+            vector_filters: 与 queries 一一对应的向量路过滤条件（两阶段检索），None 为整个知识库
+            mmr_fetch_factor: 大于 1 时各查询融合出 top_k × factor 个候选做 MMR 去冗余
+            mmr_lambda: MMR 相关度权重，默认 MMR_LAMBDA
+
+        Returns:
+            与 queries 顺序一致的结果列表
+        """
+        vector_filters = vector_filters or [None] * len(queries)
+        pool_k = mmr_fetch_k(mmr_fetch_factor, top_k)
+        leg_k = max(top_k * 2, pool_k)
+        vectors = [{} if pool_k > top_k else None for _ in queries]
+
+        # 关键词路整批一次（共享 BM25 得分 / 一次取回正文），与各查询的向量路并发
+        legs: Dict[str, Callable[[], list]] = {
+            "keyword": (
+                (lambda: self._fulltext_search_batch(queries, top_k=leg_k)) if self.bm25 is None
+                else (lambda: self._bm25_search_batch(queries, top_k=leg_k))
+            ),
+        }
+        for i, (embedding, filter_rule) in enumerate(zip(query_embeddings, vector_filters)):
+            legs[f"vector:{i}"] = lambda embedding=embedding, filter_rule=filter_rule, i=i: (
+                self._vector_search_by_vector(embedding, leg_k, filter_rule, vectors[i])
+            )
+        # 各查询的向量路在线程池中排队执行，按整批总时限等待，不按单路时限
+        results = self._run_legs(legs, batch_timeout=settings.RETRIEVAL_BATCH_TIMEOUT)
+
+        bm25_batch = results.get("keyword") or [[] for _ in queries]
+        fused_batch = [
+            self._rrf_fuse(results.get(f"vector:{i}", []), bm25_results, top_k=pool_k)
+            for i, bm25_results in enumerate(bm25_batch)
+        ]
+        if pool_k > top_k:
+            fused_batch = [
+                self._diversify(fused, vectors[i], top_k, mmr_lambda) for i, fused in enumerate(fused_batch)
+            ]
+
+        logger.info(f"批量混合检索完成: {len(queries)} 个查询")
+        return fused_batch
+
+    def _keyword_search(self, query: str, top_k: int = 10) -> List[Tuple[Document, float]]:
+        """关键词检索：有内存 BM25 索引时用 BM25，否则查全文索引"""
+        if self.bm25 is None:
+            return self._fulltext_search_batch([query], top_k=top_k)[0]
+        return self._bm25_search(query, top_k=top_k)
+
+    def _fulltext_search_batch(self, queries: List[str], top_k: int = 10) -> List[List[Tuple[Document, float]]]:
+        """
+        全文索引检索：各查询在数据库中检索片段 ID，再按 ID 一次取回所有命中片段的正文
+
+        Returns:
+            与 queries 顺序一致的 [(Document, score), ...] 列表
+        """
+        try:
+            hits = [keyword_index.search_chunks(q, self.project_id, top_k=top_k) for q in queries]
+            ids = list(dict.fromkeys(chunk_id for query_hits in hits for chunk_id, _ in query_hits))
+            if not ids:
+                return [[] for _ in queries]
+
+            documents = self.vector_store.get_by_ids(ids, project_id=self.project_id)
+            if len(documents) == len(ids):
+                doc_map = dict(zip(ids, documents))
+            else:       # 部分片段已不在向量库中，按元数据中的 chunk_id 对应
+                doc_map = {doc.metadata.get("chunk_id"): doc for doc in documents}
+
+            return [
+                [(doc_map[chunk_id], score) for chunk_id, score in query_hits if chunk_id in doc_map]
+                for query_hits in hits
+            ]
+        except Exception as e:
+            logger.warning(f"全文检索失败: {e}")
+            return [[] for _ in queries]
+
+    def _bm25_search_batch(self, queries: List[str], top_k: int = 10) -> List[List[Tuple[Document, float]]]:
+        """
+        批量 BM25 检索
+
+        BM25 得分对查询词可加，因此每个不同的查询词只在整个语料上计算一次
+        得分向量，各查询的得分由其词向量相加得到，再用 argpartition 取 top_k。
+
+        Args:
+            queries: 查询列表
+            top_k: 每个查询返回的数量
+
+        Returns:
+            与 queries 顺序一致的 [(Document, score), ...] 列表
+        """
+        try:
+            n_docs = len(self.documents)
+            if n_docs == 0:
+                return [[] for _ in queries]
+
+            tokenized_queries = [self._tokenize(q) for q in queries]
+            term_scores: Dict[str, np.ndarray] = {}
+            for tokens in tokenized_queries:
+                for term in tokens:
+                    if term not in term_scores:
+                        term_scores[term] = np.asarray(self.bm25.get_scores([term]), dtype=np.float64)
+
+            score_matrix = np.zeros((len(queries), n_docs), dtype=np.float64)
+            for row, tokens in enumerate(tokenized_queries):
+                for term in tokens:
+                    score_matrix[row] += term_scores[term]
+
+            k = min(top_k, n_docs)
+            batch_results = []
+            for row in range(len(queries)):
+                scores = score_matrix[row]
+                top_idx = np.argpartition(-scores, k - 1)[:k]
+                top_idx = top_idx[np.argsort(-scores[top_idx])]
+                batch_results.append([
+                    (self.documents[idx], float(scores[idx]))
+                    for idx in top_idx if scores[idx] > 0
+                ])
+            return batch_results
+        except Exception as e:
+            logger.warning(f"批量 BM25 检索失败: {e}")
+            return [[] for _ in queries]
+
     def _bm25_search(self, query: str, top_k: int = 10) -> List[Tuple[Document, float]]:
         """
         BM25 关键词检索
@@ -169,30 +525,4 @@ class HybridRetriever:
         Returns:
             融合排序后的 [(Document, rrf_score), ...] 列表
         """
-        scores = {}
-        doc_map = {}
-
-        # 处理向量检索结果
-        for rank, (doc, _score) in enumerate(vector_results):
-            key = doc.page_content[:200]
-            scores[key] = scores.get(key, 0) + 1.0 / (k + rank + 1)
-            if key not in doc_map:
-                doc_map[key] = doc
-
-        # 处理 BM25 检索结果
-        for rank, (doc, _score) in enumerate(bm25_results):
-            key = doc.page_content[:200]
-            scores[key] = scores.get(key, 0) + 1.0 / (k + rank + 1)
-            if key not in doc_map:
-                doc_map[key] = doc
-
-        # 按 RRF 分数降序排列
-        sorted_results = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-
-        # 返回 top_k 结果
-        results = []
-        for key, rrf_score in sorted_results[:top_k]:
-            if key in doc_map:
-                results.append((doc_map[key], rrf_score))
-
-        return results
+        return rrf_fuse([vector_results, bm25_results], top_k=top_k, k=k)
@@ -0,0 +1,89 @@
+# src/rag/keyword_index.py
+"""
+全文关键词索引 - 持久化的关键词检索路
+索引存放在数据库中（SQLite FTS5 / PostgreSQL tsvector，见 src.utils.db），
+随入库同步写入，检索时无需把整个知识库读进内存构建 BM25。
+
+中日韩文本没有空格分词，写入前先切分：中日韩字符逐字成词、其余按字母数字串小写成词，
+再以空格连接交给数据库的分词器。查询时中日韩连续片段拆成相邻二字短语，
+兼顾召回与精度（单字 posting list 过长）。
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from src.rag.text_tokenizer import CJK_RANGES as _CJK
+from src.utils.db import get_chunk_records, search_fulltext
+from src.utils.logger import setup_logger
+
+logger = setup_logger("Keyword_Index")
+
+_TOKEN_PATTERN = re.compile(rf"[{_CJK}]+|[^\W_{_CJK}]+")
+_CJK_PATTERN = re.compile(rf"[{_CJK}]")
+
+
+def _segments(text: str) -> List[str]:
+    """切出中日韩连续片段与字母数字串（下划线、标点都视为分隔）"""
+    return _TOKEN_PATTERN.findall((text or "").lower())
+
+
+def tokenize(text: str) -> List[str]:
+    """索引用分词：中日韩字符逐字、其余按词"""
+    tokens = []
+    for segment in _segments(text):
+        if _CJK_PATTERN.match(segment):
+            tokens.extend(segment)
+        else:
+            tokens.append(segment)
+    return tokens
+
+
+def index_fields(source: str, content: str) -> Dict[str, str]:
+    """写入全文索引的字段（已分词、空格分隔）"""
+    return {
+        "search_source": " ".join(tokenize(source)),
+        "search_content": " ".join(tokenize(content)),
+    }
+
+
+def query_phrases(text: str) -> List[List[str]]:
+    """查询 -> 短语列表：中日韩片段拆为相邻二字短语，其余每个词一个短语（去重、保持顺序）"""
+    phrases, seen = [], set()
+    for segment in _segments(text):
+        if _CJK_PATTERN.match(segment):
+            grams = [segment] if len(segment) == 1 else [segment[i:i + 2] for i in range(len(segment) - 1)]
+            candidates = [list(g) for g in grams]
+        else:
+            candidates = [[segment]]
+        for phrase in candidates:
+            key = " ".join(phrase)
+            if key not in seen:
+                seen.add(key)
+                phrases.append(phrase)
+    return phrases
+
+
+def search_chunks(query: str, project_id: Optional[str], top_k: int = 10) -> List[Tuple[str, float]]:
+    """
+    按正文全文检索片段
+
+    Returns:
+        [(chunk_id, score), ...]，score 越大越相关
+    """
+    phrases = query_phrases(query)
+    if not phrases:
+        return []
+    return search_fulltext(project_id, phrases, field="content", limit=top_k)
+
+
+def search_sources(filename: str, project_id: Optional[str], limit: int = 50) -> List[Dict[str, object]]:
+    """
+    按文件名全文检索片段：文件名的词须在来源中相邻出现（"a.py" 命中 "a.py"，不命中 "data.py"）
+
+    Returns:
+        片段目录记录列表，按文件与片段序号排序
+    """
+    tokens = tokenize(filename)
+    if not tokens:
+        return []
+    hits = search_fulltext(project_id, [tokens], field="source", limit=limit)
+    return get_chunk_records([chunk_id for chunk_id, _ in hits])
@@ -0,0 +1,126 @@
+# src/rag/mmr.py
+"""
+最大边际相关（MMR）去冗余 - top-k 不再被同一文件的近重复片段占满
+从 top_k × MMR_FETCH_FACTOR 个候选中贪心选出 top_k 个，每一步选
+    λ × 相关度 - (1 - λ) × 与已选片段的最大相似度
+最大的候选。候选向量直接复用向量库检索时返回的向量（不重新 Embedding），
+两两余弦相似度一次矩阵乘法算好，贪心过程只维护「与已选集合的最大相似度」向量，每步 O(n)。
+
+相关度：给出查询向量时为余弦相似度；否则按输入排名线性递减（融合 / 重排序结果的分数方向不一，只用排名）。
+"""
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config.settings import settings
+from src.utils.logger import setup_logger
+
+logger = setup_logger("MMR")
+
+
+def mmr_fetch_k(fetch_factor: int, top_k: int) -> int:
+    """MMR 的候选数（fetch_factor 不大于 1 时不启用 MMR，不多取）"""
+    return top_k * fetch_factor if fetch_factor > 1 else top_k
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def mmr_select(
+    candidates: np.ndarray,
+    k: int,
+    lambda_: Optional[float] = None,
+    query: Optional[np.ndarray] = None,
+    relevance: Optional[np.ndarray] = None,
+) -> List[int]:
+    """
+    MMR 贪心选择
+
+    Args:
+        candidates: 候选向量矩阵 (n, d)，零向量视为与其他候选都不相似
+        k: 选出数量
+        lambda_: 相关度权重，1 为纯相关度排序，0 为纯多样性；默认 MMR_LAMBDA
+        query: 查询向量，relevance 为空时用其余弦相似度作相关度
+        relevance: 各候选的相关度 (n,)
+
+    Returns:
+        选中候选的下标（按选择顺序）
+    """
+    lambda_ = settings.MMR_LAMBDA if lambda_ is None else lambda_
+    matrix = _normalize(np.asarray(candidates, dtype=np.float32))
+    n = len(matrix)
+    if relevance is None:
+        if query is None:
+            raise ValueError("mmr_select 需要 query 或 relevance")
+        relevance = matrix @ _normalize(np.asarray(query, dtype=np.float32))
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    pairwise = matrix @ matrix.T
+    penalty = np.zeros(n, dtype=np.float32)       # 与已选片段的最大相似度
+    available = np.ones(n, dtype=bool)
+    selected: List[int] = []
+    for step in range(min(k, n)):
+        scores = np.where(available, lambda_ * relevance - (1 - lambda_) * penalty, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        penalty = pairwise[best].copy() if step == 0 else np.maximum(penalty, pairwise[best])
+    return selected
+
+
+def apply_mmr(
+    results: List[Tuple[Document, float]],
+    vectors: Sequence[Optional[Sequence[float]]],
+    top_k: int,
+    lambda_: Optional[float] = None,
+    query_embedding: Optional[Sequence[float]] = None,
+) -> List[Tuple[Document, float]]:
+    """
+    对已排序的检索结果做 MMR 重排并截取 top_k（保留原分数）
+
+    Args:
+        results: 按相关度排序的 [(Document, score), ...]
+        vectors: 与 results 一一对应的片段向量，取不到的为 None
+        top_k: 返回数量
+        lambda_: 相关度权重，默认 MMR_LAMBDA
+        query_embedding: 查询向量；为空时相关度按输入排名
+
+    Returns:
+        [(Document, score), ...]
+    """
+    if len(results) <= top_k:
+        return results
+    present = [v for v in vectors if v is not None]
+    if not present:
+        logger.warning("候选片段没有向量，跳过 MMR")
+        return results[:top_k]
+
+    start = time.perf_counter()
+    dim = len(present[0])
+    matrix = np.zeros((len(results), dim), dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        if vector is not None:
+            matrix[i] = np.asarray(vector, dtype=np.float32)
+
+    if query_embedding is not None:
+        chosen = mmr_select(matrix, top_k, lambda_, query=np.asarray(query_embedding, dtype=np.float32))
+    else:
+        relevance = 1.0 - np.arange(len(results), dtype=np.float32) / len(results)
+        chosen = mmr_select(matrix, top_k, lambda_, relevance=relevance)
+
+    latency = (time.perf_counter() - start) * 1000
+    reordered = sum(1 for rank, i in enumerate(chosen) if i != rank)
+    logger.info(f"🎯 MMR: {len(results)} 个候选 → {len(chosen)} 条，{reordered} 条位置变化 ({latency:.1f}ms)")
+    _record_mmr(latency, reordered)
+    return [results[i] for i in chosen]
+
+
+def _record_mmr(latency_ms: float, reordered: int):
+    from src.metrics.collector import metrics_collector
+
+    metrics_collector.record("retrieval", "mmr_latency", latency_ms, "ms")
+    metrics_collector.record("retrieval", "mmr_reordered", reordered, "count")
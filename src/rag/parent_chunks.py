@@ -0,0 +1,84 @@
+# src/rag/parent_chunks.py
+"""
+父子片段（small-to-big）
+小的子片段 Embedding 更精确，写作需要的上下文却更长。父子切分模式下：
+- 入库：子片段写入向量库与片段目录，元数据带 parent_id；父片段正文只写入 parent_chunks 表一次
+- 检索：按子片段排序，多个子片段命中同一父片段时只保留排名最高的一次，换回父片段正文返回
+"""
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from config.settings import settings
+from src.utils.db import get_parent_chunks
+from src.utils.logger import setup_logger
+from src.utils.tokens import count_tokens
+
+logger = setup_logger("Parent_Chunks")
+
+# 切分时父片段正文暂存在子片段元数据中，入库时取出写入父片段表（不写入向量库）
+PARENT_CONTENT_KEY = "parent_content"
+
+
+def pop_parent_records(chunks: List[Document], project_id: str) -> List[Dict[str, object]]:
+    """从子片段元数据中取出父片段正文，返回待写入父片段表的记录（按 parent_id 去重）"""
+    records = {}
+    for chunk in chunks:
+        content = chunk.metadata.pop(PARENT_CONTENT_KEY, None)
+        parent_id = chunk.metadata.get("parent_id")
+        if content is None or not parent_id or parent_id in records:
+            continue
+        records[parent_id] = {
+            "parent_id": parent_id,
+            "project_id": project_id,
+            "source": chunk.metadata.get("source", "unknown"),
+            "ordinal": chunk.metadata.get("parent_index", 0),
+            "content": content,
+            "token_count": count_tokens(content),
+        }
+    return list(records.values())
+
+
+def child_fetch_k(chunk_mode: str, top_k: int) -> int:
+    """父子模式下多取子片段，保证按父片段去重后仍有 top_k 条"""
+    return top_k * max(1, settings.PARENT_FETCH_FACTOR) if chunk_mode == "parent_child" else top_k
+
+
+def expand_to_parents(results: List[Tuple[Document, float]], top_k: int = None) -> List[Tuple[Document, float]]:
+    """
+    子片段结果换成去重后的父片段（保持原有排序与分数）
+
+    没有 parent_id 的片段（普通模式入库）原样保留；父片段缺失时退回子片段本身
+
+    Returns:
+        [(Document, score), ...]，父片段的 chunk_id 为 parent_id，
+        元数据 child_chunk_id 为命中的最佳子片段，matched_children 为命中的子片段数
+    """
+    parent_ids = list(dict.fromkeys(
+        doc.metadata.get("parent_id") for doc, _ in results if doc.metadata.get("parent_id")
+    ))
+    if not parent_ids:
+        return results[:top_k] if top_k else results
+
+    parents = get_parent_chunks(parent_ids)
+    expanded, positions = [], {}
+    for doc, score in results:
+        parent_id = doc.metadata.get("parent_id")
+        parent = parents.get(parent_id) if parent_id else None
+        if parent is None:
+            expanded.append((doc, score))
+            continue
+        if parent_id in positions:
+            expanded[positions[parent_id]][0].metadata["matched_children"] += 1
+            continue
+        metadata = {
+            **doc.metadata,
+            "chunk_id": parent_id,
+            "child_chunk_id": doc.metadata.get("chunk_id"),
+            "matched_children": 1,
+        }
+        positions[parent_id] = len(expanded)
+        expanded.append((Document(page_content=parent["content"], metadata=metadata), score))
+
+    logger.info(f"👪 子片段 {len(results)} 条 → 父片段 {len(positions)} 条")
+    return expanded[:top_k] if top_k else expanded
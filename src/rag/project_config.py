@@ -0,0 +1,132 @@
+# src/rag/project_config.py
+"""
+知识库级检索配置
+全局默认值来自 settings，单个知识库可以在 project_configs 表中覆盖。
+读取结果在进程内缓存 PROJECT_CONFIG_TTL 秒，本进程内的修改立即生效。
+"""
+import threading
+import time
+from dataclasses import asdict, dataclass, fields
+from typing import Dict, Tuple
+
+from config.settings import settings
+from src.utils.db import get_project_config, set_project_config
+from src.utils.logger import setup_logger
+
+logger = setup_logger("PROJECT_CONFIG")
+
+CHUNK_MODES = ("standard", "parent_child")
+
+
+@dataclass
+class ProjectRetrievalConfig:
+    """检索相关的知识库级配置"""
+    ann_index: str          # auto（行数超过 ann_min_rows 时启用 IVF）| ivf | exact
+    ann_min_rows: int       # auto 模式下启用 IVF 的最小行数
+    ivf_nlist: int          # IVF 簇数，0 表示按行数自动选择
+    ivf_nprobe: int         # 查询时访问的簇数，越大召回越高
+    quantization: str       # none | sq8（int8 标量量化）| pq（乘积量化）
+    pq_subspaces: int       # PQ 段数，0 表示每段约 8 维
+    rescore_factor: int     # 量化检索取 top_k × factor 个候选用 float 向量重打分，0 表示不重打分
+    embedding_dimensions: int  # Embedding 截断输出维度（Matryoshka），0 表示模型全维度
+    two_stage_top_docs: int    # 两阶段检索先选出的文件数，0 表示全库检索
+    two_stage_min_chunks: int  # 启用两阶段检索的最小片段数
+    chunk_mode: str            # standard | parent_child（子片段检索、返回父片段）
+    mmr_fetch_factor: int      # 取 top_k × factor 个候选做 MMR 去冗余，不大于 1 表示关闭
+    mmr_lambda: float          # MMR 相关度权重，1 为纯相关度、越小越分散
+
+    @classmethod
+    def defaults(cls) -> "ProjectRetrievalConfig":
+        return cls(
+            ann_index=settings.ANN_INDEX,
+            ann_min_rows=settings.ANN_MIN_ROWS,
+            ivf_nlist=settings.IVF_NLIST,
+            ivf_nprobe=settings.IVF_NPROBE,
+            quantization=settings.VECTOR_QUANTIZATION,
+            pq_subspaces=settings.PQ_SUBSPACES,
+            rescore_factor=settings.QUANT_RESCORE_FACTOR,
+            embedding_dimensions=settings.EMBEDDING_DIMENSIONS,
+            two_stage_top_docs=settings.TWO_STAGE_TOP_DOCS,
+            two_stage_min_chunks=settings.TWO_STAGE_MIN_CHUNKS,
+            chunk_mode=settings.CHUNK_MODE,
+            mmr_fetch_factor=settings.MMR_FETCH_FACTOR,
+            mmr_lambda=settings.MMR_LAMBDA,
+        )
+
+
+_FIELD_TYPES = {f.name: f.type for f in fields(ProjectRetrievalConfig)}
+_cache: Dict[str, Tuple[float, ProjectRetrievalConfig]] = {}
+_cache_lock = threading.Lock()
+
+
+def _cast(name: str, value):
+    field_type = _FIELD_TYPES[name]
+    return field_type(value) if isinstance(field_type, type) else value
+
+
+def get_project_retrieval_config(project_id: str) -> ProjectRetrievalConfig:
+    """读取知识库配置（未覆盖的字段使用全局默认值）"""
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(project_id)
+        if cached and now - cached[0] < settings.PROJECT_CONFIG_TTL:
+            return cached[1]
+
+    config = ProjectRetrievalConfig.defaults()
+    try:
+        overrides = get_project_config(project_id)
+    except Exception as e:
+        logger.warning(f"⚠️ 读取知识库配置失败，使用默认值: {e}")
+        overrides = {}
+    for name, value in overrides.items():
+        if name in _FIELD_TYPES:
+            setattr(config, name, _cast(name, value))
+
+    with _cache_lock:
+        _cache[project_id] = (now, config)
+    return config
+
+
+def update_project_retrieval_config(project_id: str, **values) -> ProjectRetrievalConfig:
+    """
+    覆盖知识库配置；值为 None 时恢复全局默认
+
+    Raises:
+        ValueError: 未知的配置项
+    """
+    unknown = set(values) - set(_FIELD_TYPES)
+    if unknown:
+        raise ValueError(f"未知的知识库配置项: {unknown}")
+    if values.get("chunk_mode") not in (None, *CHUNK_MODES):
+        raise ValueError(f"未知的切分模式: {values['chunk_mode']}，可选: {', '.join(CHUNK_MODES)}")
+    if values.get("embedding_dimensions"):
+        # 提前校验当前模型是否支持该维度
+        from src.utils.model_manager import model_manager
+        model_manager.resolve_embedding_dimensions(dimensions=int(values["embedding_dimensions"]))
+
+    for name, value in values.items():
+        set_project_config(project_id, name, None if value is None else _cast(name, value))
+    with _cache_lock:
+        _cache.pop(project_id, None)
+
+    config = get_project_retrieval_config(project_id)
+    logger.info(f"⚙️ 更新知识库配置 {project_id}: {asdict(config)}")
+    return config
+
+
+def get_project_embedding_model(project_id: str):
+    """
+    获取知识库使用的 Embedding 模型（按知识库配置的输出维度）
+    入库与查询都必须经过这里，保证同一知识库的向量维度一致
+    """
+    from src.utils.model_manager import model_manager
+    dimensions = get_project_retrieval_config(project_id).embedding_dimensions
+    return model_manager.get_embedding_model(dimensions=dimensions or None)
+
+
+def get_project_embedding_key(project_id: str) -> str:
+    """Embedding 缓存命名空间：模型 + 输出维度，不同维度的查询向量不能混用"""
+    from src.utils.model_manager import model_manager
+    dimensions = get_project_retrieval_config(project_id).embedding_dimensions
+    model_id = model_manager.get_current_embedding_model_id()
+    return f"{model_id}@{dimensions}" if dimensions else model_id
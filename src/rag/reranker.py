@@ -1,37 +1,190 @@
 # src/rag/reranker.py
 """
 重排序模块 - 对检索结果进行二次排序
-支持 Cohere Rerank API 和本地 BGE Cross-Encoder 两种后端
+支持 Cohere Rerank API、本地 BGE Cross-Encoder（PyTorch）与 int8 量化 ONNX 三种后端
+
+- 模型 / 客户端每个进程只加载一次，启动时可预热
+- 本地模型按固定批大小推理
+- (查询, 片段 ID) → 分数 的 LRU 缓存，重复出现的候选不再重复打分
+- 打分超过阶段超时时退回融合排序的结果，不阻塞请求
+- 本地后端可开启跨请求动态批处理：并发请求的 (查询, 候选) 对由专用线程合并成一批推理
 """
 
-from typing import List, Tuple
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Tuple
+
 from langchain_core.documents import Document
 
 from config.settings import settings
+from src.rag.chunk_ids import chunk_key
+from src.utils.batching import MicroBatcher
 from src.utils.logger import setup_logger
 
 logger = setup_logger("Reranker")
 
+BGE_MODEL_NAME = "BAAI/bge-reranker-base"
+BACKENDS = ("cohere", "bge", "bge-onnx")
+LOCAL_BACKENDS = ("bge", "bge-onnx")
+COHERE_MODEL_NAME = "rerank-v3.5"
+
+# 进程内复用的模型与客户端
+_cross_encoders: Dict[str, object] = {}
+_cohere_clients: Dict[str, object] = {}
+_load_lock = threading.Lock()
+
+# 打分线程池（超时后调用方直接返回，打分在后台完成并写入缓存）
+_executor: Optional[ThreadPoolExecutor] = None
+
+# 每个后端一个共享实例，分数缓存跨请求复用
+_rerankers: Dict[str, "Reranker"] = {}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _load_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RERANK_WORKERS, thread_name_prefix="rerank"
+            )
+        return _executor
+
+
+def _get_cross_encoder(model_name: str):
+    """加载（或复用）本地 Cross-Encoder"""
+    model = _cross_encoders.get(model_name)
+    if model is None:
+        with _load_lock:
+            model = _cross_encoders.get(model_name)
+            if model is None:
+                from sentence_transformers import CrossEncoder
+                model = CrossEncoder(model_name)
+                _cross_encoders[model_name] = model
+                logger.info(f"✅ 重排序模型已加载: {model_name}")
+    return model
+
+
+def _get_onnx_cross_encoder():
+    """加载（或复用）量化 ONNX Cross-Encoder"""
+    key = f"onnx:{settings.RERANK_ONNX_MODEL}"
+    model = _cross_encoders.get(key)
+    if model is None:
+        with _load_lock:
+            model = _cross_encoders.get(key)
+            if model is None:
+                from src.utils.local_reranker import OnnxCrossEncoder
+                model = OnnxCrossEncoder(
+                    model_id=settings.RERANK_ONNX_MODEL.rsplit("/", 1)[-1],
+                    model_name=settings.RERANK_ONNX_MODEL,
+                )
+                _cross_encoders[key] = model
+    return model
+
+
+def _get_cohere_client(api_key: str):
+    """创建（或复用）Cohere 客户端，复用底层 HTTP 连接"""
+    client = _cohere_clients.get(api_key)
+    if client is None:
+        with _load_lock:
+            client = _cohere_clients.get(api_key)
+            if client is None:
+                import cohere
+                client = cohere.ClientV2(api_key=api_key)
+                _cohere_clients[api_key] = client
+    return client
+
+
+class ScoreCache:
+    """(查询哈希, 片段 ID) → 重排序分数 的 LRU 缓存（线程安全）"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._data: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], float]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    found[key] = self._data[key]
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items: Dict[Tuple[str, str], float]):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            for key, score in items.items():
+                self._data[key] = score
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0,
+        }
+
 
 class Reranker:
     """
     重排序器：对检索结果二次排序，提升 Top-K 精度
 
-    支持两种后端：
+    支持三种后端：
     - cohere: 使用 Cohere Rerank API（零部署，需 API Key）
-    - bge: 使用本地 BGE Cross-Encoder（需 GPU，无 API 费用）
+    - bge: 使用本地 BGE Cross-Encoder（PyTorch，CPU 上较慢，适合有 GPU 的节点）
+    - bge-onnx: 使用 int8 量化的 BGE Cross-Encoder（ONNX Runtime，CPU 节点）
     """
 
-    def __init__(self, backend: str = "cohere"):
+    def __init__(
+        self,
+        backend: str = "cohere",
+        batch_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+        cache_size: Optional[int] = None,
+    ):
         """
         初始化重排序器
 
         Args:
-            backend: 重排序后端，"cohere" 或 "bge"
+            backend: 重排序后端，"cohere"、"bge" 或 "bge-onnx"
+            batch_size: 本地模型每批推理的候选数
+            timeout: 打分超时（秒），超时后返回融合排序结果；0 表示不限制
+            cache_size: 分数缓存条数，0 表示不缓存
         """
         self.backend = backend
+        self.batch_size = batch_size or settings.RERANK_BATCH_SIZE
+        self.timeout = settings.RERANK_TIMEOUT if timeout is None else timeout
+        self.cache = ScoreCache(settings.RERANK_CACHE_SIZE if cache_size is None else cache_size)
+        self.timeouts = 0
         logger.info(f"重排序器初始化完成，后端: {backend}")
 
+    def warmup(self):
+        """加载模型 / 建立客户端并打一次分，首个请求不承担加载开销"""
+        try:
+            self._score("预热 warmup", ["预热 warmup"])
+            logger.info(f"🔥 重排序预热完成，后端: {self.backend}")
+        except Exception as e:
+            logger.warning(f"重排序预热失败: {e}")
+
     def rerank(
         self,
         query: str,
@@ -47,118 +200,208 @@ class Reranker:
             top_k: 返回的结果数量
 
         Returns:
-            重排序后的 [(Document, rerank_score), ...] 列表
+            重排序后的 [(Document, rerank_score), ...] 列表；打分失败或超时时返回原顺序的前 top_k 条
         """
         if not documents:
             return []
 
-        if self.backend == "cohere":
-            return self._cohere_rerank(query, documents, top_k)
-        elif self.backend == "bge":
-            return self._bge_rerank(query, documents, top_k)
-        else:
+        # 多路检索可能返回同一片段，按片段 ID 去重后再打分
+        unique = {}
+        for doc, score in documents:
+            unique.setdefault(chunk_key(doc), (doc, score))
+        documents = list(unique.values())
+
+        if self.backend not in BACKENDS:
             logger.warning(f"未知后端: {self.backend}，返回原始结果")
             return documents[:top_k]
 
-    def _cohere_rerank(
-        self,
-        query: str,
-        documents: List[Tuple[Document, float]],
-        top_k: int,
-    ) -> List[Tuple[Document, float]]:
+        query_hash = hashlib.md5(query.encode("utf-8")).hexdigest()
+        keys = [(query_hash, key) for key in unique]
+        scores = self.cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in scores]
+
+        if missing:
+            texts = [documents[i][0].page_content for i in missing]
+            future = self._submit_scores(query, texts, [keys[i] for i in missing])
+            try:
+                scores.update(future.result(timeout=self.timeout or None))
+            except FutureTimeoutError:
+                self.timeouts += 1
+                logger.warning(f"⏱️ 重排序超时 ({self.timeout}s)，返回融合排序结果")
+                return documents[:top_k]
+            except ImportError as e:
+                logger.warning(f"重排序依赖未安装，跳过重排序: {e}")
+                return documents[:top_k]
+            except Exception as e:
+                logger.warning(f"重排序失败: {e}，返回原始结果")
+                return documents[:top_k]
+
+        scored = sorted(
+            ((doc, scores[key]) for (doc, _), key in zip(documents, keys)),
+            key=lambda x: x[1],
+            reverse=True,
+        )
+        logger.info(
+            f"{self.backend} 重排序完成，返回 {min(top_k, len(scored))} 条结果 "
+            f"(缓存命中 {len(keys) - len(missing)}/{len(keys)})"
+        )
+        return scored[:top_k]
+
+    def _submit_scores(self, query: str, texts: List[str],
+                       keys: List[Tuple[str, str]]) -> Future:
+        """提交打分任务，返回 {key: score} 的 Future"""
+        return _get_executor().submit(self._score_and_cache, query, texts, keys)
+
+    def _score_and_cache(self, query: str, texts: List[str],
+                         keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], float]:
+        """在打分线程中执行：超时的请求打分完成后也会写入缓存"""
+        result = dict(zip(keys, self._score(query, texts)))
+        self.cache.set_many(result)
+        return result
+
+    def _score(self, query: str, texts: List[str]) -> List[float]:
+        if self.backend == "cohere":
+            return self._cohere_scores(query, texts)
+        return self._predict([(query, text) for text in texts])
+
+    def _cohere_scores(self, query: str, texts: List[str]) -> List[float]:
         """
-        使用 Cohere Rerank API 重排序
+        使用 Cohere Rerank API 为全部候选打分（top_n 取全部，分数才能缓存）
 
         Args:
             query: 查询文本
-            documents: 检索结果
-            top_k: 返回数量
+            texts: 候选文本
 
         Returns:
-            重排序后的结果列表
+            与 texts 一一对应的分数
         """
-        try:
-            import cohere
+        api_key = settings.COHERE_API_KEY
+        if not api_key:
+            raise ValueError("COHERE_API_KEY 未设置")
+
+        response = _get_cohere_client(api_key).rerank(
+            model=COHERE_MODEL_NAME,
+            query=query,
+            documents=texts,
+            top_n=len(texts),
+        )
+        scores = [0.0] * len(texts)
+        for item in response.results:
+            scores[item.index] = float(item.relevance_score)
+        return scores
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """
+        使用本地 Cross-Encoder 为 (查询, 候选) 对打分（按 batch_size 分批推理）
 
-            api_key = settings.COHERE_API_KEY
-            if not api_key:
-                logger.warning("COHERE_API_KEY 未设置，跳过重排序")
-                return documents[:top_k]
+        bge 为 PyTorch 模型；bge-onnx 为 int8 量化 ONNX 模型（按 token 长度排序分批）
 
-            client = cohere.ClientV2(api_key=api_key)
+        Args:
+            pairs: (查询, 候选文本) 列表，可以来自不同查询
 
-            # 提取文档文本
-            doc_texts = [doc.page_content for doc, _ in documents]
+        Returns:
+            与 pairs 一一对应的分数
+        """
+        if self.backend == "bge-onnx":
+            model = _get_onnx_cross_encoder()
+        else:
+            model = _get_cross_encoder(BGE_MODEL_NAME)
+        return [float(s) for s in model.predict(pairs, batch_size=self.batch_size)]
 
-            # 调用 Cohere Rerank API
-            response = client.rerank(
-                model="rerank-v3.5",
-                query=query,
-                documents=doc_texts,
-                top_n=min(top_k, len(doc_texts)),
-            )
+    def get_stats(self) -> Dict:
+        return {"backend": self.backend, "timeouts": self.timeouts, "cache": self.cache.get_stats()}
 
-            # 构建重排序结果
-            results = []
-            for item in response.results:
-                doc = documents[item.index][0]
-                results.append((doc, item.relevance_score))
 
-            logger.info(f"Cohere 重排序完成，返回 {len(results)} 条结果")
-            return results
+class BatchedReranker(Reranker):
+    """
+    跨请求动态批处理的本地重排序器（bge / bge-onnx）
 
-        except ImportError:
-            logger.warning("cohere 库未安装，跳过重排序。安装: pip install cohere")
-            return documents[:top_k]
-        except Exception as e:
-            logger.warning(f"Cohere 重排序失败: {e}，返回原始结果")
-            return documents[:top_k]
+    并发请求各自的候选不再单独推理：(查询, 候选) 对提交到共享的 MicroBatcher，
+    由专用线程攒满 max_batch_size 对或最早的请求等待超过 max_wait_ms 后合并成一批打分，
+    再把分数按请求拆回。每批的批大小、排队深度与等待时间写入指标收集器。
+    """
 
-    def _bge_rerank(
+    def __init__(
         self,
-        query: str,
-        documents: List[Tuple[Document, float]],
-        top_k: int,
-    ) -> List[Tuple[Document, float]]:
+        backend: str = "bge-onnx",
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        **kwargs,
+    ):
         """
-        使用本地 BGE Cross-Encoder 重排序
-
         Args:
-            query: 查询文本
-            documents: 检索结果
-            top_k: 返回数量
-
-        Returns:
-            重排序后的结果列表
+            backend: "bge" 或 "bge-onnx"
+            max_batch_size: 每批最多合并的 (查询, 候选) 对数
+            max_wait_ms: 最早的请求最多等待的毫秒数
+            其余参数同 Reranker
         """
-        try:
-            from sentence_transformers import CrossEncoder
-
-            # 加载 BGE reranker 模型
-            model = CrossEncoder("BAAI/bge-reranker-base")
-
-            # 构建查询-文档对
-            pairs = [(query, doc.page_content) for doc, _ in documents]
-
-            # 计算相关性分数
-            scores = model.predict(pairs)
-
-            # 按分数降序排列
-            scored_docs = list(zip(documents, scores))
-            scored_docs.sort(key=lambda x: x[1], reverse=True)
-
-            results = []
-            for (doc, _original_score), rerank_score in scored_docs[:top_k]:
-                results.append((doc, float(rerank_score)))
-
-            logger.info(f"BGE 重排序完成，返回 {len(results)} 条结果")
-            return results
-
-        except ImportError:
-            logger.warning(
-                "sentence-transformers 库未安装，跳过重排序。安装: pip install sentence-transformers"
-            )
-            return documents[:top_k]
-        except Exception as e:
-            logger.warning(f"BGE 重排序失败: {e}，返回原始结果")
-            return documents[:top_k]
+        if backend not in LOCAL_BACKENDS:
+            raise ValueError(f"动态批处理只支持本地后端 {LOCAL_BACKENDS}，当前: {backend}")
+        super().__init__(backend=backend, **kwargs)
+        self.batcher = MicroBatcher(
+            self._predict,
+            max_batch_size=max_batch_size or settings.RERANK_BATCH_MAX_SIZE,
+            max_wait_ms=settings.RERANK_BATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms,
+            name=f"rerank-{backend}",
+            on_batch=self._record_batch,
+        )
+
+    def _submit_scores(self, query: str, texts: List[str],
+                       keys: List[Tuple[str, str]]) -> Future:
+        """候选对直接进入批处理队列（不占用打分线程池）；超时的请求打分完成后同样写入缓存"""
+        result: Future = Future()
+
+        def on_done(future: Future):
+            try:
+                scores = dict(zip(keys, future.result()))
+            except Exception as e:
+                result.set_exception(e)
+                return
+            self.cache.set_many(scores)
+            result.set_result(scores)
+
+        self.batcher.submit([(query, text) for text in texts]).add_done_callback(on_done)
+        return result
+
+    def _record_batch(self, batch_size: int, queue_depth: int, waited_ms: float):
+        from src.metrics.collector import metrics_collector
+
+        tags = {"backend": self.backend}
+        metrics_collector.record("rerank", "batch_size", batch_size, "pairs", tags=tags)
+        metrics_collector.record("rerank", "queue_depth", queue_depth, "pairs", tags=tags)
+        metrics_collector.record("rerank", "batch_wait", waited_ms, "ms", tags=tags)
+
+    def get_stats(self) -> Dict:
+        stats = super().get_stats()
+        stats["batching"] = self.batcher.get_stats()
+        return stats
+
+
+def get_reranker(backend: Optional[str] = None) -> Reranker:
+    """获取后端对应的共享重排序器（模型、客户端与分数缓存在进程内复用）"""
+    backend = backend or settings.RERANKER_BACKEND
+    reranker = _rerankers.get(backend)
+    if reranker is None:
+        with _load_lock:
+            reranker = _rerankers.get(backend)
+            if reranker is None:
+                if settings.RERANK_BATCHING and backend in LOCAL_BACKENDS:
+                    reranker = BatchedReranker(backend=backend)
+                else:
+                    reranker = Reranker(backend=backend)
+                _rerankers[backend] = reranker
+    return reranker
+
+
+def get_reranker_stats() -> Dict[str, Dict]:
+    """已创建的共享重排序器的统计（缓存、超时、批处理队列深度与批大小直方图）"""
+    return {backend: reranker.get_stats() for backend, reranker in list(_rerankers.items())}
+
+
+def warmup_reranker() -> Optional[Reranker]:
+    """启用重排序时预热共享重排序器（服务启动时调用）"""
+    if not settings.ENABLE_RERANKER:
+        return None
+    reranker = get_reranker()
+    reranker.warmup()
+    return reranker
@@ -4,7 +4,9 @@ RAG检索模块 - 负责从向量数据库检索相关文档
 包含：
 1. Embedding缓存机制
 2. 多知识库隔离
-3. 混合检索模式（向量 + BM25 + RRF）
+3. 混合检索模式（向量 + 全文索引/BM25 + RRF）
+4. 多知识库联邦检索（质心路由 + 并行扇出 + RRF 融合）
+5. MMR 去冗余（复用检索返回的片段向量）
 """
 from langchain_core.embeddings import Embeddings
 from langchain_core.documents import Document
@@ -12,6 +14,14 @@ from config.settings import settings
 from src.utils.logger import setup_logger
 from src.utils.model_manager import model_manager
 from src.rag.stores import get_vector_store
+from src.rag.mmr import apply_mmr, mmr_fetch_k
+from src.rag.parent_chunks import child_fetch_k, expand_to_parents
+from src.rag.project_config import (
+    ProjectRetrievalConfig,
+    get_project_embedding_key,
+    get_project_embedding_model,
+    get_project_retrieval_config,
+)
 from typing import Dict, List, Tuple, Optional
 import hashlib
 import time
@@ -22,10 +32,25 @@ logger = setup_logger("RAG_Retriever")
 DEFAULT_PROJECT_ID = "default"
 
 
+def embed_query_batch(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """
+    批量嵌入查询，结果与逐条 embed_query 一致
+
+    有 embed_queries 的模型（本地 bge 加查询前缀）直接批量调用；查询与文档不区分的远程模型
+    （OpenAI 兼容接口）合并为一次 embed_documents；其余模型逐条 embed_query
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    from langchain_openai import OpenAIEmbeddings
+    if isinstance(embeddings, OpenAIEmbeddings):
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(text) for text in texts]
+
+
 class CachedEmbeddings:
     """
     带缓存的Embedding包装器
-    缓存查询向量，避免重复API调用
+    缓存查询向量，避免重复API调用；文档向量（embed_documents）单独缓存，与查询向量不共用键
     """
     def __init__(self, embeddings: Embeddings, cache_size: int = 1000):
         self.embeddings = embeddings
@@ -34,9 +59,10 @@ class CachedEmbeddings:
         self.cache_hits = 0
         self.cache_misses = 0
     
-    def _get_cache_key(self, text: str) -> str:
-        """生成缓存键"""
-        return hashlib.md5(text.encode('utf-8')).hexdigest()
+    def _get_cache_key(self, text: str, kind: str = "query") -> str:
+        """生成缓存键（查询与文档向量可能不同，如 bge 查询加检索指令）"""
+        key = hashlib.md5(text.encode('utf-8')).hexdigest()
+        return key if kind == "query" else f"{kind}:{key}"
     
     def embed_query(self, text: str) -> List[float]:
         """嵌入查询（带缓存）"""
@@ -63,6 +89,48 @@ class CachedEmbeddings:
         
         self.cache[cache_key] = result
         return result
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量嵌入查询（带缓存，结果与逐条 embed_query 一致）
+        未命中的文本合并为一次批量调用
+        """
+        return self._embed_many(texts, "query")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """批量嵌入文档（带缓存，如压缩时的句向量）"""
+        return self._embed_many(texts, "doc")
+
+    def _embed_many(self, texts: List[str], kind: str) -> List[List[float]]:
+        keys = [self._get_cache_key(t, kind) for t in texts]
+        resolved: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key in resolved or key in missing:
+                continue
+            if key in self.cache:
+                self.cache_hits += 1
+                resolved[key] = self.cache[key]
+            else:
+                self.cache_misses += 1
+                missing[key] = text
+
+        if missing:
+            start_time = time.time()
+            if kind == "query":
+                vectors = embed_query_batch(self.embeddings, list(missing.values()))
+            else:
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            latency = (time.time() - start_time) * 1000
+            logger.debug(f"📡 批量Embedding API调用: {len(missing)} 条 ({latency:.0f}ms)")
+            for key, vector in zip(missing.keys(), vectors):
+                resolved[key] = vector
+                if len(self.cache) >= self.cache_size:
+                    oldest_key = next(iter(self.cache))
+                    del self.cache[oldest_key]
+                self.cache[key] = vector
+
+        return [resolved[key] for key in keys]
     
     def get_hit_rate(self) -> float:
         """获取缓存命中率"""
@@ -100,6 +168,10 @@ class VectorRetriever:
             logger.info("Embedding缓存已启用")
         else:
             self.embeddings = base_embeddings
+        # 按 "模型@维度" 区分的查询 Embedding，知识库配置了 embedding_dimensions 时使用独立缓存
+        self._project_embeddings: Dict[str, Embeddings] = {
+            get_project_embedding_key(DEFAULT_PROJECT_ID): self.embeddings
+        }
 
         # 使用抽象层获取向量存储
         self.store = get_vector_store()
@@ -110,6 +182,16 @@ class VectorRetriever:
         else:
             self.vector_db = self.store
 
+    def _embeddings_for(self, project_id: str):
+        """知识库对应的查询 Embedding（不同输出维度的向量不能共用缓存）"""
+        key = get_project_embedding_key(project_id)
+        embeddings = self._project_embeddings.get(key)
+        if embeddings is None:
+            base = get_project_embedding_model(project_id)
+            embeddings = CachedEmbeddings(base) if self.enable_cache else base
+            self._project_embeddings[key] = embeddings
+        return embeddings
+
     def _build_hybrid_retriever(self, project_id: str) -> Optional["HybridRetriever"]:
         """
         构建混合检索器（懒加载）
@@ -123,26 +205,32 @@ class VectorRetriever:
         try:
             from src.rag.hybrid_retriever import HybridRetriever
 
+            if getattr(settings, 'KEYWORD_BACKEND', 'fulltext') == "fulltext":
+                from src.rag.vectorstore import VectorDBManager
+
+                # 全文索引随入库维护，只需确认已建（早期数据回填一次）
+                if VectorDBManager(store=self.store).fulltext_ready(project_id):
+                    return HybridRetriever(vector_store=self.store, documents=None, project_id=project_id)
+                logger.warning(f"项目 {project_id} 没有全文索引，改用内存 BM25")
+
             # 从向量数据库获取所有文档用于 BM25 索引
-            filter_rule = {"project_id": project_id}
-            all_results = self.vector_db.get(
-                where=filter_rule,
-                include=["documents", "metadatas"]
-            )
+            documents = self.store.get_all_documents(filter={"project_id": project_id})
 
-            if not all_results or not all_results.get("documents"):
+            if not documents:
                 logger.warning(f"项目 {project_id} 没有文档可供构建 BM25 索引")
                 return None
 
-            documents = []
-            for i, doc_content in enumerate(all_results["documents"]):
-                metadata = all_results["metadatas"][i] if all_results["metadatas"] else {}
-                documents.append(Document(page_content=doc_content, metadata=metadata))
+            # 入库时已分好的词序列，避免每次构建都对整个知识库重新分词
+            from src.rag.text_tokenizer import get_tokenizer
+            from src.utils.db import get_token_streams
 
+            tokenizer = get_tokenizer()
             return HybridRetriever(
-                vector_store=self.vector_db,
+                vector_store=self.store,
                 documents=documents,
-                project_id=project_id
+                project_id=project_id,
+                tokenizer=tokenizer,
+                token_streams=get_token_streams(project_id, tokenizer.name),
             )
         except ImportError:
             logger.warning("rank-bm25 未安装，无法使用混合检索，回退到向量检索")
@@ -171,12 +259,27 @@ class VectorRetriever:
         start_time = time.time()
         logger.info(f"🔍 检索: {question} [Project: {project_id}] [Mode: {mode}]")
 
+        config = get_project_retrieval_config(project_id)
+        # 父子切分的知识库按子片段排序、多取一些，去重换回父片段后取 top_k
+        fetch_k = child_fetch_k(config.chunk_mode, top_k)
+
         # 混合检索模式
         if mode == "hybrid":
             hybrid = self._build_hybrid_retriever(project_id)
             if hybrid is not None:
                 bm25_top_k = getattr(settings, 'BM25_TOP_K', 10)
-                results = hybrid.retrieve(question, top_k=top_k)
+                if config.two_stage_top_docs > 0 or config.mmr_fetch_factor > 1:
+                    # 两阶段检索：向量路限定在文档级粗排选出的文件内，关键词路仍检索整个知识库
+                    # MMR：向量路一并返回片段向量，融合后去冗余
+                    embedding = self._embeddings_for(project_id).embed_query(question)
+                    results = hybrid.retrieve(
+                        question, top_k=fetch_k, query_embedding=embedding,
+                        vector_filter=self._vector_filter(project_id, embedding),
+                        mmr_fetch_factor=config.mmr_fetch_factor, mmr_lambda=config.mmr_lambda,
+                    )
+                else:
+                    results = hybrid.retrieve(question, top_k=fetch_k)
+                results = expand_to_parents(results, top_k)
                 latency = (time.time() - start_time) * 1000
                 logger.info(f"✅ 混合检索到 {len(results)} 条记录 ({latency:.0f}ms)")
                 return results
@@ -184,20 +287,16 @@ class VectorRetriever:
                 logger.info("混合检索不可用，回退到向量检索")
 
         # 默认向量检索模式
-        filter_rule = {"project_id": project_id}
-
         try:
-            results = self.vector_db.similarity_search_with_score(
-                question,
-                k=top_k,
-                filter=filter_rule
-            )
+            embeddings = self._embeddings_for(project_id)
+            embedding = embeddings.embed_query(question)
+            results = expand_to_parents(self._vector_search(embedding, project_id, fetch_k, config), top_k)
             latency = (time.time() - start_time) * 1000
 
             # 记录缓存统计
             cache_info = ""
-            if self.enable_cache and hasattr(self.embeddings, 'get_stats'):
-                stats = self.embeddings.get_stats()
+            if self.enable_cache and hasattr(embeddings, 'get_stats'):
+                stats = embeddings.get_stats()
                 cache_info = f" (缓存命中率: {stats['hit_rate']:.1%})"
 
             logger.info(f"✅ 检索到 {len(results)} 条记录 ({latency:.0f}ms){cache_info}")
@@ -206,6 +305,132 @@ class VectorRetriever:
             logger.warning(f"检索为空或出错: {e}")
             return []
     
+    def _vector_search(self, embedding: List[float], project_id: str, top_k: int,
+                       config: ProjectRetrievalConfig) -> List[Tuple]:
+        """片段级向量检索；启用 MMR 时多取候选，用检索一并返回的片段向量去冗余后取 top_k"""
+        filter_rule = self._vector_filter(project_id, embedding)
+        if config.mmr_fetch_factor <= 1:
+            return self.store.similarity_search_by_vector_with_score(embedding, top_k=top_k, filter=filter_rule)
+        hits = self.store.similarity_search_by_vector_with_embeddings(
+            embedding, top_k=mmr_fetch_k(config.mmr_fetch_factor, top_k), filter=filter_rule
+        )
+        return apply_mmr(
+            [(doc, score) for doc, score, _ in hits], [vector for _, _, vector in hits],
+            top_k, config.mmr_lambda, query_embedding=embedding,
+        )
+
+    def _vector_filter(self, project_id: str, embedding: List[float]) -> Dict:
+        """片段级向量检索的过滤条件：启用两阶段检索时限定在文档级粗排选出的文件内"""
+        from src.rag.doc_index import coarse_filter
+        return coarse_filter(self.store, project_id, embedding) or {"project_id": project_id}
+
+    def _embed_queries(self, questions: List[str], project_id: str = DEFAULT_PROJECT_ID) -> List[List[float]]:
+        """一次批量调用嵌入所有查询"""
+        return embed_query_batch(self._embeddings_for(project_id), questions)
+
+    def query_batch(
+        self,
+        questions: List[str],
+        project_id: str = DEFAULT_PROJECT_ID,
+        top_k: int = 3,
+        mode: str = None,
+    ) -> List[List[Tuple]]:
+        """
+        批量检索：所有查询只做一次批量 Embedding，混合模式下共享同一份 BM25 索引
+
+        Args:
+            questions: 查询列表
+            project_id: 知识库ID
+            top_k: 每个查询返回结果数量
+            mode: 检索模式，"vector" 或 "hybrid"。None 时从配置读取
+
+        Returns:
+            与 questions 顺序一致的 [[(Document, score), ...], ...]
+        """
+        if not questions:
+            return []
+        if mode is None:
+            mode = getattr(settings, 'RETRIEVAL_MODE', 'vector')
+
+        start_time = time.time()
+        logger.info(f"🔍 批量检索: {len(questions)} 个查询 [Project: {project_id}] [Mode: {mode}]")
+
+        try:
+            query_embeddings = self._embed_queries(questions, project_id)
+        except Exception as e:
+            logger.warning(f"批量Embedding失败: {e}")
+            return [[] for _ in questions]
+
+        config = get_project_retrieval_config(project_id)
+        fetch_k = child_fetch_k(config.chunk_mode, top_k)
+        if mode == "hybrid":
+            hybrid = self._build_hybrid_retriever(project_id)
+            if hybrid is not None:
+                results = hybrid.retrieve_batch(
+                    questions, query_embeddings, top_k=fetch_k,
+                    vector_filters=[self._vector_filter(project_id, e) for e in query_embeddings],
+                    mmr_fetch_factor=config.mmr_fetch_factor, mmr_lambda=config.mmr_lambda,
+                )
+                results = [expand_to_parents(r, top_k) for r in results]
+                latency = (time.time() - start_time) * 1000
+                logger.info(f"✅ 批量混合检索完成 ({latency:.0f}ms)")
+                return results
+            logger.info("混合检索不可用，回退到向量检索")
+
+        results = []
+        for embedding in query_embeddings:
+            try:
+                results.append(expand_to_parents(self._vector_search(embedding, project_id, fetch_k, config), top_k))
+            except Exception as e:
+                logger.warning(f"检索为空或出错: {e}")
+                results.append([])
+
+        latency = (time.time() - start_time) * 1000
+        logger.info(f"✅ 批量向量检索完成 ({latency:.0f}ms)")
+        return results
+
+    def query_federated(
+        self,
+        question: str,
+        project_ids: List[str],
+        top_k: int = 5,
+        mode: str = None,
+        per_project_k: Optional[int] = None,
+    ) -> "FederatedSearchResult":
+        """
+        联邦检索：一次查询多个知识库
+
+        按知识库质心路由掉明显无关的知识库，其余并行检索，分数归一化后 RRF 融合取全局 top_k。
+        结果中片段的 metadata["project_id"] 标明来源知识库。
+
+        Args:
+            question: 查询问题
+            project_ids: 候选知识库 ID 列表
+            top_k: 全局返回结果数量
+            mode: 各库的检索模式，同 query
+            per_project_k: 每个知识库检索的数量，默认 top_k
+
+        Returns:
+            FederatedSearchResult
+        """
+        from src.rag.federated import federated_search, load_centroids
+        import numpy as np
+
+        project_ids = list(dict.fromkeys(project_ids))
+        # 同一 Embedding 模型（含输出维度）的知识库共用一次查询 Embedding（CachedEmbeddings 命中）
+        embedding_keys = {pid: get_project_embedding_key(pid) for pid in project_ids}
+        query_vectors = {
+            pid: np.asarray(self._embeddings_for(pid).embed_query(question), dtype=np.float32)
+            for pid in project_ids
+        }
+        centroids = load_centroids(self.store, project_ids, embedding_keys)
+
+        per_project_k = per_project_k or top_k
+        return federated_search(
+            lambda pid: self.query(question, project_id=pid, top_k=per_project_k, mode=mode),
+            project_ids, query_vectors, centroids, top_k=top_k,
+        )
+
     def get_cache_stats(self) -> Optional[Dict]:
         """获取缓存统计信息"""
         if self.enable_cache and hasattr(self.embeddings, 'get_stats'):
@@ -214,5 +439,7 @@ class VectorRetriever:
     
     def clear_cache(self):
         """清空Embedding缓存"""
-        if self.enable_cache and hasattr(self.embeddings, 'clear_cache'):
-            self.embeddings.clear_cache()
+        if self.enable_cache:
+            for embeddings in self._project_embeddings.values():
+                if hasattr(embeddings, 'clear_cache'):
+                    embeddings.clear_cache()
@@ -1,5 +1,5 @@
 # src/rag/stores/__init__.py
-"""向量存储抽象层 - 支持多种后端（ChromaDB / Qdrant）"""
+"""向量存储抽象层 - 支持多种后端（ChromaDB / Qdrant / NumPy）"""
 
 from abc import ABC, abstractmethod
 from typing import List, Tuple, Optional, Dict, Any
@@ -9,9 +9,53 @@ from langchain_core.documents import Document
 class VectorStoreBase(ABC):
     """向量存储抽象基类"""
 
+    embedding_fn = None    # 全局默认 Embedding 模型，由子类初始化
+
+    @staticmethod
+    def project_of(filter: Optional[Dict]) -> Optional[str]:
+        """从过滤条件（含 $and 组合）中取出单个知识库 ID"""
+        if not filter:
+            return None
+        project_id = filter.get("project_id")
+        if isinstance(project_id, str):
+            return project_id
+        for sub in filter.get("$and", []):
+            project_id = VectorStoreBase.project_of(sub)
+            if project_id:
+                return project_id
+        return None
+
+    def embedding_for(self, project_id: Optional[str]):
+        """知识库使用的 Embedding 模型（按知识库配置的输出维度），未指定知识库时用全局模型"""
+        if not project_id:
+            return self.embedding_fn
+        from src.rag.project_config import get_project_embedding_model
+        return get_project_embedding_model(project_id)
+
+    @staticmethod
+    def check_dimension(actual: int, expected: Optional[int], where: str):
+        """
+        向量维度校验：知识库改了 embedding_dimensions 或切换了 Embedding 模型后，
+        新向量与已有索引维度不一致，需要重新入库
+
+        Raises:
+            ValueError: 维度不一致
+        """
+        if expected is not None and actual != expected:
+            raise ValueError(
+                f"向量维度不一致: {where} 为 {expected} 维，当前向量为 {actual} 维。"
+                f"请检查知识库的 embedding_dimensions 配置或重新入库"
+            )
+
+    @abstractmethod
+    def add_documents(self, documents: List[Document], project_id: str,
+                      ids: Optional[List[str]] = None) -> int:
+        """添加文档到向量库，返回添加的文档数量；ids 为空时由存储生成"""
+
     @abstractmethod
-    def add_documents(self, documents: List[Document], project_id: str) -> int:
-        """添加文档到向量库，返回添加的文档数量"""
+    def add_embeddings(self, documents: List[Document], embeddings: List[List[float]],
+                       project_id: str, ids: Optional[List[str]] = None) -> int:
+        """写入已计算好向量的文档（入库任务分批 embed 后直接写入），返回写入数量"""
 
     @abstractmethod
     def similarity_search(self, query: str, top_k: int = 3,
@@ -23,10 +67,34 @@ class VectorStoreBase(ABC):
                                      filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
         """带分数检索"""
 
+    @abstractmethod
+    def similarity_search_by_vector_with_score(self, embedding: List[float], top_k: int = 3,
+                                               filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        """按已计算好的查询向量检索（批量问答时复用一次批量 Embedding 的结果）"""
+
+    def similarity_search_by_vector_with_embeddings(
+        self, embedding: List[float], top_k: int = 3, filter: Optional[Dict] = None
+    ) -> List[Tuple[Document, float, Optional[List[float]]]]:
+        """按查询向量检索，同时返回命中片段的向量（MMR 去冗余复用，不重新 Embedding）；后端取不到向量时为 None"""
+        hits = self.similarity_search_by_vector_with_score(embedding, top_k=top_k, filter=filter)
+        vectors = self.get_embeddings(
+            [doc.metadata.get("chunk_id") for doc, _ in hits if doc.metadata.get("chunk_id")],
+            project_id=self.project_of(filter),
+        )
+        return [(doc, score, vectors.get(doc.metadata.get("chunk_id"))) for doc, score in hits]
+
+    def get_embeddings(self, ids: List[str], project_id: Optional[str] = None) -> Dict[str, List[float]]:
+        """按片段 ID 取向量 {chunk_id: 向量}（不存在的 ID 跳过）；后端不支持时返回空字典"""
+        return {}
+
     @abstractmethod
     def delete_by_filter(self, filter: Dict) -> bool:
         """按条件删除"""
 
+    @abstractmethod
+    def delete_by_ids(self, ids: List[str], project_id: Optional[str] = None) -> bool:
+        """按片段 ID 删除；project_id 用于定位分区"""
+
     @abstractmethod
     def get_all_documents(self, filter: Optional[Dict] = None) -> List[Document]:
         """获取所有文档（用于BM25索引构建）"""
@@ -39,6 +107,10 @@ class VectorStoreBase(ABC):
     def get(self, where: Optional[Dict] = None, include: Optional[List[str]] = None) -> Dict:
         """获取原始数据（兼容 ChromaDB get 接口）"""
 
+    @abstractmethod
+    def get_by_ids(self, ids: List[str], project_id: Optional[str] = None) -> List[Document]:
+        """按片段 ID 取文档（与 ids 顺序一致，不存在的 ID 跳过）；project_id 用于定位分区"""
+
 
 def get_vector_store() -> VectorStoreBase:
     """
@@ -47,6 +119,7 @@ def get_vector_store() -> VectorStoreBase:
     配置 VECTOR_STORE_BACKEND 环境变量：
     - "chroma"（默认）: 使用 ChromaDB 本地存储
     - "qdrant": 使用 Qdrant 向量数据库
+    - "numpy": 使用进程内 NumPy 内存映射存储（单机部署）
     """
     from config.settings import settings
     backend = getattr(settings, 'VECTOR_STORE_BACKEND', 'chroma')
@@ -57,5 +130,8 @@ def get_vector_store() -> VectorStoreBase:
     elif backend == "qdrant":
         from .qdrant_store import QdrantStore
         return QdrantStore()
+    elif backend == "numpy":
+        from .numpy_store import NumpyStore
+        return NumpyStore()
     else:
         raise ValueError(f"未知的向量存储后端: {backend}")
@@ -1,9 +1,33 @@
 # src/rag/stores/chroma_store.py
-"""ChromaDB 向量存储实现"""
+"""
+ChromaDB 向量存储实现
+
+两种布局（CHROMA_COLLECTION_MODE）：
+- shared     : 所有知识库写入同一个集合，按 project_id 元数据过滤（旧布局）
+- per_project: 每个知识库一个集合（独立的 HNSW 索引），大知识库不拖慢小知识库，
+               检索时不再需要 project_id 过滤
+
+共享集合迁移到 per_project 是显式步骤（scripts/migrate_chroma_collections.py，或设置
+CHROMA_AUTO_MIGRATE=true 在初始化时执行）：持有持久化目录下的文件锁，按批复制到各自的集合，
+核对各知识库集合已包含全部条目后才删除共享集合并写入完成标记；中断后重跑即可继续。
+尚未迁移时 per_project 模式继续按共享布局读写，已有数据不会“消失”。集合句柄在进程内缓存。
+"""
+
+import hashlib
+import os
+import re
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, List, Tuple, Optional, Dict
+
+try:
+    import fcntl
+except ImportError:     # Windows 没有 fcntl：迁移时须确保只有一个进程在运行
+    fcntl = None
 
-from typing import List, Tuple, Optional, Dict
 from langchain_core.documents import Document
-from langchain_chroma import Chroma
 
 from config.settings import settings
 from src.utils.logger import setup_logger
@@ -12,52 +36,346 @@ from . import VectorStoreBase
 
 logger = setup_logger("ChromaStore")
 
+LEGACY_COLLECTION = "langchain"     # langchain_chroma 的默认集合名（共享布局）
+COLLECTION_PREFIX = "kb_"
+MIGRATE_BATCH = 1000
+DEFAULT_PROJECT_ID = "default"
+MIGRATION_MARKER = "per_project_migrated"     # 迁移完成标记（持久化目录下）
+MIGRATION_LOCK = "per_project_migration.lock"
+
+# 进程内缓存：(目录, 集合名) -> Collection；目录 -> 是否有未迁移的共享集合
+_collection_cache: Dict[Tuple[str, str], Any] = {}
+_shared_pending: Dict[str, bool] = {}
+_cache_lock = threading.RLock()
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """跨进程互斥（同一持久化目录只有一个进程在迁移）"""
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def collection_name_for(project_id: str) -> str:
+    """知识库集合名：可读前缀 + 哈希（ChromaDB 集合名只允许 [a-zA-Z0-9._-]，长度 3~63）"""
+    slug = re.sub(r"[^a-zA-Z0-9_-]", "_", project_id)[:40].strip("_-")
+    digest = hashlib.sha1(project_id.encode("utf-8")).hexdigest()[:10]
+    return f"{COLLECTION_PREFIX}{slug}_{digest}" if slug else f"{COLLECTION_PREFIX}{digest}"
+
+
+def _strip_project(where: Optional[Dict]) -> Optional[Dict]:
+    """去掉过滤条件中的 project_id（集合本身已经区分知识库）"""
+    if not where:
+        return None
+    if "$and" in where:
+        clauses = [c for c in (_strip_project(sub) for sub in where["$and"]) if c]
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    rest = {k: v for k, v in where.items() if k != "project_id"}
+    if len(rest) > 1:
+        return {"$and": [{k: v} for k, v in rest.items()]}
+    return rest or None
+
 
 class ChromaStore(VectorStoreBase):
     """ChromaDB 向量存储实现"""
 
     def __init__(self):
+        import chromadb
+
         self.persist_dir = str(settings.DB_DIR)
         self.embedding_fn = model_manager.get_embedding_model()
-        self._db = Chroma(
-            persist_directory=self.persist_dir,
-            embedding_function=self.embedding_fn
+        self.partitioned = settings.CHROMA_COLLECTION_MODE == "per_project"
+        self._client = chromadb.PersistentClient(path=self.persist_dir)
+        self._db = None                               # 共享布局的 langchain Chroma（延迟创建）
+        self._dimensions: Dict[str, int] = {}        # 集合名 -> 已有向量维度
+
+        if self.partitioned:
+            if settings.CHROMA_AUTO_MIGRATE:
+                self.migrate_shared_collection()
+            elif self._has_unmigrated_shared():
+                logger.warning(
+                    "⚠️ 检测到未迁移的共享集合，继续按共享布局读写；"
+                    "停止其他进程后运行 python scripts/migrate_chroma_collections.py 迁移"
+                )
+                self.partitioned = False
+        logger.info(
+            f"ChromaStore 初始化完成 (目录: {self.persist_dir}, "
+            f"布局: {'每个知识库一个集合' if self.partitioned else '共享集合'})"
         )
-        logger.info(f"ChromaStore 初始化完成 (目录: {self.persist_dir})")
 
     @property
     def raw_client(self):
-        """获取底层 ChromaDB 客户端（用于 get 等原始操作）"""
+        """获取底层 ChromaDB 客户端（用于 get 等原始操作）；分区布局下返回自身（get 接口兼容）"""
+        if self.partitioned:
+            return self
+        if self._db is None:
+            from langchain_chroma import Chroma
+            self._db = Chroma(client=self._client, embedding_function=self.embedding_fn)
         return self._db
 
-    def add_documents(self, documents: List[Document], project_id: str) -> int:
+    # ==================== 集合路由 ====================
+
+    def _cached_collection(self, name: str, create: bool, project_id: Optional[str] = None):
+        key = (self.persist_dir, name)
+        with _cache_lock:
+            collection = _collection_cache.get(key)
+            if collection is not None:
+                return collection
+            if create:
+                metadata = {"project_id": project_id} if project_id else None
+                collection = self._client.get_or_create_collection(name, metadata=metadata)
+            else:
+                try:
+                    collection = self._client.get_collection(name)
+                except Exception:       # 集合不存在（不同 chromadb 版本异常类型不同）
+                    return None
+            _collection_cache[key] = collection
+            return collection
+
+    def _forget_collection(self, name: str):
+        with _cache_lock:
+            _collection_cache.pop((self.persist_dir, name), None)
+        self._dimensions.pop(name, None)
+
+    def _collection(self, project_id: Optional[str], create: bool = False):
+        if not self.partitioned:
+            return self._cached_collection(LEGACY_COLLECTION, create=True)
+        return self._cached_collection(collection_name_for(project_id), create, project_id)
+
+    def _project_collections(self) -> List:
+        """分区布局下全部知识库集合"""
+        collections = []
+        for item in self._client.list_collections():
+            name = item if isinstance(item, str) else item.name
+            if name.startswith(COLLECTION_PREFIX):
+                collection = self._cached_collection(name, create=False)
+                if collection is not None:
+                    collections.append(collection)
+        return collections
+
+    def _route(self, filter: Optional[Dict]) -> List[Tuple[Any, Optional[Dict]]]:
+        """过滤条件 -> [(集合, 集合内 where)]；未指定知识库时遍历全部知识库集合"""
+        if not self.partitioned:
+            return [(self._collection(None), filter or None)]
+        project_id = self.project_of(filter)
+        if project_id:
+            collection = self._collection(project_id)
+            return [(collection, _strip_project(filter))] if collection is not None else []
+        return [(collection, filter or None) for collection in self._project_collections()]
+
+    def _collection_dimension(self, collection) -> Optional[int]:
+        if collection.name not in self._dimensions:
+            peek = collection.get(limit=1, include=["embeddings"])
+            embeddings = peek.get("embeddings")
+            if embeddings is None or not len(embeddings):
+                return None
+            self._dimensions[collection.name] = len(embeddings[0])
+        return self._dimensions[collection.name]
+
+    # ==================== 迁移 ====================
+
+    def _has_unmigrated_shared(self) -> bool:
+        with _cache_lock:
+            pending = _shared_pending.get(self.persist_dir)
+            if pending is None:
+                pending = False
+                if not (Path(self.persist_dir) / MIGRATION_MARKER).exists():
+                    try:
+                        pending = self._client.get_collection(LEGACY_COLLECTION).count() > 0
+                    except Exception:       # 集合不存在
+                        pending = False
+                _shared_pending[self.persist_dir] = pending
+            return pending
+
+    def migrate_shared_collection(self) -> int:
+        """
+        把共享集合中的数据按 project_id 复制到各自集合，核对无误后删除共享集合（幂等、可续跑），
+        之后本实例按 per_project 布局读写
+
+        Returns:
+            迁移的条数
+        """
+        root = Path(self.persist_dir)
+        marker = root / MIGRATION_MARKER
+        if marker.exists():
+            return 0
+        with _file_lock(root / MIGRATION_LOCK):
+            if marker.exists():         # 等锁期间其他进程已完成
+                return 0
+            try:
+                legacy = self._client.get_collection(LEGACY_COLLECTION)
+            except Exception:
+                legacy = None
+            moved = self._copy_shared_collection(legacy) if legacy is not None else 0
+            if legacy is not None:
+                self._client.delete_collection(LEGACY_COLLECTION)
+                self._forget_collection(LEGACY_COLLECTION)
+            marker.write_text(f"{moved}\n", encoding="utf-8")
+        with _cache_lock:
+            _shared_pending[self.persist_dir] = False
+        self.partitioned = True
+        if moved:
+            logger.info(f"✅ 共享集合迁移完成: {moved} 条")
+        return moved
+
+    def _copy_shared_collection(self, legacy) -> int:
+        """按批复制（共享集合保持不变），再核对各知识库集合包含全部复制的 ID；核对失败抛出异常"""
+        total = legacy.count()
+        if total:
+            logger.info(f"🚚 迁移共享集合到按知识库分区的集合: {total} 条")
+        copied: Dict[str, List[str]] = {}
+        offset = 0
+        while True:
+            batch = legacy.get(limit=MIGRATE_BATCH, offset=offset,
+                               include=["embeddings", "documents", "metadatas"])
+            ids = batch.get("ids") or []
+            if not ids:
+                break
+            groups: Dict[str, List[int]] = {}
+            for i, metadata in enumerate(batch["metadatas"]):
+                project_id = (metadata or {}).get("project_id") or DEFAULT_PROJECT_ID
+                groups.setdefault(project_id, []).append(i)
+            for project_id, rows in groups.items():
+                self._cached_collection(collection_name_for(project_id), True, project_id).upsert(
+                    ids=[ids[i] for i in rows],
+                    embeddings=[batch["embeddings"][i] for i in rows],
+                    documents=[batch["documents"][i] for i in rows],
+                    metadatas=[batch["metadatas"][i] for i in rows],
+                )
+                copied.setdefault(project_id, []).extend(ids[i] for i in rows)
+            offset += len(ids)
+            logger.info(f"   已复制 {offset}/{total}")
+
+        for project_id, ids in copied.items():
+            collection = self._cached_collection(collection_name_for(project_id), True, project_id)
+            found = sum(
+                len(collection.get(ids=ids[i:i + MIGRATE_BATCH], include=[])["ids"])
+                for i in range(0, len(ids), MIGRATE_BATCH)
+            )
+            if found != len(ids):
+                raise RuntimeError(
+                    f"知识库 {project_id} 迁移核对失败: 应有 {len(ids)} 条，集合中只有 {found} 条，保留共享集合"
+                )
+        return offset
+
+    # ==================== 写入 ====================
+
+    def add_documents(self, documents: List[Document], project_id: str,
+                      ids: Optional[List[str]] = None) -> int:
+        if not documents:
+            return 0
+        embeddings = self.embedding_for(project_id).embed_documents([d.page_content for d in documents])
+        count = self.add_embeddings(documents, embeddings, project_id, ids=ids)
+        logger.info(f"ChromaDB 添加 {count} 个文档 (project_id={project_id})")
+        return count
+
+    def add_embeddings(self, documents: List[Document], embeddings: List[List[float]],
+                       project_id: str, ids: Optional[List[str]] = None) -> int:
+        if not documents:
+            return 0
+        collection = self._collection(project_id, create=True)
+        self.check_dimension(len(embeddings[0]), self._collection_dimension(collection), f"ChromaDB 集合 {collection.name}")
         for chunk in documents:
             chunk.metadata["project_id"] = project_id
-        self._db.add_documents(documents=documents)
-        logger.info(f"ChromaDB 添加 {len(documents)} 个文档 (project_id={project_id})")
+        # upsert：确定性片段 ID 重复入库时覆盖
+        collection.upsert(
+            ids=ids or [str(uuid.uuid4()) for _ in documents],
+            embeddings=embeddings,
+            metadatas=[chunk.metadata for chunk in documents],
+            documents=[chunk.page_content for chunk in documents],
+        )
+        self._dimensions.setdefault(collection.name, len(embeddings[0]))
+        logger.info(f"ChromaDB 写入 {len(documents)} 个预计算向量 (project_id={project_id})")
         return len(documents)
 
+    # ==================== 检索 ====================
+
     def similarity_search(self, query: str, top_k: int = 3,
                           filter: Optional[Dict] = None) -> List[Document]:
-        return self._db.similarity_search(query, k=top_k, filter=filter)
+        return [doc for doc, _ in self.similarity_search_with_score(query, top_k, filter)]
 
     def similarity_search_with_score(self, query: str, top_k: int = 3,
                                      filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
-        return self._db.similarity_search_with_score(query, k=top_k, filter=filter)
+        embedding = self.embedding_for(self.project_of(filter)).embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, top_k=top_k, filter=filter)
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], top_k: int = 3,
+                                               filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        return [(doc, distance) for doc, distance, _ in self._query(embedding, top_k, filter, with_vectors=False)]
+
+    def similarity_search_by_vector_with_embeddings(
+        self, embedding: List[float], top_k: int = 3, filter: Optional[Dict] = None
+    ) -> List[Tuple[Document, float, Optional[List[float]]]]:
+        return self._query(embedding, top_k, filter, with_vectors=True)
+
+    def _query(self, embedding: List[float], top_k: int, filter: Optional[Dict],
+               with_vectors: bool) -> List[Tuple[Document, float, Optional[List[float]]]]:
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_vectors else [])
+        results = []
+        for collection, where in self._route(filter):
+            dimension = self._collection_dimension(collection)
+            if dimension is None:
+                continue
+            self.check_dimension(len(embedding), dimension, f"ChromaDB 集合 {collection.name}")
+            response = collection.query(
+                query_embeddings=[embedding],
+                n_results=top_k,
+                where=where,
+                include=include,
+            )
+            vectors = response["embeddings"][0] if with_vectors else [None] * len(response["documents"][0])
+            for content, metadata, distance, vector in zip(
+                response["documents"][0], response["metadatas"][0], response["distances"][0], vectors
+            ):
+                results.append((Document(page_content=content, metadata=metadata or {}), distance, vector))
+        results.sort(key=lambda item: item[1])     # 距离越小越相似
+        return results[:top_k]
+
+    # ==================== 删除 / 读取 ====================
 
     def delete_by_filter(self, filter: Dict) -> bool:
         try:
-            self._db._collection.delete(where=filter)
+            project_id = self.project_of(filter)
+            if self.partitioned and project_id and _strip_project(filter) is None:
+                # 只按知识库删除：直接删除整个集合
+                name = collection_name_for(project_id)
+                if self._collection(project_id) is not None:
+                    self._client.delete_collection(name)
+                self._forget_collection(name)
+                return True
+            for collection, where in self._route(filter):
+                if where:
+                    collection.delete(where=where)
+                else:
+                    ids = collection.get(include=[])["ids"]
+                    if ids:
+                        collection.delete(ids=ids)
+            return True
+        except Exception as e:
+            logger.error(f"ChromaDB 删除失败: {e}")
+            return False
+
+    def delete_by_ids(self, ids: List[str], project_id: Optional[str] = None) -> bool:
+        if not ids:
+            return True
+        try:
+            for collection, _ in self._route({"project_id": project_id} if project_id else None):
+                collection.delete(ids=list(ids))
             return True
         except Exception as e:
             logger.error(f"ChromaDB 删除失败: {e}")
             return False
 
     def get_all_documents(self, filter: Optional[Dict] = None) -> List[Document]:
-        kwargs = {"include": ["documents", "metadatas"]}
-        if filter:
-            kwargs["where"] = filter
-        results = self._db.get(**kwargs)
+        results = self.get(where=filter, include=["documents", "metadatas"])
         if not results or not results.get("documents"):
             return []
         documents = []
@@ -67,16 +385,43 @@ class ChromaStore(VectorStoreBase):
         return documents
 
     def count(self, filter: Optional[Dict] = None) -> int:
-        if filter:
-            results = self._db.get(where=filter)
-            return len(results.get("ids", []))
-        return self._db._collection.count()
+        total = 0
+        for collection, where in self._route(filter):
+            total += len(collection.get(where=where, include=[])["ids"]) if where else collection.count()
+        return total
+
+    def get_by_ids(self, ids: List[str], project_id: Optional[str] = None) -> List[Document]:
+        if not ids:
+            return []
+        found: Dict[str, Document] = {}
+        for collection, _ in self._route({"project_id": project_id} if project_id else None):
+            result = collection.get(ids=list(ids), include=["documents", "metadatas"])
+            for doc_id, content, metadata in zip(result["ids"], result["documents"], result["metadatas"]):
+                found[doc_id] = Document(page_content=content, metadata=metadata or {})
+        return [found[i] for i in ids if i in found]
+
+    def get_embeddings(self, ids: List[str], project_id: Optional[str] = None) -> Dict[str, List[float]]:
+        if not ids:
+            return {}
+        found: Dict[str, List[float]] = {}
+        for collection, _ in self._route({"project_id": project_id} if project_id else None):
+            result = collection.get(ids=list(ids), include=["embeddings"])
+            found.update(zip(result["ids"], result["embeddings"]))
+        return found
 
     def get(self, where: Optional[Dict] = None, include: Optional[List[str]] = None) -> Dict:
-        """兼容 ChromaDB 原始 get 接口"""
-        kwargs = {}
-        if where:
-            kwargs["where"] = where
-        if include:
-            kwargs["include"] = include
-        return self._db.get(**kwargs)
+        """兼容 ChromaDB 原始 get 接口（分区布局下合并各知识库集合的结果）"""
+        include = include or ["documents", "metadatas"]
+        merged: Dict[str, List] = {"ids": [], "documents": [], "metadatas": []}
+        if "embeddings" in include:
+            merged["embeddings"] = []
+        for collection, collection_where in self._route(where):
+            kwargs = {"include": include}
+            if collection_where:
+                kwargs["where"] = collection_where
+            result = collection.get(**kwargs)
+            merged["ids"].extend(result.get("ids") or [])
+            for key in ("documents", "metadatas", "embeddings"):
+                if key in include and result.get(key) is not None:
+                    merged[key].extend(result[key])
+        return merged
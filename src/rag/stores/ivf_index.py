@@ -0,0 +1,187 @@
+# src/rag/stores/ivf_index.py
+"""
+IVF 近似最近邻索引（纯 NumPy）
+
+用球面 k-means 把向量划分为 nlist 个簇（倒排列表），查询时只对最近的 nprobe 个簇内的行
+做精确打分。nprobe / nlist 越大召回越高、延迟越高。
+
+持久化文件（与向量文件放在同一目录）：
+- ivf_centroids.npy : 簇中心 (nlist, dim)
+- ivf_assign.npy    : 每一行所属的簇编号 (size,)
+- ivf_state.json    : 训练时的行数等元信息
+"""
+
+import json
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger("IVFIndex")
+
+ASSIGN_BLOCK_ROWS = 65536        # 分块计算簇归属，限制临时内存
+
+
+def auto_nlist(n: int) -> int:
+    """经验值：簇数约为 4·√n"""
+    return int(min(max(16, 4 * np.sqrt(n)), 65536))
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def spherical_kmeans(sample: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    球面 k-means：按余弦相似度归类，簇中心归一化
+
+    Args:
+        sample: 已归一化的训练样本 (n, dim)
+        k: 簇数（不超过样本数）
+    """
+    rng = np.random.default_rng(seed)
+    n = len(sample)
+    k = min(k, n)
+    centroids = sample[rng.choice(n, k, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        order = np.argsort(labels, kind="stable")
+        sorted_labels = labels[order]
+        present, starts = np.unique(sorted_labels, return_index=True)
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+
+        new_centroids = sample[rng.choice(n, k, replace=True)].copy()   # 空簇重新随机初始化
+        new_centroids[present] = sums
+        centroids = _normalize_rows(new_centroids)
+
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """倒排文件索引，行号与 _ProjectIndex 的向量行一一对应"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.centroids: Optional[np.ndarray] = None
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.trained_size = 0
+        self._order: Optional[np.ndarray] = None        # 按簇排序后的行号
+        self._offsets: Optional[np.ndarray] = None      # 每个簇在 _order 中的起止位置
+        self._load()
+
+    @property
+    def _centroids_file(self) -> Path:
+        return self.path / "ivf_centroids.npy"
+
+    @property
+    def _assign_file(self) -> Path:
+        return self.path / "ivf_assign.npy"
+
+    @property
+    def _state_file(self) -> Path:
+        return self.path / "ivf_state.json"
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def nlist(self) -> int:
+        return 0 if self.centroids is None else len(self.centroids)
+
+    # ==================== 持久化 ====================
+
+    def _load(self):
+        if not (self._centroids_file.exists() and self._assign_file.exists()):
+            return
+        self.centroids = np.load(self._centroids_file)
+        self.assign = np.load(self._assign_file)
+        if self._state_file.exists():
+            self.trained_size = json.loads(self._state_file.read_text(encoding="utf-8")).get("trained_size", 0)
+
+    def save(self):
+        if self.centroids is None:
+            return
+        np.save(self._centroids_file, self.centroids)
+        np.save(self._assign_file, self.assign)
+        self._state_file.write_text(
+            json.dumps({"trained_size": self.trained_size, "nlist": self.nlist}),
+            encoding="utf-8",
+        )
+
+    def reset(self):
+        """删除索引（行数过少或切换为精确检索时）"""
+        self.centroids = None
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.trained_size = 0
+        self._order = self._offsets = None
+        for f in (self._centroids_file, self._assign_file, self._state_file):
+            f.unlink(missing_ok=True)
+
+    # ==================== 构建 ====================
+
+    def _assign_rows(self, vectors: np.ndarray) -> np.ndarray:
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+            labels[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return labels
+
+    def train(self, vectors: np.ndarray, nlist: int, sample_size: int, iterations: int = 10, seed: int = 0):
+        """
+        在全部向量上训练并重新划分
+
+        Args:
+            vectors: 已归一化的向量（可以是内存映射）
+            nlist: 簇数
+            sample_size: k-means 训练样本数上限
+        """
+        n = len(vectors)
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(n, min(n, max(sample_size, nlist)), replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+        self.centroids = spherical_kmeans(sample, nlist, iterations=iterations, seed=seed)
+        self.assign = self._assign_rows(vectors)
+        self.trained_size = n
+        self._order = self._offsets = None
+        self.save()
+        logger.info(f"🧭 IVF 训练完成: {n} 行, nlist={self.nlist}")
+
+    def add(self, vectors: np.ndarray):
+        """增量写入：新行归入最近的簇（簇中心不变，行数大幅增长后由调用方触发重训）"""
+        if not self.trained or len(vectors) == 0:
+            return
+        self.assign = np.concatenate([self.assign, self._assign_rows(vectors)])
+        self._order = self._offsets = None
+        self.save()
+
+    def compact(self, keep: np.ndarray):
+        """与向量文件同步整理：只保留 keep 中的行"""
+        if not self.trained:
+            return
+        self.assign = self.assign[keep]
+        self._order = self._offsets = None
+        self.save()
+
+    # ==================== 查询 ====================
+
+    def _build_lists(self):
+        self._order = np.argsort(self.assign, kind="stable").astype(np.int64)
+        self._offsets = np.searchsorted(self.assign[self._order], np.arange(self.nlist + 1))
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """返回最近 nprobe 个簇内的全部行号（升序，便于顺序读取内存映射）"""
+        if self._order is None:
+            self._build_lists()
+        nprobe = min(nprobe, self.nlist)
+        sims = self.centroids @ query
+        lists = np.argpartition(-sims, nprobe - 1)[:nprobe]
+        rows = np.concatenate([self._order[self._offsets[i]:self._offsets[i + 1]] for i in lists])
+        rows.sort()
+        return rows
@@ -0,0 +1,722 @@
+# src/rag/stores/numpy_store.py
+"""
+NumPy 进程内向量存储实现（单机部署）
+
+每个知识库一个目录：
+- vectors.npy    : 归一化后的向量矩阵（float32 / float16），以内存映射方式打开，按容量倍增扩展
+- rows.jsonl     : 追加写入的行记录（id / 文本 / 元数据），加载后按列保存在内存中
+- deleted.npy    : 删除标记（tombstone），删除比例超过阈值时整理（compact）
+- state.json     : 维度、精度等元信息
+
+检索默认是精确 top-k：一次矩阵-向量乘（BLAS）+ argpartition。
+行数较多的知识库可启用 IVF 近似索引（见 ivf_index.py），只对最近的若干簇打分；
+还可启用 sq8 / pq 量化（见 quantization.py）：先用常驻内存的编码做近似打分，
+再对 top_k × rescore_factor 个候选用 float 向量精确重打分。
+ANN 与量化参数按知识库配置（见 src/rag/project_config.py）。
+返回的分数与 ChromaDB 默认的 L2 空间一致：对归一化向量为 2 - 2·cos，越小越相关。
+
+同一存储目录在进程内只加载一次，所有 NumpyStore 实例共用同一份索引与锁；
+不支持多个进程同时写入同一目录。
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config.settings import settings
+from src.utils.logger import setup_logger
+from src.rag.project_config import ProjectRetrievalConfig, get_project_retrieval_config
+from src.utils.model_manager import model_manager
+from . import VectorStoreBase
+from .ivf_index import IVFIndex, auto_nlist
+from .quantization import VectorQuantizer, create_quantizer
+
+logger = setup_logger("NumpyStore")
+
+INITIAL_CAPACITY = 1024          # 向量文件初始行数
+SEARCH_BLOCK_ROWS = 65536        # float16 存储时分块转换为 float32 计算，限制临时内存
+
+
+def _project_dirname(project_id: str) -> str:
+    """把知识库 ID 转成安全的目录名（含特殊字符时附加短哈希避免冲突）"""
+    safe = re.sub(r"[^\w\-]", "_", project_id)
+    if safe != project_id:
+        safe = f"{safe}_{hashlib.sha1(project_id.encode('utf-8')).hexdigest()[:8]}"
+    return safe
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _match_value(column: np.ndarray, condition: Any) -> np.ndarray:
+    """单列条件 → 布尔掩码；支持等值、列表（视为 $in）以及 $eq / $ne / $in / $nin"""
+    if isinstance(condition, list):
+        condition = {"$in": condition}
+    if not isinstance(condition, dict):
+        return column == condition
+
+    mask = np.ones(len(column), dtype=bool)
+    for op, value in condition.items():
+        if op == "$eq":
+            mask &= column == value
+        elif op == "$ne":
+            mask &= column != value
+        elif op == "$in":
+            mask &= np.isin(column, np.array(value, dtype=object))
+        elif op == "$nin":
+            mask &= ~np.isin(column, np.array(value, dtype=object))
+        else:
+            raise ValueError(f"不支持的过滤操作符: {op}")
+    return mask
+
+
+class _ProjectIndex:
+    """单个知识库的向量矩阵 + 元数据列存储"""
+
+    def __init__(self, path: Path, project_id: str, dtype: str):
+        self.path = path
+        self.project_id = project_id
+        self.dtype = np.dtype(dtype)
+        self.lock = threading.RLock()
+
+        self.dim: Optional[int] = None
+        self.size = 0                                   # 已写入行数（含已删除）
+        self._vectors: Optional[np.memmap] = None
+        self._deleted = np.zeros(0, dtype=bool)
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict] = []
+        self.id_to_row: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {}       # 元数据列缓存（写入/删除后失效）
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._load()
+        self.ivf = IVFIndex(self.path)
+        self.quant: Optional[VectorQuantizer] = VectorQuantizer.load(self.path)
+
+    # ==================== 持久化 ====================
+
+    @property
+    def _vectors_file(self) -> Path:
+        return self.path / "vectors.npy"
+
+    @property
+    def _rows_file(self) -> Path:
+        return self.path / "rows.jsonl"
+
+    @property
+    def _deleted_file(self) -> Path:
+        return self.path / "deleted.npy"
+
+    @property
+    def _state_file(self) -> Path:
+        return self.path / "state.json"
+
+    def _load(self):
+        if self._state_file.exists():
+            state = json.loads(self._state_file.read_text(encoding="utf-8"))
+            self.dim = state.get("dim")
+            self.dtype = np.dtype(state.get("dtype", self.dtype.name))
+
+        if self._rows_file.exists():
+            with open(self._rows_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    self.id_to_row[row["id"]] = len(self.ids)
+                    self.ids.append(row["id"])
+                    self.texts.append(row["text"])
+                    self.metadatas.append(row["metadata"])
+        self.size = len(self.ids)
+
+        if self._vectors_file.exists():
+            self._vectors = np.load(self._vectors_file, mmap_mode="r+")
+
+        self._deleted = np.zeros(self.size, dtype=bool)
+        if self._deleted_file.exists():
+            saved = np.load(self._deleted_file)
+            n = min(len(saved), self.size)
+            self._deleted[:n] = saved[:n]
+
+    def _save_state(self):
+        self._state_file.write_text(
+            json.dumps({"project_id": self.project_id, "dim": self.dim, "dtype": self.dtype.name}),
+            encoding="utf-8",
+        )
+
+    def _ensure_capacity(self, needed: int):
+        """容量不足时按倍增创建新的内存映射文件并替换"""
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if needed <= capacity:
+            return
+
+        new_capacity = max(INITIAL_CAPACITY, capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+
+        tmp_file = self.path / "vectors.tmp.npy"
+        grown = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=self.dtype, shape=(new_capacity, self.dim))
+        if self._vectors is not None and self.size:
+            grown[:self.size] = self._vectors[:self.size]
+        grown.flush()
+        del grown
+        self._vectors = None
+        os.replace(tmp_file, self._vectors_file)
+        self._vectors = np.load(self._vectors_file, mmap_mode="r+")
+
+    # ==================== 写入 / 删除 ====================
+
+    def append(self, documents: List[Document], embeddings: np.ndarray,
+               config: Optional[ProjectRetrievalConfig] = None,
+               ids: Optional[List[str]] = None) -> List[str]:
+        with self.lock:
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+                self._save_state()
+            else:
+                VectorStoreBase.check_dimension(embeddings.shape[1], self.dim, f"知识库 {self.project_id}")
+
+            new_ids = list(ids) if ids else [uuid.uuid4().hex for _ in documents]
+            # 相同 ID 重复写入：旧行打删除标记（覆盖语义）
+            replaced = [self.id_to_row[i] for i in new_ids if i in self.id_to_row]
+            if replaced:
+                self._deleted[replaced] = True
+                np.save(self._deleted_file, self._deleted)
+
+            start, n = self.size, len(documents)
+            self._ensure_capacity(start + n)
+            # 先写向量再追加行记录：行记录决定有效行数，中途崩溃不会出现没有向量的行
+            self._vectors[start:start + n] = _normalize(embeddings).astype(self.dtype)
+            self._vectors.flush()
+
+            with open(self._rows_file, "a", encoding="utf-8") as f:
+                for doc_id, doc in zip(new_ids, documents):
+                    f.write(json.dumps(
+                        {"id": doc_id, "text": doc.page_content, "metadata": doc.metadata},
+                        ensure_ascii=False,
+                    ) + "\n")
+
+            for doc_id, doc in zip(new_ids, documents):
+                self.id_to_row[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+                self.texts.append(doc.page_content)
+                self.metadatas.append(dict(doc.metadata))
+            self.size += n
+            self._deleted = np.concatenate([self._deleted, np.zeros(n, dtype=bool)])
+            self._columns.clear()
+            if config is not None:
+                self._update_ann(config, start)
+                self._update_quant(config, start)
+            return new_ids
+
+    def delete(self, mask: np.ndarray) -> int:
+        """给命中的行打删除标记，返回新删除的行数"""
+        with self.lock:
+            newly = mask & ~self._deleted
+            count = int(newly.sum())
+            if count:
+                self._deleted |= newly
+                np.save(self._deleted_file, self._deleted)
+                self._columns.clear()
+            return count
+
+    @property
+    def deleted_count(self) -> int:
+        return int(self._deleted.sum())
+
+    @property
+    def live_count(self) -> int:
+        return self.size - self.deleted_count
+
+    def compact(self):
+        """整理：丢弃已删除的行，重写向量文件与行记录"""
+        with self.lock:
+            keep = np.flatnonzero(~self._deleted)
+            logger.info(f"🧹 整理知识库 {self.project_id}: {self.size} → {len(keep)} 行")
+
+            vectors = np.array(self._vectors[keep]) if self._vectors is not None and len(keep) else None
+            ids = [self.ids[i] for i in keep]
+            texts = [self.texts[i] for i in keep]
+            metadatas = [self.metadatas[i] for i in keep]
+
+            tmp_rows = self.path / "rows.tmp.jsonl"
+            with open(tmp_rows, "w", encoding="utf-8") as f:
+                for doc_id, text, metadata in zip(ids, texts, metadatas):
+                    f.write(json.dumps({"id": doc_id, "text": text, "metadata": metadata}, ensure_ascii=False) + "\n")
+
+            self._vectors = None
+            self._vectors_file.unlink(missing_ok=True)
+            self.size = 0
+            if vectors is not None:
+                self._ensure_capacity(len(keep))
+                self._vectors[:len(keep)] = vectors
+                self._vectors.flush()
+            os.replace(tmp_rows, self._rows_file)
+
+            self.ids, self.texts, self.metadatas = ids, texts, metadatas
+            self.id_to_row = {doc_id: i for i, doc_id in enumerate(ids)}
+            self.size = len(ids)
+            self._deleted = np.zeros(self.size, dtype=bool)
+            self._deleted_file.unlink(missing_ok=True)
+            self._columns.clear()
+            self.ivf.compact(keep)
+            if self.quant is not None:
+                self.quant.codes = self.quant.codes[keep]
+                self.quant.save(self.path)
+
+    # ==================== ANN 索引 ====================
+
+    def _ann_wanted(self, config: ProjectRetrievalConfig) -> bool:
+        if config.ann_index == "ivf":
+            return True
+        return config.ann_index == "auto" and self.live_count >= config.ann_min_rows
+
+    def _ann_usable(self, config: ProjectRetrievalConfig) -> bool:
+        return self._ann_wanted(config) and self.ivf.trained and len(self.ivf.assign) == self.size
+
+    def build_ann(self, config: ProjectRetrievalConfig):
+        """（重新）训练 IVF 索引；已删除的行也参与划分，保证行号对齐"""
+        with self.lock:
+            if self.size == 0:
+                return
+            nlist = config.ivf_nlist or auto_nlist(self.live_count)
+            self.ivf.train(
+                self._vectors[:self.size],
+                nlist=nlist,
+                sample_size=settings.IVF_TRAIN_SAMPLE,
+            )
+
+    def _update_ann(self, config: ProjectRetrievalConfig, new_start: int):
+        """写入后维护索引：不需要时删除，行数翻倍或簇数配置变化时重训，否则增量归簇"""
+        if not self._ann_wanted(config):
+            if self.ivf.trained and config.ann_index == "exact":
+                self.ivf.reset()
+            return
+
+        expected_nlist = config.ivf_nlist or self.ivf.nlist
+        if (
+            not self.ivf.trained
+            or len(self.ivf.assign) != new_start
+            or self.size >= self.ivf.trained_size * settings.IVF_RETRAIN_FACTOR
+            or expected_nlist != self.ivf.nlist
+        ):
+            self.build_ann(config)
+        else:
+            self.ivf.add(self._vectors[new_start:self.size])
+
+    # ==================== 量化 ====================
+
+    def _quant_wanted(self, config: ProjectRetrievalConfig) -> bool:
+        return config.quantization != "none" and self.live_count >= settings.QUANT_MIN_ROWS
+
+    def _quant_usable(self, config: ProjectRetrievalConfig) -> bool:
+        return (
+            self._quant_wanted(config)
+            and self.quant is not None
+            and self.quant.kind == config.quantization
+            and len(self.quant.codes) == self.size
+        )
+
+    def build_quant(self, config: ProjectRetrievalConfig):
+        """（重新）训练量化参数并编码全部行"""
+        with self.lock:
+            if self.size == 0:
+                return
+            quant = create_quantizer(config.quantization, config.pq_subspaces)
+            quant.build(self._vectors[:self.size], sample_size=settings.QUANT_TRAIN_SAMPLE)
+            quant.save(self.path)
+            self.quant = quant
+            logger.info(
+                f"🗜️ 量化完成 {self.project_id}: {config.quantization}, "
+                f"{quant.bytes_per_vector} 字节/向量 (float: {self.dim * 4})"
+            )
+
+    def drop_quant(self):
+        with self.lock:
+            self.quant = None
+            VectorQuantizer.remove(self.path)
+
+    def _update_quant(self, config: ProjectRetrievalConfig, new_start: int):
+        """写入后维护量化编码：与 IVF 相同的重训策略"""
+        if not self._quant_wanted(config):
+            if self.quant is not None and config.quantization == "none":
+                self.drop_quant()
+            return
+
+        if (
+            self.quant is None
+            or self.quant.kind != config.quantization
+            or len(self.quant.codes) != new_start
+            or self.size >= self.quant.trained_size * settings.IVF_RETRAIN_FACTOR
+        ):
+            self.build_quant(config)
+        else:
+            self.quant.append(self._vectors[new_start:self.size], self.path)
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """常驻内存的向量数据量（float 向量为内存映射，只统计文件大小）"""
+        return {
+            "rows": self.size,
+            "live_rows": self.live_count,
+            "dim": self.dim,
+            "float_bytes": self.size * (self.dim or 0) * self.dtype.itemsize,
+            "quantization": self.quant.kind if self.quant is not None else "none",
+            "code_bytes": int(self.quant.codes.nbytes) if self.quant is not None else 0,
+            "ivf_nlist": self.ivf.nlist,
+        }
+
+    # ==================== 查询 ====================
+
+    def _column(self, key: str) -> np.ndarray:
+        column = self._columns.get(key)
+        if column is None:
+            column = np.empty(self.size, dtype=object)
+            column[:] = [m.get(key) for m in self.metadatas]
+            self._columns[key] = column
+        return column
+
+    def match(self, filter: Optional[Dict]) -> np.ndarray:
+        """过滤条件 → 有效行掩码（已排除删除行）"""
+        mask = ~self._deleted
+        if not filter:
+            return mask
+        for key, condition in filter.items():
+            if key == "$and":
+                for sub in condition:
+                    mask = mask & self.match(sub)
+            elif key == "$or":
+                any_mask = np.zeros(self.size, dtype=bool)
+                for sub in condition:
+                    any_mask |= self.match(sub)
+                mask = mask & any_mask
+            elif key == "project_id":
+                # 目录即知识库：project_id 条件对整个目录要么全中要么全不中
+                project = np.array([self.project_id], dtype=object)
+                if not _match_value(project, condition)[0]:
+                    mask = np.zeros(self.size, dtype=bool)
+            else:
+                mask = mask & _match_value(self._column(key), condition)
+        return mask
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """全部有效行与查询向量的余弦相似度"""
+        vectors = self._vectors[:self.size]
+        if self.dtype == np.float32:
+            return vectors @ query
+        out = np.empty(self.size, dtype=np.float32)
+        for start in range(0, self.size, SEARCH_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            out[start:start + len(block)] = block @ query
+        return out
+
+    def _score_rows(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """只对指定行打分（行号需升序，内存映射按顺序读取）"""
+        out = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self._vectors[rows[start:start + SEARCH_BLOCK_ROWS]], dtype=np.float32)
+            out[start:start + len(block)] = block @ query
+        return out
+
+    def search(self, query: np.ndarray, top_k: int, filter: Optional[Dict],
+               config: Optional[ProjectRetrievalConfig] = None) -> List[Tuple[int, float]]:
+        """
+        top-k 检索，返回 [(行号, 余弦相似度), ...]，按相似度降序
+        启用 IVF 时只对最近 nprobe 个簇内的行打分；过滤条件很严格（候选比例低于 nprobe/nlist）
+        时直接对候选行精确打分更快也更准。
+        启用量化时先按编码近似打分，再对前 top_k × rescore_factor 个候选用 float 向量重打分
+        """
+        with self.lock:
+            if self.size == 0 or self._vectors is None:
+                return []
+            VectorStoreBase.check_dimension(len(query), self.dim, f"知识库 {self.project_id}")
+            mask = self.match(filter)
+            n_matched = int(mask.sum())
+            if n_matched == 0:
+                return []
+
+            candidates = None
+            if config is not None and self._ann_usable(config):
+                probe_ratio = min(1.0, config.ivf_nprobe / self.ivf.nlist)
+                if n_matched / self.size > probe_ratio:
+                    rows = self.ivf.probe(query, config.ivf_nprobe)
+                    rows = rows[mask[rows]]
+                    if len(rows) >= top_k:
+                        candidates = rows
+
+            if candidates is None:
+                candidates = np.flatnonzero(mask)
+
+            if config is not None and self._quant_usable(config):
+                sims = self.quant.scores(query, None if len(candidates) == self.size else candidates)
+                if config.rescore_factor > 0:
+                    n_rescore = min(len(candidates), top_k * config.rescore_factor)
+                    shortlist = np.argpartition(-sims, n_rescore - 1)[:n_rescore]
+                    candidates = np.sort(candidates[shortlist])
+                    sims = self._score_rows(candidates, query)
+            elif len(candidates) == self.size:
+                sims = self.scores(query)
+            else:
+                sims = self._score_rows(candidates, query)
+            k = min(top_k, len(sims))
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            return [(int(candidates[i]), float(sims[i])) for i in top]
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.texts[row], metadata=dict(self.metadatas[row]))
+
+
+# 进程内共享的知识库索引：存储目录 -> ({知识库ID: 索引}, 锁)
+_shared_projects: Dict[Path, Tuple[Dict[str, _ProjectIndex], threading.Lock]] = {}
+_shared_projects_lock = threading.Lock()
+
+
+def _open_projects(root: Path, dtype: str) -> Tuple[Dict[str, _ProjectIndex], threading.Lock]:
+    """取目录对应的共享索引，首次访问时从磁盘加载"""
+    key = root.resolve()
+    with _shared_projects_lock:
+        shared = _shared_projects.get(key)
+        if shared is None:
+            projects = {}
+            for state_file in root.glob("*/state.json"):
+                state = json.loads(state_file.read_text(encoding="utf-8"))
+                projects[state["project_id"]] = _ProjectIndex(state_file.parent, state["project_id"], dtype)
+            shared = (projects, threading.Lock())
+            _shared_projects[key] = shared
+        return shared
+
+
+class NumpyStore(VectorStoreBase):
+    """NumPy 进程内向量存储实现"""
+
+    def __init__(self):
+        self.root = Path(settings.NUMPY_STORE_DIR)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.dtype = settings.NUMPY_STORE_DTYPE
+        self.compact_ratio = settings.NUMPY_STORE_COMPACT_RATIO
+        self.embedding_fn = model_manager.get_embedding_model()
+
+        # 同一目录在进程内共用一份知识库索引（各实例各自加载会各记行数，互相覆盖写入）
+        self._projects, self._lock = _open_projects(self.root, self.dtype)
+        logger.info(f"NumpyStore 初始化完成 (目录: {self.root}, 精度: {self.dtype})")
+
+    def _project(self, project_id: str, create: bool = False) -> Optional[_ProjectIndex]:
+        with self._lock:
+            index = self._projects.get(project_id)
+            if index is None and create:
+                index = _ProjectIndex(self.root / _project_dirname(project_id), project_id, self.dtype)
+                self._projects[project_id] = index
+            return index
+
+    def _targets(self, filter: Optional[Dict]) -> List[_ProjectIndex]:
+        """根据过滤条件中的 project_id 选择要访问的知识库"""
+        project_ids = (filter or {}).get("project_id")
+        if project_ids is None:
+            return list(self._projects.values())
+        if isinstance(project_ids, dict):
+            project_ids = project_ids.get("$in", project_ids.get("$eq"))
+        if not isinstance(project_ids, list):
+            project_ids = [project_ids]
+        return [p for p in (self._projects.get(pid) for pid in project_ids) if p is not None]
+
+    # ==================== 写入 ====================
+
+    def add_documents(self, documents: List[Document], project_id: str,
+                      ids: Optional[List[str]] = None) -> int:
+        if not documents:
+            return 0
+        embeddings = self.embedding_for(project_id).embed_documents([d.page_content for d in documents])
+        return self.add_embeddings(documents, embeddings, project_id, ids=ids)
+
+    def add_embeddings(self, documents: List[Document], embeddings: List[List[float]],
+                       project_id: str, ids: Optional[List[str]] = None) -> int:
+        if not documents:
+            return 0
+        for chunk in documents:
+            chunk.metadata["project_id"] = project_id
+        index = self._project(project_id, create=True)
+        index.append(documents, np.asarray(embeddings, dtype=np.float32),
+                     config=get_project_retrieval_config(project_id), ids=ids)
+        logger.info(f"NumpyStore 写入 {len(documents)} 个向量 (project_id={project_id})")
+        return len(documents)
+
+    def delete_by_filter(self, filter: Dict) -> bool:
+        try:
+            # 只按 project_id 删除时直接移除整个目录
+            if set(filter) == {"project_id"} and isinstance(filter["project_id"], str):
+                with self._lock:
+                    index = self._projects.pop(filter["project_id"], None)
+                if index is not None:
+                    with index.lock:
+                        shutil.rmtree(index.path, ignore_errors=True)
+                return True
+
+            for index in self._targets(filter):
+                # 匹配、打标记与整理在同一把锁内，避免并发写入 / 整理改变行号
+                with index.lock:
+                    removed = index.delete(index.match(filter))
+                    self._maybe_compact(index, removed)
+            return True
+        except Exception as e:
+            logger.error(f"NumpyStore 删除失败: {e}")
+            return False
+
+    def delete_by_ids(self, ids: List[str], project_id: Optional[str] = None) -> bool:
+        try:
+            for index in self._targets({"project_id": project_id} if project_id else None):
+                with index.lock:
+                    rows = [index.id_to_row[i] for i in ids if i in index.id_to_row]
+                    if not rows:
+                        continue
+                    mask = np.zeros(index.size, dtype=bool)
+                    mask[rows] = True
+                    self._maybe_compact(index, index.delete(mask))
+            return True
+        except Exception as e:
+            logger.error(f"NumpyStore 删除失败: {e}")
+            return False
+
+    def _maybe_compact(self, index: _ProjectIndex, removed: int):
+        """删除比例超过阈值时整理（调用方持有 index.lock）"""
+        if removed and index.size and index.deleted_count / index.size > self.compact_ratio:
+            index.compact()
+
+    def compact(self, project_id: Optional[str] = None):
+        """整理有删除标记的知识库（不指定时整理全部）"""
+        targets = self._targets({"project_id": project_id} if project_id else None)
+        for index in targets:
+            if index.deleted_count:
+                index.compact()
+
+    def rebuild_ann_index(self, project_id: str) -> bool:
+        """按当前知识库配置重建 IVF 索引（修改 nlist 后调用）；配置为 exact 时删除索引"""
+        index = self._project(project_id)
+        if index is None:
+            return False
+        config = get_project_retrieval_config(project_id)
+        with index.lock:
+            if config.ann_index == "exact":
+                index.ivf.reset()
+            else:
+                index.build_ann(config)
+        return True
+
+    def rebuild_quantization(self, project_id: str) -> bool:
+        """按当前知识库配置重建量化编码（修改 quantization / pq_subspaces 后调用）"""
+        index = self._project(project_id)
+        if index is None:
+            return False
+        config = get_project_retrieval_config(project_id)
+        if config.quantization == "none":
+            index.drop_quant()
+        else:
+            index.build_quant(config)
+        return True
+
+    def memory_stats(self, project_id: str) -> Dict[str, Any]:
+        index = self._project(project_id)
+        return index.memory_stats() if index is not None else {}
+
+    # ==================== 检索 ====================
+
+    def similarity_search(self, query: str, top_k: int = 3,
+                          filter: Optional[Dict] = None) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, top_k, filter)]
+
+    def similarity_search_with_score(self, query: str, top_k: int = 3,
+                                     filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        embedding = self.embedding_for(self.project_of(filter)).embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, top_k=top_k, filter=filter)
+
+    def _search_hits(self, embedding: List[float], top_k: int, filter: Optional[Dict],
+                     with_vectors: bool = False) -> List[Tuple[float, Document, Optional[np.ndarray]]]:
+        """
+        各知识库 top-k 合并后的 [(余弦相似度, Document, 向量), ...]，按相似度降序
+        行号只在持锁期间有效（并发删除整理会重排行号），文档和向量在检索的同一把锁内取出
+        """
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        hits = []
+        for index in self._targets(filter):
+            config = get_project_retrieval_config(index.project_id)
+            with index.lock:
+                for row, sim in index.search(query, top_k, filter, config=config):
+                    vector = np.array(index._vectors[row], dtype=np.float32) if with_vectors else None
+                    hits.append((sim, index.document(row), vector))
+        hits.sort(key=lambda h: -h[0])
+        return hits[:top_k]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], top_k: int = 3,
+                                               filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        hits = self._search_hits(embedding, top_k, filter)
+        return [(doc, 2.0 - 2.0 * sim) for sim, doc, _ in hits]
+
+    def similarity_search_by_vector_with_embeddings(
+        self, embedding: List[float], top_k: int = 3, filter: Optional[Dict] = None
+    ) -> List[Tuple[Document, float, Optional[List[float]]]]:
+        hits = self._search_hits(embedding, top_k, filter, with_vectors=True)
+        return [(doc, 2.0 - 2.0 * sim, vector) for sim, doc, vector in hits]
+
+    # ==================== 读取 ====================
+
+    def get_all_documents(self, filter: Optional[Dict] = None) -> List[Document]:
+        documents = []
+        for index in self._targets(filter):
+            with index.lock:
+                documents.extend(index.document(row) for row in np.flatnonzero(index.match(filter)))
+        return documents
+
+    def count(self, filter: Optional[Dict] = None) -> int:
+        total = 0
+        for index in self._targets(filter):
+            with index.lock:
+                total += int(index.match(filter).sum())
+        return total
+
+    def get_by_ids(self, ids: List[str], project_id: Optional[str] = None) -> List[Document]:
+        found: Dict[str, Document] = {}
+        for index in self._targets({"project_id": project_id} if project_id else None):
+            with index.lock:
+                for doc_id in ids:
+                    row = index.id_to_row.get(doc_id)
+                    if row is not None and not index._deleted[row]:
+                        found[doc_id] = index.document(row)
+        return [found[i] for i in ids if i in found]
+
+    def get_embeddings(self, ids: List[str], project_id: Optional[str] = None) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        for index in self._targets({"project_id": project_id} if project_id else None):
+            with index.lock:
+                for doc_id in ids:
+                    row = index.id_to_row.get(doc_id)
+                    if row is not None and not index._deleted[row]:
+                        found[doc_id] = np.asarray(index._vectors[row], dtype=np.float32)
+        return found
+
+    def get(self, where: Optional[Dict] = None, include: Optional[List[str]] = None) -> Dict:
+        """兼容 ChromaDB 原始 get 接口"""
+        include = include or ["documents", "metadatas"]
+        result = {"ids": [], "documents": [], "metadatas": []}
+        if "embeddings" in include:
+            result["embeddings"] = []
+        for index in self._targets(where):
+            with index.lock:
+                for row in np.flatnonzero(index.match(where)):
+                    result["ids"].append(index.ids[row])
+                    result["documents"].append(index.texts[row])
+                    result["metadatas"].append(dict(index.metadatas[row]))
+                    if "embeddings" in include:
+                        result["embeddings"].append(np.asarray(index._vectors[row], dtype=np.float32).tolist())
+        return result
@@ -1,7 +1,20 @@
 # src/rag/stores/qdrant_store.py
-"""Qdrant 向量存储实现"""
+"""
+Qdrant 向量存储实现
+
+- 客户端与 LangChain 检索包装对象在进程内复用（不再每次调用重新构建、重新校验集合）
+- 在 metadata.project_id / source / file_type 上建立 payload 索引，过滤检索与删除走索引
+- 全量读取按页流式 scroll，不再被单次 limit 截断；计数使用服务端 count
+- 写入按批分块、多线程并行 upsert
+
+QDRANT_LOCATION 为 ":memory:" 或本地目录时使用嵌入式模式（无需 Qdrant 服务，便于测试）。
+"""
+
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from typing import List, Tuple, Optional, Dict
 from langchain_core.documents import Document
 
 from config.settings import settings
@@ -11,37 +24,65 @@ from . import VectorStoreBase
 
 logger = setup_logger("QdrantStore")
 
+PAYLOAD_INDEX_FIELDS = ("project_id", "source", "file_type")
+
+# 进程内复用的客户端：连接参数 -> QdrantClient（嵌入式模式同一目录只能打开一个客户端）
+_clients: Dict[Tuple, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(host: str, port: int, location: str):
+    from qdrant_client import QdrantClient
+
+    key = (host, port, location)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            if location == ":memory:":
+                client = QdrantClient(location=":memory:")
+            elif location:
+                client = QdrantClient(path=location)
+            else:
+                client = QdrantClient(host=host, port=port)
+            _clients[key] = client
+        return client
+
 
 class QdrantStore(VectorStoreBase):
     """Qdrant 向量存储实现"""
 
     def __init__(self):
         try:
-            from qdrant_client import QdrantClient
+            import qdrant_client  # noqa: F401
         except ImportError:
             raise ImportError("请安装 qdrant-client: pip install qdrant-client")
 
         host = getattr(settings, 'QDRANT_HOST', 'localhost')
         port = int(getattr(settings, 'QDRANT_PORT', 6333))
+        self.location = getattr(settings, 'QDRANT_LOCATION', '')
 
-        self.client = QdrantClient(host=host, port=port)
+        self.client = _get_client(host, port, self.location)
         self.collection_name = getattr(settings, 'QDRANT_COLLECTION', 'rag_documents')
         self.embedding_fn = model_manager.get_embedding_model()
+        self.upsert_batch = settings.QDRANT_UPSERT_BATCH
+        self.scroll_page = settings.QDRANT_SCROLL_PAGE
+        # 嵌入式模式下客户端不是线程安全的，串行写入
+        self.upsert_parallel = 1 if self.location else settings.QDRANT_UPSERT_PARALLEL
+        self._dimension: Optional[int] = None
+        self._vector_store = None
 
         self._ensure_collection()
-        logger.info(f"QdrantStore 初始化完成 (host={host}:{port})")
+        logger.info(f"QdrantStore 初始化完成 ({self.location or f'host={host}:{port}'})")
 
     def _ensure_collection(self):
-        """确保集合存在"""
-        from qdrant_client.models import Distance, VectorParams
-
-        collections = self.client.get_collections().collections
-        names = [c.name for c in collections]
+        """确保集合与 payload 索引存在"""
+        from qdrant_client.models import Distance, PayloadSchemaType, VectorParams
 
-        if self.collection_name not in names:
-            # 获取向量维度（通过嵌入一个测试字符串）
-            test_embedding = self.embedding_fn.embed_query("test")
-            vector_size = len(test_embedding)
+        if not self.client.collection_exists(self.collection_name):
+            vector_size = model_manager.get_embedding_dimension()
+            if vector_size is None:
+                # 未知模型：通过嵌入一个测试字符串获取维度
+                vector_size = len(self.embedding_fn.embed_query("test"))
 
             self.client.create_collection(
                 collection_name=self.collection_name,
@@ -49,114 +90,210 @@ class QdrantStore(VectorStoreBase):
             )
             logger.info(f"创建 Qdrant 集合: {self.collection_name} (维度: {vector_size})")
 
-    def add_documents(self, documents: List[Document], project_id: str) -> int:
-        from langchain_qdrant import QdrantVectorStore
+        indexed = set((self.client.get_collection(self.collection_name).payload_schema or {}).keys())
+        for field in PAYLOAD_INDEX_FIELDS:
+            key = f"metadata.{field}"
+            if key not in indexed and not self.location:     # 嵌入式模式不支持 payload 索引
+                self.client.create_payload_index(
+                    self.collection_name, field_name=key, field_schema=PayloadSchemaType.KEYWORD
+                )
+                logger.info(f"创建 payload 索引: {key}")
+
+    def _collection_dimension(self) -> int:
+        if self._dimension is None:
+            info = self.client.get_collection(self.collection_name)
+            self._dimension = info.config.params.vectors.size
+        return self._dimension
+
+    @property
+    def vector_store(self):
+        """复用的 LangChain QdrantVectorStore（维度已由本类校验，跳过包装对象的集合校验）"""
+        if self._vector_store is None:
+            from langchain_qdrant import QdrantVectorStore
+            self._vector_store = QdrantVectorStore(
+                client=self.client,
+                collection_name=self.collection_name,
+                embedding=self.embedding_fn,
+                validate_collection_config=False,
+            )
+        return self._vector_store
+
+    # ==================== 写入 ====================
+
+    def add_documents(self, documents: List[Document], project_id: str,
+                      ids: Optional[List[str]] = None) -> int:
+        if not documents:
+            return 0
+        embeddings = self.embedding_for(project_id).embed_documents([d.page_content for d in documents])
+        count = self.add_embeddings(documents, embeddings, project_id, ids=ids)
+        logger.info(f"Qdrant 添加 {count} 个文档 (project_id={project_id})")
+        return count
+
+    def add_embeddings(self, documents: List[Document], embeddings: List[List[float]],
+                       project_id: str, ids: Optional[List[str]] = None) -> int:
+        from qdrant_client.models import PointStruct
+
+        if not documents:
+            return 0
+        self.check_dimension(len(embeddings[0]), self._collection_dimension(), f"Qdrant 集合 {self.collection_name}")
 
-        for chunk in documents:
+        points = []
+        ids = ids or [str(uuid.uuid4()) for _ in documents]     # Qdrant 点 ID 须为 UUID 或整数
+        for point_id, chunk, vector in zip(ids, documents, embeddings):
             chunk.metadata["project_id"] = project_id
+            points.append(PointStruct(
+                id=point_id,
+                vector=list(vector),
+                payload={"page_content": chunk.page_content, "metadata": chunk.metadata},
+            ))
 
-        vector_store = QdrantVectorStore(
-            client=self.client,
-            collection_name=self.collection_name,
-            embedding=self.embedding_fn,
-        )
-        vector_store.add_documents(documents)
-        logger.info(f"Qdrant 添加 {len(documents)} 个文档 (project_id={project_id})")
-        return len(documents)
+        batches = [points[i:i + self.upsert_batch] for i in range(0, len(points), self.upsert_batch)]
+
+        def upsert(batch):
+            self.client.upsert(collection_name=self.collection_name, points=batch, wait=True)
+
+        if self.upsert_parallel > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.upsert_parallel, len(batches))) as pool:
+                list(pool.map(upsert, batches))      # list() 让任一批次的异常抛出
+        else:
+            for batch in batches:
+                upsert(batch)
+
+        logger.info(f"Qdrant 写入 {len(points)} 个预计算向量 (project_id={project_id}, {len(batches)} 批)")
+        return len(points)
+
+    # ==================== 检索 ====================
 
     def similarity_search(self, query: str, top_k: int = 3,
                           filter: Optional[Dict] = None) -> List[Document]:
-        from langchain_qdrant import QdrantVectorStore
-
-        vector_store = QdrantVectorStore(
-            client=self.client,
-            collection_name=self.collection_name,
-            embedding=self.embedding_fn,
-        )
-        qdrant_filter = self._build_filter(filter)
-        return vector_store.similarity_search(query, k=top_k, filter=qdrant_filter)
+        return [doc for doc, _ in self.similarity_search_with_score(query, top_k, filter)]
 
     def similarity_search_with_score(self, query: str, top_k: int = 3,
                                      filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
-        from langchain_qdrant import QdrantVectorStore
+        embedding = self.embedding_for(self.project_of(filter)).embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, top_k=top_k, filter=filter)
 
-        vector_store = QdrantVectorStore(
-            client=self.client,
-            collection_name=self.collection_name,
-            embedding=self.embedding_fn,
+    def similarity_search_by_vector_with_score(self, embedding: List[float], top_k: int = 3,
+                                               filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        self.check_dimension(len(embedding), self._collection_dimension(), f"Qdrant 集合 {self.collection_name}")
+        return self.vector_store.similarity_search_with_score_by_vector(
+            list(embedding), k=top_k, filter=self._build_filter(filter)
         )
-        qdrant_filter = self._build_filter(filter)
-        return vector_store.similarity_search_with_score(query, k=top_k, filter=qdrant_filter)
+
+    # ==================== 删除 / 读取 ====================
 
     def delete_by_filter(self, filter: Dict) -> bool:
         try:
-            from qdrant_client.models import Filter, FieldCondition, MatchValue
-
-            conditions = []
-            for key, value in filter.items():
-                conditions.append(FieldCondition(key=f"metadata.{key}", match=MatchValue(value=value)))
-
             self.client.delete(
                 collection_name=self.collection_name,
-                points_selector=Filter(must=conditions)
+                points_selector=self._build_filter(filter),
             )
             return True
         except Exception as e:
             logger.error(f"Qdrant 删除失败: {e}")
             return False
 
-    def get_all_documents(self, filter: Optional[Dict] = None) -> List[Document]:
-        from qdrant_client.models import Filter, FieldCondition, MatchValue
+    def delete_by_ids(self, ids: List[str], project_id: Optional[str] = None) -> bool:
+        from qdrant_client.models import PointIdsList
 
-        scroll_filter = None
-        if filter:
-            conditions = [
-                FieldCondition(key=f"metadata.{key}", match=MatchValue(value=value))
-                for key, value in filter.items()
-            ]
-            scroll_filter = Filter(must=conditions)
+        if not ids:
+            return True
+        try:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=PointIdsList(points=list(ids)),
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Qdrant 删除失败: {e}")
+            return False
 
-        points, _ = self.client.scroll(
-            collection_name=self.collection_name,
-            limit=10000,
-            with_payload=True,
-            scroll_filter=scroll_filter
-        )
+    def iter_points(self, filter: Optional[Dict] = None, with_vectors: bool = False) -> Iterator:
+        """按页流式遍历匹配的点（默认只取 payload）"""
+        scroll_filter = self._build_filter(filter)
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                limit=self.scroll_page,
+                offset=offset,
+                with_payload=True,
+                with_vectors=with_vectors,
+            )
+            yield from points
+            if offset is None:
+                return
 
+    def get_all_documents(self, filter: Optional[Dict] = None) -> List[Document]:
         documents = []
-        for point in points:
+        for point in self.iter_points(filter):
             payload = point.payload or {}
-            content = payload.get("page_content", "")
-            metadata = payload.get("metadata", {})
-            documents.append(Document(page_content=content, metadata=metadata))
+            documents.append(Document(
+                page_content=payload.get("page_content", ""),
+                metadata=payload.get("metadata", {}),
+            ))
         return documents
 
     def count(self, filter: Optional[Dict] = None) -> int:
-        if filter:
-            docs = self.get_all_documents(filter=filter)
-            return len(docs)
-        info = self.client.get_collection(self.collection_name)
-        return info.points_count
+        return self.client.count(
+            collection_name=self.collection_name,
+            count_filter=self._build_filter(filter),
+            exact=True,
+        ).count
+
+    def get_by_ids(self, ids: List[str], project_id: Optional[str] = None) -> List[Document]:
+        if not ids:
+            return []
+        points = self.client.retrieve(self.collection_name, ids=list(ids), with_payload=True, with_vectors=False)
+        found = {
+            str(p.id): Document(
+                page_content=(p.payload or {}).get("page_content", ""),
+                metadata=(p.payload or {}).get("metadata", {}),
+            )
+            for p in points
+        }
+        return [found[i] for i in ids if i in found]
+
+    def get_embeddings(self, ids: List[str], project_id: Optional[str] = None) -> Dict[str, List[float]]:
+        if not ids:
+            return {}
+        points = self.client.retrieve(self.collection_name, ids=list(ids), with_payload=False, with_vectors=True)
+        return {str(p.id): p.vector for p in points}
 
     def get(self, where: Optional[Dict] = None, include: Optional[List[str]] = None) -> Dict:
         """兼容 ChromaDB 的 get 接口"""
-        docs = self.get_all_documents(filter=where)
+        with_vectors = "embeddings" in (include or [])
         result = {"ids": [], "documents": [], "metadatas": []}
-        for i, doc in enumerate(docs):
-            result["ids"].append(str(i))
-            result["documents"].append(doc.page_content)
-            result["metadatas"].append(doc.metadata)
+        if with_vectors:
+            result["embeddings"] = []
+        for point in self.iter_points(where, with_vectors=with_vectors):
+            payload = point.payload or {}
+            result["ids"].append(str(point.id))
+            result["documents"].append(payload.get("page_content", ""))
+            result["metadatas"].append(payload.get("metadata", {}))
+            if with_vectors:
+                result["embeddings"].append(point.vector)
         return result
 
     @staticmethod
     def _build_filter(filter_dict: Optional[Dict]):
-        """将简单 filter 字典转换为 Qdrant Filter"""
+        """
+        将过滤字典转换为 Qdrant Filter
+        支持 {"key": value}、{"key": [v1, v2]} / {"key": {"$in": [v1, v2]}}（任一匹配）与 {"$and": [...]} 组合
+        """
         if not filter_dict:
             return None
-        from qdrant_client.models import Filter, FieldCondition, MatchValue
+        from qdrant_client.models import FieldCondition, Filter, MatchAny, MatchValue
 
-        conditions = [
-            FieldCondition(key=f"metadata.{k}", match=MatchValue(value=v))
-            for k, v in filter_dict.items()
-        ]
+        conditions = []
+        for key, value in filter_dict.items():
+            if key == "$and":
+                conditions.extend(QdrantStore._build_filter(sub) for sub in value)
+            elif isinstance(value, dict) and "$in" in value:
+                conditions.append(FieldCondition(key=f"metadata.{key}", match=MatchAny(any=list(value["$in"]))))
+            elif isinstance(value, (list, tuple)):
+                conditions.append(FieldCondition(key=f"metadata.{key}", match=MatchAny(any=list(value))))
+            else:
+                conditions.append(FieldCondition(key=f"metadata.{key}", match=MatchValue(value=value)))
         return Filter(must=conditions)
@@ -0,0 +1,256 @@
+# src/rag/stores/quantization.py
+"""
+向量量化（纯 NumPy）
+
+- sq8: 标量量化，每维按训练样本的最小值/范围压缩到 uint8，内存为 float32 的 1/4
+- pq : 乘积量化，向量切成 m 段，每段用 256 个中心编码为 1 字节，内存为 dim*4/m 分之一
+
+检索使用非对称距离（ADC）：查询保持 float32，只对库向量使用编码；
+调用方再用原始 float 向量对少量候选精确重打分，以弥补量化误差。
+
+持久化文件（与向量文件放在同一目录）：
+- quant_codes.bin  : 编码 (size, dim) 或 (size, m)，uint8 原始字节，追加写入，加载到内存
+- quant_params.npz : 量化参数
+- quant_state.json : 类型、编码宽度与训练行数
+"""
+
+import json
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger("Quantization")
+
+ENCODE_BLOCK_ROWS = 65536        # 分块编码 / 打分，限制临时内存
+PQ_CENTROIDS = 256               # 每段中心数（1 字节编码）
+
+
+def auto_pq_subspaces(dim: int, target_dims_per_subspace: int = 8) -> int:
+    """选择能整除 dim、且每段约 target 维的段数"""
+    target = max(1, dim // target_dims_per_subspace)
+    for m in range(target, 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def kmeans(sample: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """欧氏 k-means，返回 (k, dim) 中心"""
+    rng = np.random.default_rng(seed)
+    n = len(sample)
+    centroids = sample[rng.choice(n, min(k, n), replace=False)].copy()
+    if len(centroids) < k:   # 样本不足时重复填充，保证编码空间完整
+        centroids = np.concatenate([centroids, centroids[rng.integers(0, len(centroids), k - len(centroids))]])
+
+    sample_sq = (sample ** 2).sum(axis=1, keepdims=True)
+    for _ in range(iterations):
+        dists = sample_sq - 2 * sample @ centroids.T + (centroids ** 2).sum(axis=1)
+        labels = np.argmin(dists, axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack(
+            [np.bincount(labels, weights=sample[:, j], minlength=k) for j in range(sample.shape[1])],
+            axis=1,
+        )
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return centroids.astype(np.float32)
+
+
+class VectorQuantizer(ABC):
+    """量化器基类：训练、编码、按编码打分（ADC）与持久化"""
+
+    kind = ""
+
+    def __init__(self):
+        self.codes = np.zeros((0, 0), dtype=np.uint8)
+        self.trained_size = 0
+
+    @property
+    @abstractmethod
+    def trained(self) -> bool:
+        """量化参数是否已训练"""
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.codes.shape[1] if self.codes.ndim == 2 else 0
+
+    @abstractmethod
+    def train(self, sample: np.ndarray):
+        """在抽样向量上训练量化参数"""
+
+    @abstractmethod
+    def _encode_block(self, block: np.ndarray) -> np.ndarray:
+        """把一块 float32 向量编码为 uint8"""
+
+    @abstractmethod
+    def _score_block(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """按编码计算查询与一块向量的近似内积"""
+
+    @abstractmethod
+    def _params(self) -> dict:
+        """需要持久化的量化参数"""
+
+    @abstractmethod
+    def _set_params(self, params):
+        """从持久化的参数恢复"""
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        chunks = []
+        for start in range(0, len(vectors), ENCODE_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + ENCODE_BLOCK_ROWS], dtype=np.float32)
+            chunks.append(self._encode_block(block))
+        return np.concatenate(chunks) if chunks else np.zeros((0, 0), dtype=np.uint8)
+
+    def build(self, vectors: np.ndarray, sample_size: int, seed: int = 0):
+        """在抽样上训练并编码全部向量"""
+        n = len(vectors)
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(n, min(n, sample_size), replace=False))
+        self.train(np.asarray(vectors[rows], dtype=np.float32))
+        self.codes = self.encode(vectors)
+        self.trained_size = n
+
+    def append(self, vectors: np.ndarray, path: Path):
+        """增量编码新行并追加到编码文件（量化参数不变）"""
+        if not self.trained or len(vectors) == 0:
+            return
+        new_codes = self.encode(vectors)
+        self.codes = np.concatenate([self.codes, new_codes])
+        with open(path / "quant_codes.bin", "ab") as f:
+            f.write(np.ascontiguousarray(new_codes).tobytes())
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """近似内积（与查询向量的余弦相似度估计），rows 为空时对全部行打分"""
+        codes = self.codes if rows is None else self.codes[rows]
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), ENCODE_BLOCK_ROWS):
+            block = codes[start:start + ENCODE_BLOCK_ROWS]
+            out[start:start + len(block)] = self._score_block(query, block)
+        return out
+
+    # ==================== 持久化 ====================
+
+    def save(self, path: Path):
+        np.ascontiguousarray(self.codes).tofile(path / "quant_codes.bin")
+        np.savez(path / "quant_params.npz", **self._params())
+        (path / "quant_state.json").write_text(
+            json.dumps({"kind": self.kind, "width": self.bytes_per_vector, "trained_size": self.trained_size}),
+            encoding="utf-8",
+        )
+
+    @staticmethod
+    def remove(path: Path):
+        for name in ("quant_codes.bin", "quant_params.npz", "quant_state.json"):
+            (path / name).unlink(missing_ok=True)
+
+    @staticmethod
+    def load(path: Path) -> Optional["VectorQuantizer"]:
+        state_file = path / "quant_state.json"
+        if not state_file.exists():
+            return None
+        state = json.loads(state_file.read_text(encoding="utf-8"))
+        quantizer = create_quantizer(state["kind"])
+        with np.load(path / "quant_params.npz") as params:
+            quantizer._set_params(params)
+        quantizer.codes = np.fromfile(path / "quant_codes.bin", dtype=np.uint8).reshape(-1, state["width"])
+        quantizer.trained_size = state.get("trained_size", 0)
+        return quantizer
+
+
+class ScalarQuantizer(VectorQuantizer):
+    """int8 标量量化：x ≈ low + scale · code"""
+
+    kind = "sq8"
+
+    def __init__(self):
+        super().__init__()
+        self.low: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def trained(self) -> bool:
+        return self.low is not None
+
+    def train(self, sample: np.ndarray):
+        self.low = sample.min(axis=0)
+        high = sample.max(axis=0)
+        self.scale = np.maximum(high - self.low, 1e-12) / 255.0
+
+    def _encode_block(self, block: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint((block - self.low) / self.scale), 0, 255).astype(np.uint8)
+
+    def _score_block(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # q·x ≈ q·low + (q·scale)·code
+        return codes.astype(np.float32) @ (query * self.scale) + float(query @ self.low)
+
+    def _params(self) -> dict:
+        return {"low": self.low, "scale": self.scale}
+
+    def _set_params(self, params):
+        self.low = params["low"]
+        self.scale = params["scale"]
+
+
+class ProductQuantizer(VectorQuantizer):
+    """乘积量化：dim 维切成 m 段，每段编码为最近中心的下标"""
+
+    kind = "pq"
+
+    def __init__(self, subspaces: int = 0):
+        super().__init__()
+        self.subspaces = subspaces
+        self.codebooks: Optional[np.ndarray] = None     # (m, 256, dim/m)
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    def train(self, sample: np.ndarray):
+        dim = sample.shape[1]
+        m = self.subspaces or auto_pq_subspaces(dim)
+        if dim % m:
+            raise ValueError(f"PQ 段数 {m} 不能整除向量维度 {dim}")
+        self.subspaces = m
+        sub_dim = dim // m
+        self.codebooks = np.stack([
+            kmeans(sample[:, i * sub_dim:(i + 1) * sub_dim], PQ_CENTROIDS, seed=i)
+            for i in range(m)
+        ])
+
+    def _encode_block(self, block: np.ndarray) -> np.ndarray:
+        m, _, sub_dim = self.codebooks.shape
+        codes = np.empty((len(block), m), dtype=np.uint8)
+        for i in range(m):
+            sub = block[:, i * sub_dim:(i + 1) * sub_dim]
+            book = self.codebooks[i]
+            dists = -2 * sub @ book.T + (book ** 2).sum(axis=1)
+            codes[:, i] = np.argmin(dists, axis=1)
+        return codes
+
+    def _score_block(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        m, _, sub_dim = self.codebooks.shape
+        # 查表：table[i, c] = 查询第 i 段与第 i 段第 c 个中心的内积
+        table = np.einsum("mkd,md->mk", self.codebooks, query.reshape(m, sub_dim))
+        out = np.zeros(len(codes), dtype=np.float32)
+        for i in range(m):
+            out += table[i][codes[:, i]]
+        return out
+
+    def _params(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+    def _set_params(self, params):
+        self.codebooks = params["codebooks"]
+        self.subspaces = self.codebooks.shape[0]
+
+
+def create_quantizer(kind: str, pq_subspaces: int = 0) -> VectorQuantizer:
+    if kind == "sq8":
+        return ScalarQuantizer()
+    if kind == "pq":
+        return ProductQuantizer(pq_subspaces)
+    raise ValueError(f"未知的量化类型: {kind}")
@@ -0,0 +1,168 @@
+# src/rag/text_tokenizer.py
+"""
+关键词检索分词器 - 可插拔的 BM25 分词
+- 中日韩连续片段：词典分词（jieba，可选依赖），未安装时退回相邻二字切分；也可选逐字切分
+- 字母数字串：小写成词；代码标识符另按 camelCase / snake_case 拆出子词
+  （"getUserName" → getusername, get, user, name）
+
+片段的词序列在入库时切分一次，随片段目录持久化（见 src.utils.db.get_token_streams），
+内存 BM25 构建时直接读取；查询分词按分词器实例做 LRU 缓存。
+"""
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+from config.settings import settings
+from src.utils.logger import setup_logger
+
+logger = setup_logger("Text_Tokenizer")
+
+CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_SEGMENT_PATTERN = re.compile(rf"[{CJK_RANGES}]+|[^\W{CJK_RANGES}]+")
+_CJK_PATTERN = re.compile(rf"[{CJK_RANGES}]")
+_IDENTIFIER_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def is_cjk(segment: str) -> bool:
+    return bool(_CJK_PATTERN.match(segment))
+
+
+def split_identifier(word: str) -> List[str]:
+    """代码标识符按 snake_case / camelCase 拆分（"HTTPServer_v2" → HTTP, Server, v, 2）"""
+    parts = []
+    for piece in word.split("_"):
+        parts.extend(_IDENTIFIER_PART.findall(piece) or ([piece] if piece else []))
+    return parts
+
+
+class Tokenizer(ABC):
+    """分词器基类：子类只需实现中日韩片段的切分"""
+
+    name = "base"
+
+    def __init__(self, cache_size: Optional[int] = None):
+        size = settings.QUERY_TOKEN_CACHE_SIZE if cache_size is None else cache_size
+        self._cached = lru_cache(maxsize=size)(self._tokenize_tuple)
+
+    @abstractmethod
+    def segment_cjk(self, run: str) -> List[str]:
+        """切分一段连续的中日韩字符"""
+
+    def tokenize(self, text: str) -> List[str]:
+        """片段正文分词（入库时调用一次）"""
+        tokens = []
+        for segment in _SEGMENT_PATTERN.findall(text or ""):
+            if is_cjk(segment):
+                tokens.extend(self.segment_cjk(segment))
+                continue
+            word = segment.strip("_")
+            if not word:
+                continue
+            parts = split_identifier(word)
+            tokens.append(word.lower())
+            if len(parts) > 1:
+                tokens.extend(p.lower() for p in parts)
+        return tokens
+
+    def _tokenize_tuple(self, text: str) -> tuple:
+        return tuple(self.tokenize(text))
+
+    def tokenize_query(self, text: str) -> List[str]:
+        """查询分词（带缓存：多路检索、批量检索与重复查询不重复切分）"""
+        return list(self._cached(text))
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+
+class CharTokenizer(Tokenizer):
+    """中日韩逐字切分（召回高、常用字 posting list 长，精度低）"""
+
+    name = "char"
+
+    def segment_cjk(self, run: str) -> List[str]:
+        return list(run)
+
+
+class BigramTokenizer(Tokenizer):
+    """中日韩相邻二字切分（无需词典；单字片段保留单字）"""
+
+    name = "bigram"
+
+    def segment_cjk(self, run: str) -> List[str]:
+        if len(run) == 1:
+            return [run]
+        return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+class JiebaTokenizer(Tokenizer):
+    """jieba 词典分词（可用 TOKENIZER_USER_DICT 加载领域词典）"""
+
+    name = "jieba"
+
+    def __init__(self, user_dict: Optional[str] = None, cache_size: Optional[int] = None):
+        try:
+            import jieba
+        except ImportError:
+            raise ImportError("词典分词需要安装 jieba: pip install jieba")
+        super().__init__(cache_size)
+        self._jieba = jieba.Tokenizer()
+        user_dict = user_dict if user_dict is not None else settings.TOKENIZER_USER_DICT
+        if user_dict:
+            self._jieba.load_userdict(user_dict)
+            logger.info(f"📖 已加载分词用户词典: {user_dict}")
+
+    def segment_cjk(self, run: str) -> List[str]:
+        return [word for word in self._jieba.lcut(run) if word.strip()]
+
+
+TOKENIZERS: Dict[str, Callable[[], Tokenizer]] = {
+    "char": CharTokenizer,
+    "bigram": BigramTokenizer,
+    "jieba": JiebaTokenizer,
+}
+
+_instances: Dict[str, Tokenizer] = {}
+
+
+def register_tokenizer(name: str, factory: Callable[[], Tokenizer]):
+    """注册自定义分词器（factory 返回的实例 name 属性须与注册名一致）"""
+    TOKENIZERS[name] = factory
+    _instances.pop(name, None)
+    _instances.pop("auto", None)
+
+
+def get_tokenizer(name: Optional[str] = None) -> Tokenizer:
+    """
+    获取共享分词器实例
+
+    Args:
+        name: 分词器名称，默认取 BM25_TOKENIZER；"auto" 优先 jieba，未安装时用 bigram
+    """
+    name = name or settings.BM25_TOKENIZER
+    if name == "auto":
+        tokenizer = _instances.get("auto")
+        if tokenizer is None:
+            try:
+                tokenizer = get_tokenizer("jieba")
+            except ImportError:
+                logger.info("jieba 未安装，中文按相邻二字切分")
+                tokenizer = get_tokenizer("bigram")
+            _instances["auto"] = tokenizer
+        return tokenizer
+
+    tokenizer = _instances.get(name)
+    if tokenizer is None:
+        if name not in TOKENIZERS:
+            raise ValueError(f"未知分词器: {name}，可选: {', '.join(TOKENIZERS)}")
+        tokenizer = TOKENIZERS[name]()
+        _instances[name] = tokenizer
+        logger.info(f"✅ 关键词分词器: {name}")
+    return tokenizer
+
+
+def token_fields(content: str) -> Dict[str, str]:
+    """写入片段目录的词序列（空格分隔）及其分词器名称"""
+    tokenizer = get_tokenizer()
+    return {"tokenizer": tokenizer.name, "tokens": " ".join(tokenizer.tokenize(content))}
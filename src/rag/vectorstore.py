@@ -1,16 +1,77 @@
 # src/rag/vectorstore.py
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
 from config.settings import settings
+from src.rag.chunk_ids import assign_chunk_id, content_hash
+from src.rag.keyword_index import index_fields
+from src.rag.parent_chunks import pop_parent_records
+from src.rag.text_tokenizer import token_fields
+from src.utils.db import (
+    add_chunk_records,
+    add_parent_chunks,
+    catalog_cached,
+    count_chunk_records,
+    count_fulltext_records,
+    delete_chunk_records_by_ids,
+    list_chunk_ids,
+    prune_parent_chunks,
+)
 from src.utils.logger import setup_logger
+from src.utils.tokens import count_tokens
 
 logger = setup_logger("RAG_Database")
 
 DEFAULT_PROJECT_ID = "default"
 
+# 已确认片段目录完整的知识库（进程内只回填一次）
+_catalog_checked: set = set()
+
+
+def _file_type(chunk) -> str:
+    metadata = chunk.metadata or {}
+    file_type = metadata.get("file_type") or Path(metadata.get("source", "")).suffix
+    return str(file_type).lower().lstrip(".")
+
+
+def _catalog_record(chunk_id: str, project_id: str, chunk, ordinal: int) -> Dict[str, object]:
+    source = (chunk.metadata or {}).get("source", "unknown")
+    return {
+        "chunk_id": chunk_id,
+        "project_id": project_id,
+        "source": source,
+        "file_type": _file_type(chunk),
+        "ordinal": ordinal,
+        "content_hash": content_hash(chunk.page_content),
+        "token_count": count_tokens(chunk.page_content),
+        **index_fields(source, chunk.page_content),
+        **token_fields(chunk.page_content),
+    }
+
+
 class VectorDBManager:
-    def __init__(self):
-        # 使用抽象层获取向量存储
-        from src.rag.stores import get_vector_store
-        self.store = get_vector_store()
+    def __init__(self, store=None):
+        # 使用抽象层获取向量存储（检索器可传入已有的实例）
+        if store is None:
+            from src.rag.stores import get_vector_store
+            store = get_vector_store()
+        self.store = store
+
+    @staticmethod
+    def _assign_ids(chunks, ordinals: List[int], project_id: str) -> List[str]:
+        """
+        为片段生成确定性 ID（写入元数据，向量库与片段目录共用）
+        切分时已记录 chunk_index 的片段沿用该序号
+        """
+        return [assign_chunk_id(chunk, project_id, ordinal) for chunk, ordinal in zip(chunks, ordinals)]
+
+    @staticmethod
+    def _record_catalog(chunks, ids: List[str], project_id: str):
+        add_chunk_records([
+            _catalog_record(chunk_id, project_id, chunk, chunk.metadata["chunk_index"])
+            for chunk_id, chunk in zip(ids, chunks)
+        ])
 
     def create_vector_db(self, chunks, project_id: str = DEFAULT_PROJECT_ID):
         if not chunks:
@@ -19,10 +80,137 @@ class VectorDBManager:
 
         logger.info(f"为 {len(chunks)} 个文档块打上项目标签 project_id={project_id}")
 
-        count = self.store.add_documents(chunks, project_id)
+        # 文件内序号：按来源文件分别从 0 计数
+        seen = Counter()
+        ordinals = []
+        for chunk in chunks:
+            source = (chunk.metadata or {}).get("source", "unknown")
+            ordinals.append(seen[source])
+            seen[source] += 1
+        ids = self._assign_ids(chunks, ordinals, project_id)
+
+        add_parent_chunks(pop_parent_records(chunks, project_id))
+        count = self.store.add_documents(chunks, project_id, ids=ids)
+        self._record_catalog(chunks, ids, project_id)
+        # 同名文件重新入库：与入库任务一致，清理不再存在的旧片段
+        keep_parent_ids = [c.metadata["parent_id"] for c in chunks if c.metadata.get("parent_id")]
+        for source in seen:
+            self.prune_source(project_id, source, ids, keep_parent_ids)
+        self.refresh_document_index(project_id, list(seen))
         logger.info(f"入库成功！添加 {count} 个文档块")
 
         # 返回底层存储实例（兼容旧代码）
         if hasattr(self.store, 'raw_client'):
             return self.store.raw_client
         return self.store
+
+    def add_chunk_batch(self, chunks, embeddings, project_id: str = DEFAULT_PROJECT_ID,
+                        start_ordinal: int = 0) -> int:
+        """
+        写入一批已计算好向量的文档块（入库任务按批 embed → upsert）
+
+        Args:
+            chunks: 同一文件的连续文档块
+            embeddings: 与 chunks 一一对应的向量
+            project_id: 知识库ID
+            start_ordinal: 第一块在文件内的序号
+
+        Returns:
+            写入数量
+        """
+        if not chunks:
+            return 0
+        ids = self._assign_ids(chunks, list(range(start_ordinal, start_ordinal + len(chunks))), project_id)
+        # 父子切分模式：父片段正文写入父片段表，不随子片段进入向量库
+        add_parent_chunks(pop_parent_records(chunks, project_id))
+        count = self.store.add_embeddings(chunks, embeddings, project_id, ids=ids)
+        self._record_catalog(chunks, ids, project_id)
+        return count
+
+    def delete_chunks(self, chunk_ids: List[str], project_id: str) -> int:
+        """按片段 ID 从向量库与片段目录中删除，返回删除数"""
+        if not chunk_ids:
+            return 0
+        if not self.store.delete_by_ids(chunk_ids, project_id=project_id):
+            return 0
+        return delete_chunk_records_by_ids(chunk_ids)
+
+    def prune_source(self, project_id: str, source: str, keep_ids: Iterable[str],
+                     keep_parent_ids: Iterable[str] = ()) -> int:
+        """
+        删除文件中不在 keep_ids 里的旧片段（文件重新入库后，内容变化的片段 ID 不同），
+        以及不在 keep_parent_ids 里的旧父片段
+
+        Returns:
+            删除的片段数
+        """
+        keep = set(keep_ids)
+        stale = [chunk_id for chunk_id in list_chunk_ids(project_id, source) if chunk_id not in keep]
+        removed = self.delete_chunks(stale, project_id)
+        prune_parent_chunks(project_id, source, sorted(set(keep_parent_ids)))
+        if removed:
+            logger.info(f"🧹 清理 {source} 的旧片段: {removed} 个 (project_id={project_id})")
+        return removed
+
+    def refresh_document_index(self, project_id: str, sources: Optional[List[str]] = None) -> int:
+        """
+        重新计算文件的文档级向量（两阶段检索的粗排索引），并在后台重算知识库质心（联邦检索路由），
+        失败不影响入库
+
+        Returns:
+            更新的文件数
+        """
+        from src.rag.doc_index import refresh_document_index
+        from src.rag.federated import refresh_saved_centroid
+        try:
+            updated = refresh_document_index(self.store, project_id, sources)
+        except Exception as e:
+            logger.warning(f"⚠️ 文档级向量更新失败 (project_id={project_id}): {e}")
+            updated = 0
+        try:
+            refresh_saved_centroid(self.store, project_id)
+        except Exception as e:
+            logger.warning(f"⚠️ 知识库质心重算提交失败 (project_id={project_id}): {e}")
+        return updated
+
+    def fulltext_ready(self, project_id: str) -> bool:
+        """
+        知识库是否已建全文索引（检索时调用；结果按片段目录版本缓存，入库 / 删除后重新统计）
+        """
+        self.ensure_catalog(project_id)
+        return catalog_cached("fulltext_ready", project_id, lambda: count_fulltext_records(project_id) > 0)
+
+    def ensure_catalog(self, project_id: Optional[str] = None) -> int:
+        """
+        片段目录或全文索引不完整而向量库有数据时（功能上线前入库的数据），从向量库回填一次
+
+        Returns:
+            回填的片段数
+        """
+        key = project_id or "*"
+        if key in _catalog_checked:
+            return 0
+        _catalog_checked.add(key)
+        cataloged = count_chunk_records(project_id)
+        if cataloged and count_fulltext_records(project_id) >= cataloged:
+            return 0
+
+        raw = self.store.get(where={"project_id": project_id} if project_id else None,
+                             include=["documents", "metadatas"])
+        if not raw.get("ids"):
+            return 0
+
+        from langchain_core.documents import Document
+        seen = Counter()
+        records = []
+        for chunk_id, content, metadata in zip(raw["ids"], raw["documents"], raw["metadatas"]):
+            metadata = metadata or {}
+            chunk = Document(page_content=content or "", metadata=metadata)
+            source = metadata.get("source", "unknown")
+            ordinal = metadata.get("chunk_index", seen[source])
+            seen[source] += 1
+            records.append(_catalog_record(chunk_id, metadata.get("project_id", project_id or DEFAULT_PROJECT_ID),
+                                           chunk, ordinal))
+        add_chunk_records(records)
+        logger.info(f"📇 回填片段目录: {len(records)} 条 (project_id={project_id or '全部'})")
+        return len(records)
@@ -0,0 +1,187 @@
+# src/rag/warmup.py
+"""
+知识库预热 - 打开知识库时在后台把首个问题要用到的资源提前加载好
+1. Embedding：加载本地模型 / 建立 Embedding 接口连接，顺带得到探测用的查询向量
+2. 向量索引：用探测向量检索一次（Chroma 段文件、NumPy 内存映射页、Qdrant 连接）；启用两阶段检索时加载文档级索引
+3. 关键词索引：全文索引回填检查并探测一次（内存 BM25 模式下读取入库词序列）
+4. 重排序：启用时加载模型 / 建立客户端并打一次分
+5. 对话模型：建立到 LLM 接口的 HTTP 连接（不发起生成请求）
+
+各步骤互不依赖前一步是否成功，结果按知识库记录，可随时查询就绪状态。
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from config.settings import settings
+from src.utils.logger import setup_logger
+
+logger = setup_logger("Warmup")
+
+_PROBE_TEXT = "预热 warmup"
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_states: Dict[str, "ProjectWarmup"] = {}
+_futures: Dict[str, Future] = {}
+_states_lock = threading.Lock()
+
+
+@dataclass
+class ProjectWarmup:
+    """单个知识库的预热状态"""
+    project_id: str
+    status: str = "pending"        # pending | warming | ready | failed（有步骤失败，其余步骤仍已预热）
+    steps: Dict[str, float] = field(default_factory=dict)     # 已完成步骤 -> 耗时 ms
+    errors: Dict[str, str] = field(default_factory=dict)      # 失败步骤 -> 错误信息
+    skipped: List[str] = field(default_factory=list)          # 当前配置下不需要的步骤
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    @property
+    def latency_ms(self) -> float:
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return (self.finished_at - self.started_at) * 1000
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.WARMUP_WORKERS, thread_name_prefix="warmup")
+        return _executor
+
+
+def _warm_embedding(project_id: str) -> List[float]:
+    from src.rag.project_config import get_project_embedding_model
+    return get_project_embedding_model(project_id).embed_query(_PROBE_TEXT)
+
+
+def _warm_vector_index(store, project_id: str, embedding: List[float]):
+    from src.rag.doc_index import coarse_filter
+    filter_rule = coarse_filter(store, project_id, embedding) or {"project_id": project_id}
+    store.similarity_search_by_vector_with_score(embedding, top_k=1, filter=filter_rule)
+
+
+def _warm_keyword_index(store, project_id: str):
+    if settings.KEYWORD_BACKEND == "fulltext":
+        from src.rag import keyword_index
+        from src.rag.vectorstore import VectorDBManager
+        VectorDBManager(store=store).ensure_catalog(project_id)
+        keyword_index.search_chunks(_PROBE_TEXT, project_id, top_k=1)
+    else:
+        # 内存 BM25 每次检索时构建，这里只预读入库时保存的词序列
+        from src.rag.text_tokenizer import get_tokenizer
+        from src.utils.db import get_token_streams
+        get_token_streams(project_id, get_tokenizer().name)
+
+
+def _warm_reranker():
+    from src.rag.reranker import get_reranker
+    get_reranker(settings.RERANKER_BACKEND).warmup()
+
+
+def _warm_chat_model():
+    from src.utils.model_manager import model_manager
+    model_manager.warmup_chat_connection()
+
+
+def _run(state: ProjectWarmup):
+    from src.rag.stores import get_vector_store
+
+    project_id = state.project_id
+    state.status, state.started_at = "warming", time.time()
+    logger.info(f"🔥 开始预热知识库 {project_id}")
+
+    def step(name: str, fn, *args):
+        start = time.perf_counter()
+        # 整体替换字典，查询状态的线程不会遇到迭代中被修改
+        try:
+            result = fn(*args)
+            state.steps = {**state.steps, name: (time.perf_counter() - start) * 1000}
+            return result
+        except Exception as e:
+            state.errors = {**state.errors, name: str(e)}
+            logger.warning(f"⚠️ 预热 {project_id} 的 {name} 失败: {e}")
+            return None
+
+    embedding = step("embedding", _warm_embedding, project_id)
+    store = step("vector_store", get_vector_store)
+    if store is not None and embedding is not None:
+        step("vector_index", _warm_vector_index, store, project_id, embedding)
+    if store is not None and settings.RETRIEVAL_MODE == "hybrid":
+        step("keyword_index", _warm_keyword_index, store, project_id)
+    else:
+        state.skipped = state.skipped + ["keyword_index"]
+    if settings.ENABLE_RERANKER:
+        step("reranker", _warm_reranker)
+    else:
+        state.skipped = state.skipped + ["reranker"]
+    step("chat_model", _warm_chat_model)
+
+    state.finished_at = time.time()
+    state.status = "failed" if state.errors else "ready"
+    logger.info(
+        f"{'✅' if state.ready else '⚠️'} 知识库 {project_id} 预热{'完成' if state.ready else '部分失败'} "
+        f"({state.latency_ms:.0f}ms): " + ", ".join(f"{k}={v:.0f}ms" for k, v in state.steps.items())
+    )
+    _record_warmup(state)
+
+
+def warmup_project(project_id: str, wait: bool = False, force: bool = False) -> ProjectWarmup:
+    """
+    在后台预热知识库（同一知识库正在预热或已就绪时不重复提交）
+
+    Args:
+        project_id: 知识库ID
+        wait: 是否等待预热完成再返回
+        force: 已就绪 / 失败时也重新预热（如切换模型后）
+
+    Returns:
+        ProjectWarmup（wait=False 时为提交时的状态，之后原地更新）
+    """
+    with _states_lock:
+        state = _states.get(project_id)
+        future = _futures.get(project_id)
+        running = future is not None and not future.done()
+        if state is None or (force and not running):
+            state = ProjectWarmup(project_id)
+            _states[project_id] = state
+            future = _get_executor().submit(_run, state)
+            _futures[project_id] = future
+    if wait:
+        future.result()
+    return state
+
+
+def warmup_projects(project_ids: Iterable[str], wait: bool = False) -> Dict[str, ProjectWarmup]:
+    """批量预热（服务启动时的常用知识库）"""
+    states = {pid: warmup_project(pid) for pid in dict.fromkeys(project_ids)}
+    if wait:
+        for pid in states:
+            _futures[pid].result()
+    return states
+
+
+def get_warmup_status(project_id: Optional[str] = None) -> Dict[str, ProjectWarmup]:
+    """预热状态：指定知识库时只返回该知识库（未预热过的为 pending）"""
+    with _states_lock:
+        if project_id is None:
+            return dict(_states)
+        return {project_id: _states.get(project_id) or ProjectWarmup(project_id)}
+
+
+def _record_warmup(state: ProjectWarmup):
+    from src.metrics.collector import metrics_collector
+
+    tags = {"project_id": state.project_id, "status": state.status}
+    metrics_collector.record("warmup", "latency", state.latency_ms, "ms", tags=tags)
+    for name, latency in state.steps.items():
+        metrics_collector.record("warmup", f"{name}_latency", latency, "ms", tags=tags)
@@ -7,9 +7,12 @@ Service Layer - 业务逻辑层
 from src.service.kb_service import KnowledgeBaseService
 from src.service.chat_service import ChatService
 from src.service.document_service import DocumentService
+from src.service.ingest_service import IngestJobService, get_ingest_service
 
 __all__ = [
     "KnowledgeBaseService",
     "ChatService", 
     "DocumentService",
+    "IngestJobService",
+    "get_ingest_service",
 ]
\ No newline at end of file
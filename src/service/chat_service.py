@@ -6,9 +6,12 @@
 from typing import List, Dict, Iterator, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
+import time
+import uuid
 
 from langchain_core.messages import HumanMessage
 
+from config.settings import settings
 from src.agent.graph import app as agent_app
 from src.utils.db import get_messages, save_message
 from src.utils.logger import setup_logger
@@ -60,6 +63,17 @@ class AgentEvent:
         )
 
 
+@dataclass
+class BatchChatResult:
+    """批量聊天中单个问题的结果"""
+    index: int
+    prompt: str
+    session_id: str
+    success: bool
+    content: str          # 响应内容或错误信息
+    latency_ms: float
+
+
 class ChatService:
     """聊天服务"""
     
@@ -86,14 +100,20 @@ class ChatService:
         self, 
         prompt: str, 
         session_id: str, 
-        project_id: str
+        project_id: str,
+        stream_tokens: bool = False,
     ) -> Iterator[Tuple[str, AgentEvent | str]]:
         """
         流式获取 Agent 响应
         
+        Args:
+            stream_tokens: 是否同时产出 writer 节点的增量 token。
+                writer 被答案验证打回重写时会再次产出 token，以最终 "response" 为准。
+
         Yields:
             Tuple[str, AgentEvent | str]: 
                 - "event": AgentEvent 事件
+                - "token": writer 生成的增量文本（仅 stream_tokens=True）
                 - "response": 最终响应文本
                 - "error": 错误信息
         """
@@ -103,8 +123,19 @@ class ChatService:
         full_response = ""
         
         try:
-            for event in self.agent_app.stream(inputs, config=run_config):
-                for node_name, node_output in event.items():
+            if stream_tokens:
+                stream = self.agent_app.stream(inputs, config=run_config, stream_mode=["updates", "messages"])
+            else:
+                stream = (("updates", event) for event in self.agent_app.stream(inputs, config=run_config))
+
+            for mode, payload in stream:
+                if mode == "messages":
+                    chunk, metadata = payload
+                    if metadata.get("langgraph_node") == "writer" and chunk.content:
+                        yield "token", chunk.content
+                    continue
+
+                for node_name, node_output in payload.items():
                     agent_event = AgentEvent.from_stream_event(node_name)
                     yield "event", agent_event
                     
@@ -146,6 +177,68 @@ class ChatService:
         
         return True, full_response, events
 
+    def iter_chat_batch(
+        self,
+        prompts: List[str],
+        project_id: str,
+        session_ids: Optional[List[str]] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> Iterator[BatchChatResult]:
+        """
+        批量执行 Agent 对话，按完成顺序逐条产出结果
+
+        Args:
+            prompts: 问题列表
+            project_id: 知识库 ID
+            session_ids: 与 prompts 对应的会话 ID，None 时为每个问题生成独立 ID
+            max_concurrency: 同时运行的 Agent 数，None 时读取 BATCH_MAX_CONCURRENCY
+        """
+        if not prompts:
+            return
+        if session_ids is None:
+            session_ids = [f"batch-{uuid.uuid4()}" for _ in prompts]
+        if len(session_ids) != len(prompts):
+            raise ValueError("session_ids 数量必须与 prompts 一致")
+
+        max_concurrency = max_concurrency or settings.BATCH_MAX_CONCURRENCY
+        inputs = [{"messages": [HumanMessage(content=p)]} for p in prompts]
+        configs = [
+            {
+                "configurable": {"session_id": sid, "project_id": project_id},
+                "max_concurrency": max_concurrency,
+            }
+            for sid in session_ids
+        ]
+
+        logger.info(f"📦 批量对话: {len(prompts)} 个问题 (并发 {max_concurrency})")
+        start_time = time.time()
+        for index, output in self.agent_app.batch_as_completed(inputs, config=configs, return_exceptions=True):
+            latency_ms = (time.time() - start_time) * 1000
+            if isinstance(output, Exception):
+                logger.error(f"❌ 批量对话第 {index} 条出错: {output}")
+                success, content = False, str(output)
+            else:
+                success, content = True, output["messages"][-1].content
+            yield BatchChatResult(
+                index=index,
+                prompt=prompts[index],
+                session_id=session_ids[index],
+                success=success,
+                content=content,
+                latency_ms=latency_ms,
+            )
+
+    def chat_batch(
+        self,
+        prompts: List[str],
+        project_id: str,
+        session_ids: Optional[List[str]] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> List[BatchChatResult]:
+        """批量执行 Agent 对话，按输入顺序返回全部结果"""
+        results = list(self.iter_chat_batch(prompts, project_id, session_ids, max_concurrency))
+        return sorted(results, key=lambda r: r.index)
+
 
 class ChatUIHelper:
     """聊天 UI 辅助类（用于 Streamlit 的状态显示）"""
@@ -3,7 +3,7 @@
 文档服务 - Document Service
 负责文档上传、处理和入库
 """
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from dataclasses import dataclass
 from collections import Counter
 from pathlib import Path
@@ -12,6 +12,7 @@ from streamlit.runtime.uploaded_file_manager import UploadedFile
 
 from src.rag.etl import ContentProcessor
 from src.rag.vectorstore import VectorDBManager
+from src.service.ingest_service import IngestJob, get_ingest_service
 from src.utils.db import add_project_file_record
 from src.utils.logger import setup_logger
 
@@ -81,7 +82,7 @@ class DocumentService:
             
             # 2. 切分文档
             logger.info(f"✂️ 切分文档...")
-            chunks = self.processor.split_documents(docs)
+            chunks = self.processor.split_documents(docs, project_id=project_id)
             
             # 3. 写入向量库
             logger.info(f"📥 写入向量库 (project_id={project_id})...")
@@ -129,6 +130,24 @@ class DocumentService:
                 file_details=[]
             )
     
+    # ==================== 后台入库任务 ====================
+
+    def submit_ingest_job(self, uploaded_files: List[UploadedFile], project_id: str) -> str:
+        """提交后台入库任务，立即返回任务 ID"""
+        return get_ingest_service().submit(uploaded_files, project_id)
+
+    def get_ingest_job(self, job_id: str) -> Optional[IngestJob]:
+        """查询入库任务进度"""
+        return get_ingest_service().get_job(job_id)
+
+    def list_ingest_jobs(self, project_id: str, limit: int = 10) -> List[IngestJob]:
+        """列出知识库最近的入库任务"""
+        return get_ingest_service().list_jobs(project_id, limit)
+
+    def cancel_ingest_job(self, job_id: str) -> bool:
+        """取消入库任务"""
+        return get_ingest_service().cancel(job_id)
+
     def get_supported_formats(self) -> List[str]:
         """获取支持的文件格式"""
         return [".txt", ".md", ".pdf", ".docx", ".py", ".js", ".java", ".c", ".cpp", ".ts", ".go", ".rs"]
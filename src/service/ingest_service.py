@@ -0,0 +1,397 @@
+# src/service/ingest_service.py
+"""
+入库任务服务 - Ingest Job Service
+把文档入库从请求线程中剥离，交给后台 worker 执行：
+1. 上传文件先暂存到磁盘，任务状态持久化到数据库
+2. 每个文件按 load → split → embed → upsert 阶段推进，按批写入并记录断点
+3. 支持取消；进程重启后可从断点继续未完成的任务
+"""
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config.settings import settings
+from src.utils.db import (
+    add_project_file_record,
+    claim_ingest_job,
+    create_ingest_job,
+    get_ingest_job,
+    list_ingest_job_files,
+    list_ingest_jobs,
+    list_unfinished_ingest_jobs,
+    update_ingest_job,
+    update_ingest_job_file,
+)
+from src.utils.logger import setup_logger
+
+logger = setup_logger("INGEST_SERVICE")
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_CANCELLING = "cancelling"
+JOB_CANCELLED = "cancelled"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = {JOB_CANCELLED, JOB_COMPLETED, JOB_FAILED}
+
+
+@dataclass
+class IngestJobFile:
+    """任务中的单个文件"""
+    id: int
+    filename: str
+    status: str
+    stage: str
+    chunks_total: int
+    chunks_done: int
+    error: Optional[str] = None
+
+
+@dataclass
+class IngestJob:
+    """入库任务状态"""
+    id: str
+    project_id: str
+    status: str
+    total_files: int
+    done_files: int
+    total_chunks: int
+    created_at: str
+    updated_at: str
+    error: Optional[str] = None
+    files: List[IngestJobFile] = field(default_factory=list)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def progress(self) -> float:
+        """整体进度 0~1：已完成文件记满分，进行中的文件按已写入块数折算"""
+        if not self.total_files:
+            return 1.0 if self.finished else 0.0
+        done = 0.0
+        for f in self.files:
+            if f.status in ("done", "failed"):
+                done += 1
+            elif f.chunks_total:
+                done += f.chunks_done / f.chunks_total
+        return min(done / self.total_files, 1.0)
+
+    @classmethod
+    def from_row(cls, row: Dict, files: Optional[List[Dict]] = None) -> "IngestJob":
+        return cls(
+            id=row["id"],
+            project_id=row["project_id"],
+            status=row["status"],
+            total_files=row["total_files"] or 0,
+            done_files=row["done_files"] or 0,
+            total_chunks=row["total_chunks"] or 0,
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            error=row["error"],
+            files=[
+                IngestJobFile(
+                    id=f["id"],
+                    filename=f["filename"],
+                    status=f["status"],
+                    stage=f["stage"] or "",
+                    chunks_total=f["chunks_total"] or 0,
+                    chunks_done=f["chunks_done"] or 0,
+                    error=f["error"],
+                )
+                for f in (files or [])
+            ],
+        )
+
+
+class _StagedFile:
+    """暂存在磁盘上的上传文件，提供 ContentProcessor 需要的 name / getvalue 接口"""
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+
+    def getvalue(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+class _JobCancelled(Exception):
+    """任务在批次之间被取消"""
+
+
+class IngestJobService:
+    """
+    后台入库任务服务
+    每个进程持有一个实例（见 get_ingest_service），worker 线程数由 INGEST_WORKERS 控制
+    """
+
+    def __init__(
+        self,
+        processor=None,
+        vector_db=None,
+        embeddings=None,
+        max_workers: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        staging_dir: Optional[Path] = None,
+    ):
+        self._processor = processor
+        self._vector_db = vector_db
+        self._embeddings = embeddings
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        self.staging_dir = Path(staging_dir or settings.INGEST_STAGING_DIR)
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or settings.INGEST_WORKERS,
+            thread_name_prefix="ingest",
+        )
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._events_lock = threading.Lock()
+        logger.info("✅ 入库任务服务初始化完成")
+
+    # ==================== 依赖（延迟创建） ====================
+
+    @property
+    def processor(self):
+        if self._processor is None:
+            from src.rag.etl import ContentProcessor
+            self._processor = ContentProcessor()
+        return self._processor
+
+    @property
+    def vector_db(self):
+        if self._vector_db is None:
+            from src.rag.vectorstore import VectorDBManager
+            self._vector_db = VectorDBManager()
+        return self._vector_db
+
+    def embeddings_for(self, project_id: str):
+        """注入的 Embedding 优先，否则按知识库配置的输出维度获取"""
+        if self._embeddings is not None:
+            return self._embeddings
+        from src.rag.project_config import get_project_embedding_model
+        return get_project_embedding_model(project_id)
+
+    # ==================== 对外接口 ====================
+
+    def submit(self, uploaded_files: List, project_id: str) -> str:
+        """
+        暂存文件并提交入库任务，立即返回任务 ID
+
+        Args:
+            uploaded_files: 具有 name / getvalue 接口的文件对象
+            project_id: 知识库 ID
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = self.staging_dir / job_id
+        job_dir.mkdir(parents=True, exist_ok=True)
+
+        staged = []
+        for i, up_file in enumerate(uploaded_files):
+            path = job_dir / f"{i:04d}_{Path(up_file.name).name}"
+            path.write_bytes(up_file.getvalue())
+            staged.append((up_file.name, str(path)))
+
+        create_ingest_job(job_id, project_id, staged)
+        logger.info(f"📥 提交入库任务 {job_id}: {len(staged)} 个文件 (project_id={project_id})")
+        self._enqueue(job_id)
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[IngestJob]:
+        """查询任务状态（含文件明细）"""
+        row = get_ingest_job(job_id)
+        if not row:
+            return None
+        return IngestJob.from_row(row, list_ingest_job_files(job_id))
+
+    def list_jobs(self, project_id: Optional[str] = None, limit: int = 10) -> List[IngestJob]:
+        """列出最近的任务（含文件明细）"""
+        return [
+            IngestJob.from_row(row, list_ingest_job_files(row["id"]))
+            for row in list_ingest_jobs(project_id, limit)
+        ]
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        请求取消任务
+        当前批次写完后停止；已写入的片段保留在向量库中
+        """
+        row = get_ingest_job(job_id)
+        if not row or row["status"] in FINISHED_STATUSES:
+            return False
+
+        update_ingest_job(job_id, status=JOB_CANCELLING)
+        with self._events_lock:
+            event = self._cancel_events.get(job_id)
+        if event:
+            event.set()
+        logger.info(f"🛑 请求取消入库任务 {job_id}")
+        return True
+
+    def resume_unfinished(self) -> int:
+        """
+        恢复遗留任务：长时间未更新的排队/运行中/取消中任务视为原进程已退出（取消中的任务直接标记为已取消）
+        多进程同时恢复时由 claim_ingest_job 保证只有一个进程执行
+
+        Returns:
+            重新排队的任务数
+        """
+        stale_before = (datetime.now() - timedelta(seconds=settings.INGEST_STALE_SECONDS)).isoformat()
+        jobs = list_unfinished_ingest_jobs(stale_before)
+        for row in jobs:
+            logger.info(f"🔁 恢复入库任务 {row['id']} (status={row['status']})")
+            self._enqueue(row["id"])
+        return len(jobs)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    # ==================== Worker ====================
+
+    def _enqueue(self, job_id: str):
+        with self._events_lock:
+            self._cancel_events.setdefault(job_id, threading.Event())
+        self._executor.submit(self._run_job, job_id)
+
+    def _is_cancelled(self, job_id: str) -> bool:
+        with self._events_lock:
+            event = self._cancel_events.get(job_id)
+        if event and event.is_set():
+            return True
+        # 取消请求可能来自其他进程（如 API worker）
+        row = get_ingest_job(job_id)
+        return row is not None and row["status"] == JOB_CANCELLING
+
+    def _run_job(self, job_id: str):
+        try:
+            row = get_ingest_job(job_id)
+            if not row:
+                return
+            if row["status"] == JOB_CANCELLING:
+                self._finish(job_id, JOB_CANCELLED)
+                return
+            if not claim_ingest_job(job_id, row["updated_at"]):
+                logger.info(f"⏭️ 入库任务 {job_id} 已被其他进程领取")
+                return
+
+            logger.info(f"🚀 开始执行入库任务 {job_id}")
+            total_chunks = row["total_chunks"] or 0
+            done_files = row["done_files"] or 0
+            failed = []
+
+            for file_row in list_ingest_job_files(job_id):
+                if file_row["status"] in ("done", "failed"):
+                    continue
+                if self._is_cancelled(job_id):
+                    raise _JobCancelled()
+
+                chunks = self._process_file(job_id, row["project_id"], file_row)
+                if chunks is None:
+                    failed.append(file_row["filename"])
+                else:
+                    total_chunks += chunks
+                done_files += 1
+                update_ingest_job(job_id, done_files=done_files, total_chunks=total_chunks)
+
+            error = f"解析失败: {', '.join(failed)}" if failed else None
+            self._finish(job_id, JOB_COMPLETED, error=error)
+            logger.info(f"✅ 入库任务 {job_id} 完成: {total_chunks} chunks")
+
+        except _JobCancelled:
+            self._finish(job_id, JOB_CANCELLED)
+            logger.info(f"🛑 入库任务 {job_id} 已取消")
+        except Exception as e:
+            logger.error(f"❌ 入库任务 {job_id} 失败: {e}")
+            update_ingest_job(job_id, status=JOB_FAILED, error=str(e))
+        finally:
+            with self._events_lock:
+                self._cancel_events.pop(job_id, None)
+
+    def _process_file(self, job_id: str, project_id: str, file_row: Dict) -> Optional[int]:
+        """
+        处理单个文件，返回写入的片段数；解析不出内容时返回 None
+        从 chunks_done 断点继续，切分结果是确定的，所以断点前的片段不会重复写入
+        """
+        file_id = file_row["id"]
+        filename = file_row["filename"]
+
+        update_ingest_job_file(file_id, status="running", stage="load")
+        docs = self.processor.load_uploaded_files([_StagedFile(filename, file_row["staged_path"])])
+        if not docs:
+            update_ingest_job_file(file_id, status="failed", stage="load", error="未解析出有效内容")
+            return None
+
+        update_ingest_job_file(file_id, stage="split")
+        chunks = self.processor.split_documents(docs, project_id=project_id)
+        update_ingest_job_file(file_id, chunks_total=len(chunks))
+
+        start = file_row["chunks_done"] or 0
+        for offset in range(start, len(chunks), self.batch_size):
+            if offset > start and self._is_cancelled(job_id):
+                raise _JobCancelled()
+
+            batch = chunks[offset:offset + self.batch_size]
+            update_ingest_job_file(file_id, stage="embed")
+            vectors = self.embeddings_for(project_id).embed_documents([c.page_content for c in batch])
+
+            update_ingest_job_file(file_id, stage="upsert")
+            self.vector_db.add_chunk_batch(batch, vectors, project_id, start_ordinal=offset)
+            update_ingest_job_file(file_id, chunks_done=offset + len(batch))
+            # 刷新任务 updated_at，避免长文件被误判为遗留任务
+            update_ingest_job(job_id)
+
+        # 同名文件重新入库：内容未变的片段 ID 相同已被覆盖，清理不再存在的旧片段
+        keep_ids = [c.metadata.get("chunk_id") for c in chunks]
+        sources = sorted({c.metadata.get("source", filename) for c in chunks})
+        keep_parent_ids = [c.metadata["parent_id"] for c in chunks if c.metadata.get("parent_id")]
+        if all(keep_ids):
+            for source in sources:
+                self.vector_db.prune_source(project_id, source, keep_ids, keep_parent_ids)
+        self.vector_db.refresh_document_index(project_id, sources)
+
+        add_project_file_record(
+            project_id=project_id,
+            source=filename,
+            file_type=Path(filename).suffix.lower().lstrip("."),
+            chunks_count=len(chunks),
+        )
+        update_ingest_job_file(file_id, status="done", stage="done")
+        self._remove_staged(file_row["staged_path"])
+        return len(chunks)
+
+    def _finish(self, job_id: str, status: str, error: Optional[str] = None):
+        if error:
+            update_ingest_job(job_id, status=status, error=error)
+        else:
+            update_ingest_job(job_id, status=status)
+        if status in (JOB_COMPLETED, JOB_CANCELLED):
+            shutil.rmtree(self.staging_dir / job_id, ignore_errors=True)
+
+    @staticmethod
+    def _remove_staged(path: Optional[str]):
+        if path:
+            Path(path).unlink(missing_ok=True)
+
+
+_ingest_service: Optional[IngestJobService] = None
+_ingest_service_lock = threading.Lock()
+
+
+def get_ingest_service() -> IngestJobService:
+    """获取进程内共享的入库任务服务，首次创建时恢复遗留任务"""
+    global _ingest_service
+    if _ingest_service is None:
+        with _ingest_service_lock:
+            if _ingest_service is None:
+                service = IngestJobService()
+                service.resume_unfinished()
+                _ingest_service = service
+    return _ingest_service
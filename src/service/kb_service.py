@@ -17,6 +17,12 @@ from src.utils.db import (
     get_latest_session_by_project,
     create_session,
 )
+from src.rag.project_config import (
+    ProjectRetrievalConfig,
+    get_project_retrieval_config,
+    update_project_retrieval_config,
+)
+from src.rag.warmup import ProjectWarmup, get_warmup_status, warmup_project
 from src.utils.logger import setup_logger
 
 logger = setup_logger("KB_SERVICE")
@@ -41,6 +47,7 @@ class KnowledgeBaseStats:
     message_count: int
     latest_file_time: Optional[str]
     latest_session_time: Optional[str]
+    chunk_count: int = 0
 
 
 @dataclass
@@ -102,6 +109,22 @@ class KnowledgeBaseService:
             logger.error(f"❌ 删除知识库失败: {e}")
             return False, str(e)
     
+    def get_retrieval_config(self, kb_id: str) -> ProjectRetrievalConfig:
+        """获取知识库检索配置（ANN 索引参数等）"""
+        return get_project_retrieval_config(kb_id)
+
+    def update_retrieval_config(self, kb_id: str, **values) -> ProjectRetrievalConfig:
+        """修改知识库检索配置，值为 None 的项恢复全局默认"""
+        return update_project_retrieval_config(kb_id, **values)
+    
+    def warmup_kb(self, kb_id: str, wait: bool = False, force: bool = False) -> ProjectWarmup:
+        """后台预热知识库（向量索引、关键词索引、重排序模型、模型接口连接）"""
+        return warmup_project(kb_id, wait=wait, force=force)
+
+    def get_warmup_status(self, kb_id: str) -> ProjectWarmup:
+        """知识库预热状态（未预热过的为 pending）"""
+        return get_warmup_status(kb_id)[kb_id]
+    
     def get_kb_stats(self, kb_id: str) -> KnowledgeBaseStats:
         """获取知识库统计信息"""
         stats = get_project_stats(kb_id)
@@ -111,6 +134,7 @@ class KnowledgeBaseService:
             message_count=stats.get("message_count", 0),
             latest_file_time=stats.get("latest_file_time"),
             latest_session_time=stats.get("latest_session_time"),
+            chunk_count=stats.get("chunk_count", 0),
         )
     
     def get_kb_files(self, kb_id: str, limit: int = 50) -> List[FileRecord]:
@@ -137,6 +161,7 @@ class KnowledgeBaseService:
                 "知识库": kb.name,
                 "ID": kb.id,
                 "文件数": stats.file_count,
+                "片段数": stats.chunk_count,
                 "会话数": stats.session_count,
                 "消息数": stats.message_count,
                 "最近入库": stats.latest_file_time or "-",
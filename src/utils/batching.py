@@ -0,0 +1,184 @@
+# src/utils/batching.py
+"""
+动态批处理队列 - Micro Batcher
+把多个并发调用方的小请求合并成一次批量计算（本地模型推理、批量打分等），
+攒满 max_batch_size 条或最早的请求等待超过 max_wait_ms 即触发一次批处理。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger("MicroBatcher")
+
+
+@dataclass
+class _Request:
+    items: List
+    future: Future = field(default_factory=Future)
+    submitted: float = field(default_factory=time.monotonic)
+
+
+def _bucket(size: int) -> int:
+    """批大小直方图的桶：向上取 2 的幂（1, 2, 4, 8, ...）"""
+    return 1 << max(0, size - 1).bit_length()
+
+
+class MicroBatcher:
+    """
+    跨调用方的动态批处理
+
+    用法:
+        batcher = MicroBatcher(lambda texts: model.encode(texts), max_batch_size=32, max_wait_ms=5)
+        vectors = batcher.submit(["a", "b"]).result()
+
+    batch_fn 接收合并后的列表，返回等长的结果列表；单个请求的条目不会被拆到两个批次
+    （超过 max_batch_size 的请求单独成批，由 batch_fn 自行分块）。
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List], List],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "batcher",
+        on_batch: Optional[Callable[[int, int, float], None]] = None,
+    ):
+        """
+        Args:
+            on_batch: 每批处理完成后的回调 (批大小, 剩余排队条目数, 最早请求的等待毫秒)，用于上报指标
+        """
+        self.batch_fn = batch_fn
+        self.on_batch = on_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.name = name
+
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+
+        # 统计
+        self.batches = 0
+        self.items = 0
+        self.requests = 0
+        self.pending = 0                    # 已提交未处理的条目数（队列深度）
+        self.max_pending = 0
+        self.histogram: Dict[int, int] = {}
+
+    # ==================== 对外接口 ====================
+
+    def submit(self, items: List) -> Future:
+        """提交一组条目，返回结果 Future（结果与 items 顺序一致）"""
+        request = _Request(list(items))
+        if not request.items:
+            request.future.set_result([])
+            return request.future
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} 已关闭")
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+            self.pending += len(request.items)
+            self.max_pending = max(self.max_pending, self.pending)
+        self._queue.put(request)
+        return request.future
+
+    def __call__(self, items: List) -> List:
+        """同步提交并等待结果"""
+        return self.submit(items).result()
+
+    def close(self):
+        """处理完已提交的请求后停止 worker 线程"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            worker = self._worker
+        self._queue.put(None)
+        if worker is not None:
+            worker.join()
+
+    def get_stats(self) -> Dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "queue_depth": self.pending,
+            "max_queue_depth": self.max_pending,
+            "batch_size_histogram": {f"<={k}": v for k, v in sorted(self.histogram.items())},
+        }
+
+    # ==================== worker ====================
+
+    def _collect(self, first: _Request) -> List[_Request]:
+        """以 first 为起点攒批：数量达到上限或等待超时即返回"""
+        batch = [first]
+        size = len(first.items)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:             # 关闭信号放回，当前批处理完再退出
+                self._queue.put(None)
+                break
+            if size + len(request.items) > self.max_batch_size:
+                # 放不下：先处理已攒的批次，新请求作为下一批的起点
+                self._dispatch(batch)
+                batch, size = [], 0
+                deadline = time.monotonic() + self.max_wait
+            batch.append(request)
+            size += len(request.items)
+        return batch
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            self._dispatch(self._collect(request))
+
+    def _dispatch(self, batch: List[_Request]):
+        if not batch:
+            return
+        items = [item for request in batch for item in request.items]
+        waited_ms = (time.monotonic() - batch[0].submitted) * 1000
+        with self._lock:
+            self.pending -= len(items)
+            pending = self.pending
+        try:
+            results = self.batch_fn(items)
+            if len(results) != len(items):
+                raise ValueError(f"批处理结果数 {len(results)} 与输入数 {len(items)} 不一致")
+        except Exception as e:
+            logger.warning(f"⚠️ {self.name} 批处理失败: {e}")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.requests += len(batch)
+        self.items += len(items)
+        bucket = _bucket(len(items))
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+        if self.on_batch is not None:
+            try:
+                self.on_batch(len(items), pending, waited_ms)
+            except Exception as e:
+                logger.debug(f"{self.name} 指标回调失败: {e}")
+        offset = 0
+        for request in batch:
+            request.future.set_result(list(results[offset:offset + len(request.items)]))
+            offset += len(request.items)
@@ -5,15 +5,22 @@
 - 未配置或为空 → 使用 SQLite（向后兼容）
 - 已配置 → 使用 PostgreSQL（连接池）
 """
+import json
 import os
+import re
 import sys
+import threading
+import time
 from datetime import datetime
-from typing import List, Optional, Tuple, Dict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 from config.settings import settings
+from src.utils.logger import setup_logger
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+logger = setup_logger("Database")
+
 DEFAULT_PROJECT_ID = "default"
 DEFAULT_PROJECT_NAME = "默认知识库"
 
@@ -47,6 +54,34 @@ def _ensure_column_sqlite(cursor, table: str, column: str, ddl: str):
         cursor.execute(ddl)
 
 
+def _rename_legacy_catalog_sqlite(cursor) -> Optional[str]:
+    """
+    早期的 chunk_catalog 没有显式整数主键（全文索引按隐式 rowid 对应）：改名后由
+    _copy_legacy_catalog_sqlite 复制到新表；返回旧表名，无需迁移时返回 None
+    """
+    cursor.execute("PRAGMA table_info(chunk_catalog)")
+    cols = [row[1] for row in cursor.fetchall()]
+    if not cols or "id" in cols:
+        return None
+    legacy = "chunk_catalog_legacy"
+    cursor.execute(f"ALTER TABLE chunk_catalog RENAME TO {legacy}")
+    # 索引随表改名，先删除以便在新表上重建同名索引
+    cursor.execute("DROP INDEX IF EXISTS idx_chunk_catalog_source")
+    cursor.execute("DROP INDEX IF EXISTS idx_chunk_catalog_file_type")
+    return legacy
+
+
+def _copy_legacy_catalog_sqlite(cursor, legacy: str):
+    """旧表的 rowid 作为新表 id，已有的全文索引行保持对应"""
+    cursor.execute(f"PRAGMA table_info({legacy})")
+    legacy_cols = {row[1] for row in cursor.fetchall()}
+    cursor.execute("PRAGMA table_info(chunk_catalog)")
+    columns = ", ".join(row[1] for row in cursor.fetchall() if row[1] in legacy_cols)
+    cursor.execute(f"INSERT INTO chunk_catalog (id, {columns}) SELECT rowid, {columns} FROM {legacy}")
+    cursor.execute(f"DROP TABLE {legacy}")
+    logger.info("📇 片段目录已迁移为显式整数主键")
+
+
 # ==================== PostgreSQL 后端 ====================
 
 def _pg_get_conn():
@@ -152,6 +187,128 @@ def init_db():
             )
         """)
 
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total_files INTEGER DEFAULT 0,
+                done_files INTEGER DEFAULT 0,
+                total_chunks INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_job_files (
+                id SERIAL PRIMARY KEY,
+                job_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                staged_path TEXT,
+                status TEXT NOT NULL,
+                stage TEXT,
+                chunks_total INTEGER DEFAULT 0,
+                chunks_done INTEGER DEFAULT 0,
+                error TEXT,
+                updated_at TEXT,
+                FOREIGN KEY (job_id) REFERENCES ingest_jobs(id)
+            )
+        """)
+
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ingest_jobs_project_id ON ingest_jobs(project_id)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ingest_job_files_job_id ON ingest_job_files(job_id)"
+        )
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS project_configs (
+                project_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (project_id, key)
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_catalog (
+                chunk_id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                file_type TEXT,
+                ordinal INTEGER NOT NULL,
+                content_hash TEXT,
+                token_count INTEGER,
+                created_at TEXT
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chunk_catalog_source ON chunk_catalog(project_id, source, ordinal)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chunk_catalog_file_type ON chunk_catalog(project_id, file_type)"
+        )
+        # 内存 BM25 的词序列（入库时分词一次）
+        cursor.execute("ALTER TABLE chunk_catalog ADD COLUMN IF NOT EXISTS tokenizer TEXT")
+        cursor.execute("ALTER TABLE chunk_catalog ADD COLUMN IF NOT EXISTS tokens TEXT")
+
+        # 知识库质心向量（联邦检索路由用）：signature 记录计算时的内容签名，入库 / 删除后在后台重新计算
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS project_centroids (
+                project_id TEXT PRIMARY KEY,
+                embedding_key TEXT NOT NULL,
+                vector TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                signature TEXT,
+                updated_at TEXT
+            )
+        """)
+        cursor.execute("ALTER TABLE project_centroids ADD COLUMN IF NOT EXISTS signature TEXT")
+
+        # 父片段（父子切分模式）：子片段入向量库，检索命中后按 parent_id 换回父片段正文
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS parent_chunks (
+                parent_id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                ordinal INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                token_count INTEGER,
+                created_at TEXT
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_parent_chunks_source ON parent_chunks(project_id, source, ordinal)"
+        )
+
+        # 文档级粗排索引：每个来源文件一条质心向量（两阶段检索第一阶段用）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS document_centroids (
+                project_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                embedding_key TEXT NOT NULL,
+                vector TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                updated_at TEXT,
+                PRIMARY KEY (project_id, source)
+            )
+        """)
+
+        # 全文索引：文本在入库时已分好词（空格分隔），用 simple 配置建 tsvector
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_fts (
+                chunk_id TEXT PRIMARY KEY,
+                source_tsv TSVECTOR,
+                content_tsv TSVECTOR
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_fts_source ON chunk_fts USING GIN(source_tsv)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_fts_content ON chunk_fts USING GIN(content_tsv)")
+
         cursor.execute(
             f"INSERT INTO projects (id, name, created_at) VALUES ({_ph()}, {_ph()}, {_ph()}) "
             f"ON CONFLICT (id) DO NOTHING",
@@ -210,6 +367,138 @@ def init_db():
             )
         """)
 
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total_files INTEGER DEFAULT 0,
+                done_files INTEGER DEFAULT 0,
+                total_chunks INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_job_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                staged_path TEXT,
+                status TEXT NOT NULL,
+                stage TEXT,
+                chunks_total INTEGER DEFAULT 0,
+                chunks_done INTEGER DEFAULT 0,
+                error TEXT,
+                updated_at TEXT,
+                FOREIGN KEY(job_id) REFERENCES ingest_jobs(id)
+            )
+        """)
+
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ingest_jobs_project_id ON ingest_jobs(project_id)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ingest_job_files_job_id ON ingest_job_files(job_id)"
+        )
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS project_configs (
+                project_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (project_id, key)
+            )
+        """)
+
+        # id 为显式整数主键（rowid 别名，VACUUM 不会重排），全文索引按 id 对应
+        legacy_catalog = _rename_legacy_catalog_sqlite(cursor)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_catalog (
+                id INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                project_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                file_type TEXT,
+                ordinal INTEGER NOT NULL,
+                content_hash TEXT,
+                token_count INTEGER,
+                created_at TEXT
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chunk_catalog_source ON chunk_catalog(project_id, source, ordinal)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chunk_catalog_file_type ON chunk_catalog(project_id, file_type)"
+        )
+        # 内存 BM25 的词序列（入库时分词一次）
+        for column in CHUNK_TOKEN_COLUMNS:
+            _ensure_column_sqlite(
+                cursor,
+                table="chunk_catalog",
+                column=column,
+                ddl=f"ALTER TABLE chunk_catalog ADD COLUMN {column} TEXT"
+            )
+        if legacy_catalog:
+            _copy_legacy_catalog_sqlite(cursor, legacy_catalog)
+
+        # 知识库质心向量（联邦检索路由用）：signature 记录计算时的内容签名，入库 / 删除后在后台重新计算
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS project_centroids (
+                project_id TEXT PRIMARY KEY,
+                embedding_key TEXT NOT NULL,
+                vector TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                signature TEXT,
+                updated_at TEXT
+            )
+        """)
+        _ensure_column_sqlite(
+            cursor,
+            table="project_centroids",
+            column="signature",
+            ddl="ALTER TABLE project_centroids ADD COLUMN signature TEXT"
+        )
+
+        # 父片段（父子切分模式）：子片段入向量库，检索命中后按 parent_id 换回父片段正文
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS parent_chunks (
+                parent_id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                ordinal INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                token_count INTEGER,
+                created_at TEXT
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_parent_chunks_source ON parent_chunks(project_id, source, ordinal)"
+        )
+
+        # 文档级粗排索引：每个来源文件一条质心向量（两阶段检索第一阶段用）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS document_centroids (
+                project_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                embedding_key TEXT NOT NULL,
+                vector TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                updated_at TEXT,
+                PRIMARY KEY (project_id, source)
+            )
+        """)
+
+        # 全文索引（FTS5）：rowid 与 chunk_catalog 的 id 一致，文本在入库时已分好词
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING fts5(source, content)")
+        except Exception as e:
+            logger.warning(f"⚠️ SQLite 不支持 FTS5，全文检索不可用: {e}")
+
         cursor.execute(
             "INSERT OR IGNORE INTO projects (id, name, created_at) VALUES (?, ?, ?)",
             (DEFAULT_PROJECT_ID, DEFAULT_PROJECT_NAME, _now())
@@ -286,10 +575,17 @@ def delete_project(project_id: str):
         cursor.execute(f"DELETE FROM sessions WHERE id = {_ph()}", (sid,))
 
     cursor.execute(f"DELETE FROM project_files WHERE project_id = {_ph()}", (project_id,))
+    cursor.execute(f"DELETE FROM project_configs WHERE project_id = {_ph()}", (project_id,))
+    _delete_fulltext(cursor, *_catalog_where(project_id))
+    cursor.execute(f"DELETE FROM chunk_catalog WHERE project_id = {_ph()}", (project_id,))
+    cursor.execute(f"DELETE FROM project_centroids WHERE project_id = {_ph()}", (project_id,))
+    cursor.execute(f"DELETE FROM document_centroids WHERE project_id = {_ph()}", (project_id,))
+    cursor.execute(f"DELETE FROM parent_chunks WHERE project_id = {_ph()}", (project_id,))
     cursor.execute(f"DELETE FROM projects WHERE id = {_ph()}", (project_id,))
 
     conn.commit()
     _close(conn)
+    _bump_catalog_versions([project_id])
 
 
 # ==================== Session CRUD ====================
@@ -452,6 +748,714 @@ def delete_project_file_record(file_id: int):
     _close(conn)
 
 
+# ==================== Project Configs ====================
+
+def get_project_config(project_id: str) -> Dict[str, object]:
+    """读取知识库级配置（值以 JSON 存储），未设置的键由调用方回落到全局配置"""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT key, value FROM project_configs WHERE project_id = {_ph()}",
+        (project_id,)
+    )
+    rows = cursor.fetchall()
+    _close(conn)
+    return {key: json.loads(value) for key, value in rows}
+
+
+def set_project_config(project_id: str, key: str, value):
+    """写入一项知识库级配置；value 为 None 时删除该项"""
+    conn = _connect()
+    cursor = conn.cursor()
+    if value is None:
+        cursor.execute(
+            f"DELETE FROM project_configs WHERE project_id = {_ph()} AND key = {_ph()}",
+            (project_id, key)
+        )
+    elif _USE_POSTGRES:
+        cursor.execute(
+            f"INSERT INTO project_configs (project_id, key, value, updated_at) VALUES ({_placeholder(4)}) "
+            f"ON CONFLICT (project_id, key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at",
+            (project_id, key, json.dumps(value), _now())
+        )
+    else:
+        cursor.execute(
+            "INSERT OR REPLACE INTO project_configs (project_id, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (project_id, key, json.dumps(value), _now())
+        )
+    conn.commit()
+    _close(conn)
+
+
+# ==================== Catalog Versions ====================
+# 进程内按知识库记录片段目录的版本号：本进程写入 / 删除片段目录或文档级向量时递增。
+# 查询路径上要用、由片段目录统计得到的值（全文索引是否就绪、片段数、文档级索引签名等）
+# 按版本缓存，不必每次查询都统计整表；其他进程的写入在 CATALOG_CACHE_TTL 秒后可见。
+
+_catalog_versions: Dict[Optional[str], int] = {}
+_catalog_cache: Dict[Tuple[str, Optional[str]], Tuple[int, float, Any]] = {}
+_catalog_lock = threading.Lock()
+
+
+def _bump_catalog_versions(project_ids: Iterable[str]):
+    """片段目录变化后调用（不区分知识库的缓存键 None 一并失效）"""
+    with _catalog_lock:
+        for project_id in set(project_ids) | {None}:
+            _catalog_versions[project_id] = _catalog_versions.get(project_id, 0) + 1
+
+
+def catalog_cached(name: str, project_id: Optional[str], load: Callable[[], Any]) -> Any:
+    """
+    按知识库缓存由片段目录统计得到的值
+
+    Args:
+        name: 缓存项名称
+        project_id: 知识库ID（None 表示全部知识库）
+        load: 缓存失效时重新统计
+    """
+    now = time.monotonic()
+    with _catalog_lock:
+        version = _catalog_versions.get(project_id, 0)
+        cached = _catalog_cache.get((name, project_id))
+    if cached and cached[0] == version and now - cached[1] < settings.CATALOG_CACHE_TTL:
+        return cached[2]
+    value = load()
+    with _catalog_lock:
+        _catalog_cache[(name, project_id)] = (version, now, value)
+    return value
+
+
+# ==================== Chunk Catalog ====================
+# 每个向量片段一行：文件列表、按文件名查找、计数都走索引查询，只按 chunk_id 回向量库取正文
+
+CHUNK_CATALOG_COLUMNS = (
+    "chunk_id", "project_id", "source", "file_type", "ordinal", "content_hash", "token_count",
+)
+# 分词器名称与空格分隔的词序列：只在构建内存 BM25 时读取，不随目录记录返回
+CHUNK_TOKEN_COLUMNS = ("tokenizer", "tokens")
+
+
+def add_chunk_records(records: List[Dict[str, object]]):
+    """
+    批量写入片段目录（一个事务；chunk_id 已存在时覆盖）
+
+    记录中带 search_source / search_content（已分词、空格分隔的文本）时同步写入全文索引，
+    带 tokenizer / tokens 时一并保存 BM25 词序列。
+    """
+    if not records:
+        return
+    now = _now()
+    written = CHUNK_CATALOG_COLUMNS + CHUNK_TOKEN_COLUMNS
+    rows = [tuple(r.get(c) for c in written) + (now,) for r in records]
+    columns = ", ".join(written + ("created_at",))
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in written[1:])
+    fts_rows = [
+        (r.get("search_source") or "", r.get("search_content") or "", r["chunk_id"])
+        for r in records if r.get("search_content") is not None
+    ]
+    conn = _connect()
+    cursor = conn.cursor()
+    # 两个后端都用 upsert：SQLite 下保持 id 不变，全文索引按 id 对应
+    cursor.executemany(
+        f"INSERT INTO chunk_catalog ({columns}) VALUES ({_placeholder(len(written) + 1)}) "
+        f"ON CONFLICT (chunk_id) DO UPDATE SET {updates}",
+        rows
+    )
+    if fts_rows:
+        if _USE_POSTGRES:
+            cursor.executemany(
+                "INSERT INTO chunk_fts (chunk_id, source_tsv, content_tsv) "
+                "VALUES (%s, to_tsvector('simple', %s), to_tsvector('simple', %s)) "
+                "ON CONFLICT (chunk_id) DO UPDATE SET "
+                "source_tsv = EXCLUDED.source_tsv, content_tsv = EXCLUDED.content_tsv",
+                [(chunk_id, source, content) for source, content, chunk_id in fts_rows]
+            )
+        elif _fulltext_available(cursor):
+            cursor.executemany(
+                "INSERT OR REPLACE INTO chunk_fts (rowid, source, content) "
+                "SELECT id, ?, ? FROM chunk_catalog WHERE chunk_id = ?",
+                fts_rows
+            )
+    conn.commit()
+    _close(conn)
+    _bump_catalog_versions(r["project_id"] for r in records)
+
+
+def _catalog_where(project_id: Optional[str], source: Optional[str] = None) -> Tuple[str, tuple]:
+    clauses, params = [], []
+    if project_id is not None:
+        clauses.append(f"project_id = {_ph()}")
+        params.append(project_id)
+    if source is not None:
+        clauses.append(f"source = {_ph()}")
+        params.append(source)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", tuple(params)
+
+
+def count_chunk_records(project_id: Optional[str] = None, source: Optional[str] = None) -> int:
+    """片段数（project_id 为 None 时统计全部知识库）"""
+    where, params = _catalog_where(project_id, source)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM chunk_catalog{where}", params)
+    (count,) = cursor.fetchone()
+    _close(conn)
+    return count or 0
+
+
+def list_catalog_files(project_id: Optional[str] = None) -> List[Tuple[str, str, int, int]]:
+    """按文件聚合：[(source, file_type, 片段数, token 总数), ...]"""
+    where, params = _catalog_where(project_id)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT source, MAX(file_type), COUNT(*), SUM(token_count) FROM chunk_catalog{where} "
+        f"GROUP BY source ORDER BY source",
+        params
+    )
+    rows = cursor.fetchall()
+    _close(conn)
+    return [(source, file_type or "", count, tokens or 0) for source, file_type, count, tokens in rows]
+
+
+def search_chunk_records(
+    project_id: Optional[str],
+    pattern: str = "",
+    file_types: Optional[List[str]] = None,
+    limit: int = 200,
+) -> List[Dict[str, object]]:
+    """
+    按文件名（子串，不区分大小写）或文件类型查找片段，按文件与片段序号排序
+
+    Args:
+        pattern: 文件名子串，为空时不按文件名过滤
+        file_types: 文件类型列表（不带点，如 ["pdf"]），与 pattern 为或关系
+    """
+    where, params = _catalog_where(project_id)
+    conditions, match_params = [], []
+    if pattern:
+        # 转义 LIKE 通配符，文件名中的 % _ 按字面匹配
+        escaped = pattern.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append(f"LOWER(source) LIKE {_ph()} ESCAPE '\\'")
+        match_params.append(f"%{escaped}%")
+    if file_types:
+        conditions.append(f"file_type IN ({_placeholder(len(file_types))})")
+        match_params.extend(t.lower().lstrip(".") for t in file_types)
+    if conditions:
+        where += (" AND " if where else " WHERE ") + "(" + " OR ".join(conditions) + ")"
+
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {', '.join(CHUNK_CATALOG_COLUMNS)} FROM chunk_catalog{where} "
+        f"ORDER BY source, ordinal LIMIT {int(limit)}",
+        params + tuple(match_params)
+    )
+    rows = cursor.fetchall()
+    _close(conn)
+    return [dict(zip(CHUNK_CATALOG_COLUMNS, row)) for row in rows]
+
+
+def get_chunk_records(chunk_ids: List[str]) -> List[Dict[str, object]]:
+    """按 chunk_id 取片段目录记录，按文件与片段序号排序"""
+    if not chunk_ids:
+        return []
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {', '.join(CHUNK_CATALOG_COLUMNS)} FROM chunk_catalog "
+        f"WHERE chunk_id IN ({_placeholder(len(chunk_ids))}) ORDER BY source, ordinal",
+        tuple(chunk_ids)
+    )
+    rows = cursor.fetchall()
+    _close(conn)
+    return [dict(zip(CHUNK_CATALOG_COLUMNS, row)) for row in rows]
+
+
+def get_token_streams(project_id: str, tokenizer: str) -> Dict[str, List[str]]:
+    """
+    读取入库时保存的 BM25 词序列
+
+    Args:
+        tokenizer: 分词器名称，只返回由该分词器切分的记录（更换分词器后旧记录需重新分词）
+
+    Returns:
+        {chunk_id: [token, ...]}
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT chunk_id, tokens FROM chunk_catalog "
+        f"WHERE project_id = {_ph()} AND tokenizer = {_ph()} AND tokens IS NOT NULL",
+        (project_id, tokenizer)
+    )
+    rows = cursor.fetchall()
+    _close(conn)
+    return {chunk_id: tokens.split() for chunk_id, tokens in rows}
+
+
+def list_chunk_ids(project_id: str, source: Optional[str] = None) -> List[str]:
+    """知识库（或其中一个文件）的全部片段 ID"""
+    where, params = _catalog_where(project_id, source)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT chunk_id FROM chunk_catalog{where}", params)
+    rows = cursor.fetchall()
+    _close(conn)
+    return [row[0] for row in rows]
+
+
+def delete_chunk_records_by_ids(chunk_ids: List[str]) -> int:
+    """按片段 ID 删除目录记录与全文索引，返回删除行数"""
+    if not chunk_ids:
+        return 0
+    where, params = f" WHERE chunk_id IN ({_placeholder(len(chunk_ids))})", tuple(chunk_ids)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT DISTINCT project_id FROM chunk_catalog{where}", params)
+    project_ids = [row[0] for row in cursor.fetchall()]
+    _delete_fulltext(cursor, where, params)
+    cursor.execute(f"DELETE FROM chunk_catalog{where}", params)
+    deleted = cursor.rowcount
+    conn.commit()
+    _close(conn)
+    _bump_catalog_versions(project_ids)
+    return deleted
+
+
+def delete_chunk_records(project_id: str, source: Optional[str] = None) -> int:
+    """删除知识库（或其中一个文件）的片段目录、全文索引、文档级向量与父片段，返回删除的片段数"""
+    where, params = _catalog_where(project_id, source)
+    conn = _connect()
+    cursor = conn.cursor()
+    _delete_fulltext(cursor, where, params)
+    cursor.execute(f"DELETE FROM chunk_catalog{where}", params)
+    deleted = cursor.rowcount
+    cursor.execute(f"DELETE FROM document_centroids{where}", params)
+    cursor.execute(f"DELETE FROM parent_chunks{where}", params)
+    conn.commit()
+    _close(conn)
+    _bump_catalog_versions([project_id])
+    return deleted
+
+
+# ==================== Full-text Index ====================
+# SQLite FTS5 / PostgreSQL tsvector。文本在写入前已由 src.rag.keyword_index 分词，
+# 查询以“短语”列表传入：短语内词语须相邻，短语之间为或关系。
+
+_FULLTEXT_TOKEN = re.compile(r"\w+")
+
+
+def _fulltext_available(cursor) -> bool:
+    if _USE_POSTGRES:
+        return True
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunk_fts'")
+    return cursor.fetchone() is not None
+
+
+def _delete_fulltext(cursor, where: str, params: tuple):
+    """删除 chunk_catalog 中匹配行对应的全文索引（须在删除目录行之前调用）"""
+    if not _fulltext_available(cursor):
+        return
+    if _USE_POSTGRES:
+        cursor.execute(f"DELETE FROM chunk_fts WHERE chunk_id IN (SELECT chunk_id FROM chunk_catalog{where})", params)
+    else:
+        cursor.execute(f"DELETE FROM chunk_fts WHERE rowid IN (SELECT id FROM chunk_catalog{where})", params)
+
+
+def _fulltext_query(phrases: List[List[str]]) -> str:
+    """短语列表 -> 后端查询语法；只保留单词字符，避免注入查询运算符"""
+    cleaned = [
+        [t for t in phrase if _FULLTEXT_TOKEN.fullmatch(t)]
+        for phrase in phrases
+    ]
+    cleaned = [p for p in cleaned if p]
+    if _USE_POSTGRES:
+        return " | ".join("(" + " <-> ".join(p) + ")" for p in cleaned)
+    return " OR ".join('"' + " ".join(p) + '"' for p in cleaned)
+
+
+def search_fulltext(
+    project_id: Optional[str],
+    phrases: List[List[str]],
+    field: str = "content",
+    limit: int = 50,
+) -> List[Tuple[str, float]]:
+    """
+    全文检索片段
+
+    Args:
+        phrases: 已分词的查询短语
+        field: content（正文）| source（文件名）
+
+    Returns:
+        [(chunk_id, score), ...]，score 越大越相关
+    """
+    if field not in ("content", "source"):
+        raise ValueError(f"未知的全文检索字段: {field}")
+    query = _fulltext_query(phrases)
+    if not query:
+        return []
+
+    where, params = _catalog_where(project_id)
+    conn = _connect()
+    cursor = conn.cursor()
+    if not _fulltext_available(cursor):
+        _close(conn)
+        return []
+    if _USE_POSTGRES:
+        project_clause = where.replace(" WHERE ", " AND ").replace("project_id", "c.project_id")
+        cursor.execute(
+            f"SELECT c.chunk_id, ts_rank_cd(f.{field}_tsv, q) AS score "
+            f"FROM chunk_fts f JOIN chunk_catalog c ON c.chunk_id = f.chunk_id, "
+            f"to_tsquery('simple', %s) q "
+            f"WHERE f.{field}_tsv @@ q{project_clause} ORDER BY score DESC LIMIT {int(limit)}",
+            (query,) + params
+        )
+    else:
+        project_clause = where.replace(" WHERE ", " AND ").replace("project_id", "c.project_id")
+        # bm25() 越小越相关，取负数
+        cursor.execute(
+            f"SELECT c.chunk_id, -bm25(chunk_fts) AS score "
+            f"FROM chunk_fts JOIN chunk_catalog c ON c.id = chunk_fts.rowid "
+            f"WHERE chunk_fts MATCH ?{project_clause} ORDER BY score DESC LIMIT {int(limit)}",
+            (f"{field} : ({query})",) + params
+        )
+    rows = cursor.fetchall()
+    _close(conn)
+    return [(chunk_id, float(score)) for chunk_id, score in rows]
+
+
+def count_fulltext_records(project_id: Optional[str] = None) -> int:
+    """已建全文索引的片段数"""
+    where, params = _catalog_where(project_id)
+    where = where.replace("project_id", "c.project_id")
+    conn = _connect()
+    cursor = conn.cursor()
+    if not _fulltext_available(cursor):
+        _close(conn)
+        return 0
+    join = "c.chunk_id = f.chunk_id" if _USE_POSTGRES else "c.id = f.rowid"
+    cursor.execute(f"SELECT COUNT(*) FROM chunk_fts f JOIN chunk_catalog c ON {join}{where}", params)
+    (count,) = cursor.fetchone()
+    _close(conn)
+    return count or 0
+
+
+# ==================== Project Centroids ====================
+
+def save_project_centroid(project_id: str, embedding_key: str, vector: List[float], chunk_count: int,
+                          signature: Optional[str] = None):
+    """保存知识库质心向量（JSON 存储）；signature 为计算时的内容签名"""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"INSERT INTO project_centroids (project_id, embedding_key, vector, chunk_count, signature, updated_at) "
+        f"VALUES ({_placeholder(6)}) ON CONFLICT (project_id) DO UPDATE SET "
+        f"embedding_key = EXCLUDED.embedding_key, vector = EXCLUDED.vector, "
+        f"chunk_count = EXCLUDED.chunk_count, signature = EXCLUDED.signature, updated_at = EXCLUDED.updated_at",
+        (project_id, embedding_key, json.dumps(vector), chunk_count, signature, _now())
+    )
+    conn.commit()
+    _close(conn)
+
+
+def get_project_centroids(project_ids: List[str]) -> Dict[str, Dict[str, object]]:
+    """
+    读取知识库质心
+
+    Returns:
+        {project_id: {"embedding_key", "vector", "chunk_count", "signature"}}
+    """
+    if not project_ids:
+        return {}
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT project_id, embedding_key, vector, chunk_count, signature FROM project_centroids "
+        f"WHERE project_id IN ({_placeholder(len(project_ids))})",
+        tuple(project_ids)
+    )
+    rows = cursor.fetchall()
+    _close(conn)
+    return {
+        project_id: {"embedding_key": key, "vector": json.loads(vector), "chunk_count": count, "signature": signature}
+        for project_id, key, vector, count, signature in rows
+    }
+
+
+# ==================== Document Centroids ====================
+
+def save_document_centroids(project_id: str, embedding_key: str,
+                            rows: List[Tuple[str, List[float], int]]):
+    """批量保存文档级向量 [(source, vector, chunk_count), ...]（已存在时覆盖）"""
+    if not rows:
+        return
+    now = _now()
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.executemany(
+        f"INSERT INTO document_centroids (project_id, source, embedding_key, vector, chunk_count, updated_at) "
+        f"VALUES ({_placeholder(6)}) ON CONFLICT (project_id, source) DO UPDATE SET "
+        f"embedding_key = EXCLUDED.embedding_key, vector = EXCLUDED.vector, "
+        f"chunk_count = EXCLUDED.chunk_count, updated_at = EXCLUDED.updated_at",
+        [(project_id, source, embedding_key, json.dumps(vector), count, now) for source, vector, count in rows]
+    )
+    conn.commit()
+    _close(conn)
+    _bump_catalog_versions([project_id])
+
+
+def get_document_centroids(project_id: str) -> List[Tuple[str, str, List[float], int]]:
+    """读取知识库全部文档级向量 [(source, embedding_key, vector, chunk_count), ...]"""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT source, embedding_key, vector, chunk_count FROM document_centroids "
+        f"WHERE project_id = {_ph()} ORDER BY source",
+        (project_id,)
+    )
+    rows = cursor.fetchall()
+    _close(conn)
+    return [(source, key, json.loads(vector), count) for source, key, vector, count in rows]
+
+
+def delete_document_centroids(project_id: str, sources: Optional[List[str]] = None) -> int:
+    """删除文档级向量（sources 为空时删除整个知识库的）"""
+    where, params = _catalog_where(project_id)
+    if sources is not None:
+        if not sources:
+            return 0
+        where += f" AND source IN ({_placeholder(len(sources))})"
+        params += tuple(sources)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM document_centroids{where}", params)
+    deleted = cursor.rowcount
+    conn.commit()
+    _close(conn)
+    _bump_catalog_versions([project_id])
+    return deleted
+
+
+def document_index_signature(project_id: str) -> Tuple[int, int, Optional[str]]:
+    """(来源文件数, 已建文档级向量的文件数, 最近更新时间)：判断进程内缓存的文档索引是否过期、是否需要回填"""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(DISTINCT source) FROM chunk_catalog WHERE project_id = {_ph()}", (project_id,))
+    (sources,) = cursor.fetchone()
+    cursor.execute(
+        f"SELECT COUNT(*), MAX(updated_at) FROM document_centroids WHERE project_id = {_ph()}",
+        (project_id,)
+    )
+    indexed, updated_at = cursor.fetchone()
+    _close(conn)
+    return sources or 0, indexed or 0, updated_at
+
+
+# ==================== Parent Chunks ====================
+
+PARENT_CHUNK_COLUMNS = ("parent_id", "project_id", "source", "ordinal", "content", "token_count")
+
+
+def add_parent_chunks(records: List[Dict[str, object]]):
+    """批量写入父片段（parent_id 已存在时覆盖）"""
+    if not records:
+        return
+    now = _now()
+    columns = ", ".join(PARENT_CHUNK_COLUMNS + ("created_at",))
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in PARENT_CHUNK_COLUMNS[1:])
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.executemany(
+        f"INSERT INTO parent_chunks ({columns}) VALUES ({_placeholder(len(PARENT_CHUNK_COLUMNS) + 1)}) "
+        f"ON CONFLICT (parent_id) DO UPDATE SET {updates}",
+        [tuple(r.get(c) for c in PARENT_CHUNK_COLUMNS) + (now,) for r in records]
+    )
+    conn.commit()
+    _close(conn)
+
+
+def get_parent_chunks(parent_ids: List[str]) -> Dict[str, Dict]:
+    """按 parent_id 批量读取父片段 {parent_id: {列: 值}}"""
+    if not parent_ids:
+        return {}
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {', '.join(PARENT_CHUNK_COLUMNS)} FROM parent_chunks "
+        f"WHERE parent_id IN ({_placeholder(len(parent_ids))})",
+        tuple(parent_ids)
+    )
+    rows = cursor.fetchall()
+    _close(conn)
+    return {row[0]: dict(zip(PARENT_CHUNK_COLUMNS, row)) for row in rows}
+
+
+def prune_parent_chunks(project_id: str, source: str, keep_ids: List[str]) -> int:
+    """删除文件中不在 keep_ids 里的旧父片段（文件重新入库后），返回删除数"""
+    where, params = _catalog_where(project_id, source)
+    if keep_ids:
+        where += f" AND parent_id NOT IN ({_placeholder(len(keep_ids))})"
+        params += tuple(keep_ids)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM parent_chunks{where}", params)
+    deleted = cursor.rowcount
+    conn.commit()
+    _close(conn)
+    return deleted
+
+
+# ==================== Ingest Jobs ====================
+
+INGEST_JOB_COLUMNS = (
+    "id", "project_id", "status", "total_files", "done_files",
+    "total_chunks", "error", "created_at", "updated_at",
+)
+INGEST_JOB_FILE_COLUMNS = (
+    "id", "job_id", "filename", "staged_path", "status", "stage",
+    "chunks_total", "chunks_done", "error", "updated_at",
+)
+
+
+def create_ingest_job(job_id: str, project_id: str, files: List[Tuple[str, str]]):
+    """
+    创建入库任务及其文件记录
+
+    Args:
+        files: [(原始文件名, 暂存路径), ...]
+    """
+    now = _now()
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"INSERT INTO ingest_jobs (id, project_id, status, total_files, done_files, total_chunks, created_at, updated_at) "
+        f"VALUES ({_placeholder(8)})",
+        (job_id, project_id, "queued", len(files), 0, 0, now, now)
+    )
+    for filename, staged_path in files:
+        cursor.execute(
+            f"INSERT INTO ingest_job_files (job_id, filename, staged_path, status, stage, chunks_total, chunks_done, updated_at) "
+            f"VALUES ({_placeholder(8)})",
+            (job_id, filename, staged_path, "pending", "", 0, 0, now)
+        )
+    conn.commit()
+    _close(conn)
+
+
+def get_ingest_job(job_id: str) -> Optional[Dict[str, object]]:
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {', '.join(INGEST_JOB_COLUMNS)} FROM ingest_jobs WHERE id = {_ph()}",
+        (job_id,)
+    )
+    row = cursor.fetchone()
+    _close(conn)
+    return dict(zip(INGEST_JOB_COLUMNS, row)) if row else None
+
+
+def list_ingest_jobs(project_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, object]]:
+    conn = _connect()
+    cursor = conn.cursor()
+    if project_id:
+        cursor.execute(
+            f"SELECT {', '.join(INGEST_JOB_COLUMNS)} FROM ingest_jobs WHERE project_id = {_ph()} "
+            f"ORDER BY created_at DESC LIMIT {int(limit)}",
+            (project_id,)
+        )
+    else:
+        cursor.execute(
+            f"SELECT {', '.join(INGEST_JOB_COLUMNS)} FROM ingest_jobs ORDER BY created_at DESC LIMIT {int(limit)}"
+        )
+    rows = cursor.fetchall()
+    _close(conn)
+    return [dict(zip(INGEST_JOB_COLUMNS, row)) for row in rows]
+
+
+def list_ingest_job_files(job_id: str) -> List[Dict[str, object]]:
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {', '.join(INGEST_JOB_FILE_COLUMNS)} FROM ingest_job_files WHERE job_id = {_ph()} ORDER BY id",
+        (job_id,)
+    )
+    rows = cursor.fetchall()
+    _close(conn)
+    return [dict(zip(INGEST_JOB_FILE_COLUMNS, row)) for row in rows]
+
+
+def list_unfinished_ingest_jobs(updated_before: str) -> List[Dict[str, object]]:
+    """列出在 updated_before 之前就不再更新的排队/运行中/取消中任务（进程退出后遗留的任务）"""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {', '.join(INGEST_JOB_COLUMNS)} FROM ingest_jobs "
+        f"WHERE status IN ('queued', 'running', 'cancelling') AND updated_at < {_ph()} ORDER BY created_at",
+        (updated_before,)
+    )
+    rows = cursor.fetchall()
+    _close(conn)
+    return [dict(zip(INGEST_JOB_COLUMNS, row)) for row in rows]
+
+
+def claim_ingest_job(job_id: str, expected_updated_at: str) -> bool:
+    """
+    原子地领取任务：只有 updated_at 未被其他进程改动时才成功
+    多个 worker 进程同时恢复遗留任务时，保证只有一个进程执行
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"UPDATE ingest_jobs SET status = 'running', updated_at = {_ph()} "
+        f"WHERE id = {_ph()} AND status IN ('queued', 'running') AND updated_at = {_ph()}",
+        (_now(), job_id, expected_updated_at)
+    )
+    claimed = cursor.rowcount == 1
+    conn.commit()
+    _close(conn)
+    return claimed
+
+
+def update_ingest_job(job_id: str, **fields):
+    """更新任务字段（status / done_files / total_chunks / error），同时刷新 updated_at"""
+    allowed = {"status", "done_files", "total_chunks", "error"}
+    unknown = set(fields) - allowed
+    if unknown:
+        raise ValueError(f"未知的任务字段: {unknown}")
+
+    fields["updated_at"] = _now()
+    assignments = ", ".join(f"{k} = {_ph()}" for k in fields)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"UPDATE ingest_jobs SET {assignments} WHERE id = {_ph()}",
+        (*fields.values(), job_id)
+    )
+    conn.commit()
+    _close(conn)
+
+
+def update_ingest_job_file(file_id: int, **fields):
+    """更新任务文件字段（status / stage / chunks_total / chunks_done / error）"""
+    allowed = {"status", "stage", "chunks_total", "chunks_done", "error"}
+    unknown = set(fields) - allowed
+    if unknown:
+        raise ValueError(f"未知的任务文件字段: {unknown}")
+
+    fields["updated_at"] = _now()
+    assignments = ", ".join(f"{k} = {_ph()}" for k in fields)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"UPDATE ingest_job_files SET {assignments} WHERE id = {_ph()}",
+        (*fields.values(), file_id)
+    )
+    conn.commit()
+    _close(conn)
+
+
 # ==================== Project Stats ====================
 
 def get_project_stats(project_id: str) -> Dict[str, object]:
@@ -477,12 +1481,19 @@ def get_project_stats(project_id: str) -> Dict[str, object]:
     )
     file_count, latest_file_time = cursor.fetchone()
 
+    cursor.execute(
+        f"SELECT COUNT(*) FROM chunk_catalog WHERE project_id = {_ph()}",
+        (project_id,)
+    )
+    (chunk_count,) = cursor.fetchone()
+
     _close(conn)
 
     return {
         "session_count": session_count or 0,
         "message_count": message_count or 0,
         "file_count": file_count or 0,
+        "chunk_count": chunk_count or 0,
         "latest_session_time": latest_session_time,
         "latest_file_time": latest_file_time,
     }
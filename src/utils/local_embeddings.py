@@ -0,0 +1,211 @@
+# src/utils/local_embeddings.py
+"""
+本地 CPU Embedding - ONNX Runtime
+在进程内运行小型句向量模型（bge-small、MiniLM 等 ONNX 导出），不走网络 API：
+- 并发调用方的请求经 MicroBatcher 合并为一次推理
+- 批内按长度排序再分块，减少 padding 计算
+- intra-op 线程数可控，避免与 API worker / 入库线程争抢 CPU
+- 启动时预热，首个请求不承担模型加载与图优化的开销
+
+模型目录需包含 tokenizer.json 与 model.onnx（或 onnx/model.onnx）。
+LOCAL_EMBEDDING_DIR/<模型ID> 存在时直接加载，否则通过 huggingface_hub 下载。
+"""
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config.settings import settings
+from src.utils.batching import MicroBatcher
+from src.utils.logger import setup_logger
+
+logger = setup_logger("LocalEmbeddings")
+
+_ONNX_CANDIDATES = ("model.onnx", "onnx/model.onnx")
+
+
+def resolve_model_files(local: Path, repo_name: str, onnx_candidates) -> Tuple[Path, Path]:
+    """
+    定位 (tokenizer.json, ONNX 模型)：本地目录存在时直接使用，否则从 Hugging Face 下载
+    onnx_candidates 按优先顺序尝试
+    """
+    if local.exists():
+        onnx_path = next((local / c for c in onnx_candidates if (local / c).exists()), None)
+        if onnx_path is None or not (local / "tokenizer.json").exists():
+            raise FileNotFoundError(f"本地模型目录缺少 tokenizer.json 或 ONNX 模型: {local}")
+        return local / "tokenizer.json", onnx_path
+
+    try:
+        from huggingface_hub import hf_hub_download
+    except ImportError:
+        raise ImportError(f"本地模型 {local} 不存在，且未安装 huggingface_hub 无法下载")
+
+    logger.info(f"⬇️ 下载本地模型: {repo_name}")
+    tokenizer_path = hf_hub_download(repo_name, "tokenizer.json")
+    last_error = None
+    for candidate in onnx_candidates:
+        try:
+            return Path(tokenizer_path), Path(hf_hub_download(repo_name, candidate))
+        except Exception as e:
+            last_error = e
+    raise FileNotFoundError(f"{repo_name} 中没有 ONNX 模型文件: {last_error}")
+
+
+def load_tokenizer(path: Path):
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        raise ImportError("本地模型需要安装 tokenizers: pip install tokenizers")
+    return Tokenizer.from_file(str(path))
+
+
+def create_session(onnx_path: Path, threads: int = 0):
+    """CPU 推理会话：开启全部图优化，threads > 0 时限制 intra-op 线程数"""
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        raise ImportError("本地模型需要安装 onnxruntime: pip install onnxruntime")
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    return ort.InferenceSession(str(onnx_path), options, providers=["CPUExecutionProvider"])
+
+
+class LocalOnnxEmbeddings(Embeddings):
+    """ONNX Runtime 句向量模型（LangChain Embeddings 接口）"""
+
+    def __init__(
+        self,
+        model_id: str,
+        model_name: str,
+        dimension: int,
+        pooling: str = "cls",
+        query_instruction: str = "",
+        normalize: bool = True,
+        model_dir: Optional[Path] = None,
+        threads: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        max_length: Optional[int] = None,
+    ):
+        """
+        Args:
+            model_id: 注册表中的模型ID（本地目录名）
+            model_name: Hugging Face 仓库名（本地目录不存在时下载）
+            dimension: 输出维度
+            pooling: cls | mean
+            query_instruction: 查询前缀（bge 系列检索用指令），文档不加
+        """
+        if pooling not in ("cls", "mean"):
+            raise ValueError(f"未知的池化方式: {pooling}")
+        self.model_id = model_id
+        self.model_name = model_name
+        self.dimension = dimension
+        self.pooling = pooling
+        self.query_instruction = query_instruction
+        self.normalize = normalize
+        self.model_dir = Path(model_dir or settings.LOCAL_EMBEDDING_DIR)
+        self.threads = settings.LOCAL_EMBEDDING_THREADS if threads is None else threads
+        self.batch_size = batch_size or settings.LOCAL_EMBEDDING_BATCH_SIZE
+        self.max_length = max_length or settings.LOCAL_EMBEDDING_MAX_LENGTH
+
+        self._session = None
+        self._tokenizer = None
+        self._input_names: set = set()
+        self._load_lock = threading.Lock()
+        self._batcher = MicroBatcher(
+            self._encode,
+            max_batch_size=self.batch_size,
+            max_wait_ms=settings.LOCAL_EMBEDDING_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms,
+            name=f"embed-{model_id}",
+        )
+
+    # ==================== 加载 ====================
+
+    def _resolve_files(self):
+        """返回 (tokenizer.json, model.onnx) 路径"""
+        return resolve_model_files(self.model_dir / self.model_id, self.model_name, _ONNX_CANDIDATES)
+
+    def _ensure_loaded(self):
+        if self._session is not None:
+            return
+        with self._load_lock:
+            if self._session is not None:
+                return
+            start = time.perf_counter()
+            tokenizer_path, onnx_path = self._resolve_files()
+            tokenizer = load_tokenizer(tokenizer_path)
+            tokenizer.enable_truncation(self.max_length)
+            if tokenizer.padding is None:
+                pad_id = tokenizer.token_to_id("[PAD]")
+                tokenizer.enable_padding(pad_id=pad_id or 0, pad_token="[PAD]" if pad_id is not None else "<pad>")
+            session = create_session(onnx_path, self.threads)
+
+            self._input_names = {i.name for i in session.get_inputs()}
+            self._tokenizer = tokenizer
+            self._session = session
+            logger.info(
+                f"✅ 本地 Embedding 模型已加载: {self.model_id} "
+                f"(线程: {self.threads or 'auto'}, {time.perf_counter() - start:.1f}s)"
+            )
+
+    def warmup(self):
+        """加载模型并跑一次满批推理（触发图优化与内存分配）"""
+        start = time.perf_counter()
+        self._ensure_loaded()
+        self._encode(["预热 warmup"] * min(self.batch_size, 8))
+        logger.info(f"🔥 本地 Embedding 预热完成: {self.model_id} ({(time.perf_counter() - start) * 1000:.0f}ms)")
+
+    # ==================== 推理 ====================
+
+    def _run(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        feeds = {name: value for name, value in feeds.items() if name in self._input_names}
+
+        hidden = self._session.run(None, feeds)[0]
+        if hidden.ndim == 2:            # 模型已经输出句向量
+            return hidden.astype(np.float32)
+        if self.pooling == "cls":
+            return hidden[:, 0].astype(np.float32)
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        """MicroBatcher 回调：按长度排序分块推理，再还原顺序"""
+        self._ensure_loaded()
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            vectors[rows] = self._run([texts[i] for i in rows])
+        if self.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.maximum(norms, 1e-12)
+        return vectors.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._batcher(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._batcher([self.query_instruction + text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量嵌入查询（与 embed_query 一样加查询前缀）"""
+        return self._batcher([self.query_instruction + text for text in texts])
+
+    def get_stats(self) -> dict:
+        return {"model": self.model_id, "threads": self.threads or "auto", **self._batcher.get_stats()}
+
+    def close(self):
+        self._batcher.close()
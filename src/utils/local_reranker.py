@@ -0,0 +1,161 @@
+# src/utils/local_reranker.py
+"""
+本地 CPU 重排序 - ONNX Runtime 量化 Cross-Encoder
+在没有 GPU 的节点上运行 bge-reranker 的 int8 量化 ONNX 导出：
+- 查询保留完整，只截断候选文本（按 token 数，不按字符）
+- 候选对按 token 长度排序后分批，每批只 padding 到批内最长，短文本不陪长文本计算
+- intra-op 线程数可控
+
+模型目录（LOCAL_EMBEDDING_DIR/<模型ID>）需包含 tokenizer.json 与 ONNX 模型，
+优先使用 model_quantized.onnx；只有 float32 模型且开启 RERANK_ONNX_QUANTIZE 时，
+首次加载动态量化为 int8 并保存到模型目录。
+"""
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config.settings import settings
+from src.utils.local_embeddings import create_session, load_tokenizer, resolve_model_files
+from src.utils.logger import setup_logger
+
+logger = setup_logger("LocalReranker")
+
+_QUANTIZED_CANDIDATES = ("onnx/model_quantized.onnx", "model_quantized.onnx")
+_FLOAT_CANDIDATES = ("onnx/model.onnx", "model.onnx")
+
+
+def quantize_model(src: Path, dst: Path) -> Path:
+    """float32 ONNX 模型动态量化为 int8（权重量化，激活在推理时量化）"""
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError:
+        raise ImportError("量化需要安装 onnx: pip install onnx")
+
+    start = time.perf_counter()
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    quantize_dynamic(str(src), str(dst), weight_type=QuantType.QInt8)
+    logger.info(f"🗜️ 重排序模型已量化为 int8: {dst} ({time.perf_counter() - start:.1f}s)")
+    return dst
+
+
+class OnnxCrossEncoder:
+    """ONNX Runtime Cross-Encoder，predict 接口与 sentence-transformers CrossEncoder 一致"""
+
+    def __init__(
+        self,
+        model_id: str,
+        model_name: str,
+        model_dir: Optional[Path] = None,
+        threads: Optional[int] = None,
+        max_length: Optional[int] = None,
+        quantize: Optional[bool] = None,
+    ):
+        """
+        Args:
+            model_id: 本地目录名
+            model_name: Hugging Face 仓库名（本地目录不存在时下载）
+            max_length: 查询 + 候选的最大 token 数
+            quantize: 只有 float32 模型时是否量化为 int8
+        """
+        self.model_id = model_id
+        self.model_name = model_name
+        self.model_dir = Path(model_dir or settings.LOCAL_EMBEDDING_DIR)
+        self.threads = settings.RERANK_ONNX_THREADS if threads is None else threads
+        self.max_length = max_length or settings.RERANK_MAX_LENGTH
+        self.quantize = settings.RERANK_ONNX_QUANTIZE if quantize is None else quantize
+        self.quantized = False
+
+        self._session = None
+        self._tokenizer = None
+        self._pad_id = 0
+        self._input_names: set = set()
+        self._load_lock = threading.Lock()
+
+    # ==================== 加载 ====================
+
+    def _resolve_files(self) -> Tuple[Path, Path]:
+        local = self.model_dir / self.model_id
+        try:
+            tokenizer_path, onnx_path = resolve_model_files(local, self.model_name, _QUANTIZED_CANDIDATES)
+            self.quantized = True
+            return tokenizer_path, onnx_path
+        except FileNotFoundError:
+            pass
+
+        tokenizer_path, onnx_path = resolve_model_files(local, self.model_name, _FLOAT_CANDIDATES)
+        if self.quantize:
+            try:
+                onnx_path = quantize_model(onnx_path, local / "model_quantized.onnx")
+                self.quantized = True
+            except Exception as e:
+                logger.warning(f"⚠️ 量化失败，使用 float32 模型: {e}")
+        return tokenizer_path, onnx_path
+
+    def _ensure_loaded(self):
+        if self._session is not None:
+            return
+        with self._load_lock:
+            if self._session is not None:
+                return
+            start = time.perf_counter()
+            tokenizer_path, onnx_path = self._resolve_files()
+            tokenizer = load_tokenizer(tokenizer_path)
+            # 只截断候选文本；padding 在分批时按批内最长补齐
+            tokenizer.enable_truncation(self.max_length, strategy="only_second")
+            tokenizer.no_padding()
+            for token in ("<pad>", "[PAD]"):
+                if tokenizer.token_to_id(token) is not None:
+                    self._pad_id = tokenizer.token_to_id(token)
+                    break
+            session = create_session(onnx_path, self.threads)
+
+            self._input_names = {i.name for i in session.get_inputs()}
+            self._tokenizer = tokenizer
+            self._session = session
+            logger.info(
+                f"✅ 重排序模型已加载: {self.model_id} ({'int8' if self.quantized else 'float32'}, "
+                f"线程: {self.threads or 'auto'}, {time.perf_counter() - start:.1f}s)"
+            )
+
+    def warmup(self):
+        self._ensure_loaded()
+        self.predict([("预热 warmup", "预热 warmup")])
+
+    # ==================== 推理 ====================
+
+    def _run(self, encodings) -> np.ndarray:
+        width = max(len(e.ids) for e in encodings)
+        input_ids = np.full((len(encodings), width), self._pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        token_type_ids = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            n = len(encoding.ids)
+            input_ids[row, :n] = encoding.ids
+            attention_mask[row, :n] = 1
+            token_type_ids[row, :n] = encoding.type_ids
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": token_type_ids}
+        feeds = {name: value for name, value in feeds.items() if name in self._input_names}
+        logits = self._session.run(None, feeds)[0]
+        return logits.reshape(len(encodings), -1)[:, 0]
+
+    def predict(self, pairs: Sequence[Tuple[str, str]], batch_size: int = 16) -> List[float]:
+        """
+        为 (查询, 候选) 对打分（未归一化的 logit，越大越相关）
+
+        Returns:
+            与 pairs 一一对应的分数
+        """
+        if not pairs:
+            return []
+        self._ensure_loaded()
+        encodings = self._tokenizer.encode_batch([(query, text) for query, text in pairs])
+        order = np.argsort([len(e.ids) for e in encodings], kind="stable")
+        scores = np.empty(len(pairs), dtype=np.float32)
+        for start in range(0, len(pairs), batch_size):
+            rows = order[start:start + batch_size]
+            scores[rows] = self._run([encodings[i] for i in rows])
+        return scores.tolist()
@@ -27,6 +27,7 @@ class ModelProvider(Enum):
     ZHIPU = "zhipu"
     MOONSHOT = "moonshot"
     CUSTOM = "custom"
+    LOCAL = "local"          # 本地 CPU 推理（ONNX Runtime），不需要 API Key
 
 
 @dataclass
@@ -56,6 +57,13 @@ class EmbeddingModelConfig:
     api_key_env: str = "OPENAI_API_KEY"
     dimension: int = 1536            # 向量维度
     description: str = ""
+    supports_dimensions: bool = False  # 是否支持截断输出维度（Matryoshka，如 text-embedding-3）
+    pooling: str = "cls"             # 本地模型的池化方式：cls | mean
+    query_instruction: str = ""      # 本地模型的查询前缀（bge 检索指令）
+
+    @property
+    def requires_api_key(self) -> bool:
+        return self.provider != ModelProvider.LOCAL
 
 
 # ==================== 预定义模型列表 ====================
@@ -186,7 +194,8 @@ EMBEDDING_MODELS: Dict[str, EmbeddingModelConfig] = {
         model_name="text-embedding-3-small",
         provider=ModelProvider.OPENAI,
         dimension=1536,
-        description="OpenAI最新小维度Embedding，性价比高"
+        description="OpenAI最新小维度Embedding，性价比高",
+        supports_dimensions=True
     ),
     "text-embedding-3-large": EmbeddingModelConfig(
         id="text-embedding-3-large",
@@ -194,7 +203,8 @@ EMBEDDING_MODELS: Dict[str, EmbeddingModelConfig] = {
         model_name="text-embedding-3-large",
         provider=ModelProvider.OPENAI,
         dimension=3072,
-        description="OpenAI最新大维度Embedding，效果最好"
+        description="OpenAI最新大维度Embedding，效果最好",
+        supports_dimensions=True
     ),
     "text-embedding-ada-002": EmbeddingModelConfig(
         id="text-embedding-ada-002",
@@ -216,6 +226,29 @@ EMBEDDING_MODELS: Dict[str, EmbeddingModelConfig] = {
         dimension=1024,
         description="智谱AI Embedding模型"
     ),
+
+    # 本地 CPU Embedding（ONNX Runtime）
+    "bge-small-zh-v1.5": EmbeddingModelConfig(
+        id="bge-small-zh-v1.5",
+        name="BGE Small 中文 (本地)",
+        model_name="Xenova/bge-small-zh-v1.5",
+        provider=ModelProvider.LOCAL,
+        api_key_env="",
+        dimension=512,
+        description="本地CPU推理，中文检索，无网络延迟和API费用",
+        pooling="cls",
+        query_instruction="为这个句子生成表示以用于检索相关文章："
+    ),
+    "all-MiniLM-L6-v2": EmbeddingModelConfig(
+        id="all-MiniLM-L6-v2",
+        name="MiniLM L6 英文 (本地)",
+        model_name="Xenova/all-MiniLM-L6-v2",
+        provider=ModelProvider.LOCAL,
+        api_key_env="",
+        dimension=384,
+        description="本地CPU推理，英文轻量模型",
+        pooling="mean"
+    ),
 }
 
 
@@ -278,14 +311,13 @@ class ModelManager:
             return False
         
         config = EMBEDDING_MODELS[model_id]
-        api_key = os.getenv(config.api_key_env)
-        if not api_key:
+        if config.requires_api_key and not os.getenv(config.api_key_env):
             logger.error(f"缺少API Key: {config.api_key_env}")
             return False
         
         self._current_embedding_model = model_id
         # 清空Embedding缓存，因为切换了模型
-        self._embedding_cache.clear()
+        self._clear_embedding_cache()
         logger.info(f"切换Embedding模型: {config.name}")
         return True
     
@@ -351,24 +383,85 @@ class ModelManager:
         
         return self._chat_cache[cache_key]
     
-    def get_embedding_model(self, model_id: Optional[str] = None) -> Embeddings:
+    def resolve_embedding_dimensions(
+        self,
+        model_id: Optional[str] = None,
+        dimensions: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        校验并规范化输出维度：None / 0 / 等于模型全维度时返回 None（不截断）
+        
+        Raises:
+            ValueError: 模型不支持截断维度，或维度超出模型全维度
+        """
+        if not dimensions:
+            return None
+        target_model = model_id or self._current_embedding_model
+        config = EMBEDDING_MODELS.get(target_model)
+        if config is None:
+            return dimensions
+        if dimensions == config.dimension:
+            return None
+        if not config.supports_dimensions:
+            raise ValueError(f"Embedding模型 {config.name} 不支持自定义输出维度")
+        if not 0 < dimensions < config.dimension:
+            raise ValueError(f"输出维度 {dimensions} 超出范围 (1 ~ {config.dimension})")
+        return dimensions
+    
+    def get_embedding_dimension(
+        self,
+        model_id: Optional[str] = None,
+        dimensions: Optional[int] = None
+    ) -> Optional[int]:
+        """实际输出的向量维度（未知模型返回 None）"""
+        target_model = model_id or self._current_embedding_model
+        dimensions = self.resolve_embedding_dimensions(target_model, dimensions)
+        if dimensions:
+            return dimensions
+        config = EMBEDDING_MODELS.get(target_model)
+        return config.dimension if config else None
+    
+    def get_embedding_model(
+        self,
+        model_id: Optional[str] = None,
+        dimensions: Optional[int] = None
+    ) -> Embeddings:
         """
         获取Embedding模型实例
         
         Args:
             model_id: 模型ID，None则使用当前模型
+            dimensions: 截断后的输出维度（仅 supports_dimensions 的模型），None 为全维度
         """
         target_model = model_id or self._current_embedding_model
         config = EMBEDDING_MODELS.get(target_model)
+        dimensions = self.resolve_embedding_dimensions(target_model, dimensions)
         
         if not config:
             logger.warning(f"未找到Embedding模型配置 {target_model}，使用默认配置")
             return OpenAIEmbeddings(
                 model=target_model,
                 openai_api_key=settings.OPENAI_API_KEY,
-                openai_api_base=settings.OPENAI_BASE_URL
+                openai_api_base=settings.OPENAI_BASE_URL,
+                dimensions=dimensions
             )
         
+        # 不同维度是不同的向量空间，分别缓存
+        cache_key = f"{target_model}@{dimensions}" if dimensions else target_model
+        
+        if config.provider == ModelProvider.LOCAL:
+            if cache_key not in self._embedding_cache:
+                from src.utils.local_embeddings import LocalOnnxEmbeddings
+                self._embedding_cache[cache_key] = LocalOnnxEmbeddings(
+                    model_id=config.id,
+                    model_name=config.model_name,
+                    dimension=config.dimension,
+                    pooling=config.pooling,
+                    query_instruction=config.query_instruction,
+                )
+                logger.debug(f"创建本地Embedding模型实例: {config.name}")
+            return self._embedding_cache[cache_key]
+        
         # 获取API Key
         api_key = os.getenv(config.api_key_env)
         if not api_key:
@@ -377,16 +470,52 @@ class ModelManager:
         # 获取Base URL
         base_url = config.base_url or os.getenv("OPENAI_API_BASE")
         
-        if target_model not in self._embedding_cache:
-            self._embedding_cache[target_model] = OpenAIEmbeddings(
+        if cache_key not in self._embedding_cache:
+            self._embedding_cache[cache_key] = OpenAIEmbeddings(
                 model=config.model_name,
                 openai_api_key=api_key,
-                openai_api_base=base_url
+                openai_api_base=base_url,
+                dimensions=dimensions
             )
-            logger.debug(f"创建新的Embedding模型实例: {config.name}")
+            logger.debug(f"创建新的Embedding模型实例: {config.name} (维度: {dimensions or config.dimension})")
         
-        return self._embedding_cache[target_model]
+        return self._embedding_cache[cache_key]
     
+    def warmup_embedding_model(self) -> bool:
+        """
+        预热当前 Embedding 模型（仅本地模型需要：加载 ONNX 并跑一次推理）
+        
+        Returns:
+            是否执行了预热
+        """
+        config = EMBEDDING_MODELS.get(self._current_embedding_model)
+        if not config or config.provider != ModelProvider.LOCAL:
+            return False
+        try:
+            self.get_embedding_model().warmup()
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ 本地Embedding模型预热失败: {e}")
+            return False
+
+    def warmup_chat_connection(self) -> bool:
+        """
+        建立到当前对话模型接口的 HTTP 连接（请求模型列表，不发起生成）
+
+        ChatOpenAI 实例共用同一个连接池，服务端有响应（含 4xx）即视为连接已建立
+
+        Raises:
+            连接失败（网络不可达、超时等）时抛出
+        """
+        from openai import APIStatusError
+
+        llm = self.get_chat_model(temperature=0.1)
+        try:
+            llm.root_client.models.list()
+        except APIStatusError as e:
+            logger.debug(f"模型列表接口返回 {e.status_code}，连接已建立")
+        return True
+
     # ==================== 工具和状态 ====================
     
     def get_model_status(self) -> Dict:
@@ -428,6 +557,8 @@ class ModelManager:
         # 检查Embedding模型
         if model_id in EMBEDDING_MODELS:
             config = EMBEDDING_MODELS[model_id]
+            if not config.requires_api_key:
+                return True, "本地模型"
             api_key = os.getenv(config.api_key_env)
             if api_key:
                 return True, "可用"
@@ -517,9 +648,15 @@ class ModelManager:
     def clear_cache(self):
         """清空模型缓存"""
         self._chat_cache.clear()
-        self._embedding_cache.clear()
+        self._clear_embedding_cache()
         logger.info("模型缓存已清空")
 
+    def _clear_embedding_cache(self):
+        for embeddings in self._embedding_cache.values():
+            if hasattr(embeddings, "close"):    # 本地模型的批处理线程
+                embeddings.close()
+        self._embedding_cache.clear()
+
 
 # 全局单例
 model_manager = ModelManager()
\ No newline at end of file
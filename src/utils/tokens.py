@@ -0,0 +1,54 @@
+# src/utils/tokens.py
+"""
+Token 计数
+优先使用 tiktoken（与 OpenAI 模型一致）；编码文件不可用（离线部署）时退回到估算：
+中日韩字符按 1 token/字，其余按空白分词后 4/3 token/词。
+"""
+import re
+import threading
+from typing import Optional
+
+from config.settings import settings
+from src.utils.logger import setup_logger
+
+logger = setup_logger("Tokens")
+
+_CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+
+_encoder = None
+_encoder_failed = False
+_encoder_lock = threading.Lock()
+
+
+def _get_encoder():
+    global _encoder, _encoder_failed
+    if _encoder is not None or _encoder_failed:
+        return _encoder
+    with _encoder_lock:
+        if _encoder is None and not _encoder_failed:
+            try:
+                import tiktoken
+                _encoder = tiktoken.get_encoding(settings.TOKEN_ENCODING)
+            except Exception as e:
+                _encoder_failed = True
+                logger.warning(f"⚠️ tiktoken 不可用，使用估算 token 数: {e}")
+    return _encoder
+
+
+def estimate_tokens(text: str) -> int:
+    """不依赖词表的 token 数估算"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    words = len(_CJK_PATTERN.sub(" ", text).split())
+    return cjk + (words * 4 + 2) // 3
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """文本的 token 数"""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is None:
+        return estimate_tokens(text)
+    return len(encoder.encode(text, disallowed_special=()))
@@ -142,8 +142,8 @@ class BenchmarkSuite:
         self.results = []
         
         for config in self.benchmarks:
-            result = self.run_benchmark(config, test_func)
-            self.results.append(result)
+            # run_benchmark 内部已把结果追加到 self.results
+            self.run_benchmark(config, test_func)
         
         logger.info(f"✅ 基准测试套件完成: {len(self.results)} 个测试")
         
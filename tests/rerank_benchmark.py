@@ -0,0 +1,138 @@
+# tests/rerank_benchmark.py
+"""
+重排序微基准 - Rerank Micro-Benchmark
+按候选数统计各重排序后端的延迟（p50 / p95 / 每候选耗时），对比 PyTorch 与 int8 ONNX Cross-Encoder
+
+候选文本默认为合成的中英文混合段落（长度随机），也可用 --corpus 指定一个文本文件（每行一个候选）。
+分数缓存关闭、超时不限制，只测打分本身；每个后端先预热一次，模型加载不计入延迟。
+
+用法:
+    python tests/rerank_benchmark.py --backends bge bge-onnx --candidates 5 10 20 50
+    python tests/rerank_benchmark.py --backends bge-onnx --threads 2 --repeats 50 --output rerank.json
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from tests.benchmark import run_quick_benchmark
+from tests.retrieval_benchmark import _print_results
+from src.utils.logger import setup_logger
+
+logger = setup_logger("RERANK_BENCHMARK")
+
+_WORDS = (
+    "检索 增强 生成 向量 数据库 知识库 文档 片段 模型 推理 延迟 吞吐 "
+    "retrieval ranking latency vector index query passage model batch cpu"
+).split()
+
+
+def synthetic_passages(n: int, min_words: int = 40, max_words: int = 200, seed: int = 0) -> List[str]:
+    """长度随机的合成候选段落"""
+    rng = np.random.default_rng(seed)
+    return [
+        " ".join(rng.choice(_WORDS, size=int(rng.integers(min_words, max_words))))
+        for _ in range(n)
+    ]
+
+
+def load_passages(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _make_reranker(backend: str, batch_size: int):
+    from langchain_core.documents import Document
+    from src.rag.reranker import Reranker
+
+    reranker = Reranker(backend=backend, batch_size=batch_size, timeout=0, cache_size=0)
+    reranker.warmup()
+
+    def score(query: str, passages: List[str]) -> float:
+        docs = [(Document(page_content=p, metadata={"chunk_id": str(i)}), 0.0) for i, p in enumerate(passages)]
+        start = time.perf_counter()
+        reranker.rerank(query, docs, top_k=len(docs))
+        return (time.perf_counter() - start) * 1000
+
+    return score
+
+
+def benchmark_rerank(
+    backends: Tuple[str, ...],
+    passages: List[str],
+    query: str = "向量检索的延迟如何优化",
+    candidate_counts: Tuple[int, ...] = (5, 10, 20, 50),
+    repeats: int = 20,
+    batch_size: int = 16,
+) -> List:
+    """
+    每个 (后端, 候选数) 组合重复打分 repeats 次
+
+    Returns:
+        BenchmarkResult 列表（第一个后端、最少候选数为基线）
+    """
+    scorers = {backend: _make_reranker(backend, batch_size) for backend in backends}
+    rng = np.random.default_rng(1)
+
+    configs: Dict[str, Dict] = {}
+    for backend in backends:
+        for count in candidate_counts:
+            name = f"{backend}@{count}"
+            configs[name] = {"name": name, "backend": backend, "count": count}
+
+    def test_func(config: Dict) -> Dict[str, float]:
+        score = scorers[config["backend"]]
+        count = config["count"]
+        latencies = np.array([
+            score(query, list(rng.choice(passages, size=count, replace=count > len(passages))))
+            for _ in range(repeats)
+        ])
+        return {
+            "latency_p50_ms": float(np.percentile(latencies, 50)),
+            "latency_p95_ms": float(np.percentile(latencies, 95)),
+            "ms_per_candidate": float(latencies.mean() / count),
+        }
+
+    baseline = f"{backends[0]}@{candidate_counts[0]}"
+    results, _ = run_quick_benchmark(test_func, configs, baseline_name=baseline)
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="重排序微基准")
+    parser.add_argument("--backends", nargs="+", default=["bge", "bge-onnx"])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[5, 10, 20, 50])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--threads", type=int, help="bge-onnx 的 intra-op 线程数")
+    parser.add_argument("--corpus", help="候选文本文件（每行一个）")
+    parser.add_argument("--query", default="向量检索的延迟如何优化")
+    parser.add_argument("--output", help="结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    if args.threads is not None:
+        from config.settings import settings
+        settings.RERANK_ONNX_THREADS = args.threads
+
+    passages = load_passages(args.corpus) if args.corpus else synthetic_passages(max(args.candidates) * 4)
+    logger.info(f"📚 候选文本: {len(passages)} 条")
+
+    results = benchmark_rerank(
+        tuple(args.backends), passages, query=args.query,
+        candidate_counts=tuple(args.candidates), repeats=args.repeats, batch_size=args.batch_size,
+    )
+    _print_results(f"重排序延迟 (repeats={args.repeats}, batch={args.batch_size})", results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump([r.to_dict() for r in results], f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
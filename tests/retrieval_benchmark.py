@@ -0,0 +1,466 @@
+# tests/retrieval_benchmark.py
+"""
+向量检索基准测试 - Retrieval Benchmark
+对比近似检索与精确检索的召回率（recall@k）和延迟
+
+语料来源：
+- 指定 --project 时读取 NumPy 后端中该知识库的真实向量
+- 否则生成带簇结构的合成向量（模拟真实 Embedding 的分布）
+
+用法:
+    python tests/retrieval_benchmark.py ann --n 200000 --dim 256 --nprobe 4 8 16 32
+    python tests/retrieval_benchmark.py ann --project default
+    python tests/retrieval_benchmark.py quant --n 100000 --dim 1536 --pq-subspaces 96 192
+    python tests/retrieval_benchmark.py dims --n 50000 --dim 1536 --dims 256 512 1024 1536
+    python tests/retrieval_benchmark.py two_stage --n 200000 --docs 2000 --top-docs 5 10 20 50
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from tests.benchmark import run_quick_benchmark
+from src.utils.logger import setup_logger
+
+logger = setup_logger("RETRIEVAL_BENCHMARK")
+
+
+# ==================== 语料 ====================
+
+def synthetic_corpus(n: int, dim: int, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """生成归一化的高斯混合向量"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def matryoshka_corpus(n: int, dim: int, clusters: int = 200, decay: float = 0.5, seed: int = 0) -> np.ndarray:
+    """
+    生成方差随维度下标衰减的向量（模拟 Matryoshka 训练的 Embedding：信息集中在前面的维度）
+    第 i 维的尺度为 (i+1)^-decay
+    """
+    rng = np.random.default_rng(seed)
+    scale = (np.arange(1, dim + 1, dtype=np.float32) ** -decay)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = (centers[labels] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)) * scale
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def truncate_dims(vectors: np.ndarray, dims: int) -> np.ndarray:
+    """截断到前 dims 维并重新归一化（与 text-embedding-3 的 dimensions 参数等价）"""
+    head = np.ascontiguousarray(vectors[:, :dims])
+    norms = np.linalg.norm(head, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return head / norms
+
+
+def document_corpus(n: int, dim: int, docs: int = 1000, topics: int = 100, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    生成按文档分组的向量：文档围绕主题中心，片段围绕所属文档
+
+    Returns:
+        (归一化向量, 每行所属文档编号)
+    """
+    rng = np.random.default_rng(seed)
+    topic_centers = rng.normal(size=(topics, dim)).astype(np.float32)
+    doc_centers = topic_centers[rng.integers(0, topics, size=docs)] + 0.5 * rng.normal(size=(docs, dim)).astype(np.float32)
+    labels = rng.integers(0, docs, size=n)
+    vectors = doc_centers[labels] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True), labels
+
+
+def load_project_sources(project_id: str, size: int) -> np.ndarray:
+    """读取 NumPy 后端中某个知识库每行的来源文件，映射为文档编号"""
+    from config.settings import settings
+    from src.rag.stores.numpy_store import _project_dirname
+
+    rows_file = Path(settings.NUMPY_STORE_DIR) / _project_dirname(project_id) / "rows.jsonl"
+    sources = []
+    with open(rows_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                sources.append(json.loads(line)["metadata"].get("source", "unknown"))
+    _, labels = np.unique(sources[:size], return_inverse=True)
+    return labels
+
+
+def load_project_vectors(project_id: str) -> np.ndarray:
+    """读取 NumPy 后端中某个知识库的全部向量（已归一化）"""
+    from config.settings import settings
+    from src.rag.stores.numpy_store import _project_dirname
+
+    path = Path(settings.NUMPY_STORE_DIR) / _project_dirname(project_id)
+    rows_file = path / "rows.jsonl"
+    if not rows_file.exists():
+        raise FileNotFoundError(f"知识库 {project_id} 没有 NumPy 向量数据: {path}")
+    with open(rows_file, "r", encoding="utf-8") as f:
+        size = sum(1 for line in f if line.strip())
+    vectors = np.load(path / "vectors.npy", mmap_mode="r")[:size]
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def make_queries(vectors: np.ndarray, n_queries: int, noise: float = 0.1, seed: int = 1) -> np.ndarray:
+    """从语料中抽样并加噪声作为查询（模拟与文档相近但不相同的问题）"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    queries = vectors[rows] + noise * rng.normal(size=(len(rows), vectors.shape[1])).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_topk(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """精确 top-k 行号（作为召回率的真值）"""
+    sims = queries @ vectors.T
+    top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+# ==================== 度量 ====================
+
+def measure(
+    search_fn: Callable[[np.ndarray, int], np.ndarray],
+    queries: np.ndarray,
+    truth: np.ndarray,
+    k: int,
+) -> Dict[str, float]:
+    """逐条查询，统计 recall@k 与延迟分位数"""
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        rows = search_fn(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(rows[:k].tolist()) & set(expected.tolist()))
+
+    latencies = np.array(latencies)
+    return {
+        f"recall@{k}": hits / (len(queries) * k),
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p95_ms": float(np.percentile(latencies, 95)),
+        "qps": float(len(queries) / (latencies.sum() / 1000)),
+    }
+
+
+def _exact_search(vectors: np.ndarray) -> Callable[[np.ndarray, int], np.ndarray]:
+    def search(query: np.ndarray, k: int) -> np.ndarray:
+        sims = vectors @ query
+        top = np.argpartition(-sims, k - 1)[:k]
+        return top[np.argsort(-sims[top])]
+    return search
+
+
+def _print_results(title: str, results):
+    print("\n" + "=" * 60)
+    print(title)
+    print("=" * 60)
+    for result in results:
+        metrics = ", ".join(
+            f"{name}={value:.4f}" if isinstance(value, float) else f"{name}={value}"
+            for name, value in result.metrics.items()
+        )
+        print(f"{result.config.name:<24} {metrics}")
+
+
+# ==================== ANN（IVF） ====================
+
+def benchmark_ann(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    nlist: int = 0,
+    nprobes: Tuple[int, ...] = (4, 8, 16, 32),
+) -> List:
+    """
+    IVF 与精确检索对比
+
+    Returns:
+        BenchmarkResult 列表（第一项为精确检索基线）
+    """
+    from src.rag.stores.ivf_index import IVFIndex, auto_nlist
+
+    truth = exact_topk(vectors, queries, k)
+    nlist = nlist or auto_nlist(len(vectors))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = IVFIndex(Path(tmp))
+        start = time.perf_counter()
+        index.train(vectors, nlist=nlist, sample_size=100000)
+        build_seconds = time.perf_counter() - start
+
+        def ivf_search(nprobe: int) -> Callable[[np.ndarray, int], np.ndarray]:
+            def search(query: np.ndarray, k: int) -> np.ndarray:
+                rows = index.probe(query, nprobe)
+                sims = vectors[rows] @ query
+                kk = min(k, len(rows))
+                top = np.argpartition(-sims, kk - 1)[:kk]
+                return rows[top[np.argsort(-sims[top])]]
+            return search
+
+        searches = {"exact": _exact_search(vectors)}
+        configs: Dict[str, Dict] = {"exact": {"method": "exact"}}
+        for nprobe in nprobes:
+            name = f"ivf_nlist{nlist}_nprobe{nprobe}"
+            searches[name] = ivf_search(nprobe)
+            configs[name] = {"method": "ivf", "nlist": nlist, "nprobe": nprobe, "name": name}
+
+        def test_func(config: Dict) -> Dict[str, float]:
+            metrics = measure(searches[config.get("name", "exact")], queries, truth, k)
+            if config["method"] == "ivf":
+                metrics["build_seconds"] = build_seconds
+            return metrics
+
+        results, _ = run_quick_benchmark(test_func, configs, baseline_name="exact")
+    return results
+
+
+# ==================== 量化（SQ8 / PQ） ====================
+
+def benchmark_quantization(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    pq_subspaces: Tuple[int, ...] = (0,),
+    rescore_factor: int = 10,
+) -> List:
+    """
+    量化检索与 float32 精确检索对比：每种量化分别测试纯 ADC 与 ADC + float 重打分
+
+    Returns:
+        BenchmarkResult 列表（第一项为 float32 基线）
+    """
+    from src.rag.stores.quantization import create_quantizer
+
+    truth = exact_topk(vectors, queries, k)
+    n, dim = vectors.shape
+
+    quantizers = {"sq8": create_quantizer("sq8")}
+    for m in pq_subspaces:
+        pq = create_quantizer("pq", m)
+        quantizers[f"pq{m or 'auto'}"] = pq
+
+    build_seconds = {}
+    for name, quantizer in quantizers.items():
+        start = time.perf_counter()
+        quantizer.build(vectors, sample_size=65536)
+        build_seconds[name] = time.perf_counter() - start
+
+    def quant_search(quantizer, factor: int) -> Callable[[np.ndarray, int], np.ndarray]:
+        def search(query: np.ndarray, k: int) -> np.ndarray:
+            approx = quantizer.scores(query)
+            if factor <= 0:
+                top = np.argpartition(-approx, k - 1)[:k]
+                return top[np.argsort(-approx[top])]
+            shortlist = np.sort(np.argpartition(-approx, k * factor - 1)[:k * factor])
+            sims = vectors[shortlist] @ query
+            top = np.argpartition(-sims, k - 1)[:k]
+            return shortlist[top[np.argsort(-sims[top])]]
+        return search
+
+    searches = {"float32": _exact_search(vectors)}
+    configs: Dict[str, Dict] = {"float32": {"name": "float32", "bytes_per_vector": dim * 4}}
+    for name, quantizer in quantizers.items():
+        for factor in (0, rescore_factor):
+            label = f"{name}_adc" if factor == 0 else f"{name}_rescore{factor}"
+            searches[label] = quant_search(quantizer, factor)
+            configs[label] = {
+                "name": label,
+                "quantizer": name,
+                "bytes_per_vector": quantizer.bytes_per_vector,
+            }
+
+    def test_func(config: Dict) -> Dict[str, float]:
+        metrics = measure(searches[config["name"]], queries, truth, k)
+        metrics["bytes_per_vector"] = config["bytes_per_vector"]
+        metrics["resident_mb"] = config["bytes_per_vector"] * n / 1024 / 1024
+        if "quantizer" in config:
+            metrics["build_seconds"] = build_seconds[config["quantizer"]]
+        return metrics
+
+    results, _ = run_quick_benchmark(test_func, configs, baseline_name="float32")
+    return results
+
+
+# ==================== Matryoshka 截断维度 ====================
+
+def benchmark_dimensions(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    dims: Tuple[int, ...] = (256, 512, 1024, 1536),
+) -> List:
+    """
+    截断维度检索与全维度精确检索对比：召回率以全维度 top-k 为真值
+
+    Returns:
+        BenchmarkResult 列表（第一项为全维度基线）
+    """
+    n, full_dim = vectors.shape
+    truth = exact_topk(vectors, queries, k)
+    dims = tuple(d for d in dims if 0 < d <= full_dim)
+
+    searches = {}
+    truncated_queries = {}
+    configs: Dict[str, Dict] = {}
+    for d in sorted(set(dims) | {full_dim}, reverse=True):
+        name = f"dim{d}"
+        corpus = vectors if d == full_dim else truncate_dims(vectors, d)
+        searches[name] = _exact_search(corpus)
+        truncated_queries[name] = queries if d == full_dim else truncate_dims(queries, d)
+        configs[name] = {"name": name, "dims": d}
+
+    def test_func(config: Dict) -> Dict[str, float]:
+        name = config["name"]
+        metrics = measure(searches[name], truncated_queries[name], truth, k)
+        metrics["bytes_per_vector"] = config["dims"] * 4
+        metrics["resident_mb"] = config["dims"] * 4 * n / 1024 / 1024
+        return metrics
+
+    results, _ = run_quick_benchmark(test_func, configs, baseline_name=f"dim{full_dim}")
+    return results
+
+
+# ==================== 两阶段检索（文档级粗排） ====================
+
+def benchmark_two_stage(
+    vectors: np.ndarray,
+    labels: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    top_docs: Tuple[int, ...] = (5, 10, 20, 50),
+) -> List:
+    """
+    两阶段检索与全库精确检索对比：先按文档级向量选出 top_docs 个文档，再在其片段中精确检索
+
+    Returns:
+        BenchmarkResult 列表（第一项为全库检索基线）
+    """
+    from src.rag.doc_index import DocumentIndex, document_centroids
+
+    truth = exact_topk(vectors, queries, k)
+    start = time.perf_counter()
+    centroids = document_centroids(vectors, labels.tolist())
+    index = DocumentIndex(list(centroids), np.stack([vector for vector, _ in centroids.values()]))
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(labels.max() + 2))
+    doc_rows = {doc: order[bounds[doc]:bounds[doc + 1]] for doc in centroids}
+    build_seconds = time.perf_counter() - start
+
+    def two_stage_search(n_docs: int) -> Callable[[np.ndarray, int], np.ndarray]:
+        def search(query: np.ndarray, k: int) -> np.ndarray:
+            docs = index.top_sources(query, n_docs)
+            rows = np.concatenate([doc_rows[doc] for doc, _ in docs])
+            sims = vectors[rows] @ query
+            kk = min(k, len(rows))
+            top = np.argpartition(-sims, kk - 1)[:kk]
+            return rows[top[np.argsort(-sims[top])]]
+        return search
+
+    searches = {"flat": _exact_search(vectors)}
+    configs: Dict[str, Dict] = {"flat": {"name": "flat"}}
+    for n_docs in top_docs:
+        if n_docs >= len(index):
+            continue
+        name = f"two_stage_top{n_docs}"
+        searches[name] = two_stage_search(n_docs)
+        configs[name] = {"name": name, "top_docs": n_docs}
+
+    def test_func(config: Dict) -> Dict[str, float]:
+        metrics = measure(searches[config["name"]], queries, truth, k)
+        if "top_docs" in config:
+            metrics["build_seconds"] = build_seconds
+        return metrics
+
+    results, _ = run_quick_benchmark(test_func, configs, baseline_name="flat")
+    return results
+
+
+# ==================== CLI ====================
+
+def _load_corpus(args) -> np.ndarray:
+    if args.project:
+        vectors = load_project_vectors(args.project)
+        logger.info(f"📚 读取知识库 {args.project}: {vectors.shape}")
+    elif args.command == "dims":
+        vectors = matryoshka_corpus(args.n, args.dim)
+        logger.info(f"🎲 合成语料（维度方差衰减）: {vectors.shape}")
+    else:
+        vectors = synthetic_corpus(args.n, args.dim)
+        logger.info(f"🎲 合成语料: {vectors.shape}")
+    return vectors
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="向量检索基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(p):
+        p.add_argument("--project", help="使用 NumPy 后端中该知识库的真实向量")
+        p.add_argument("--n", type=int, default=100000, help="合成语料行数")
+        p.add_argument("--dim", type=int, default=256, help="合成语料维度")
+        p.add_argument("--queries", type=int, default=200, help="查询数")
+        p.add_argument("--k", type=int, default=10)
+        p.add_argument("--output", help="结果写入 JSON 文件")
+
+    ann = sub.add_parser("ann", help="IVF 近似检索 vs 精确检索")
+    add_common(ann)
+    ann.add_argument("--nlist", type=int, default=0, help="簇数，0 为自动")
+    ann.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+
+    quant = sub.add_parser("quant", help="SQ8 / PQ 量化 vs float32")
+    add_common(quant)
+    quant.add_argument("--pq-subspaces", type=int, nargs="+", default=[0], help="PQ 段数，0 为自动")
+    quant.add_argument("--rescore-factor", type=int, default=10)
+
+    dims = sub.add_parser("dims", help="Matryoshka 截断维度 vs 全维度")
+    add_common(dims)
+    dims.add_argument("--dims", type=int, nargs="+", default=[256, 512, 1024, 1536])
+
+    two_stage = sub.add_parser("two_stage", help="文档级粗排 + 片段检索 vs 全库检索")
+    add_common(two_stage)
+    two_stage.add_argument("--docs", type=int, default=1000, help="合成语料文档数")
+    two_stage.add_argument("--top-docs", type=int, nargs="+", default=[5, 10, 20, 50])
+
+    args = parser.parse_args(argv)
+    if args.command == "two_stage" and not args.project:
+        vectors, labels = document_corpus(args.n, args.dim, docs=args.docs)
+        logger.info(f"🎲 合成语料（{args.docs} 个文档）: {vectors.shape}")
+    else:
+        vectors = _load_corpus(args)
+        if args.command == "two_stage":
+            labels = load_project_sources(args.project, len(vectors))
+    queries = make_queries(vectors, args.queries)
+
+    if args.command == "ann":
+        results = benchmark_ann(vectors, queries, k=args.k, nlist=args.nlist, nprobes=tuple(args.nprobe))
+        _print_results(f"IVF vs 精确检索 (n={len(vectors)}, k={args.k})", results)
+    elif args.command == "quant":
+        results = benchmark_quantization(
+            vectors, queries, k=args.k,
+            pq_subspaces=tuple(args.pq_subspaces), rescore_factor=args.rescore_factor,
+        )
+        _print_results(f"量化 vs float32 (n={len(vectors)}, dim={vectors.shape[1]}, k={args.k})", results)
+    elif args.command == "dims":
+        results = benchmark_dimensions(vectors, queries, k=args.k, dims=tuple(args.dims))
+        _print_results(f"截断维度 vs 全维度 (n={len(vectors)}, k={args.k})", results)
+    elif args.command == "two_stage":
+        results = benchmark_two_stage(vectors, labels, queries, k=args.k, top_docs=tuple(args.top_docs))
+        _print_results(f"两阶段 vs 全库检索 (n={len(vectors)}, 文档={labels.max() + 1}, k={args.k})", results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump([r.to_dict() for r in results], f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# tests/test_api.py
+"""
+HTTP API 测试 — 用假的 Service 替换依赖，不需要 API Key
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from unittest.mock import MagicMock
+
+from fastapi.testclient import TestClient
+
+
+def _parse_sse(text: str):
+    """把 SSE 文本解析为 [(event, data), ...]"""
+    import json
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.fixture
+def services():
+    from src.service.chat_service import AgentEvent
+    from src.service.kb_service import KnowledgeBase
+    from src.service.document_service import IngestResult
+
+    kb_service = MagicMock()
+    kb_service.get_all_kbs.return_value = [KnowledgeBase(id="default", name="默认知识库")]
+    kb_service.get_or_create_session.return_value = "sid-1"
+
+    chat_service = MagicMock()
+    chat_service.chat.return_value = (True, "回答", [AgentEvent.from_stream_event("writer")])
+    chat_service.stream_agent_response.return_value = iter([
+        ("event", AgentEvent.from_stream_event("researcher")),
+        ("token", "回"),
+        ("token", "答"),
+        ("response", "回答"),
+    ])
+
+    doc_service = MagicMock()
+    doc_service.filter_supported_files.side_effect = lambda files: (files, [])
+    doc_service.process_and_ingest.side_effect = lambda files, pid: IngestResult(
+        success=True,
+        message="ok",
+        total_chunks=1,
+        file_details=[{"filename": f.name, "content": f.getvalue().decode()} for f in files],
+    )
+    return kb_service, chat_service, doc_service
+
+
+@pytest.fixture
+def client(services):
+    from src.api.app import create_app, get_kb_service, get_chat_service, get_doc_service
+
+    kb_service, chat_service, doc_service = services
+    app = create_app()
+    app.dependency_overrides[get_kb_service] = lambda: kb_service
+    app.dependency_overrides[get_chat_service] = lambda: chat_service
+    app.dependency_overrides[get_doc_service] = lambda: doc_service
+    with TestClient(app) as c:
+        yield c
+
+
+class TestApi:
+
+    def test_list_kbs(self, client):
+        resp = client.get("/kbs")
+        assert resp.status_code == 200
+        assert resp.json() == [{"id": "default", "name": "默认知识库"}]
+
+    def test_chat_saves_history(self, client, services):
+        _, chat_service, _ = services
+        resp = client.post("/chat", json={"prompt": "你好", "project_id": "default"})
+        assert resp.status_code == 200
+        body = resp.json()
+        assert body["session_id"] == "sid-1"
+        assert body["content"] == "回答"
+        chat_service.save_user_message.assert_called_once_with("sid-1", "你好")
+        chat_service.save_assistant_message.assert_called_once_with("sid-1", "回答")
+
+    def test_chat_stream_sse(self, client):
+        resp = client.post("/chat/stream", json={"prompt": "你好", "save_history": False})
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        events = _parse_sse(resp.text)
+        names = [e for e, _ in events]
+        assert names == ["session", "agent", "token", "token", "response", "done"]
+        assert events[4][1] == {"content": "回答"}
+
+    def test_upload_streams_to_disk(self, client):
+        resp = client.post(
+            "/kbs/default/documents",
+            files=[("files", ("a.txt", b"hello", "text/plain"))],
+        )
+        assert resp.status_code == 200
+        assert resp.json()["file_details"] == [{"filename": "a.txt", "content": "hello"}]
+
+    def test_background_upload_returns_job(self, client, services):
+        _, _, doc_service = services
+        doc_service.submit_ingest_job.return_value = "job-1"
+        resp = client.post(
+            "/kbs/default/documents?background=true",
+            files=[("files", ("a.txt", b"hello", "text/plain"))],
+        )
+        assert resp.status_code == 202
+        assert resp.json()["job_id"] == "job-1"
+        doc_service.process_and_ingest.assert_not_called()
+
+    def test_federated_search_defaults_to_all_kbs(self, client, services):
+        from langchain_core.documents import Document
+        from src.api.app import get_retriever
+        from src.rag.federated import FederatedSearchResult
+
+        retriever = MagicMock()
+        retriever.query_federated.return_value = FederatedSearchResult(
+            results=[(Document(page_content="片段", metadata={"project_id": "default", "source": "a.md"}), 0.03)],
+            searched=["default"],
+        )
+        client.app.dependency_overrides[get_retriever] = lambda: retriever
+        resp = client.post("/search/federated", json={"query": "问题", "top_k": 3})
+        assert resp.status_code == 200
+        body = resp.json()
+        assert body["results"][0]["project_id"] == "default"
+        assert body["searched"] == ["default"]
+        retriever.query_federated.assert_called_once_with("问题", ["default"], top_k=3, mode=None)
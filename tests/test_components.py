@@ -8,6 +8,7 @@ import tempfile
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import numpy as np
 import pytest
 from unittest.mock import MagicMock, patch
 
@@ -297,3 +298,1833 @@ class TestVectorStoreFactory:
         # 验证不配置 VECTOR_STORE_BACKEND 时默认是 "chroma"
         # 完整集成测试在 integration 模式下进行
         assert callable(get_vector_store)
+
+
+# ==================== 批量问答 ====================
+
+class TestBatchRetrieval:
+    """测试批量 Embedding 与批量 BM25"""
+
+    def test_embed_queries_single_call_and_cache(self):
+        """查询与文档不区分的远程模型：未命中的查询合并为一次 embed_documents 调用，重复查询走缓存"""
+        from langchain_openai import OpenAIEmbeddings
+        from src.rag.retriever import CachedEmbeddings
+        base = MagicMock(spec=OpenAIEmbeddings)
+        base.embed_documents.side_effect = lambda texts: [[float(len(t))] for t in texts]
+        cached = CachedEmbeddings(base)
+
+        vectors = cached.embed_queries(["a", "bb", "a"])
+        assert vectors == [[1.0], [2.0], [1.0]]
+        assert base.embed_documents.call_count == 1
+
+        cached.embed_queries(["bb"])
+        assert base.embed_documents.call_count == 1
+        assert cached.cache_hits == 1
+
+    def test_batch_query_vectors_match_single_query(self):
+        """有查询前缀的模型：批量与逐条查询向量一致，文档向量不占用查询缓存"""
+        from src.rag.retriever import CachedEmbeddings
+
+        class PrefixedEmbeddings:
+            def embed_query(self, text):
+                return [1.0, float(len(text))]
+
+            def embed_queries(self, texts):
+                return [self.embed_query(t) for t in texts]
+
+            def embed_documents(self, texts):
+                return [[0.0, float(len(t))] for t in texts]
+
+        cached = CachedEmbeddings(PrefixedEmbeddings())
+        assert cached.embed_documents(["ab"]) == [[0.0, 2.0]]
+        assert cached.embed_queries(["ab", "c"]) == [[1.0, 2.0], [1.0, 1.0]]
+        assert cached.embed_query("ab") == [1.0, 2.0]
+
+        fallback = CachedEmbeddings(MagicMock(spec=["embed_query", "embed_documents"]))
+        fallback.embeddings.embed_query.side_effect = lambda t: [float(len(t))]
+        assert fallback.embed_queries(["a", "bb"]) == [[1.0], [2.0]]
+        fallback.embeddings.embed_documents.assert_not_called()
+
+    def test_bm25_batch_matches_single_query(self):
+        """批量 BM25 结果与逐条检索一致"""
+        from langchain_core.documents import Document
+        from src.rag.hybrid_retriever import HybridRetriever
+        docs = [
+            Document(page_content="python code retrieval"),
+            Document(page_content="vector database index"),
+            Document(page_content="python vector search"),
+        ]
+        hybrid = HybridRetriever(vector_store=MagicMock(), documents=docs, project_id="p")
+        queries = ["python", "vector index", "unknown"]
+
+        batch = hybrid._bm25_search_batch(queries, top_k=2)
+        for query, results in zip(queries, batch):
+            single = hybrid._bm25_search(query, top_k=2)
+            assert [d.page_content for d, _ in results] == [d.page_content for d, _ in single]
+        assert batch[2] == []
+
+
+class TestBatchGeneration:
+    """测试 RAGGenerator 批量生成"""
+
+    def _make_generator(self, docs_batch, responses):
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from src.agent.prompts import get_rag_generator_prompt
+        from src.rag.generator import RAGGenerator
+
+        gen = RAGGenerator.__new__(RAGGenerator)
+        gen.retriever = MagicMock()
+        gen.retriever.query_batch.return_value = docs_batch
+        gen.enable_relevance_check = True
+        gen.enable_reranker = False
+        gen.reranker = None
+        gen.prompt_template = get_rag_generator_prompt()
+        llm = FakeListChatModel(responses=responses)
+        gen._get_llm = lambda: llm
+        return gen
+
+    def test_batch_returns_per_item_results_in_order(self):
+        from langchain_core.documents import Document
+        docs_batch = [
+            [(Document(page_content="内容A", metadata={"source": "a.md"}), 0.2)],
+            [],
+        ]
+        gen = self._make_generator(docs_batch, ["回答A"])
+
+        results = gen.get_answers_batch(["问题A", "问题B"], project_id="p", max_concurrency=2)
+
+        assert [r.index for r in results] == [0, 1]
+        assert results[0].answer == "回答A"
+        assert results[0].docs_count == 1
+        assert results[1].deny_reason == "no_results"
+        assert all(r.latency_ms >= 0 for r in results)
+        gen.retriever.query_batch.assert_called_once()
+
+
+# ==================== 后台入库任务 ====================
+
+class TestIngestJobService:
+    """测试后台入库任务（临时 SQLite + 假的解析/向量库）"""
+
+    def setup_method(self):
+        from pathlib import Path
+        from langchain_core.documents import Document
+
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.patches = [
+            patch("src.utils.db._USE_POSTGRES", False),
+            patch("src.utils.db.DB_PATH", self.tmp_dir / "jobs.db"),
+        ]
+        for p in self.patches:
+            p.start()
+        from src.utils.db import init_db
+        init_db()
+
+        # 每个文件按行切分为 chunk
+        self.processor = MagicMock()
+        self.processor.load_uploaded_files.side_effect = lambda files: [
+            Document(page_content=f.getvalue().decode(), metadata={"source": f.name}) for f in files
+        ]
+        self.processor.split_documents.side_effect = lambda docs, project_id=None: [
+            Document(page_content=line, metadata={**d.metadata, "chunk_id": f"{d.metadata['source']}#{i}"})
+            for d in docs for i, line in enumerate(d.page_content.splitlines())
+        ]
+        self.vector_db = MagicMock()
+        self.vector_db.add_chunk_batch.side_effect = lambda chunks, vectors, pid, start_ordinal=0: len(chunks)
+        self.embeddings = MagicMock()
+        self.embeddings.embed_documents.side_effect = lambda texts: [[0.0] for _ in texts]
+
+    def teardown_method(self):
+        for p in self.patches:
+            p.stop()
+
+    def _make_service(self):
+        from src.service.ingest_service import IngestJobService
+        return IngestJobService(
+            processor=self.processor,
+            vector_db=self.vector_db,
+            embeddings=self.embeddings,
+            max_workers=1,
+            batch_size=2,
+            staging_dir=self.tmp_dir / "staging",
+        )
+
+    def test_job_runs_in_batches_and_completes(self):
+        service = self._make_service()
+        upload = MagicMock()
+        upload.name = "a.txt"
+        upload.getvalue.return_value = "l1\nl2\nl3".encode()
+
+        job_id = service.submit([upload], "p")
+        service.shutdown(wait=True)
+
+        job = service.get_job(job_id)
+        assert job.status == "completed"
+        assert job.total_chunks == 3
+        assert job.progress == 1.0
+        assert job.files[0].stage == "done"
+        assert self.vector_db.add_chunk_batch.call_count == 2
+        self.vector_db.prune_source.assert_called_once_with("p", "a.txt", ["a.txt#0", "a.txt#1", "a.txt#2"], [])
+        self.vector_db.refresh_document_index.assert_called_once_with("p", ["a.txt"])
+        assert not (self.tmp_dir / "staging" / job_id).exists()
+
+    def test_resume_from_checkpoint_and_cancel_queued(self):
+        from src.utils.db import create_ingest_job, list_ingest_job_files, update_ingest_job_file
+        service = self._make_service()
+
+        staged = self.tmp_dir / "b.txt"
+        staged.write_text("l1\nl2\nl3\nl4")
+        create_ingest_job("job-resume", "p", [("b.txt", str(staged))])
+        file_id = list_ingest_job_files("job-resume")[0]["id"]
+        update_ingest_job_file(file_id, chunks_done=2)
+
+        service._run_job("job-resume")
+        written = [c.page_content for call in self.vector_db.add_chunk_batch.call_args_list for c in call.args[0]]
+        assert written == ["l3", "l4"]
+        assert service.get_job("job-resume").status == "completed"
+
+        create_ingest_job("job-cancel", "p", [("b.txt", str(staged))])
+        assert service.cancel("job-cancel")
+        service._run_job("job-cancel")
+        assert service.get_job("job-cancel").status == "cancelled"
+        assert not service.cancel("job-cancel")
+
+    def test_resume_finishes_stale_cancelling_job(self):
+        from src.utils.db import create_ingest_job
+        service = self._make_service()
+        staged = self.tmp_dir / "c.txt"
+        staged.write_text("l1")
+        create_ingest_job("job-stale", "p", [("c.txt", str(staged))])
+        assert service.cancel("job-stale")      # 进程在执行前退出，任务停留在取消中
+
+        with patch("src.service.ingest_service.settings") as mock_settings:
+            mock_settings.INGEST_STALE_SECONDS = -60
+            assert service.resume_unfinished() == 1
+        service.shutdown(wait=True)
+        assert service.get_job("job-stale").status == "cancelled"
+        self.vector_db.add_chunk_batch.assert_not_called()
+
+
+# ==================== 片段目录 ====================
+
+class TestChunkCatalog:
+    """测试片段目录（临时 SQLite）：文件列表、文件名搜索、计数"""
+
+    def setup_method(self):
+        from pathlib import Path
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.patches = [
+            patch("src.utils.db._USE_POSTGRES", False),
+            patch("src.utils.db.DB_PATH", self.tmp_dir / "catalog.db"),
+        ]
+        for p in self.patches:
+            p.start()
+        from src.utils.db import init_db
+        init_db()
+
+    def teardown_method(self):
+        for p in self.patches:
+            p.stop()
+
+    def _manager(self):
+        from src.rag.vectorstore import VectorDBManager
+        manager = VectorDBManager.__new__(VectorDBManager)
+        manager.store = MagicMock()
+        manager.store.add_embeddings.side_effect = lambda docs, vecs, pid, ids=None: len(docs)
+        return manager
+
+    def _chunks(self, source, n):
+        from langchain_core.documents import Document
+        return [Document(page_content=f"{source} 第{i}段", metadata={"source": source}) for i in range(n)]
+
+    def test_batches_recorded_with_ordinals(self):
+        from src.utils.db import count_chunk_records, list_catalog_files, search_chunk_records
+        manager = self._manager()
+        manager.add_chunk_batch(self._chunks("报告_2024.pdf", 2), [[0.0]] * 2, "p1")
+        manager.add_chunk_batch(self._chunks("报告_2024.pdf", 1), [[0.0]], "p1", start_ordinal=2)
+        manager.add_chunk_batch(self._chunks("notes.md", 1), [[0.0]], "p2")
+
+        assert count_chunk_records("p1") == 3
+        assert count_chunk_records() == 4
+        assert list_catalog_files("p1")[0][:3] == ("报告_2024.pdf", "pdf", 3)
+        assert len(list_catalog_files(None)) == 2
+
+        records = search_chunk_records("p1", pattern="报告_")
+        assert [r["ordinal"] for r in records] == [0, 1, 2]
+        ids = manager.store.add_embeddings.call_args_list[0].kwargs["ids"]
+        assert records[0]["chunk_id"] == ids[0]
+        # LIKE 通配符按字面匹配
+        assert search_chunk_records("p1", pattern="报告%") == []
+        assert len(search_chunk_records(None, file_types=["md"])) == 1
+
+    def test_reingest_overwrites_and_prunes(self):
+        from langchain_core.documents import Document
+        from src.utils.db import list_chunk_ids
+        manager = self._manager()
+        manager.store.delete_by_ids.return_value = True
+        old = [Document(page_content=t, metadata={"source": "a.md"}) for t in ("x", "y", "z")]
+        manager.add_chunk_batch(old, [[0.0]] * 3, "p1")
+        new = [Document(page_content=t, metadata={"source": "a.md"}) for t in ("x", "y2")]
+        manager.add_chunk_batch(new, [[0.0]] * 2, "p1")
+
+        assert new[0].metadata["chunk_id"] == old[0].metadata["chunk_id"]
+        assert manager.prune_source("p1", "a.md", [c.metadata["chunk_id"] for c in new]) == 2
+        assert sorted(list_chunk_ids("p1")) == sorted(c.metadata["chunk_id"] for c in new)
+        stale = set(manager.store.delete_by_ids.call_args.args[0])
+        assert stale == {old[1].metadata["chunk_id"], old[2].metadata["chunk_id"]}
+
+    def test_create_vector_db_prunes_reuploaded_file(self):
+        """同步入库路径重新上传同名文件时同样清理旧片段"""
+        from langchain_core.documents import Document
+        from src.utils.db import list_chunk_ids
+        manager = self._manager()
+        manager.store.delete_by_ids.return_value = True
+        old = [Document(page_content=t, metadata={"source": "b.md"}) for t in ("x", "y", "z")]
+        manager.create_vector_db(old, project_id="p1")
+        new = [Document(page_content=t, metadata={"source": "b.md"}) for t in ("x", "y2")]
+        manager.create_vector_db(new, project_id="p1")
+
+        assert sorted(list_chunk_ids("p1", "b.md")) == sorted(c.metadata["chunk_id"] for c in new)
+        stale = set(manager.store.delete_by_ids.call_args.args[0])
+        assert stale == {old[1].metadata["chunk_id"], old[2].metadata["chunk_id"]}
+
+    def test_backfill_from_store(self):
+        from src.utils.db import count_chunk_records
+        manager = self._manager()
+        manager.store.get.return_value = {
+            "ids": ["a", "b"],
+            "documents": ["x", "y"],
+            "metadatas": [{"source": "old.txt", "project_id": "legacy"}] * 2,
+        }
+        assert manager.ensure_catalog("legacy") == 2
+        assert manager.ensure_catalog("legacy") == 0
+        assert count_chunk_records("legacy", source="old.txt") == 2
+
+    def test_search_by_filename_fetches_only_matches(self):
+        from langchain_core.documents import Document
+        from src.agent.tools_dir.knowledge_base import search_by_filename
+        manager = self._manager()
+        manager.add_chunk_batch(self._chunks("a.py", 2), [[0.0]] * 2, "p1")
+        manager.add_chunk_batch(self._chunks("b.txt", 1), [[0.0]], "p1")
+        manager.store.get_by_ids.side_effect = lambda ids, project_id=None: [
+            Document(page_content=f"内容-{i}", metadata={"chunk_id": i}) for i in ids
+        ]
+
+        with patch("src.agent.tools_dir.knowledge_base.get_vector_db", return_value=manager):
+            result = search_by_filename.invoke({"filename": "a.py"}, config={"configurable": {"project_id": "p1"}})
+
+        fetched = manager.store.get_by_ids.call_args.args[0]
+        assert len(fetched) == 2
+        assert "找到 2 个" in result and "【来源: a.py】" in result
+
+
+class TestFullTextIndex:
+    """测试持久化全文索引（临时 SQLite FTS5）"""
+
+    def setup_method(self):
+        from pathlib import Path
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.patches = [
+            patch("src.utils.db._USE_POSTGRES", False),
+            patch("src.utils.db.DB_PATH", self.tmp_dir / "fts.db"),
+        ]
+        for p in self.patches:
+            p.start()
+        from src.utils.db import init_db
+        init_db()
+
+        from langchain_core.documents import Document
+        from src.rag.vectorstore import VectorDBManager
+        self.store = MagicMock()
+        self.store.add_embeddings.side_effect = lambda docs, vecs, pid, ids=None: len(docs)
+        self.store.get_by_ids.side_effect = lambda ids, project_id=None: [
+            Document(page_content=self.texts[i], metadata={"chunk_id": i}) for i in ids if i in self.texts
+        ]
+        self.manager = VectorDBManager(store=self.store)
+        chunks = [
+            Document(page_content="机器学习是人工智能的分支", metadata={"source": "ml_intro.md"}),
+            Document(page_content="深度学习使用神经网络", metadata={"source": "ml_intro.md"}),
+            Document(page_content="The quick brown fox", metadata={"source": "报告.txt"}),
+        ]
+        self.manager.add_chunk_batch(chunks, [[0.0]] * 3, "p1")
+        self.texts = {c.metadata["chunk_id"]: c.page_content for c in chunks}
+
+    def teardown_method(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_tokenize_and_phrases(self):
+        from src.rag.keyword_index import query_phrases, tokenize
+        assert tokenize("机器 Learning_rate2") == ["机", "器", "learning", "rate2"]
+        assert query_phrases("机器学习 Fox") == [["机", "器"], ["器", "学"], ["学", "习"], ["fox"]]
+
+    def test_search_chunks_ranked_and_scoped(self):
+        from src.rag.keyword_index import search_chunks
+        hits = search_chunks("机器学习", "p1")
+        assert self.texts[hits[0][0]] == "机器学习是人工智能的分支"
+        assert search_chunks("FOX", "p1") and not search_chunks("fox", "other")
+        assert search_chunks('" OR *', "p1") == []
+
+    def test_search_sources_and_delete(self):
+        from src.rag.keyword_index import search_chunks, search_sources
+        from src.utils.db import count_fulltext_records, delete_chunk_records
+        assert [r["ordinal"] for r in search_sources("ml_intro.md", "p1")] == [0, 1]
+        assert len(search_sources("报告", None)) == 1
+        assert search_sources("intro.md.bak", "p1") == []
+
+        assert delete_chunk_records("p1", source="ml_intro.md") == 2
+        assert count_fulltext_records("p1") == 1
+        assert search_chunks("学习", "p1") == []
+
+    def test_fulltext_join_survives_vacuum(self):
+        """全文索引按片段目录的显式整数主键对应，VACUUM 后不会错位"""
+        import sqlite3
+        from src.rag.keyword_index import search_chunks
+        from src.utils.db import DB_PATH, delete_chunk_records
+        delete_chunk_records("p1", source="ml_intro.md")
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("VACUUM")
+        conn.close()
+        hits = search_chunks("fox", "p1")
+        assert [self.texts[chunk_id] for chunk_id, _ in hits] == ["The quick brown fox"]
+
+    def test_legacy_catalog_migrated_to_integer_key(self):
+        import sqlite3
+        from src.rag.keyword_index import search_chunks
+        from src.utils.db import DB_PATH, init_db
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("DROP TABLE chunk_catalog")
+        conn.execute(
+            "CREATE TABLE chunk_catalog (chunk_id TEXT PRIMARY KEY, project_id TEXT NOT NULL, source TEXT NOT NULL, "
+            "file_type TEXT, ordinal INTEGER NOT NULL, content_hash TEXT, token_count INTEGER, created_at TEXT)"
+        )
+        conn.execute("CREATE INDEX idx_chunk_catalog_source ON chunk_catalog(project_id, source, ordinal)")
+        conn.execute("DELETE FROM chunk_fts")
+        conn.execute("INSERT INTO chunk_catalog VALUES ('old-1', 'p1', 'old.md', 'md', 0, NULL, 1, NULL)")
+        conn.execute("INSERT INTO chunk_fts (rowid, source, content) VALUES (1, 'old md', 'legacy')")
+        conn.commit()
+        conn.close()
+
+        init_db()
+        conn = sqlite3.connect(DB_PATH)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(chunk_catalog)")]
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(chunk_catalog)")}
+        conn.close()
+        assert columns[0] == "id" and "tokens" in columns
+        assert "idx_chunk_catalog_source" in indexes
+        assert [chunk_id for chunk_id, _ in search_chunks("legacy", "p1")] == ["old-1"]
+
+    def test_fulltext_ready_cached_until_catalog_changes(self):
+        from langchain_core.documents import Document
+        from src.utils.db import count_fulltext_records, delete_chunk_records
+        self.manager.ensure_catalog("p1")
+        self.manager.ensure_catalog("p2")
+        with patch("src.rag.vectorstore.count_fulltext_records", wraps=count_fulltext_records) as counted:
+            assert self.manager.fulltext_ready("p1")
+            assert self.manager.fulltext_ready("p1")
+            assert counted.call_count == 1
+
+            assert not self.manager.fulltext_ready("p2")
+            self.manager.add_chunk_batch([Document(page_content="新文件", metadata={"source": "n.md"})], [[0.0]], "p2")
+            assert self.manager.fulltext_ready("p2")
+
+            delete_chunk_records("p1")
+            assert not self.manager.fulltext_ready("p1")
+            assert counted.call_count == 4
+
+    def test_hybrid_retriever_uses_fulltext_leg(self):
+        from src.rag.hybrid_retriever import HybridRetriever
+        self.store.similarity_search_with_score.return_value = []
+        hybrid = HybridRetriever(self.store, documents=None, project_id="p1")
+        results = hybrid.retrieve("神经网络", top_k=2)
+        assert [doc.page_content for doc, _ in results] == ["深度学习使用神经网络"]
+        assert len(self.store.get_by_ids.call_args.args[0]) == 1
+
+    def test_token_streams_saved_and_reused_by_bm25(self):
+        from langchain_core.documents import Document
+        from src.rag.hybrid_retriever import HybridRetriever
+        from src.rag.text_tokenizer import get_tokenizer
+        from src.utils.db import get_token_streams
+
+        tokenizer = get_tokenizer()
+        streams = get_token_streams("p1", tokenizer.name)
+        assert len(streams) == 3 and get_token_streams("p1", "other") == {}
+
+        docs = [Document(page_content=text, metadata={"chunk_id": cid}) for cid, text in self.texts.items()]
+        with patch.object(tokenizer, "tokenize", wraps=tokenizer.tokenize) as tokenize:
+            hybrid = HybridRetriever(self.store, documents=docs, project_id="p1",
+                                     tokenizer=tokenizer, token_streams=streams)
+            assert tokenize.call_count == 0
+        results = hybrid._bm25_search("神经网络", top_k=1)
+        assert results[0][0].page_content == "深度学习使用神经网络"
+
+
+class TestTextTokenizer:
+    """测试可插拔分词器：中文切分、标识符拆分、查询缓存"""
+
+    def test_identifiers_and_cjk(self):
+        from src.rag.text_tokenizer import BigramTokenizer, CharTokenizer
+        bigram = BigramTokenizer(cache_size=8)
+        assert bigram.tokenize("机器学习 getUserName") == [
+            "机器", "器学", "学习", "getusername", "get", "user", "name",
+        ]
+        assert bigram.tokenize("max_batch_size 的") == ["max_batch_size", "max", "batch", "size", "的"]
+        assert CharTokenizer(cache_size=8).tokenize("学习 HTTPServer") == [
+            "学", "习", "httpserver", "http", "server",
+        ]
+
+    def test_query_tokenization_memoized(self):
+        from src.rag.text_tokenizer import BigramTokenizer
+        tokenizer = BigramTokenizer(cache_size=8)
+        first = tokenizer.tokenize_query("向量检索")
+        first.append("mutated")
+        assert tokenizer.tokenize_query("向量检索") == ["向量", "量检", "检索"]
+        assert tokenizer.cache_info().hits == 1
+
+    def test_registry_and_auto_fallback(self):
+        from src.rag import text_tokenizer
+        from src.rag.text_tokenizer import Tokenizer, get_tokenizer, register_tokenizer
+
+        class Upper(Tokenizer):
+            name = "upper"
+
+            def segment_cjk(self, run):
+                return [run]
+
+        register_tokenizer("upper", Upper)
+        assert get_tokenizer("upper").tokenize("机器学习 a") == ["机器学习", "a"]
+        with pytest.raises(ValueError):
+            get_tokenizer("missing")
+        with patch.dict("sys.modules", {"jieba": None}), patch.dict(text_tokenizer._instances, clear=True):
+            assert get_tokenizer("auto").name == "bigram"
+
+
+class TestConcurrentRetrievalLegs:
+    """测试混合检索各路并发执行与超时丢弃"""
+
+    def _hybrid(self, vector_delay=0.0, keyword_delay=0.0, **kwargs):
+        import time
+        from langchain_core.documents import Document
+        from src.rag.hybrid_retriever import HybridRetriever
+
+        def doc(text):
+            return Document(page_content=text, metadata={"chunk_id": text})
+
+        def vector(query, top_k, filter):
+            time.sleep(vector_delay)
+            return [(doc(f"v-{query}"), 0.1)]
+
+        def keyword(query, top_k):
+            time.sleep(keyword_delay)
+            return [(doc(f"k-{query}"), 1.0)]
+
+        store = MagicMock()
+        store.similarity_search_with_score.side_effect = vector
+        hybrid = HybridRetriever(store, documents=None, project_id="p", **kwargs)
+        hybrid._keyword_search = keyword
+        return hybrid
+
+    def test_legs_run_concurrently_with_variants(self):
+        import time
+        hybrid = self._hybrid(vector_delay=0.2, keyword_delay=0.2, leg_timeouts={"vector": 0, "keyword": 0})
+        with patch("src.rag.hybrid_retriever._record_leg") as record:
+            start = time.perf_counter()
+            results = hybrid.retrieve("q", top_k=10, variants=["q2"])
+            elapsed = time.perf_counter() - start
+        assert elapsed < 0.6                # 4 路串行至少 0.8s
+        assert {d.page_content for d, _ in results} == {"v-q", "k-q", "v-q2", "k-q2"}
+        assert sorted(call.args[1] for call in record.call_args_list) == [
+            "keyword", "keyword:1", "vector", "vector:1",
+        ]
+
+    def test_slow_leg_dropped_from_fusion(self):
+        hybrid = self._hybrid(keyword_delay=0.5, leg_timeouts={"vector": 1.0, "keyword": 0.05})
+        with patch("src.rag.hybrid_retriever._record_leg") as record:
+            results = hybrid.retrieve("q", top_k=5)
+        assert [d.page_content for d, _ in results] == ["v-q"]
+        assert hybrid.dropped_legs == 1
+        assert any(call.args[1:] == ("keyword", 50.0, "timeout") for call in record.call_args_list)
+
+    def test_queued_leg_clock_starts_when_leg_runs(self):
+        from concurrent.futures import ThreadPoolExecutor
+        hybrid = self._hybrid(vector_delay=0.1, keyword_delay=0.1, leg_timeouts={"vector": 0.15, "keyword": 0.15})
+        with patch("src.rag.hybrid_retriever._get_executor", return_value=ThreadPoolExecutor(1)), \
+                patch("src.rag.hybrid_retriever._record_leg"):
+            results = hybrid.retrieve("q", top_k=5)        # 单线程：关键词路排队 0.1s 后才开始
+        assert {d.page_content for d, _ in results} == {"v-q", "k-q"}
+        assert hybrid.dropped_legs == 0
+
+    def test_queue_wait_is_capped_when_pool_is_saturated(self):
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        hybrid = self._hybrid(leg_timeouts={"vector": 0.1, "keyword": 0.1})
+        pool = ThreadPoolExecutor(1)
+        release = threading.Event()
+        pool.submit(release.wait)                  # 之前超时未结束的路占满线程池
+        try:
+            with patch("src.rag.hybrid_retriever._get_executor", return_value=pool), \
+                    patch("src.rag.hybrid_retriever._record_leg"):
+                start = time.perf_counter()
+                results = hybrid.retrieve("q", top_k=5)
+                elapsed = time.perf_counter() - start
+        finally:
+            release.set()
+        assert results == []
+        assert hybrid.dropped_legs == 2
+        assert elapsed < 0.5
+
+    def test_batch_uses_batch_deadline_and_cancels_queued_legs(self):
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from langchain_core.documents import Document
+        from src.rag.hybrid_retriever import HybridRetriever
+
+        calls = []
+
+        def vector(embedding, top_k, filter):
+            calls.append(embedding[0])
+            time.sleep(0.02)
+            return [(Document(page_content=f"v{embedding[0]}", metadata={"chunk_id": f"v{embedding[0]}"}), 0.1)]
+
+        store = MagicMock()
+        store.similarity_search_by_vector_with_score.side_effect = vector
+        hybrid = HybridRetriever(store, documents=None, project_id="p", leg_timeouts={"vector": 0.01})
+        hybrid._fulltext_search_batch = lambda queries, top_k: [[] for _ in queries]
+        queries = [f"q{i}" for i in range(20)]
+        embeddings = [[float(i)] for i in range(20)]
+        with patch("src.rag.hybrid_retriever._get_executor", return_value=ThreadPoolExecutor(2)), \
+                patch("src.rag.hybrid_retriever._record_leg"):
+            with patch("src.rag.hybrid_retriever.settings.RETRIEVAL_BATCH_TIMEOUT", 0):
+                results = hybrid.retrieve_batch(queries, embeddings, top_k=1)
+            assert [r[0][0].page_content for r in results] == [f"v{float(i)}" for i in range(20)]
+
+            calls.clear()
+            with patch("src.rag.hybrid_retriever.settings.RETRIEVAL_BATCH_TIMEOUT", 0.05):
+                hybrid.retrieve_batch(queries, embeddings, top_k=1)
+            time.sleep(0.3)
+        assert len(calls) < 20               # 超过总时限仍在排队的路被取消，不再占用线程
+
+
+class TestFederatedSearch:
+    """测试多知识库联邦检索：质心路由、分数归一化、超时丢弃、质心过期重算"""
+
+    def _doc(self, text, project_id):
+        from langchain_core.documents import Document
+        return Document(page_content=text, metadata={"chunk_id": text, "project_id": project_id})
+
+    def test_routing_skips_irrelevant_and_empty_projects(self):
+        from src.rag.federated import route_projects
+        query = np.array([1.0, 0.0], dtype=np.float32)
+        centroids = {
+            "near": np.array([1.0, 0.0], dtype=np.float32),
+            "close": np.array([0.95, 0.312], dtype=np.float32),
+            "far": np.array([0.0, 1.0], dtype=np.float32),
+            "empty": None,
+        }
+        selected, skipped, scores = route_projects(
+            {p: query for p in centroids}, centroids, max_projects=5, margin=0.1, min_similarity=0.0,
+        )
+        assert selected == ["near", "close"]
+        assert skipped == {"far": "routing", "empty": "empty"}
+        assert scores["near"] == pytest.approx(1.0)
+
+    def test_normalize_scores_direction_independent(self):
+        from src.rag.federated import normalize_scores
+        distances = [(None, 0.2), (None, 0.4), (None, 0.6)]
+        similarities = [(None, 9.0), (None, 5.0), (None, 1.0)]
+        assert normalize_scores(distances) == pytest.approx([1.0, 0.5, 0.0])
+        assert normalize_scores(similarities) == pytest.approx([1.0, 0.5, 0.0])
+        assert normalize_scores([(None, 3.0)]) == [1.0]
+
+    def test_fan_out_fuses_and_drops_slow_project(self):
+        import time
+        from src.rag.federated import federated_search
+
+        def search(project_id):
+            if project_id == "slow":
+                time.sleep(0.5)
+            return [(self._doc(f"{project_id}-{i}", project_id), 0.1 * i) for i in range(3)]
+
+        vec = np.array([1.0, 0.0], dtype=np.float32)
+        centroids = {"a": vec, "b": np.array([0.99, 0.14], dtype=np.float32), "slow": vec}
+        result = federated_search(search, ["a", "b", "slow"], {p: vec for p in centroids}, centroids,
+                                  top_k=4, timeout=0.2)
+        assert sorted(result.searched) == ["a", "b"] and result.skipped == {"slow": "timeout"}
+        texts = [doc.page_content for doc, _ in result.results]
+        assert texts[:2] == ["a-0", "b-0"] and len(texts) == 4
+
+    def test_centroids_refreshed_in_background_when_content_changes(self):
+        from pathlib import Path
+        from src.rag import federated
+        tmp_dir = Path(tempfile.mkdtemp())
+        store = MagicMock()
+        store.get.return_value = {"embeddings": [[2.0, 0.0], [0.0, 2.0]]}
+        records = [{"chunk_id": f"c{i}", "project_id": "p", "source": "a.md", "file_type": "md",
+                    "ordinal": i, "content_hash": f"h{i}", "token_count": 1} for i in range(2)]
+        with patch("src.utils.db._USE_POSTGRES", False), patch("src.utils.db.DB_PATH", tmp_dir / "c.db"), \
+                patch("src.rag.federated.get_project_embedding_key", return_value="m@0"):
+            from src.utils.db import add_chunk_records, init_db, save_document_centroids
+            init_db()
+            federated._refreshing.clear()
+            assert federated.load_centroids(store, ["p"], {"p": "m@0"}) == {"p": None}     # 空知识库
+            assert federated.refresh_saved_centroid(store, "p") is None                   # 从未计算过，不重算
+            assert store.get.call_count == 0
+
+            add_chunk_records(records)
+            save_document_centroids("p", "m@0", [("a.md", [1.0, 0.0], 2)])
+            assert federated.load_centroids(store, ["p"], {"p": "m@0"}) == {}              # 尚无质心：不参与路由
+            federated._refreshing["p"].result()
+            first = federated.load_centroids(store, ["p"], {"p": "m@0"})
+            assert first["p"] == pytest.approx(np.array([0.7071, 0.7071]), abs=1e-3)
+            assert store.get.call_count == 1 and federated._refreshing["p"].done()
+
+            # 重新入库：片段数不变、内容变化；检索先用旧质心，后台重算
+            store.get.return_value = {"embeddings": [[1.0, 0.0], [1.0, 0.0]]}
+            save_document_centroids("p", "m@0", [("a.md", [1.0, 0.0], 2)])
+            stale = federated.load_centroids(store, ["p"], {"p": "m@0"})
+            assert stale["p"] == pytest.approx(first["p"])
+            federated._refreshing["p"].result()
+            assert federated.load_centroids(store, ["p"], {"p": "m@0"})["p"] == pytest.approx([1.0, 0.0])
+            assert store.get.call_count == 2
+
+            assert federated.load_centroids(store, ["p"], {"p": "other@0"}) == {}           # 模型变化
+            federated._refreshing["p"].result()
+
+    def test_projects_without_centroid_are_searched_unrouted(self):
+        from src.rag.federated import federated_search
+        vec = np.array([1.0, 0.0], dtype=np.float32)
+        centroids = {"a": vec, "far": np.array([-1.0, 0.0], dtype=np.float32)}
+        result = federated_search(
+            lambda pid: [(self._doc(f"{pid}-0", pid), 0.1)], ["a", "far", "new"],
+            {p: vec for p in ("a", "far", "new")}, centroids, top_k=3, timeout=0,
+        )
+        assert sorted(result.searched) == ["a", "new"] and result.skipped == {"far": "routing"}
+
+
+class TestDocumentIndex:
+    """测试两阶段检索：文档级向量构建、粗排过滤条件、进程内缓存与回填"""
+
+    def _record(self, chunk_id, source):
+        return {"chunk_id": chunk_id, "project_id": "p", "source": source, "file_type": "md",
+                "ordinal": 0, "content_hash": chunk_id, "token_count": 1}
+
+    def test_centroids_per_source_and_top_sources(self):
+        from src.rag.doc_index import DocumentIndex, document_centroids
+        centroids = document_centroids(
+            np.array([[2.0, 0.0], [1.0, 0.0], [0.0, 3.0]]), ["a.md", "a.md", "b.md"]
+        )
+        assert centroids["a.md"][1] == 2 and centroids["a.md"][0] == pytest.approx([1.0, 0.0])
+        index = DocumentIndex(list(centroids), np.stack([v for v, _ in centroids.values()]))
+        top = index.top_sources(np.array([0.1, 1.0]), 1)
+        assert [source for source, _ in top] == ["b.md"]
+
+    def test_backfill_cache_and_coarse_filter(self):
+        from pathlib import Path
+        from src.rag import doc_index
+        from src.rag.project_config import ProjectRetrievalConfig
+        tmp_dir = Path(tempfile.mkdtemp())
+        store = MagicMock()
+        store.get.return_value = {
+            "embeddings": [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0]],
+            "metadatas": [{"source": "a.md"}, {"source": "a.md"}, {"source": "b.md"}],
+        }
+        config = ProjectRetrievalConfig.defaults()
+        config.two_stage_top_docs, config.two_stage_min_chunks = 1, 0
+        with patch("src.utils.db._USE_POSTGRES", False), patch("src.utils.db.DB_PATH", tmp_dir / "d.db"), \
+                patch("src.rag.doc_index.get_project_embedding_key", return_value="m@0"), \
+                patch("src.rag.doc_index.get_project_retrieval_config", return_value=config):
+            from src.utils.db import add_chunk_records, init_db
+            init_db()
+            doc_index._indexes.pop("p", None)
+            add_chunk_records([self._record("c1", "a.md"), self._record("c2", "a.md"), self._record("c3", "b.md")])
+
+            index = doc_index.get_document_index(store, "p")
+            assert index.sources == ["a.md", "b.md"]
+            doc_index.get_document_index(store, "p")
+            assert store.get.call_count == 1           # 已回填并缓存
+
+            assert doc_index.coarse_filter(store, "p", [0.0, 1.0]) == {
+                "$and": [{"project_id": "p"}, {"source": {"$in": ["b.md"]}}]
+            }
+            config.two_stage_top_docs = 0
+            assert doc_index.coarse_filter(store, "p", [0.0, 1.0]) is None
+
+    def test_coarse_filter_counts_only_after_catalog_changes(self):
+        from pathlib import Path
+        from src.rag import doc_index
+        from src.rag.project_config import ProjectRetrievalConfig
+        tmp_dir = Path(tempfile.mkdtemp())
+        store = MagicMock()
+        store.get.return_value = {
+            "embeddings": [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]],
+            "metadatas": [{"source": "a.md"}, {"source": "b.md"}, {"source": "c.md"}],
+        }
+        config = ProjectRetrievalConfig.defaults()
+        config.two_stage_top_docs, config.two_stage_min_chunks = 1, 2
+        with patch("src.utils.db._USE_POSTGRES", False), patch("src.utils.db.DB_PATH", tmp_dir / "d.db"), \
+                patch("src.rag.doc_index.get_project_embedding_key", return_value="m@0"), \
+                patch("src.rag.doc_index.get_project_retrieval_config", return_value=config):
+            from src.utils.db import add_chunk_records, count_chunk_records, document_index_signature, init_db
+            init_db()
+            doc_index._indexes.pop("p", None)
+            add_chunk_records([self._record("c1", "a.md"), self._record("c2", "b.md")])
+            for _ in range(2):                                 # 首次检索回填文档级向量
+                doc_index.coarse_filter(store, "p", [0.0, 1.0])
+            with patch("src.rag.doc_index.count_chunk_records", wraps=count_chunk_records) as counted, \
+                    patch("src.rag.doc_index.document_index_signature", wraps=document_index_signature) as signed:
+                for _ in range(3):
+                    assert doc_index.coarse_filter(store, "p", [0.0, 1.0])["$and"][1] == {"source": {"$in": ["b.md"]}}
+                assert counted.call_count == 0 and signed.call_count == 0
+
+                add_chunk_records([self._record("c3", "c.md")])     # 入库后重新统计并回填新文件
+                assert doc_index.coarse_filter(store, "p", [0.7, 0.7])["$and"][1] == {"source": {"$in": ["c.md"]}}
+                assert counted.call_count == 1 and signed.call_count >= 1
+
+    def test_refresh_single_source_drops_missing_file(self):
+        from pathlib import Path
+        from src.rag.doc_index import refresh_document_index
+        from src.utils.db import get_document_centroids
+        tmp_dir = Path(tempfile.mkdtemp())
+        store = MagicMock()
+        store.get.return_value = {"embeddings": [[1.0, 0.0]], "metadatas": [{"source": "a.md"}]}
+        with patch("src.utils.db._USE_POSTGRES", False), patch("src.utils.db.DB_PATH", tmp_dir / "d.db"), \
+                patch("src.rag.doc_index.get_project_embedding_key", return_value="m@0"):
+            from src.utils.db import init_db, save_document_centroids
+            init_db()
+            save_document_centroids("p", "m@0", [("gone.md", [0.0, 1.0], 3)])
+            assert refresh_document_index(store, "p", ["a.md", "gone.md"]) == 1
+            where = store.get.call_args.kwargs["where"]
+            assert where["$and"][1] == {"source": {"$in": ["a.md", "gone.md"]}}
+            assert [row[0] for row in get_document_centroids("p")] == ["a.md"]
+
+
+class TestParentChildChunks:
+    """测试父子切分：子片段带父片段指针，检索后去重换回父片段"""
+
+    def _init_db(self):
+        from pathlib import Path
+        tmp_dir = Path(tempfile.mkdtemp())
+        return patch("src.utils.db._USE_POSTGRES", False), patch("src.utils.db.DB_PATH", tmp_dir / "pc.db")
+
+    def test_split_children_point_to_parents(self):
+        from langchain_core.documents import Document
+        from src.rag.etl import ContentProcessor
+        from src.rag.parent_chunks import PARENT_CONTENT_KEY
+        processor = ContentProcessor()
+        processor.parent_chunk_size, processor.child_chunk_size, processor.child_chunk_overlap = 200, 50, 0
+        text = "\n\n".join(f"第{i}段：" + "检索增强生成需要足够的上下文。" * 3 for i in range(6))
+        doc = Document(page_content=text, metadata={"source": "a.txt", "file_type": ".txt"})
+
+        children = processor.split_documents([doc], project_id="p", mode="parent_child")
+        parents = {c.metadata["parent_id"]: c.metadata[PARENT_CONTENT_KEY] for c in children}
+        assert 1 < len(parents) < len(children)
+        assert [c.metadata["chunk_index"] for c in children] == list(range(len(children)))
+        for child in children:
+            assert len(child.page_content) <= 50
+            assert child.page_content in child.metadata[PARENT_CONTENT_KEY]
+        again = processor.split_documents([doc], project_id="p", mode="parent_child")
+        assert [c.metadata["parent_id"] for c in again] == [c.metadata["parent_id"] for c in children]
+
+    def test_expand_dedupes_children_to_parents(self):
+        from langchain_core.documents import Document
+        from src.rag.parent_chunks import PARENT_CONTENT_KEY, expand_to_parents, pop_parent_records
+
+        def child(chunk_id, parent_id):
+            return Document(page_content=chunk_id, metadata={
+                "chunk_id": chunk_id, "parent_id": parent_id, "parent_index": 0,
+                "source": "a.txt", PARENT_CONTENT_KEY: f"parent {parent_id}",
+            })
+
+        chunks = [child("c1", "P1"), child("c2", "P1"), child("c3", "P2")]
+        postgres, db_path = self._init_db()
+        with postgres, db_path:
+            from src.utils.db import add_parent_chunks, init_db
+            init_db()
+            records = pop_parent_records(chunks, "p")
+            assert [r["parent_id"] for r in records] == ["P1", "P2"]
+            assert all(PARENT_CONTENT_KEY not in c.metadata for c in chunks)
+            add_parent_chunks(records)
+
+            plain = Document(page_content="plain", metadata={"chunk_id": "x"})
+            results = expand_to_parents(
+                [(chunks[1], 0.1), (plain, 0.2), (chunks[0], 0.3), (chunks[2], 0.4)], top_k=2
+            )
+        assert [(d.page_content, score) for d, score in results] == [("parent P1", 0.1), ("plain", 0.2)]
+        assert results[0][0].metadata["chunk_id"] == "P1"
+        assert results[0][0].metadata["child_chunk_id"] == "c2"
+        assert results[0][0].metadata["matched_children"] == 2
+
+    def test_batch_write_keeps_parent_text_out_of_vector_store(self):
+        from langchain_core.documents import Document
+        from src.rag.parent_chunks import PARENT_CONTENT_KEY
+        from src.rag.vectorstore import VectorDBManager
+        store = MagicMock()
+        store.add_embeddings.side_effect = lambda chunks, vectors, pid, ids=None: len(chunks)
+        chunk = Document(page_content="child", metadata={
+            "source": "a.txt", "chunk_index": 0, "parent_id": "P1", "parent_index": 0,
+            PARENT_CONTENT_KEY: "parent text",
+        })
+        postgres, db_path = self._init_db()
+        with postgres, db_path:
+            from src.utils.db import get_parent_chunks, init_db
+            init_db()
+            VectorDBManager(store=store).add_chunk_batch([chunk], [[1.0, 0.0]], "p")
+            assert get_parent_chunks(["P1"])["P1"]["content"] == "parent text"
+        written = store.add_embeddings.call_args.args[0][0]
+        assert PARENT_CONTENT_KEY not in written.metadata and written.metadata["parent_id"] == "P1"
+
+
+class TestContextPacker:
+    """测试上下文打包：相邻片段合并、近重复去除、token 预算"""
+
+    def _doc(self, text, source="a.md", index=None, chunk_id=None):
+        from langchain_core.documents import Document
+        metadata = {"source": source, "chunk_id": chunk_id or text[:8]}
+        if index is not None:
+            metadata["chunk_index"] = index
+        return Document(page_content=text, metadata=metadata)
+
+    def test_adjacent_overlapping_chunks_merge(self):
+        from src.rag.context_packer import pack_context
+        first = "向量检索先把问题编码成向量。然后在索引里查找最近的片段。"
+        second = "然后在索引里查找最近的片段。最后把片段交给大模型生成回答。"
+        results = [(self._doc(second, index=4), 0.9), (self._doc("无关文件的内容", "b.md", 0), 0.5),
+                   (self._doc(first, index=3), 0.8)]
+        with patch("src.rag.context_packer._record_packing"):
+            packed = pack_context(results, token_budget=0)
+        assert packed.merged_chunks == 1 and len(packed.spans) == 2
+        span = packed.spans[0]
+        assert span.text == first + "最后把片段交给大模型生成回答。"
+        assert span.score == 0.9 and span.rank == 0
+        assert packed.tokens_saved > 0
+
+    def test_near_duplicates_dropped(self):
+        from src.rag.context_packer import pack_context
+        text = "部署时需要先配置环境变量，再执行数据库初始化脚本，最后启动服务。"
+        results = [(self._doc(text, "a.md"), 1.0), (self._doc(text + "！", "copy.md"), 0.9),
+                   (self._doc("完全不同的另一段说明文字，讲的是监控告警。", "c.md"), 0.8)]
+        with patch("src.rag.context_packer._record_packing"):
+            packed = pack_context(results, token_budget=0, duplicate_threshold=0.9)
+        assert packed.dropped_duplicates == 1
+        assert [s.source for s in packed.spans] == ["a.md", "c.md"]
+
+    def test_token_budget_fills_in_rank_order(self):
+        from src.rag.context_packer import pack_context
+        from src.utils.tokens import count_tokens
+        results = [(self._doc("甲" * 200, "a.md"), 1.0), (self._doc("乙" * 400, "b.md"), 0.9),
+                   (self._doc("丙" * 20, "c.md"), 0.8)]
+        with patch("src.rag.context_packer._record_packing"):
+            packed = pack_context(results, token_budget=300, duplicate_threshold=1.1)
+            assert [s.source for s in packed.spans] == ["a.md", "c.md"]
+            assert packed.dropped_over_budget == 1 and packed.packed_tokens <= 300
+            assert "【文档2 来源: c.md" in packed.text
+
+            tight = pack_context(results[1:2], token_budget=50)
+        assert tight.truncated and count_tokens(tight.text) <= 50
+
+
+class TestContextCompression:
+    """测试抽取式上下文压缩：切句、关键词 / 语义打分、预算与重叠句去重"""
+
+    def _doc(self, text, source="a.md"):
+        from langchain_core.documents import Document
+        return Document(page_content=text, metadata={"source": source})
+
+    def test_split_sentences(self):
+        from src.rag.compressor import split_sentences
+        text = "第一句。第二句！Third one. Fourth?\n标题行\n最后一句；"
+        assert split_sentences(text) == ["第一句。", "第二句！", "Third one.", "Fourth?", "标题行", "最后一句；"]
+
+    def test_keyword_compression_keeps_relevant_sentences(self):
+        from src.rag.compressor import ExtractiveCompressor
+        filler = "这一段讲的是公司团建的安排和午餐菜单。"
+        relevant = "向量索引使用 IVF 聚类来加速检索。"
+        results = [(self._doc(filler * 3 + relevant), 0.9), (self._doc(relevant + "另外还有停车场的说明。", "b.md"), 0.8),
+                   (self._doc(filler * 2, "c.md"), 0.7)]
+        compressor = ExtractiveCompressor(embeddings=None, token_budget=30, target_ratio=0.5, min_tokens=0)
+        with patch("src.rag.compressor._record_compression"):
+            result = compressor.compress("IVF 向量索引", results)
+        assert [doc.metadata["source"] for doc, _ in result.results] == ["a.md"]
+        assert result.results[0][0].page_content == f"… {relevant}"
+        assert result.results[0][1] == 0.9
+        assert result.ratio < 0.5 and result.sentences_kept < result.sentences_total
+
+    def test_semantic_scores_use_query_embedding(self):
+        from src.rag.compressor import ExtractiveCompressor
+
+        class FakeEmbeddings:
+            def embed_query(self, text):
+                return [1.0, 0.0]
+
+            def embed_documents(self, texts):
+                return [[1.0, 0.0] if "缓存" in t else [0.0, 1.0] for t in texts]
+
+        compressor = ExtractiveCompressor(embeddings=FakeEmbeddings(), semantic_weight=1.0, min_tokens=0)
+        scores = compressor.score("如何提高速度", ["结果缓存可以避免重复计算。", "今天天气不错。"])
+        assert scores[0] == pytest.approx(1.0) and scores[1] == pytest.approx(0.0)
+
+    def test_writer_compresses_tool_output(self):
+        from langchain_core.messages import HumanMessage, ToolMessage
+        from src.agent.nodes import _format_conversation_history
+        compressor = MagicMock()
+        compressor.compress_text.return_value = "压缩后"
+        messages = [HumanMessage(content="问题"), ToolMessage(content="很长的工具结果", tool_call_id="1", name="kb")]
+        text = _format_conversation_history(messages, compressor=compressor, query="问题")
+        compressor.compress_text.assert_called_once_with("问题", "很长的工具结果")
+        assert "🔧 [工具-kb]: 压缩后" in text
+
+
+class TestMMR:
+    """测试 MMR 去冗余：向量化贪心选择、检索器接入与候选向量复用"""
+
+    def _candidates(self):
+        from langchain_core.documents import Document
+        # 0、1 近重复（同一文件），2 相关度稍低但方向不同
+        vectors = [[1.0, 0.0, 0.0], [0.99, 0.01, 0.0], [0.7, 0.0, 0.7]]
+        docs = [Document(page_content=f"c{i}", metadata={"chunk_id": f"c{i}"}) for i in range(3)]
+        return docs, vectors
+
+    def test_select_prefers_diverse_over_near_duplicate(self):
+        from src.rag.mmr import mmr_select
+        _, vectors = self._candidates()
+        query = np.array([1.0, 0.0, 0.1])
+        assert mmr_select(np.array(vectors), 2, 0.5, query=query) == [0, 2]
+        assert mmr_select(np.array(vectors), 2, 1.0, query=query) == [0, 1]      # λ=1 即按相关度
+
+    def test_apply_mmr_keeps_scores_and_skips_without_vectors(self):
+        from src.rag.mmr import apply_mmr
+        docs, vectors = self._candidates()
+        results = [(doc, 0.1 * (i + 1)) for i, doc in enumerate(docs)]
+        with patch("src.rag.mmr._record_mmr"):
+            picked = apply_mmr(results, vectors, 2, 0.3)       # 无查询向量：相关度按排名
+            assert [(d.page_content, s) for d, s in picked] == [("c0", 0.1), ("c2", pytest.approx(0.3))]
+            assert apply_mmr(results, [None] * 3, 2, 0.5) == results[:2]
+        assert apply_mmr(results[:2], vectors[:2], 2, 0.5) == results[:2]
+
+    def test_vector_query_reuses_store_vectors(self):
+        from dataclasses import replace
+        from src.rag.project_config import ProjectRetrievalConfig
+        from src.rag.retriever import VectorRetriever
+        docs, vectors = self._candidates()
+        config = replace(ProjectRetrievalConfig.defaults(), mmr_fetch_factor=3, mmr_lambda=0.5, chunk_mode="standard")
+        retriever = VectorRetriever.__new__(VectorRetriever)
+        retriever.enable_cache = False
+        retriever.store = MagicMock()
+        retriever.store.similarity_search_by_vector_with_embeddings.return_value = [
+            (doc, 0.1 * i, vector) for i, (doc, vector) in enumerate(zip(docs, vectors))
+        ]
+        embeddings = MagicMock()
+        embeddings.embed_query.return_value = [1.0, 0.0, 0.1]
+        retriever._embeddings_for = lambda pid: embeddings
+        retriever._vector_filter = lambda pid, e: {"project_id": pid}
+        with patch("src.rag.retriever.get_project_retrieval_config", return_value=config), \
+                patch("src.rag.mmr._record_mmr"):
+            results = retriever.query("q", project_id="p", top_k=2, mode="vector")
+        assert [d.page_content for d, _ in results] == ["c0", "c2"]
+        assert retriever.store.similarity_search_by_vector_with_embeddings.call_args.kwargs["top_k"] == 6
+        embeddings.embed_query.assert_called_once()     # 候选不重新 Embedding
+
+    def test_hybrid_fetches_only_keyword_only_vectors(self):
+        from langchain_core.documents import Document
+        from src.rag.hybrid_retriever import HybridRetriever
+        docs, vectors = self._candidates()
+        store = MagicMock()
+        store.similarity_search_by_vector_with_embeddings.return_value = [
+            (docs[0], 0.1, vectors[0]), (docs[1], 0.2, vectors[1]),
+        ]
+        store.get_embeddings.return_value = {"c2": vectors[2]}
+        hybrid = HybridRetriever(store, documents=None, project_id="p")
+        hybrid._keyword_search = lambda query, top_k: [(docs[1], 2.0), (docs[2], 1.0)]
+        with patch("src.rag.hybrid_retriever._record_leg"), patch("src.rag.mmr._record_mmr"):
+            results = hybrid.retrieve("q", top_k=2, query_embedding=[1.0, 0.0, 0.1],
+                                      mmr_fetch_factor=3, mmr_lambda=0.3)
+        assert [d.page_content for d, _ in results] == ["c1", "c2"]
+        store.get_embeddings.assert_called_once_with(["c2"], project_id="p")
+
+    def test_numpy_store_returns_vectors(self):
+        from pathlib import Path
+        from langchain_core.documents import Document
+        from src.rag.project_config import ProjectRetrievalConfig
+        from src.rag.stores.numpy_store import NumpyStore
+        tmp_dir = Path(tempfile.mkdtemp())
+        with patch("src.rag.stores.numpy_store.model_manager"), \
+                patch("src.rag.stores.numpy_store.get_project_retrieval_config",
+                      return_value=ProjectRetrievalConfig.defaults()), \
+                patch("src.rag.stores.numpy_store.settings") as mock_settings:
+            mock_settings.NUMPY_STORE_DIR = tmp_dir
+            mock_settings.NUMPY_STORE_DTYPE = "float32"
+            mock_settings.NUMPY_STORE_COMPACT_RATIO = 0.5
+            mock_settings.ANN_MIN_ROWS = 10 ** 9
+            store = NumpyStore()
+            docs = [Document(page_content=f"d{i}", metadata={"chunk_id": f"c{i}"}) for i in range(2)]
+            store.add_embeddings(docs, [[3.0, 0.0], [0.0, 2.0]], "p", ids=["c0", "c1"])
+            hits = store.similarity_search_by_vector_with_embeddings([1.0, 0.1], top_k=2, filter={"project_id": "p"})
+            assert [d.page_content for d, _, _ in hits] == ["d0", "d1"]
+            assert hits[0][2] == pytest.approx([1.0, 0.0])
+            assert store.get_embeddings(["c1", "x"], project_id="p")["c1"] == pytest.approx([0.0, 1.0])
+
+
+class TestProjectWarmup:
+    """测试知识库预热：各步骤后台执行、状态上报、去重与失败隔离"""
+
+    def setup_method(self):
+        from src.rag import warmup
+        warmup._states.clear()
+        warmup._futures.clear()
+        self.patches = [
+            patch("src.rag.warmup._warm_embedding", return_value=[1.0, 0.0]),
+            patch("src.rag.warmup._warm_vector_index"),
+            patch("src.rag.warmup._warm_keyword_index"),
+            patch("src.rag.warmup._warm_reranker"),
+            patch("src.rag.warmup._warm_chat_model"),
+            patch("src.rag.warmup._record_warmup"),
+            patch("src.rag.stores.get_vector_store", return_value=MagicMock()),
+        ]
+        self.mocks = {p.attribute: p.start() for p in self.patches}
+
+    def teardown_method(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_warmup_runs_steps_once_and_reports_ready(self):
+        from src.rag.warmup import get_warmup_status, warmup_project
+        assert get_warmup_status("p")["p"].status == "pending"
+        with patch("src.rag.warmup.settings.RETRIEVAL_MODE", "hybrid"), \
+                patch("src.rag.warmup.settings.ENABLE_RERANKER", True):
+            state = warmup_project("p", wait=True)
+            assert state.ready and not state.errors and not state.skipped
+            assert set(state.steps) == {
+                "embedding", "vector_store", "vector_index", "keyword_index", "reranker", "chat_model",
+            }
+            assert warmup_project("p", wait=True) is state          # 已就绪不重复预热
+            assert self.mocks["_warm_embedding"].call_count == 1
+            assert warmup_project("p", wait=True, force=True) is not state
+        assert self.mocks["_warm_vector_index"].call_args.args[1:] == ("p", [1.0, 0.0])
+        assert get_warmup_status("p")["p"].ready
+
+    def test_failed_step_does_not_block_others(self):
+        from src.rag.warmup import warmup_projects
+        self.mocks["_warm_chat_model"].side_effect = ConnectionError("unreachable")
+        with patch("src.rag.warmup.settings.RETRIEVAL_MODE", "vector"), \
+                patch("src.rag.warmup.settings.ENABLE_RERANKER", False):
+            states = warmup_projects(["a", "b", "a"], wait=True)
+        assert list(states) == ["a", "b"]
+        state = states["a"]
+        assert state.status == "failed" and "unreachable" in state.errors["chat_model"]
+        assert "vector_index" in state.steps
+        assert state.skipped == ["keyword_index", "reranker"]
+        self.mocks["_warm_keyword_index"].assert_not_called()
+
+
+class TestChunkIds:
+    """测试确定性片段 ID 与按 ID 融合"""
+
+    def test_ids_deterministic_and_scoped(self):
+        from langchain_core.documents import Document
+        from src.rag.chunk_ids import assign_chunk_id, make_chunk_id
+        import uuid
+
+        first = make_chunk_id("p", "a.md", 0, "text")
+        assert first == make_chunk_id("p", "a.md", 0, "text")
+        assert len({first, make_chunk_id("q", "a.md", 0, "text"), make_chunk_id("p", "a.md", 1, "text"),
+                    make_chunk_id("p", "a.md", 0, "text2")}) == 4
+        uuid.UUID(first)
+
+        chunk = Document(page_content="text", metadata={"source": "a.md", "chunk_index": 3})
+        assert assign_chunk_id(chunk, "p", ordinal=0) == make_chunk_id("p", "a.md", 3, "text")
+
+    def test_rrf_fuse_keeps_chunks_with_same_prefix(self):
+        from langchain_core.documents import Document
+        from src.rag.hybrid_retriever import HybridRetriever
+        header = "版权所有 " * 60
+        a = Document(page_content=header + "A", metadata={"chunk_id": "a"})
+        b = Document(page_content=header + "B", metadata={"chunk_id": "b"})
+        hybrid = HybridRetriever(MagicMock(), documents=None, project_id="p")
+        fused = hybrid._rrf_fuse([(a, 0.1), (b, 0.2)], [(b, 3.0)], top_k=5)
+        assert [doc.metadata["chunk_id"] for doc, _ in fused] == ["b", "a"]
+
+
+# ==================== 重排序 ====================
+
+class TestReranker:
+    """测试重排序：模型复用、分数缓存、超时回退"""
+
+    def _docs(self):
+        from langchain_core.documents import Document
+        return [
+            (Document(page_content=text, metadata={"chunk_id": text}), 0.0)
+            for text in ("aa", "bbbb", "c")
+        ]
+
+    def _model(self, delay: float = 0.0):
+        import time
+
+        def predict(pairs, batch_size=32):
+            time.sleep(delay)
+            model.calls.append(len(pairs))
+            return [float(len(text)) for _, text in pairs]
+
+        model = MagicMock()
+        model.calls = []
+        model.predict.side_effect = predict
+        return model
+
+    def test_scores_cached_by_query_and_chunk(self):
+        from src.rag.reranker import Reranker
+        model = self._model()
+        reranker = Reranker(backend="bge", timeout=0, cache_size=100)
+        with patch("src.rag.reranker._get_cross_encoder", return_value=model):
+            docs = self._docs()
+            first = reranker.rerank("q", docs + docs[:1], top_k=2)
+            assert [d.page_content for d, _ in first] == ["bbbb", "aa"]
+            assert model.calls == [3]
+
+            reranker.rerank("q", docs, top_k=2)
+            assert model.calls == [3]
+            reranker.rerank("other", docs[:1], top_k=1)
+            assert model.calls == [3, 1]
+        assert reranker.get_stats()["cache"]["hits"] == 3
+
+    def test_timeout_falls_back_to_fused_order(self):
+        from src.rag.reranker import Reranker
+        reranker = Reranker(backend="bge", timeout=0.05, cache_size=100)
+        with patch("src.rag.reranker._get_cross_encoder", return_value=self._model(delay=0.3)):
+            result = reranker.rerank("q", self._docs(), top_k=2)
+        assert [d.page_content for d, _ in result] == ["aa", "bbbb"]
+        assert reranker.timeouts == 1
+
+    def test_shared_instance_per_backend(self):
+        from src.rag.reranker import get_reranker
+        assert get_reranker("bge") is get_reranker("bge")
+        assert get_reranker("bge") is not get_reranker("cohere")
+
+    def test_batched_reranker_merges_concurrent_requests(self):
+        import threading
+        from langchain_core.documents import Document
+        from src.rag.reranker import BatchedReranker
+
+        model = self._model()
+        reranker = BatchedReranker(backend="bge", max_batch_size=64, max_wait_ms=100,
+                                   timeout=0, cache_size=100)
+        results = {}
+
+        def worker(i):
+            docs = [(Document(page_content="x" * (n + 1), metadata={"chunk_id": f"{i}-{n}"}), 0.0)
+                    for n in range(3)]
+            results[i] = reranker.rerank(f"q{i}", docs, top_k=2)
+
+        with patch("src.rag.reranker._get_cross_encoder", return_value=model), \
+                patch.object(reranker, "_record_batch"):
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            reranker.batcher.close()
+
+        assert all([d.page_content for d, _ in results[i]] == ["xxx", "xx"] for i in range(6))
+        assert sum(model.calls) == 18
+        assert len(model.calls) < 6         # 不同请求的候选对合并推理
+        stats = reranker.get_stats()["batching"]
+        assert stats["requests"] == 6 and stats["queue_depth"] == 0
+        assert reranker.cache.get_stats()["size"] == 18
+
+    def test_batching_only_for_local_backends(self):
+        from src.rag.reranker import BatchedReranker
+        with pytest.raises(ValueError):
+            BatchedReranker(backend="cohere")
+
+
+class TestOnnxCrossEncoder:
+    """测试量化 ONNX Cross-Encoder（替换推理会话，不加载真实模型）"""
+
+    def _make_model(self, max_length=6):
+        from tokenizers import Tokenizer
+        from tokenizers.models import WordLevel
+        from tokenizers.pre_tokenizers import Whitespace
+        from src.utils.local_reranker import OnnxCrossEncoder
+
+        tokenizer = Tokenizer(WordLevel({"[PAD]": 0, "[UNK]": 1, "q": 2, "a": 3, "b": 4}, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = Whitespace()
+        tokenizer.enable_truncation(max_length, strategy="only_second")
+
+        class FakeSession:
+            """logit = 行内 token "a" 的个数"""
+            def __init__(self):
+                self.widths = []
+
+            def run(self, _, feeds):
+                ids = feeds["input_ids"]
+                self.widths.append(ids.shape[1])
+                assert (feeds["attention_mask"].sum(axis=1) >= 1).all()
+                return [(ids == 3).sum(axis=1, keepdims=True).astype(np.float32)]
+
+        model = OnnxCrossEncoder(model_id="fake", model_name="fake/fake", threads=1, max_length=max_length)
+        model._tokenizer = tokenizer
+        model._session = FakeSession()
+        model._input_names = {"input_ids", "attention_mask", "token_type_ids"}
+        return model
+
+    def test_scores_ordered_truncated_and_length_batched(self):
+        model = self._make_model()
+        pairs = [("q", "a a a a a a a a"), ("q", "b"), ("q q", "a b"), ("q", "a")]
+        scores = model.predict(pairs, batch_size=2)
+        # 只截断候选文本：第一对保留查询 1 个 token + 候选 5 个
+        assert scores == [5.0, 0.0, 1.0, 1.0]
+        # 按长度排序分批：短的两对一批，只补齐到批内最长
+        assert model._session.widths == [2, 6]
+
+    def test_backend_uses_onnx_model(self):
+        from langchain_core.documents import Document
+        from src.rag.reranker import Reranker
+        model = self._make_model()
+        docs = [(Document(page_content=t, metadata={"chunk_id": t}), 0.0) for t in ("b", "a a", "a")]
+        with patch("src.rag.reranker._get_onnx_cross_encoder", return_value=model):
+            result = Reranker(backend="bge-onnx", timeout=0, cache_size=0).rerank("q", docs, top_k=2)
+        assert [d.page_content for d, _ in result] == ["a a", "a"]
+
+
+# ==================== NumPy 向量存储 ====================
+
+class TestNumpyStore:
+    """测试 NumPy 内存映射向量存储"""
+
+    def setup_method(self):
+        from dataclasses import replace
+        from src.rag.project_config import ProjectRetrievalConfig
+        self.config = replace(
+            ProjectRetrievalConfig.defaults(),
+            ann_index="exact", ann_min_rows=0, ivf_nlist=0, ivf_nprobe=4, quantization="none",
+        )
+        self.patches = [
+            patch("src.rag.stores.numpy_store.model_manager"),
+            patch("src.rag.stores.numpy_store.get_project_retrieval_config", lambda pid: self.config),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def teardown_method(self):
+        for p in self.patches:
+            p.stop()
+
+    def _make_store(self, tmp_dir, dtype="float32"):
+        from src.rag.stores.numpy_store import NumpyStore
+        with patch("src.rag.stores.numpy_store.settings") as mock_settings:
+            mock_settings.NUMPY_STORE_DIR = tmp_dir
+            mock_settings.NUMPY_STORE_DTYPE = dtype
+            mock_settings.NUMPY_STORE_COMPACT_RATIO = 0.5
+            return NumpyStore()
+
+    def _docs(self):
+        from langchain_core.documents import Document
+        docs = [Document(page_content=f"doc{i}", metadata={"source": f"f{i % 2}.md"}) for i in range(6)]
+        vectors = [[1.0, float(i), 0.0] for i in range(6)]
+        return docs, vectors
+
+    def test_exact_search_filter_and_persistence(self):
+        from pathlib import Path
+        tmp_dir = Path(tempfile.mkdtemp())
+        store = self._make_store(tmp_dir)
+        docs, vectors = self._docs()
+        store.add_embeddings(docs, vectors, "p")
+
+        results = store.similarity_search_by_vector_with_score([1.0, 5.0, 0.0], top_k=2, filter={"project_id": "p"})
+        assert [d.page_content for d, _ in results] == ["doc5", "doc4"]
+        assert results[0][1] == pytest.approx(0.0, abs=1e-6)
+
+        filtered = store.similarity_search_by_vector_with_score(
+            [1.0, 5.0, 0.0], top_k=2, filter={"$and": [{"project_id": "p"}, {"source": "f0.md"}]}
+        )
+        assert [d.page_content for d, _ in filtered] == ["doc4", "doc2"]
+        assert store.similarity_search_by_vector_with_score([1.0, 0.0, 0.0], filter={"project_id": "other"}) == []
+
+        from src.rag.stores import numpy_store
+        numpy_store._shared_projects.pop(tmp_dir.resolve())
+        reloaded = self._make_store(tmp_dir)
+        assert reloaded.count({"project_id": "p"}) == 6
+        assert reloaded.similarity_search_by_vector_with_score([1.0, 5.0, 0.0], top_k=1)[0][0].page_content == "doc5"
+
+    def test_store_handles_share_one_index(self):
+        """同一目录的多个存储实例共用索引：写入互相可见，不会按过期行数覆盖向量"""
+        from pathlib import Path
+        from langchain_core.documents import Document
+        from src.rag.stores import get_vector_store
+        tmp_dir = Path(tempfile.mkdtemp())
+        with patch("src.rag.stores.numpy_store.settings") as mock_settings, \
+                patch("config.settings.settings.VECTOR_STORE_BACKEND", "numpy"):
+            mock_settings.NUMPY_STORE_DIR = tmp_dir
+            mock_settings.NUMPY_STORE_DTYPE = "float32"
+            mock_settings.NUMPY_STORE_COMPACT_RATIO = 0.5
+            store_a = get_vector_store()
+            store_a.add_embeddings([Document(page_content="a0")], [[1.0, 0.0, 0.0]], "p", ids=["a0"])
+            store_b = get_vector_store()
+            store_a.add_embeddings([Document(page_content="a1")], [[0.0, 1.0, 0.0]], "p", ids=["a1"])
+            assert store_b.count({"project_id": "p"}) == 2
+            store_b.add_embeddings([Document(page_content="b1")], [[0.0, 0.0, 1.0]], "p", ids=["b1"])
+
+            from src.rag.stores import numpy_store
+            numpy_store._shared_projects.pop(tmp_dir.resolve())
+            reloaded = get_vector_store()
+        assert reloaded.get(where={"project_id": "p"})["ids"] == ["a0", "a1", "b1"]
+        results = reloaded.similarity_search_by_vector_with_score([0.0, 1.0, 0.0], top_k=3, filter={"project_id": "p"})
+        assert [d.page_content for d, _ in results][0] == "a1"
+        assert results[0][1] == pytest.approx(0.0, abs=1e-6)
+        assert results[1][1] == pytest.approx(2.0, abs=1e-6)
+
+    def test_search_results_consistent_with_concurrent_compact(self):
+        """检索与并发的删除整理交错时，返回的文档和向量仍对应检索到的行"""
+        import threading
+        from pathlib import Path
+        store = self._make_store(Path(tempfile.mkdtemp()))
+        docs, vectors = self._docs()
+        store.add_embeddings(docs, vectors, "p")
+        index = store._projects["p"]
+        original_search = index.search
+        stale_ids = list(index.ids[:5])
+        workers = []
+
+        def search_then_compact(*args, **kwargs):
+            hits = original_search(*args, **kwargs)
+            # 检索刚返回行号时另一线程删除 doc0~doc4 并整理（行号重排）
+            worker = threading.Thread(target=store.delete_by_ids, args=(stale_ids, "p"))
+            workers.append(worker)
+            worker.start()
+            worker.join(timeout=0.2)
+            return hits
+
+        index.search = search_then_compact
+        results = store.similarity_search_by_vector_with_embeddings([1.0, 4.0, 0.0], top_k=2, filter={"project_id": "p"})
+        index.search = original_search
+        workers[0].join()
+
+        assert [d.page_content for d, _, _ in results] == ["doc4", "doc5"]
+        expected = np.array([[1.0, 4.0, 0.0], [1.0, 5.0, 0.0]])
+        expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+        assert np.allclose([vector for _, _, vector in results], expected, atol=1e-6)
+        assert index.size == 1
+
+    def test_delete_by_ids_consistent_with_concurrent_compact(self):
+        """按 ID 删除与并发整理交错时，仍删除正确的行"""
+        import threading
+        from pathlib import Path
+        store = self._make_store(Path(tempfile.mkdtemp()))
+        docs, vectors = self._docs()
+        store.add_embeddings(docs, vectors, "p")
+        index = store._projects["p"]
+        ids = list(index.ids)
+        assert store.delete_by_ids(ids[:3], "p")
+        assert index.size == 6
+        original_delete = index.delete
+        workers = []
+
+        def compact_then_delete(mask):
+            # 行号已查出、尚未打标记时另一线程整理（行号重排）
+            worker = threading.Thread(target=store.compact, args=("p",))
+            workers.append(worker)
+            worker.start()
+            worker.join(timeout=0.2)
+            return original_delete(mask)
+
+        index.delete = compact_then_delete
+        assert store.delete_by_ids([ids[5]], "p")
+        index.delete = original_delete
+        workers[0].join()
+
+        assert [d.page_content for d in store.get_all_documents({"project_id": "p"})] == ["doc3", "doc4"]
+
+    def test_tombstone_delete_and_compact(self):
+        from pathlib import Path
+        tmp_dir = Path(tempfile.mkdtemp())
+        store = self._make_store(tmp_dir, dtype="float16")
+        docs, vectors = self._docs()
+        store.add_embeddings(docs, vectors, "p")
+
+        assert store.delete_by_filter({"project_id": "p", "source": "f1.md"})
+        assert store.count({"project_id": "p"}) == 3
+        # 删除比例 0.5 未超过阈值，仅打标记
+        assert store._projects["p"].size == 6
+
+        store.compact("p")
+        assert store._projects["p"].size == 3
+        results = store.similarity_search_by_vector_with_score([1.0, 5.0, 0.0], top_k=3)
+        assert [d.page_content for d, _ in results] == ["doc4", "doc2", "doc0"]
+
+        assert store.delete_by_filter({"project_id": "p"})
+        assert store.count() == 0
+        assert not any(tmp_dir.iterdir())
+
+    def test_same_ids_overwrite_and_delete_by_ids(self):
+        from pathlib import Path
+        store = self._make_store(Path(tempfile.mkdtemp()))
+        docs, vectors = self._docs()
+        ids = [f"id{i}" for i in range(6)]
+        store.add_embeddings(docs, vectors, "p", ids=ids)
+        store.add_embeddings(docs[:2], vectors[:2], "p", ids=ids[:2])
+        assert store.count({"project_id": "p"}) == 6
+
+        assert store.delete_by_ids(["id1", "missing"], project_id="p")
+        assert [d.page_content for d in store.get_by_ids(ids[:3], project_id="p")] == ["doc0", "doc2"]
+
+    def test_ivf_recall_and_incremental_insert(self):
+        """IVF 检索：nprobe 覆盖全部簇时与精确检索一致；增量写入的行可被检索到"""
+        from pathlib import Path
+        from langchain_core.documents import Document
+        tmp_dir = Path(tempfile.mkdtemp())
+        store = self._make_store(tmp_dir)
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(400, 8)).astype(np.float32)
+        docs = [Document(page_content=f"doc{i}", metadata={}) for i in range(400)]
+
+        self.config.ann_index = "ivf"
+        self.config.ivf_nlist = 8
+        with patch("src.rag.stores.numpy_store.settings") as mock_settings:
+            mock_settings.IVF_TRAIN_SAMPLE = 1000
+            mock_settings.IVF_RETRAIN_FACTOR = 2.0
+            store.add_embeddings(docs[:300], vectors[:300], "p")
+            store.add_embeddings(docs[300:], vectors[300:], "p")
+        index = store._projects["p"]
+        assert index.ivf.nlist == 8
+        assert len(index.ivf.assign) == 400
+
+        query = vectors[350]
+        self.config.ivf_nprobe = 8
+        full = store.similarity_search_by_vector_with_score(query, top_k=5)
+        self.config.ann_index = "exact"
+        exact = store.similarity_search_by_vector_with_score(query, top_k=5)
+        assert [d.page_content for d, _ in full] == [d.page_content for d, _ in exact]
+        assert full[0][0].page_content == "doc350"
+
+        self.config.ann_index = "ivf"
+        self.config.ivf_nprobe = 2
+        probed = store.similarity_search_by_vector_with_score(query, top_k=5)
+        assert probed[0][0].page_content == "doc350"
+
+    def test_quantized_search_with_rescore(self):
+        """sq8 / pq 编码检索 + float 重打分，结果与精确检索一致；编码远小于 float 向量"""
+        from pathlib import Path
+        from langchain_core.documents import Document
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(600, 32)).astype(np.float32)
+        docs = [Document(page_content=f"doc{i}", metadata={}) for i in range(600)]
+        query = vectors[123] + 0.05 * rng.normal(size=32).astype(np.float32)
+
+        exact_store = self._make_store(Path(tempfile.mkdtemp()))
+        exact_store.add_embeddings(docs, vectors, "p")
+        expected = [d.page_content for d, _ in exact_store.similarity_search_by_vector_with_score(query, top_k=5)]
+
+        for kind in ("sq8", "pq"):
+            self.config.quantization = kind
+            store = self._make_store(Path(tempfile.mkdtemp()))
+            with patch("src.rag.stores.numpy_store.settings") as mock_settings:
+                mock_settings.QUANT_MIN_ROWS = 100
+                mock_settings.QUANT_TRAIN_SAMPLE = 1000
+                mock_settings.IVF_RETRAIN_FACTOR = 2.0
+                store.add_embeddings(docs, vectors, "p")
+                stats = store.memory_stats("p")
+                assert stats["quantization"] == kind
+                assert stats["code_bytes"] * 4 <= stats["float_bytes"]
+
+                results = store.similarity_search_by_vector_with_score(query, top_k=5)
+            assert [d.page_content for d, _ in results] == expected
+
+    def test_dimension_mismatch_rejected(self):
+        """知识库改了 embedding_dimensions 后，不同维度的向量写入 / 查询应报错"""
+        from pathlib import Path
+        store = self._make_store(Path(tempfile.mkdtemp()))
+        docs, vectors = self._docs()
+        store.add_embeddings(docs, vectors, "p")
+
+        with pytest.raises(ValueError, match="维度不一致"):
+            store.similarity_search_by_vector_with_score([1.0, 0.0], filter={"project_id": "p"})
+        with pytest.raises(ValueError, match="维度不一致"):
+            store.add_embeddings(docs[:1], [[1.0, 0.0]], "p")
+
+
+class TestEmbeddingDimensions:
+    """测试 Matryoshka 截断维度的校验与模型缓存"""
+
+    def test_resolve_dimensions(self):
+        from src.utils.model_manager import model_manager
+        assert model_manager.resolve_embedding_dimensions("text-embedding-3-small", None) is None
+        assert model_manager.resolve_embedding_dimensions("text-embedding-3-small", 1536) is None
+        assert model_manager.resolve_embedding_dimensions("text-embedding-3-small", 256) == 256
+        assert model_manager.get_embedding_dimension("text-embedding-3-large", 1024) == 1024
+        assert model_manager.get_embedding_dimension("text-embedding-3-large") == 3072
+        with pytest.raises(ValueError):
+            model_manager.resolve_embedding_dimensions("text-embedding-3-small", 4096)
+        with pytest.raises(ValueError):
+            model_manager.resolve_embedding_dimensions("text-embedding-ada-002", 256)
+
+    @patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test"})
+    def test_models_cached_per_dimension(self):
+        from src.utils.model_manager import model_manager
+        reduced = model_manager.get_embedding_model("text-embedding-3-small", dimensions=256)
+        assert reduced.dimensions == 256
+        assert model_manager.get_embedding_model("text-embedding-3-small", dimensions=256) is reduced
+        full = model_manager.get_embedding_model("text-embedding-3-small")
+        assert full is not reduced
+        assert full.dimensions is None
+
+
+# ==================== 本地 Embedding / 动态批处理 ====================
+
+class TestMicroBatcher:
+    """测试跨调用方的动态批处理"""
+
+    def test_concurrent_requests_merged_in_order(self):
+        import threading
+        from src.utils.batching import MicroBatcher
+
+        calls = []
+
+        def batch_fn(items):
+            calls.append(len(items))
+            return [x * 10 for x in items]
+
+        batcher = MicroBatcher(batch_fn, max_batch_size=64, max_wait_ms=50)
+        results = {}
+
+        def worker(i):
+            results[i] = batcher([i, i + 100])
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        batcher.close()
+
+        assert all(results[i] == [i * 10, (i + 100) * 10] for i in range(8))
+        assert sum(calls) == 16
+        assert len(calls) < 8               # 至少有请求被合并
+
+    def test_error_propagates_to_callers(self):
+        from src.utils.batching import MicroBatcher
+
+        def batch_fn(items):
+            raise RuntimeError("boom")
+
+        batcher = MicroBatcher(batch_fn, max_batch_size=4, max_wait_ms=1)
+        with pytest.raises(RuntimeError, match="boom"):
+            batcher(["x"])
+        batcher.close()
+
+    def test_stats_histogram_and_queue_depth(self):
+        from src.utils.batching import MicroBatcher
+
+        seen = []
+        batcher = MicroBatcher(lambda items: items, max_batch_size=8, max_wait_ms=1,
+                               on_batch=lambda size, depth, waited: seen.append(size))
+        batcher([1])
+        batcher([1, 2, 3])
+        batcher(list(range(5)))
+        batcher.close()
+
+        stats = batcher.get_stats()
+        assert seen == [1, 3, 5]
+        assert stats["batch_size_histogram"] == {"<=1": 1, "<=4": 1, "<=8": 1}
+        assert stats["queue_depth"] == 0
+        assert stats["max_queue_depth"] >= 5
+
+
+class TestLocalEmbeddings:
+    """测试本地 ONNX Embedding（替换推理会话，不加载真实模型）"""
+
+    def _make_model(self, **kwargs):
+        from tokenizers import Tokenizer
+        from tokenizers.models import WordLevel
+        from tokenizers.pre_tokenizers import Whitespace
+        from src.utils.local_embeddings import LocalOnnxEmbeddings
+
+        vocab = {"[PAD]": 0, "[UNK]": 1, "q": 2, "a": 3, "b": 4, "c": 5}
+        tokenizer = Tokenizer(WordLevel(vocab, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = Whitespace()
+        tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+        class FakeSession:
+            """hidden[b, t] = one-hot(token id)，便于核对池化结果"""
+            def __init__(self):
+                self.batch_sizes = []
+
+            def run(self, _, feeds):
+                ids = feeds["input_ids"]
+                self.batch_sizes.append(len(ids))
+                return [np.eye(6, dtype=np.float32)[ids]]
+
+        model = LocalOnnxEmbeddings(
+            model_id="fake", model_name="fake/fake", dimension=6,
+            threads=1, max_wait_ms=20, **kwargs,
+        )
+        model._tokenizer = tokenizer
+        model._session = FakeSession()
+        model._input_names = {"input_ids", "attention_mask"}
+        return model
+
+    def test_mean_pooling_normalized_and_ordered(self):
+        model = self._make_model(pooling="mean", batch_size=2)
+        vectors = np.array(model.embed_documents(["a a b", "c", "a b c"]))
+        model.close()
+
+        assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+        assert vectors[1].argmax() == 5            # "c"
+        assert vectors[0][3] > vectors[0][4]       # "a a b" 中 a 的权重更大
+        assert vectors[0][0] == 0                  # padding 不参与池化
+        assert max(model._session.batch_sizes) <= 2
+
+    def test_query_instruction_and_cls_pooling(self):
+        model = self._make_model(pooling="cls", query_instruction="q ")
+        query = model.embed_query("a")
+        doc = model.embed_documents(["a"])[0]
+        batch = model.embed_queries(["a", "b"])
+        model.close()
+        assert np.argmax(query) == 2               # 查询首个 token 为指令前缀
+        assert np.argmax(doc) == 3
+        assert batch[0] == pytest.approx(query)    # 批量查询同样加指令
+
+    def test_local_model_selectable_without_api_key(self):
+        from src.utils.local_embeddings import LocalOnnxEmbeddings
+        from src.utils.model_manager import ModelManager
+
+        with patch.dict(os.environ, {}, clear=True):
+            manager = ModelManager()
+            assert manager.set_current_embedding_model("bge-small-zh-v1.5")
+            model = manager.get_embedding_model()
+            assert isinstance(model, LocalOnnxEmbeddings)
+            assert model.dimension == 512
+            assert manager.get_embedding_model() is model
+            assert manager.check_model_available("bge-small-zh-v1.5")[0]
+            manager.clear_cache()
+
+
+class TestChromaPartitioning:
+    """测试 ChromaDB 按知识库分区与共享集合迁移"""
+
+    def _make_store(self, tmp_dir, mode="per_project", auto_migrate=False):
+        from src.rag.stores.chroma_store import ChromaStore
+        with patch("src.rag.stores.chroma_store.settings") as mock_settings, \
+                patch("src.rag.stores.chroma_store.model_manager"):
+            mock_settings.DB_DIR = tmp_dir
+            mock_settings.CHROMA_COLLECTION_MODE = mode
+            mock_settings.CHROMA_AUTO_MIGRATE = auto_migrate
+            return ChromaStore()
+
+    def _shared_store(self, tmp_dir):
+        shared = self._make_store(tmp_dir, mode="shared")
+        for project_id, prefix in (("p1", "a"), ("p2", "b")):
+            docs, vectors = self._docs(prefix, 4)
+            shared.add_embeddings(docs, vectors, project_id)
+        return shared
+
+    def _docs(self, prefix, n):
+        from langchain_core.documents import Document
+        docs = [Document(page_content=f"{prefix}{i}", metadata={"source": f"{prefix}{i % 2}.md"}) for i in range(n)]
+        vectors = [[1.0, float(i), 0.0] for i in range(n)]
+        return docs, vectors
+
+    def test_shared_layout_migrates_to_per_project(self):
+        from src.rag.stores.chroma_store import MIGRATION_MARKER
+        tmp_dir = tempfile.mkdtemp()
+        shared = self._shared_store(tmp_dir)
+        assert shared.count({"project_id": "p1"}) == 4
+
+        # 未迁移：per_project 模式继续按共享布局读写，数据不丢
+        store = self._make_store(tmp_dir)
+        assert not store.partitioned
+        assert store.count({"project_id": "p2"}) == 4
+        assert {c.name for c in store._client.list_collections()} == {"langchain"}
+
+        assert store.migrate_shared_collection() == 8
+        assert store.partitioned
+        assert os.path.exists(os.path.join(tmp_dir, MIGRATION_MARKER))
+        assert store.migrate_shared_collection() == 0
+        assert self._make_store(tmp_dir, auto_migrate=True).partitioned
+        names = {c.name for c in store._client.list_collections()}
+        assert "langchain" not in names
+        assert len(names) == 2
+        assert store.count() == 8
+        assert store.count({"project_id": "p2"}) == 4
+
+        results = store.similarity_search_by_vector_with_score([1.0, 3.0, 0.0], top_k=2, filter={"project_id": "p1"})
+        assert [d.page_content for d, _ in results] == ["a3", "a2"]
+        filtered = store.similarity_search_by_vector_with_score(
+            [1.0, 3.0, 0.0], top_k=2, filter={"$and": [{"project_id": "p2"}, {"source": "b0.md"}]}
+        )
+        assert [d.page_content for d, _ in filtered] == ["b2", "b0"]
+
+        assert store.delete_by_filter({"project_id": "p1", "source": "a1.md"})
+        assert store.count({"project_id": "p1"}) == 2
+        assert store.delete_by_filter({"project_id": "p1"})
+        assert store.count({"project_id": "p1"}) == 0
+        assert store.similarity_search_by_vector_with_score([1.0, 0.0, 0.0], filter={"project_id": "p1"}) == []
+        assert len(store.get(include=["metadatas"])["metadatas"]) == 4
+
+    def test_failed_migration_keeps_shared_collection(self):
+        from chromadb.api.models.Collection import Collection
+        from src.rag.stores.chroma_store import MIGRATION_MARKER
+        tmp_dir = tempfile.mkdtemp()
+        self._shared_store(tmp_dir)
+        store = self._make_store(tmp_dir)
+        with patch.object(Collection, "upsert", lambda self, **kwargs: None):
+            with pytest.raises(RuntimeError):
+                store.migrate_shared_collection()
+        assert "langchain" in {c.name for c in store._client.list_collections()}
+        assert not os.path.exists(os.path.join(tmp_dir, MIGRATION_MARKER))
+        assert not store.partitioned
+        assert store.count({"project_id": "p1"}) == 4
+
+        # 重跑即可完成
+        assert store.migrate_shared_collection() == 8
+        assert store.count({"project_id": "p1"}) == 4
+
+    def test_collection_name_is_valid(self):
+        from src.rag.stores.chroma_store import collection_name_for
+        for project_id in ("default", "知识库", "a" * 100, "x y/z"):
+            name = collection_name_for(project_id)
+            assert 3 <= len(name) <= 63
+            assert name[0].isalnum() and name[-1].isalnum()
+        assert collection_name_for("知识库") != collection_name_for("知识")
+
+
+class TestQdrantStore:
+    """测试 Qdrant 存储（嵌入式内存模式）"""
+
+    def _make_store(self, collection):
+        from src.rag.stores.qdrant_store import QdrantStore
+        with patch("src.rag.stores.qdrant_store.settings") as mock_settings, \
+                patch("src.rag.stores.qdrant_store.model_manager") as mock_manager:
+            mock_settings.QDRANT_HOST = "localhost"
+            mock_settings.QDRANT_PORT = 6333
+            mock_settings.QDRANT_LOCATION = ":memory:"
+            mock_settings.QDRANT_COLLECTION = collection
+            mock_settings.QDRANT_UPSERT_BATCH = 100
+            mock_settings.QDRANT_UPSERT_PARALLEL = 4
+            mock_settings.QDRANT_SCROLL_PAGE = 64
+            mock_manager.get_embedding_dimension.return_value = 3
+            return QdrantStore()
+
+    def test_paged_scroll_count_and_filters(self):
+        import uuid as _uuid
+        from langchain_core.documents import Document
+        store = self._make_store(f"test_{_uuid.uuid4().hex}")
+        docs = [Document(page_content=f"doc{i}", metadata={"source": f"f{i % 3}.md"}) for i in range(250)]
+        vectors = [[1.0, float(i), 0.5] for i in range(250)]
+        assert store.add_embeddings(docs[:200], vectors[:200], "p1") == 200
+        store.add_embeddings(docs[200:], vectors[200:], "p2")
+
+        assert store.count() == 250
+        assert store.count({"project_id": "p1"}) == 200
+        assert store.count({"project_id": "p1", "source": ["f0.md", "f1.md"]}) == 134
+        assert len(store.get_all_documents({"project_id": "p1"})) == 200     # 跨多页读取，不截断
+        assert len(set(store.get(where={"project_id": "p2"})["ids"])) == 50
+
+        results = store.similarity_search_by_vector_with_score(
+            [0.0, 1.0, 0.0], top_k=3, filter={"$and": [{"project_id": "p2"}, {"source": "f0.md"}]}
+        )
+        assert len(results) == 3
+        assert all(d.metadata["project_id"] == "p2" and d.metadata["source"] == "f0.md" for d, _ in results)
+
+        assert store.delete_by_filter({"project_id": "p2"})
+        assert store.count() == 200
+        with pytest.raises(ValueError, match="维度不一致"):
+            store.similarity_search_by_vector_with_score([1.0, 0.0], filter={"project_id": "p1"})
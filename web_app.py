@@ -37,6 +37,26 @@ def get_chat_service() -> ChatService:
 def get_doc_service() -> DocumentService:
     return DocumentService()
 
+@st.cache_resource
+def warmup_embedding_model() -> bool:
+    """本地 Embedding 模型进程内只预热一次"""
+    return settings.LOCAL_EMBEDDING_WARMUP and model_manager.warmup_embedding_model()
+
+@st.cache_resource
+def warmup_reranker() -> bool:
+    """启用重排序时进程内只预热一次"""
+    from src.rag.reranker import warmup_reranker as _warmup
+    return settings.RERANK_WARMUP and _warmup() is not None
+
+@st.cache_resource
+def warmup_hot_projects() -> bool:
+    """配置的常用知识库进程内只提交一次后台预热"""
+    if not settings.WARMUP_PROJECTS:
+        return False
+    for pid in settings.WARMUP_PROJECTS:
+        get_kb_service().warmup_kb(pid)
+    return True
+
 
 # ==================== Page: Knowledge Base ====================
 def render_kb_page():
@@ -146,7 +166,9 @@ def render_chat_page():
     st.session_state["current_session_id"] = sid
     
     st.title("💬 聊天")
-    st.caption(f"当前知识库：{pid} ｜ 当前会话：{sid[:8]}")
+    warmup = kb_service.get_warmup_status(pid)
+    warmup_label = {"warming": " ｜ 🔥 预热中", "ready": " ｜ ✅ 已就绪", "failed": " ｜ ⚠️ 部分预热失败"}
+    st.caption(f"当前知识库：{pid} ｜ 当前会话：{sid[:8]}{warmup_label.get(warmup.status, '')}")
     
     # 侧边栏
     with st.sidebar:
@@ -455,7 +477,7 @@ def render_chat_sidebar(kb_service, doc_service, pid, sid):
 
 
 def render_file_uploader(doc_service, pid):
-    """渲染文件上传组件"""
+    """渲染文件上传组件（提交后台入库任务，不阻塞页面）"""
     st.subheader("上传文件（写入当前知识库）")
     uploaded_files = st.file_uploader("上传文档", accept_multiple_files=True)
     
@@ -463,15 +485,60 @@ def render_file_uploader(doc_service, pid):
         if not uploaded_files:
             st.warning("请先上传文件")
         else:
-            status = st.empty()
-            status.info(f"正在处理 {len(uploaded_files)} 个文件...")
-            
-            result = doc_service.process_and_ingest(uploaded_files, pid)
-            
-            if result.success:
-                status.success(f"✅ {result.message}")
-            else:
-                status.error(f"❌ {result.message}")
+            supported, unsupported = doc_service.filter_supported_files(uploaded_files)
+            if unsupported:
+                st.warning(f"已跳过不支持的文件: {', '.join(unsupported)}")
+            if supported:
+                job_id = doc_service.submit_ingest_job(supported, pid)
+                st.success(f"✅ 已提交入库任务 {job_id[:8]}，可在下方查看进度")
+    
+    render_ingest_jobs(doc_service, pid)
+
+
+INGEST_STAGE_LABELS = {
+    "": "等待中",
+    "load": "解析",
+    "split": "切分",
+    "embed": "向量化",
+    "upsert": "写入",
+    "done": "完成",
+}
+
+INGEST_STATUS_LABELS = {
+    "queued": "⏳ 排队中",
+    "running": "🔄 处理中",
+    "cancelling": "🛑 取消中",
+    "cancelled": "🛑 已取消",
+    "completed": "✅ 已完成",
+    "failed": "❌ 失败",
+}
+
+
+@st.fragment(run_every=settings.INGEST_POLL_SECONDS)
+def render_ingest_jobs(doc_service, pid):
+    """渲染入库任务进度（局部定时刷新，不影响页面其他部分）"""
+    jobs = doc_service.list_ingest_jobs(pid, limit=5)
+    if not jobs:
+        return
+    
+    st.caption("最近的入库任务")
+    for job in jobs:
+        label = INGEST_STATUS_LABELS.get(job.status, job.status)
+        st.progress(
+            job.progress,
+            text=f"{label} · {job.done_files}/{job.total_files} 个文件 · {job.total_chunks} chunks",
+        )
+        if job.error:
+            st.caption(f"⚠️ {job.error}")
+        
+        if not job.finished:
+            with st.expander(f"任务 {job.id[:8]} 明细", expanded=False):
+                for f in job.files:
+                    stage = INGEST_STAGE_LABELS.get(f.stage, f.stage)
+                    st.text(f"{f.filename} · {stage} · {f.chunks_done}/{f.chunks_total}")
+                if job.status != "cancelling" and st.button("取消任务", key=f"cancel_job_{job.id}"):
+                    doc_service.cancel_ingest_job(job.id)
+                    st.rerun(scope="fragment")
 
 
 def render_chat_area(chat_service, pid, sid):
@@ -511,8 +578,10 @@ def render_chat_area(chat_service, pid, sid):
 
 # ==================== Navigation ====================
 def _goto_chat(project_id: str):
-    """跳转到聊天页面"""
+    """跳转到聊天页面（后台预热该知识库，首个问题不承担加载开销）"""
     kb_service = get_kb_service()
+    if settings.WARMUP_ON_OPEN:
+        kb_service.warmup_kb(project_id)
     sid = kb_service.get_or_create_session(project_id)
     st.session_state["current_project_id"] = project_id
     st.session_state["current_session_id"] = sid
@@ -524,6 +593,9 @@ def _goto_chat(project_id: str):
 def main():
     st.set_page_config(page_title="RAG Kernel (Test UI)", layout="wide")
     init_app_state()
+    warmup_embedding_model()
+    warmup_reranker()
+    warmup_hot_projects()
     
     if st.session_state["view"] == "kb":
         render_kb_page()